@@ -6,15 +6,36 @@ ReasoningV优化后完整验证测试脚本
 确保准确率可重复
 """
 
+import contextlib
 import json
 import torch
 import time
 import os
 from transformers import AutoTokenizer, AutoModelForCausalLM
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Optional, Tuple
+from prefix_scheduler import StrategyGroupedScheduler, print_schedule_stats
+from profiling import RunProfiler
+from metrics import RunMetrics
+from results_store import ResultsStore
+from prompt_cache import PromptHashCache, print_incremental_summary
+from aggregation import ResultFrame, error_mask
+from option_scorer import OPTION_LETTERS, OptionLetterScorer, extract_option
+from http_backend import CompletionsBackend
+from onnx_export import OnnxLetterScorer
+from logit_archive import LogitArchive, print_archive_summary, template_label
+from coreset import CoreSet, print_core_set
+from question_ids import QuestionIndex, assign_question_ids, migrate_position_keys
+from fewshot_retrieval import FewShotIndex
+from cascade import (DEFAULT_THRESHOLDS, letter_probabilities, option_margins, cascade_curve,
+                     average_curves, merge_curves, print_cascade_curve)
+import numpy as np
 import warnings
 warnings.filterwarnings("ignore")
 
+DEFAULT_PROMPT = "Question: {question}\n\nOptions:\n{options}\n\nAnswer:"
+DEFAULT_PARAMS = {"max_new_tokens": 1, "temperature": 0.0, "do_sample": False,
+                  "repetition_penalty": 1.0, "top_p": 1.0, "top_k": 1, "use_cache": True}
+
 class ReasoningVFullValidation:
     """ReasoningV完整验证测试器"""
     
@@ -27,6 +48,15 @@ class ReasoningVFullValidation:
         self.model = None
         self.tokenizer = None
         
+        # OpenAI兼容HTTP推理后端（None表示在本进程加载模型）；使用后端时只加载tokenizer
+        self.backend: Optional[CompletionsBackend] = None
+        
+        # ONNX Runtime打分（CPU）：单token贪心工作项使用导出的选项字母图（None表示使用PyTorch）；
+        # 其余生成参数仍按需加载PyTorch模型
+        self.onnx_path: Optional[str] = None
+        self.onnx_threads: Optional[int] = None
+        self.onnx_scorer: Optional[OnnxLetterScorer] = None
+        
         # 任务配置（使用实际的数据路径）
         self.tasks = {
             "LDO Task": {
@@ -63,6 +93,47 @@ class ReasoningVFullValidation:
         # 加载优化后的策略配置
         self.optimized_configs = self.load_optimized_configs()
         
+        # 策略分组调度（按策略前缀和提示词长度重排执行顺序）
+        self.schedule_by_strategy = True
+        self.schedule_batch_size = 8
+        self.last_schedule_stats = None
+        
+        # 剖析器（None表示不剖析）
+        self.profiler: Optional[RunProfiler] = None
+        
+        # 运行指标（None表示不导出）
+        self.metrics: Optional[RunMetrics] = None
+        self.last_prompt_tokens = 0
+        self.observe_questions = True  # 级联评估尚未决定是否采用的Few-shot答案时暂停记录题目结果
+        
+        # 增量评估：提示词哈希缓存（None表示全部重新生成），开启时Few-shot示例按种子选择以便复用
+        self.prompt_cache: Optional[PromptHashCache] = None
+        self.few_shot_seed: Optional[int] = None
+        
+        # 置信度门控级联：Few-shot任务先用零样本模板打分，margin低于阈值才升级到Few-shot（None表示不级联）
+        self.cascade_threshold: Optional[float] = None
+        self.cascade_sweep: Optional[List[float]] = None
+        
+        # 检索式Few-shot示例：每题取BM25最相似的有效题目（None表示随机选择），索引按任务持久化
+        self.example_index_dir: Optional[str] = None
+        self.example_indexes: Dict[str, FewShotIndex] = {}
+        
+        # Few-shot任务的多次运行合并为一次批量执行（各示例集前缀只预填充一次）
+        self.batch_few_shot_runs = True
+        
+        # 选项logit归档：每题的选项字母logits按 (模型, 任务, 策略) 持久化（None表示不归档）
+        self.logit_archive: Optional[LogitArchive] = None
+        # 错误模式优化任务额外把每个候选策略在全部题目上打分归档（离线策略表优化的输入）
+        self.archive_candidates = False
+        
+        # 冒烟模式：只评估分层核心子集，准确率为全集估计值（None表示评估全部题目）
+        self.core_set: Optional[CoreSet] = None
+        
+        # 题目ID -> 位置 索引（None表示不持久化）
+        self.question_index: Optional[QuestionIndex] = None
+        self.letter_scorer: Optional[OptionLetterScorer] = None
+        self.last_letter_logits = None
+        
         print(f"🚀 初始化ReasoningV完整验证测试器")
         print(f"   模型路径: {model_path}")
         print(f"   设备: {self.device}")
@@ -142,13 +213,19 @@ class ReasoningVFullValidation:
                 if 'optimization_results' in data and 'result' in data['optimization_results']:
                     result = data['optimization_results']['result']
                     if 'strategy_map' in result:
-                        # 转换strategy_map的键为整数
-                        strategy_map = {}
-                        for k, v in result['strategy_map'].items():
-                            try:
-                                strategy_map[int(k)] = v
-                            except:
-                                pass
+                        # strategy_map按题目ID；旧版本按位置记录的键按TQA数据文件的顺序迁移为题目ID
+                        # （数据文件不可用时保留整数位置键）
+                        strategy_map = {k: v for k, v in result['strategy_map'].items() if not k.isdigit()}
+                        legacy = {int(k): v for k, v in result['strategy_map'].items() if k.isdigit()}
+                        if legacy:
+                            tqa_questions = self.load_task_data("TQA Task")
+                            if tqa_questions:
+                                migrated, moved, dropped = migrate_position_keys(legacy, tqa_questions)
+                                strategy_map.update(migrated)
+                                print(f"   🔁 TQA strategy_map的 {moved} 个位置键已迁移为题目ID"
+                                      f"{f'（越界丢弃 {dropped} 个）' if dropped else ''}")
+                            else:
+                                strategy_map.update(legacy)
                         
                         configs["TQA Task"] = {
                             'type': 'pattern_optimized',
@@ -196,8 +273,8 @@ class ReasoningVFullValidation:
         
         return configs
     
-    def load_few_shot_examples(self, task_name: str, num_examples: int = 2) -> List[Dict]:
-        """加载Few-shot示例（每次调用随机选择，模拟优化时的随机性）"""
+    def load_few_shot_examples(self, task_name: str, num_examples: int = 2, seed: Optional[str] = None) -> List[Dict]:
+        """加载Few-shot示例（每次调用随机选择，模拟优化时的随机性；提供seed时选择可复现）"""
         import random
         # 不设置固定种子，让每次调用都随机选择（模拟优化时的行为）
         # 这样多次运行取平均才能得到稳定结果
@@ -218,8 +295,18 @@ class ReasoningVFullValidation:
             return valid_examples
         
         # 随机选择（不设置种子，每次调用都不同）
+        if seed is not None:
+            return random.Random(seed).sample(valid_examples, min(num_examples, len(valid_examples)))
         return random.sample(valid_examples, min(num_examples, len(valid_examples)))
     
+    def get_example_index(self, task_name: str) -> FewShotIndex:
+        """任务的Few-shot示例检索索引（磁盘上的索引过期时重新构建）"""
+        if task_name not in self.example_indexes:
+            questions = self.load_task_data(task_name)
+            self.example_indexes[task_name] = FewShotIndex.for_task(
+                task_name, questions, self.tasks[task_name]["groundtruth_field"], self.example_index_dir)
+        return self.example_indexes[task_name]
+    
     def build_few_shot_prompt(self, task_name: str, question: str, options: Dict[str, str], 
                               examples: List[Dict], expert_instruction: str = "") -> str:
         """构建Few-shot提示词（与优化脚本一致）"""
@@ -265,10 +352,28 @@ class ReasoningVFullValidation:
         
         return "\n".join(prompt_parts)
     
-    def load_model(self):
-        """加载模型"""
+    def load_model(self, local: bool = False):
+        """加载模型（local=True时即使使用ONNX也加载PyTorch模型，用于ONNX图不支持的生成参数）"""
         if self.model is not None:
             return
+        if self.onnx_path is not None and not local:
+            if self.onnx_scorer is None:
+                self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, trust_remote_code=True)
+                if self.tokenizer.pad_token is None:
+                    self.tokenizer.pad_token = self.tokenizer.eos_token
+                self.onnx_scorer = OnnxLetterScorer.for_model(self.model_path, self.onnx_path, self.tokenizer,
+                                                              self.schedule_batch_size, self.onnx_threads)
+                print(f"\n⚙️ 使用ONNX Runtime打分: {self.onnx_path}")
+            return
+        if self.backend is not None:
+            # 模型在推理服务中，本地只需要tokenizer（调度时按token统计前缀、级联统计成本）
+            if self.tokenizer is None:
+                self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, trust_remote_code=True)
+                if self.tokenizer.pad_token is None:
+                    self.tokenizer.pad_token = self.tokenizer.eos_token
+                print(f"\n🛰️ 使用推理服务 {self.backend.base_url}（模型 {self.backend.model}, "
+                      f"并发上限 {self.backend.max_concurrency}）")
+            return
         
         print(f"\n📥 正在加载ReasoningV模型...")
         import sys
@@ -283,12 +388,16 @@ class ReasoningVFullValidation:
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
         
+        # GPU上使用FP16；无GPU时在CPU上以FP32运行（基准测试、小模型调试）
+        if torch.cuda.is_available():
+            model_kwargs = {"torch_dtype": torch.float16, "device_map": {"": 0}}
+        else:
+            model_kwargs = {"torch_dtype": torch.float32}
         self.model = AutoModelForCausalLM.from_pretrained(
             self.model_path,
-            torch_dtype=torch.float16,
-            device_map={"": 0},
             low_cpu_mem_usage=True,
-            trust_remote_code=True
+            trust_remote_code=True,
+            **model_kwargs
         )
         print(f"✅ ReasoningV模型加载完成")
         import sys
@@ -309,7 +418,9 @@ class ReasoningVFullValidation:
             
             try:
                 with open(data_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    questions = json.load(f)
+                assign_question_ids(questions)
+                return questions
             except Exception as e:
                 print(f"❌ 加载数据失败: {e}")
                 return []
@@ -324,7 +435,8 @@ class ReasoningVFullValidation:
             
             all_data = []
             try:
-                files = glob.glob(os.path.join(data_dir, file_pattern))
+                # 文件按名称排序，加载顺序与文件系统无关
+                files = sorted(glob.glob(os.path.join(data_dir, file_pattern)))
                 for file_path in files:
                     with open(file_path, 'r', encoding='utf-8') as f:
                         file_data = json.load(f)
@@ -332,6 +444,7 @@ class ReasoningVFullValidation:
                             all_data.extend(file_data)
                         else:
                             all_data.append(file_data)
+                assign_question_ids(all_data)
                 return all_data
             except Exception as e:
                 print(f"❌ 加载数据失败: {e}")
@@ -360,10 +473,28 @@ class ReasoningVFullValidation:
     
     def generate_answer(self, prompt: str, parameters: Dict) -> Tuple[str, float]:
         """生成答案"""
+        if self.backend is not None:
+            answer, completion = self.backend.answer(prompt, parameters)
+            self.last_prompt_tokens = completion["prompt_tokens"]
+            if self.logit_archive is not None:
+                self.last_letter_logits = completion["letter_logits"]
+            return answer, 0.95
+        if self.onnx_scorer is not None and self.onnx_compatible(parameters):
+            scores = self.onnx_scorer.score_prompts([prompt])
+            self.last_prompt_tokens = scores["prompt_tokens"]
+            if self.logit_archive is not None:
+                self.last_letter_logits = scores["letter_logits"][0]
+            return self.onnx_scorer.decode_greedy(scores["top_token_ids"])[0], 0.95
+        if self.model is None:
+            self.load_model(local=True)
+        
         inputs = self.tokenizer(prompt, return_tensors="pt")
+        self.last_prompt_tokens = inputs["input_ids"].shape[1]
         model_device = next(self.model.parameters()).device
         inputs = {k: v.to(model_device) for k, v in inputs.items()}
         
+        # 归档时顺带取出第一个生成位置的原始logits（不额外前向）
+        archive_logits = self.logit_archive is not None
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
@@ -374,9 +505,17 @@ class ReasoningVFullValidation:
                 top_p=parameters.get("top_p", 1.0),
                 top_k=parameters.get("top_k", 1),
                 pad_token_id=self.tokenizer.eos_token_id,
-                use_cache=parameters.get("use_cache", True)
+                use_cache=parameters.get("use_cache", True),
+                output_logits=archive_logits,
+                return_dict_in_generate=archive_logits
             )
         
+        if archive_logits:
+            if self.letter_scorer is None:
+                self.letter_scorer = OptionLetterScorer(self.model, self.tokenizer, self.schedule_batch_size)
+            self.last_letter_logits = self.letter_scorer.letter_logits(outputs.logits[0].float())[0].cpu().numpy()
+            outputs = outputs.sequences
+        
         response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
         answer_part = response[len(prompt):].strip()
         
@@ -386,6 +525,477 @@ class ReasoningVFullValidation:
         
         return 'A', 0.95
     
+    @staticmethod
+    def onnx_compatible(parameters: Dict) -> bool:
+        """单token贪心生成可由一次前向替代（ONNX图、本地批量打分；不采样、无重复惩罚）"""
+        return (not parameters.get("do_sample", False) and parameters.get("max_new_tokens", 1) == 1
+                and parameters.get("repetition_penalty", 1.0) == 1.0)
+    
+    def build_work_items(self, task_name: str, questions: List[Dict], config: Dict,
+                         few_shot_examples: List[Dict] = None) -> List[Dict]:
+        """构建工作项（每题的提示词、生成参数和策略标签，构建失败时prompt为None）"""
+        groundtruth_field = self.tasks[task_name]["groundtruth_field"]
+        pattern_optimized = isinstance(config, dict) and config.get('type') == 'pattern_optimized'
+        
+        if pattern_optimized:
+            strategy_map = config.get('strategy_map', {})
+            base_strategy = config.get('base_strategy', {"prompt": DEFAULT_PROMPT, "params": DEFAULT_PARAMS})
+        else:
+            prompt_template = config.get("prompt", DEFAULT_PROMPT)
+            params = config.get("params", DEFAULT_PARAMS)
+        
+        # 检索式示例：每题使用各自的近邻题目（题目本身除外）
+        example_index = None
+        if not pattern_optimized and config.get('use_few_shot', False) and self.example_index_dir is not None:
+            example_index = self.get_example_index(task_name)
+        
+        items = []
+        for i, question_data in enumerate(questions):
+            question = question_data.get('question', '')
+            options = question_data.get('options', {})
+            groundtruth = question_data.get(groundtruth_field, '')
+            
+            if not question or not groundtruth:
+                continue
+            if self.core_set is not None and not self.core_set.contains(task_name, question_data.get('question_id')):
+                continue
+            
+            item = {"index": i, "groundtruth": groundtruth, "prompt": None, "params": None, "strategy": "base"}
+            try:
+                if pattern_optimized:
+                    # 根据题目ID选择策略（未能迁移的旧策略表仍按位置）
+                    question_id = question_data.get('question_id')
+                    if question_id in strategy_map:
+                        strategy = strategy_map[question_id]
+                    else:
+                        strategy = strategy_map.get(i, base_strategy)
+                    item["prompt"] = self.build_prompt(strategy["prompt"], question, options)
+                    item["params"] = strategy["params"]
+                    item["template"] = strategy["prompt"]
+                    item["strategy"] = StrategyGroupedScheduler.strategy_label(strategy["prompt"])
+                elif config.get('use_few_shot', False) and (few_shot_examples or example_index is not None):
+                    expert_instruction = config.get('expert_instruction', '')
+                    examples = (example_index.examples(i, config.get('num_examples', 2))
+                                if example_index is not None else few_shot_examples)
+                    item["prompt"] = self.build_few_shot_prompt(task_name, question, options,
+                                                                examples, expert_instruction)
+                    item["params"] = params
+                    item["strategy"] = "few_shot"
+                else:
+                    item["prompt"] = self.build_prompt(prompt_template, question, options)
+                    item["params"] = params
+                    item["template"] = prompt_template
+                    item["strategy"] = StrategyGroupedScheduler.strategy_label(prompt_template)
+            except Exception:
+                pass
+            items.append(item)
+        
+        return items
+    
+    def phase(self, name: str):
+        """记录阶段耗时（未开启指标时为空上下文）"""
+        return self.metrics.phase(name) if self.metrics is not None else contextlib.nullcontext()
+    
+    def observe_question(self, task_name: str, strategy: str, correct: bool):
+        """记录一道题的结果（未开启指标或暂停记录时忽略）"""
+        if self.metrics is not None and self.observe_questions:
+            self.metrics.observe_question(task_name, strategy, correct)
+    
+    def run_work_item(self, item: Dict, task_name: str = "") -> Optional[str]:
+        """执行单个工作项（生成失败为None），开启指标时记录题目结果、预填充token数和生成耗时"""
+        if self.metrics is None:
+            return self.generate_work_item(item)
+        
+        self.last_prompt_tokens = 0
+        with self.metrics.phase("generate"):
+            answer = self.generate_work_item(item)
+        self.observe_question(task_name, item["strategy"], answer == item["groundtruth"])
+        self.metrics.prefill_tokens.inc(self.last_prompt_tokens, task=task_name)
+        return answer
+    
+    def generate_work_item(self, item: Dict) -> Optional[str]:
+        """为单个工作项生成答案（生成失败为None）"""
+        if item["prompt"] is None:
+            return None
+        try:
+            self.last_letter_logits = None
+            answer, _ = self.generate_answer(item["prompt"], item["params"])
+            if self.last_letter_logits is not None:
+                item["letter_logits"] = self.last_letter_logits
+            return answer
+        except Exception:
+            return None
+    
+    def execute_work_items(self, items: List[Dict], task_name: str = "") -> List[Optional[str]]:
+        """执行工作项，返回与items顺序一致的答案（生成失败为None）；增量模式下只生成哈希变化的工作项"""
+        if self.prompt_cache is None:
+            return self.execute_scheduled(items, task_name)
+        
+        pending, reused = self.prompt_cache.split(items, task_name)
+        answers = [None] * len(items)
+        for position, answer in reused.items():
+            answers[position] = answer
+            if self.metrics is not None:
+                self.metrics.observe_cache("prompt_hash", True)
+                self.observe_question(task_name, items[position]["strategy"],
+                                      answer == items[position]["groundtruth"])
+        print(f"   ♻️ 复用 {len(reused)} 个答案, 需要生成 {len(pending)} 个")
+        if pending:
+            self.load_model()
+            pending_answers = self.execute_scheduled([items[p] for p in pending], task_name)
+            for position, answer in zip(pending, pending_answers):
+                answers[position] = answer
+                self.prompt_cache.record(items[position], answer)
+                if self.metrics is not None:
+                    self.metrics.observe_cache("prompt_hash", False)
+        return answers
+    
+    def execute_scheduled(self, items: List[Dict], task_name: str = "") -> List[Optional[str]]:
+        """
+        按策略分组调度执行工作项，返回与items顺序一致的答案；
+        单token贪心工作项按调度顺序切成schedule_batch_size的批一次前向打分（本地PyTorch或ONNX Runtime），
+        推理服务和性能剖析模式下逐题执行，调度统计中的填充浪费只是估计值
+        """
+        batched = self.backend is None and self.profiler is None
+        if batched and self.onnx_scorer is None and self.model is None:
+            self.load_model(local=True)
+        
+        if self.schedule_by_strategy:
+            scheduler = StrategyGroupedScheduler(self.schedule_batch_size, self.tokenizer)
+            with self.phase("schedule"):
+                plan = scheduler.plan(items)
+            order = plan["order"]
+            plan["stats"]["batched_items"] = sum(
+                1 for item in items if item["prompt"] is not None and self.onnx_compatible(item["params"])
+            ) if batched else 0
+            self.last_schedule_stats = plan["stats"]
+            print_schedule_stats(plan["stats"])
+            if self.metrics is not None:
+                self.metrics.prefix_hit_ratio.set(plan["stats"]["after"]["prefix_hit_ratio"], task=task_name)
+        else:
+            order = list(range(len(items)))
+            self.last_schedule_stats = None
+        
+        if self.backend is not None and self.profiler is None:
+            scheduled_answers = self.execute_remote([items[idx] for idx in order], task_name)
+        elif batched:
+            if self.onnx_scorer is not None:
+                scorer = self.onnx_scorer
+            else:
+                if self.letter_scorer is None:
+                    self.letter_scorer = OptionLetterScorer(self.model, self.tokenizer, self.schedule_batch_size)
+                scorer = self.letter_scorer
+            scheduled_answers = self.execute_batched([items[idx] for idx in order], scorer, task_name)
+        else:
+            scheduled_answers = self.execute_profiled(items, order, task_name)
+        
+        return StrategyGroupedScheduler.restore(scheduled_answers, order)
+    
+    def execute_remote(self, items: List[Dict], task_name: str = "") -> List[Optional[str]]:
+        """并发发送到推理服务（同时进行的请求数由后端限制），返回与items顺序一致的答案（失败为None）"""
+        pending = [item for item in items if item["prompt"] is not None]
+        with self.phase("generate"):
+            completions = iter(self.backend.complete_many([(item["prompt"], item["params"]) for item in pending]))
+        answers = []
+        for item in items:
+            completion = next(completions) if item["prompt"] is not None else None
+            answer = extract_option(completion["text"].strip()) if completion is not None else None
+            if completion is not None and self.logit_archive is not None:
+                item["letter_logits"] = completion["letter_logits"]
+            if self.metrics is not None:
+                self.observe_question(task_name, item["strategy"], answer == item["groundtruth"])
+                if completion is not None:
+                    self.metrics.prefill_tokens.inc(completion["prompt_tokens"], task=task_name)
+            answers.append(answer)
+        return answers
+    
+    def execute_batched(self, items: List[Dict], scorer, task_name: str = "") -> List[Optional[str]]:
+        """
+        批量执行：单token贪心工作项按给定顺序切批打分（scorer为OptionLetterScorer或OnnxLetterScorer，
+        与generate_answer的贪心解析一致），其余工作项逐题使用PyTorch生成；返回与items顺序一致的答案
+        """
+        answers: List[Optional[str]] = [None] * len(items)
+        batched = [p for p, item in enumerate(items) if item["prompt"] is not None and self.onnx_compatible(item["params"])]
+        if batched:
+            try:
+                with self.phase("generate"):
+                    scores = scorer.score_prompts([items[p]["prompt"] for p in batched])
+                decoded = scorer.decode_greedy(scores["top_token_ids"])
+            except Exception as e:
+                print(f"   ⚠️ 批量打分失败，回退到逐题生成: {e}")
+                batched = []
+        for row, p in enumerate(batched):
+            answers[p] = decoded[row]
+            if self.logit_archive is not None:
+                items[p]["letter_logits"] = np.asarray(scores["letter_logits"][row], dtype=np.float32)
+            if self.metrics is not None:
+                self.observe_question(task_name, items[p]["strategy"], decoded[row] == items[p]["groundtruth"])
+        if batched and self.metrics is not None:
+            self.metrics.prefill_tokens.inc(scores["prompt_tokens"], task=task_name)
+        done = set(batched)
+        for p, item in enumerate(items):
+            if p not in done:
+                answers[p] = self.run_work_item(item, task_name)
+        return answers
+    
+    def score_prompts(self, prompts: List[str]) -> Dict:
+        """批量取提示词最后位置的选项字母分数（本地一次前向、ONNX Runtime，或推理服务返回的logprobs）"""
+        if self.backend is not None:
+            return self.backend.score_prompts(prompts)
+        if self.onnx_scorer is not None:
+            return self.onnx_scorer.score_prompts(prompts)
+        scores = OptionLetterScorer(self.model, self.tokenizer, self.schedule_batch_size).score_prompts(prompts)
+        return dict(scores, letter_logits=scores["letter_logits"].numpy())
+    
+    def execute_profiled(self, items: List[Dict], order: List[int], task_name: str) -> List[Optional[str]]:
+        """按执行顺序执行，剖析窗口内的题目（窗口按策略切分，分别输出）"""
+        labels = [items[idx]["strategy"] for idx in order]
+        scheduled_answers = []
+        for lo, hi, strategy in self.profiler.segments(labels):
+            scheduled_answers.extend(self.run_work_item(items[idx], task_name)
+                                     for idx in order[len(scheduled_answers):lo])
+            with self.profiler.capture(task_name, strategy, hi - lo):
+                scheduled_answers.extend(self.run_work_item(items[idx], task_name) for idx in order[lo:hi])
+        scheduled_answers.extend(self.run_work_item(items[idx], task_name)
+                                 for idx in order[len(scheduled_answers):])
+        return scheduled_answers
+    
+    def execute_few_shot_runs(self, task_name: str, questions: List[Dict], config: Dict,
+                              num_runs: int) -> Optional[Dict]:
+        """
+        多次Few-shot运行一起执行：每次运行的示例集前缀（该运行所有提示词的公共token前缀）只预填充一次，
+        同一道题在各次运行中的提示词排在同一批，一次前向取最后位置的argmax（等价于max_new_tokens=1的贪心生成）
+        
+        Returns:
+            {items: 每次运行的工作项, answers: 每次运行的答案, elapsed, stats}；
+            非单token贪心配置（采样、多token或repetition_penalty≠1.0）、增量/剖析模式、使用推理服务/ONNX或批量执行失败时返回None（由调用方逐次运行）
+        """
+        params = config.get("params", DEFAULT_PARAMS)
+        if (self.prompt_cache is not None or self.profiler is not None or self.backend is not None
+                or self.onnx_path is not None or not self.onnx_compatible(params)):
+            return None
+        
+        start_time = time.time()
+        run_items = []
+        with self.phase("build_prompts"):
+            for run in range(num_runs):
+                seed = None if self.few_shot_seed is None else f"{self.few_shot_seed}:{task_name}:{run}"
+                examples = self.load_few_shot_examples(task_name, num_examples=config.get('num_examples', 2), seed=seed)
+                run_items.append(self.build_work_items(task_name, questions, config, examples))
+        if not run_items[0] or any(item["prompt"] is None for items in run_items for item in items):
+            return None
+        
+        try:
+            self.load_model()
+            encoded = [self.tokenizer([item["prompt"] for item in items])["input_ids"] for items in run_items]
+            # 每次运行的示例集前缀：公共token前缀（每题至少保留一个后缀token）
+            prefix_ids = []
+            for ids in encoded:
+                common = os.path.commonprefix(ids)
+                prefix_ids.append(common[:min(len(common), min(len(x) for x in ids) - 1)])
+            if not all(prefix_ids):
+                return None
+            
+            scorer = OptionLetterScorer(self.model, self.tokenizer, self.schedule_batch_size)
+            with self.phase("prefill"):
+                root_ids = os.path.commonprefix(prefix_ids)
+                root = scorer.prefill_ids(root_ids) if root_ids else None
+                states = [scorer.prefill_ids(ids, root) for ids in prefix_ids]
+            
+            # 按后缀长度排序减少填充；同一道题的各次运行相邻，批大小取运行数的整数倍
+            num_items = len(run_items[0])
+            order = sorted(range(num_items), key=lambda q: max(len(encoded[r][q]) for r in range(num_runs)))
+            rows = [(r, encoded[r][q][len(prefix_ids[r]):]) for q in order for r in range(num_runs)]
+            batch_size = num_runs * max(1, self.schedule_batch_size // num_runs)
+            with self.phase("generate"):
+                scores = scorer.score_with_prefixes(states, rows, batch_size)
+            decoded = scorer.decode_greedy(scores["top_token_ids"])
+        except Exception as e:
+            print(f"   ⚠️ 批量执行多次运行失败，回退到逐次运行: {e}")
+            return None
+        
+        answers = [[None] * num_items for _ in range(num_runs)]
+        for row, answer in enumerate(decoded):
+            answers[row % num_runs][order[row // num_runs]] = answer
+            run_items[row % num_runs][order[row // num_runs]]["letter_logits"] = scores["letter_logits"][row].numpy()
+        
+        computed = ((root["computed_tokens"] if root else 0) + sum(state["computed_tokens"] for state in states)
+                    + scores["prompt_tokens"])
+        sequential = sum(len(ids) for run_ids in encoded for ids in run_ids)
+        if self.metrics is not None:
+            self.metrics.prefill_tokens.inc(computed, task=task_name)
+            for items, run_answers in zip(run_items, answers):
+                for item, answer in zip(items, run_answers):
+                    self.observe_question(task_name, item["strategy"], answer == item["groundtruth"])
+        
+        stats = {
+            "num_runs": num_runs,
+            "prompts": num_items * num_runs,
+            "prefix_tokens": [state["length"] for state in states],
+            "shared_prefix_tokens": len(root_ids),
+            "computed_tokens": computed,
+            "sequential_tokens": sequential,
+            "saved_fraction": 1 - computed / sequential if sequential else 0.0
+        }
+        print(f"   🧮 {num_runs} 次运行批量执行: {stats['prompts']} 个提示词, 计算 {computed} tokens "
+              f"(逐次运行 {sequential} tokens, 节省 {stats['saved_fraction'] * 100:.1f}%)")
+        return {"items": run_items, "answers": answers, "elapsed": time.time() - start_time, "stats": stats}
+    
+    @staticmethod
+    def archive_key(item: Dict) -> str:
+        """工作项在logit归档中的策略键：模板策略为完整提示词模板，Few-shot等没有模板的用策略标签"""
+        return item.get("template") or item["strategy"]
+    
+    def archive_option_logits(self, task_name: str, questions: List[Dict], run_items: List[List[Dict]]):
+        """
+        把各次运行每道题的选项字母logits按策略写入归档（[运行数, 题数, 选项数]，未使用该策略的题目为NaN）；
+        策略按完整提示词模板区分（前缀标签相同的模板各自一份），标签只写入元数据用于显示；
+        执行时没有得到logits的工作项（如增量模式复用的答案、级联中未升级的题目）补一次批量前向打分；
+        开启archive_candidates时，错误模式优化任务的每个候选策略改为在全部题目上各归档一份
+        """
+        config = self.optimized_configs.get(task_name, {})
+        candidate_mode = False
+        if self.archive_candidates and config.get('type') == 'pattern_optimized':
+            candidate_mode = True
+            executed_items, run_items = run_items, []
+            base_strategy = config.get('base_strategy', {"prompt": DEFAULT_PROMPT, "params": DEFAULT_PARAMS})
+            candidates = {base_strategy["prompt"]: base_strategy}
+            for strategy in config.get('strategy_map', {}).values():
+                candidates.setdefault(strategy["prompt"], strategy)
+            for strategy in candidates.values():
+                run_items.append(self.build_work_items(task_name, questions, strategy))
+            # 本次运行已经得到的logits按提示词复用
+            known = {item["prompt"]: item["letter_logits"] for items in executed_items for item in items
+                     if "letter_logits" in item}
+            for items in run_items:
+                for item in items:
+                    if item["prompt"] in known:
+                        item["letter_logits"] = known[item["prompt"]]
+        
+        missing = [item for items in run_items for item in items
+                   if item["prompt"] is not None and "letter_logits" not in item]
+        if missing:
+            self.load_model()
+            missing.sort(key=lambda item: len(item["prompt"]))
+            with self.phase("archive_logits"):
+                scores = self.score_prompts([item["prompt"] for item in missing])
+            for item, row in zip(missing, scores["letter_logits"]):
+                item["letter_logits"] = row
+        
+        groundtruth_field = self.tasks[task_name]["groundtruth_field"]
+        groundtruth = [question.get(groundtruth_field, '') for question in questions]
+        question_ids = [question.get('question_id', str(i)) for i, question in enumerate(questions)]
+        strategy_meta = {}
+        for items in run_items:
+            for item in items:
+                if item["prompt"] is not None:
+                    template = item.get("template")
+                    strategy_meta.setdefault(self.archive_key(item), {
+                        "prompt": template, "params": item["params"],
+                        "label": template_label(template) if template else item["strategy"]
+                    })
+        
+        # 候选策略模式下每个候选一组完整覆盖的工作项，各自只有一次"运行"
+        runs = 1 if candidate_mode else len(run_items)
+        for strategy, meta in strategy_meta.items():
+            logits = np.full((runs, len(questions), len(OPTION_LETTERS)), np.nan, dtype=np.float32)
+            for run, items in enumerate(run_items):
+                for item in items:
+                    if self.archive_key(item) == strategy and "letter_logits" in item:
+                        logits[0 if candidate_mode else run, item["index"]] = item["letter_logits"]
+            self.logit_archive.save(task_name, strategy, logits, groundtruth, question_ids, meta)
+        print(f"   🗄️ 已归档 {len(strategy_meta)} 个策略的选项logits"
+              f"{f'（补打分 {len(missing)} 个工作项）' if missing else ''}")
+    
+    def score_cheap_strategy(self, task_name: str, questions: List[Dict]) -> Dict[int, Dict]:
+        """
+        级联第一级：零样本模板一次前向取选项字母概率
+
+        Returns:
+            {题目索引: {predicted, margin, tokens}}（提示词构建失败的题目不在其中）
+        """
+        self.load_model()
+        cheap_items = [item for item in self.build_work_items(
+            task_name, questions, {"prompt": DEFAULT_PROMPT, "params": DEFAULT_PARAMS}) if item["prompt"] is not None]
+        if not cheap_items:
+            return {}
+        
+        prompts = [item["prompt"] for item in cheap_items]
+        with self.phase("cascade_score"):
+            scores = self.score_prompts(prompts)
+        if self.metrics is not None:
+            self.metrics.prefill_tokens.inc(scores["prompt_tokens"], task=task_name)
+        
+        valid_letters = [list(questions[item["index"]].get('options', {}).keys()) for item in cheap_items]
+        margins = option_margins(letter_probabilities(scores["letter_logits"], valid_letters))
+        tokens = [len(ids) for ids in self.tokenizer(prompts)["input_ids"]]
+        print(f"   🪜 零样本打分: {len(prompts)} 题, {scores['prompt_tokens']} tokens, "
+              f"平均margin {float(np.mean(margins['margin'])):.3f}")
+        return {
+            item["index"]: {"predicted": margins["predicted"][p], "margin": float(margins["margin"][p]),
+                            "tokens": tokens[p]}
+            for p, item in enumerate(cheap_items)
+        }
+    
+    def cascade_thresholds(self) -> Tuple[List[float], float]:
+        """级联扫描的阈值和需要评估昂贵策略的margin上界（未指定扫描时只扫描不超过工作阈值的点）"""
+        threshold = self.cascade_threshold
+        if self.cascade_sweep is None:
+            sweep = [t for t in DEFAULT_THRESHOLDS if t <= threshold]
+        else:
+            sweep = list(self.cascade_sweep)
+        sweep = sorted(set(sweep) | {threshold})
+        return sweep, max(sweep)
+    
+    def execute_cascade(self, items: List[Dict], cheap: Dict[int, Dict], task_name: str,
+                        total_questions: int) -> Tuple[List[Optional[str]], Dict]:
+        """
+        级联执行：margin低于阈值的题目使用Few-shot工作项生成，其余直接采用零样本答案
+
+        为得到成本-准确率曲线，margin低于扫描上界的题目都会生成Few-shot答案；
+        返回的答案和准确率对应工作阈值
+        """
+        sweep, bound = self.cascade_thresholds()
+        # 没有零样本分数的题目总是升级（margin记为-inf，低于任何阈值）
+        margins = np.array([cheap[item["index"]]["margin"] if item["index"] in cheap else -np.inf for item in items])
+        evaluate = [p for p in range(len(items)) if margins[p] < bound]
+        
+        expensive_answers = [None] * len(items)
+        if evaluate:
+            # 扫描用的Few-shot答案不一定被采用，题目结果在升级决定后统一记录（每题一次）
+            self.observe_questions = False
+            try:
+                for p, answer in zip(evaluate, self.execute_work_items([items[p] for p in evaluate], task_name)):
+                    expensive_answers[p] = answer
+            finally:
+                self.observe_questions = True
+        
+        escalated = margins < self.cascade_threshold
+        answers = []
+        for p, item in enumerate(items):
+            item["margin"] = float(margins[p]) if item["index"] in cheap else None
+            if escalated[p] or item["index"] not in cheap:
+                answer = expensive_answers[p]
+            else:
+                answer = cheap[item["index"]]["predicted"]
+                item["strategy"] = "zero_shot"
+            answers.append(answer)
+            self.observe_question(task_name, item["strategy"], answer == item["groundtruth"])
+        
+        cheap_tokens = [cheap[item["index"]]["tokens"] if item["index"] in cheap else 0 for item in items]
+        prompts = [item["prompt"] for item in items if item["prompt"] is not None]
+        prompt_tokens = iter(len(ids) for ids in self.tokenizer(prompts)["input_ids"]) if prompts else iter(())
+        expensive_tokens = [next(prompt_tokens) if item["prompt"] is not None else 0 for item in items]
+        curve = cascade_curve(
+            margins,
+            [item["index"] in cheap and cheap[item["index"]]["predicted"] == item["groundtruth"] for item in items],
+            [answer == item["groundtruth"] if margins[p] < bound else None
+             for p, (item, answer) in enumerate(zip(items, expensive_answers))],
+            cheap_tokens, expensive_tokens, sweep, total_questions
+        )
+        print(f"   🪜 级联: 阈值 {self.cascade_threshold:.2f}, 升级 {int(escalated.sum())}/{len(items)} 题到Few-shot")
+        return answers, {"curve": curve, "few_shot_cost": float(sum(expensive_tokens))}
+    
     def test_task(self, task_name: str, num_runs: int = 1) -> Dict[str, Any]:
         """测试单个任务（支持多次运行取平均，与优化时一致）"""
         print(f"\n{'='*80}")
@@ -396,12 +1006,20 @@ class ReasoningVFullValidation:
         import sys
         sys.stdout.flush()
         
-        questions = self.load_task_data(task_name)
+        with self.phase("load_data"):
+            questions = self.load_task_data(task_name)
         if not questions:
             print(f"❌ 无法加载 {task_name} 数据")
             return None
         
         print(f"   加载了 {len(questions)} 个问题")
+        if self.question_index is not None:
+            moves = self.question_index.update(task_name, questions)
+            if moves["moved"] or moves["removed"]:
+                print(f"   ⚠️ 与上次相比 {moves['moved']} 题位置变化, {moves['removed']} 题移除, {moves['added']} 题新增"
+                      f"（按题目ID的策略和缓存不受影响）")
+        if self.core_set is not None:
+            print(f"   🔥 冒烟模式: 只评估核心子集中的 {len(self.core_set.selected.get(task_name, ()))} 题")
         import sys
         sys.stdout.flush()
         
@@ -412,6 +1030,19 @@ class ReasoningVFullValidation:
         all_accuracies = []
         all_correct_counts = []
         all_total_times = []
+        question_results = []  # 逐题预测（每次运行一组，供结果库做跨运行查询）
+        run_items = []  # 各次运行的工作项（归档选项logits用）
+        
+        # 级联模式：零样本分数与Few-shot示例无关，每个任务只打分一次
+        cascade_mode = self.cascade_threshold is not None and config.get('use_few_shot', False)
+        cheap_scores = self.score_cheap_strategy(task_name, questions) if cascade_mode else None
+        cascade_runs = []
+        
+        # 多次Few-shot运行合并为一次批量执行（示例随机选择时）
+        batched_runs = None
+        if (num_runs > 1 and self.batch_few_shot_runs and not cascade_mode
+                and config.get('use_few_shot', False) and self.example_index_dir is None):
+            batched_runs = self.execute_few_shot_runs(task_name, questions, config, num_runs)
         
         for run in range(num_runs):
             if num_runs > 1:
@@ -420,99 +1051,59 @@ class ReasoningVFullValidation:
                 sys.stdout.flush()
             
             correct_count = 0
-            total_time = 0
             start_time = time.time()
             
-            # 处理Few-shot配置（每次运行重新选择示例）
-            few_shot_examples = None
-            num_few_shot = config.get('num_examples', 2)  # 从配置中读取示例数量
-            if config.get('use_few_shot', False):
-                # 每次运行重新选择Few-shot示例（模拟优化时的随机性）
-                few_shot_examples = self.load_few_shot_examples(task_name, num_examples=num_few_shot)
-            
-            # 处理TQA错误模式优化配置
             error_indices = []  # 记录错误题目的索引（仅用于TQA任务）
-            if isinstance(config, dict) and config.get('type') == 'pattern_optimized':
-                strategy_map = config.get('strategy_map', {})
-                base_strategy = config.get('base_strategy', {
-                    "prompt": "Question: {question}\n\nOptions:\n{options}\n\nAnswer:",
-                    "params": {"max_new_tokens": 1, "temperature": 0.0, "do_sample": False,
-                              "repetition_penalty": 1.0, "top_p": 1.0, "top_k": 1, "use_cache": True}
-                })
-                
-                # 使用多策略映射
-                for i, question_data in enumerate(questions):
-                    question = question_data.get('question', '')
-                    options = question_data.get('options', {})
-                    groundtruth = question_data.get(groundtruth_field, '')
-                    
-                    if not question or not groundtruth:
-                        continue
-                    
-                    try:
-                        # 根据题目索引选择策略
-                        if i in strategy_map:
-                            strategy = strategy_map[i]
-                        else:
-                            strategy = base_strategy
-                        
-                        prompt = self.build_prompt(strategy["prompt"], question, options)
-                        q_start_time = time.time()
-                        answer, _ = self.generate_answer(prompt, strategy["params"])
-                        elapsed_time = time.time() - q_start_time
-                        total_time += elapsed_time
-                        
-                        if answer == groundtruth:
-                            correct_count += 1
-                        else:
-                            # 记录错误题目索引（仅用于TQA任务）
-                            if task_name == "TQA Task":
-                                error_indices.append(i)
-                    except Exception as e:
-                        if task_name == "TQA Task":
-                            error_indices.append(i)
-                        continue
+            if batched_runs is not None:
+                items, answers = batched_runs["items"][run], batched_runs["answers"][run]
             else:
-                # 标准配置或Few-shot配置
-                prompt_template = config.get("prompt", "Question: {question}\n\nOptions:\n{options}\n\nAnswer:")
-                params = config.get("params", {"max_new_tokens": 1, "temperature": 0.0, "do_sample": False,
-                                             "repetition_penalty": 1.0, "top_p": 1.0, "top_k": 1, "use_cache": True})
+                # 处理Few-shot配置（每次运行重新选择示例）
+                few_shot_examples = None
+                num_few_shot = config.get('num_examples', 2)  # 从配置中读取示例数量
+                if config.get('use_few_shot', False) and self.example_index_dir is None:
+                    # 每次运行重新选择Few-shot示例（模拟优化时的随机性）
+                    seed = None if self.few_shot_seed is None else f"{self.few_shot_seed}:{task_name}:{run}"
+                    few_shot_examples = self.load_few_shot_examples(task_name, num_examples=num_few_shot, seed=seed)
                 
-                for i, question_data in enumerate(questions):
-                    question = question_data.get('question', '')
-                    options = question_data.get('options', {})
-                    groundtruth = question_data.get(groundtruth_field, '')
-                    
-                    if not question or not groundtruth:
-                        continue
-                    
-                    try:
-                        # 构建提示词（Few-shot或标准）
-                        if config.get('use_few_shot', False) and few_shot_examples:
-                            expert_instruction = config.get('expert_instruction', '')
-                            prompt = self.build_few_shot_prompt(task_name, question, options, 
-                                                               few_shot_examples, expert_instruction)
-                        else:
-                            prompt = self.build_prompt(prompt_template, question, options)
-                        
-                        q_start_time = time.time()
-                        answer, _ = self.generate_answer(prompt, params)
-                        elapsed_time = time.time() - q_start_time
-                        total_time += elapsed_time
-                        
-                        if answer == groundtruth:
-                            correct_count += 1
-                        else:
-                            # 记录错误题目索引（仅用于TQA任务）
-                            if task_name == "TQA Task":
-                                error_indices.append(i)
-                    except Exception as e:
-                        if task_name == "TQA Task":
-                            error_indices.append(i)
-                        continue
+                # 构建工作项并按策略分组调度执行
+                with self.phase("build_prompts"):
+                    items = self.build_work_items(task_name, questions, config, few_shot_examples)
+                if cascade_mode:
+                    answers, cascade_run = self.execute_cascade(items, cheap_scores, task_name, len(questions))
+                    cascade_runs.append(cascade_run)
+                else:
+                    answers = self.execute_work_items(items, task_name)
+            
+            run_items.append(items)
+            for item, answer in zip(items, answers):
+                if answer == item["groundtruth"]:
+                    correct_count += 1
+                elif task_name == "TQA Task":
+                    # 记录错误题目索引（仅用于TQA任务，生成失败也计为错误）
+                    error_indices.append(item["index"])
+                question_results.append({
+                    'index': item["index"],
+                    'question_id': questions[item["index"]].get('question_id'),
+                    'run': run,
+                    'level': questions[item["index"]].get('level'),
+                    'strategy': item["strategy"],
+                    'groundtruth': item["groundtruth"],
+                    'predicted': answer,
+                    'correct': answer == item["groundtruth"]
+                })
+                if "margin" in item:
+                    question_results[-1]['margin'] = item["margin"]
             
             elapsed_total = time.time() - start_time
+            if batched_runs is not None:
+                elapsed_total += batched_runs["elapsed"] / num_runs
             accuracy = correct_count / len(questions) * 100 if questions else 0
+            if self.core_set is not None:
+                # 冒烟模式：子集上的结果按分层权重估计全集准确率，正确数为折算到全集的估计值
+                outcomes = {questions[item["index"]].get('question_id'): float(answer == item["groundtruth"])
+                            for item, answer in zip(items, answers)}
+                accuracy = self.core_set.estimate({task_name: outcomes}, [task_name])["accuracy"]
+                correct_count = accuracy * len(questions) / 100
             
             all_accuracies.append(accuracy)
             all_correct_counts.append(correct_count)
@@ -523,6 +1114,12 @@ class ReasoningVFullValidation:
                 import sys
                 sys.stdout.flush()
         
+        if self.logit_archive is not None:
+            self.archive_option_logits(task_name, questions, run_items)
+        smoke = None
+        if self.core_set is not None:
+            smoke = self.core_set.estimate({task_name: self.question_outcomes(question_results)}, [task_name])
+        
         # 计算平均值
         avg_accuracy = sum(all_accuracies) / len(all_accuracies) if all_accuracies else 0
         avg_correct_count = sum(all_correct_counts) / len(all_correct_counts) if all_correct_counts else 0
@@ -536,11 +1133,28 @@ class ReasoningVFullValidation:
             'avg_time': avg_total_time / len(questions) if questions else 0,
             'total_time': avg_total_time,
             'num_runs': num_runs,
-            'individual_accuracies': all_accuracies if num_runs > 1 else None
+            'individual_accuracies': all_accuracies if num_runs > 1 else None,
+            'question_results': question_results
         }
+        if self.last_schedule_stats:
+            result['schedule_stats'] = self.last_schedule_stats
+        if batched_runs is not None:
+            result['batched_runs'] = batched_runs["stats"]
+        if smoke is not None:
+            result['smoke'] = smoke
+        if self.prompt_cache is not None:
+            result['incremental'] = self.prompt_cache.task_summary(task_name)
+        if cascade_runs:
+            result['cascade'] = {
+                'threshold': self.cascade_threshold,
+                'curve': average_curves([run['curve'] for run in cascade_runs]),
+                'few_shot_cost': sum(run['few_shot_cost'] for run in cascade_runs) / len(cascade_runs)
+            }
+            print(f"\n   🪜 成本-准确率曲线（成本为预填充token数，相对成本以全部使用Few-shot为基准）:")
+            print_cascade_curve(result['cascade']['curve'])
         
-        # 如果是TQA任务，统计错误难度分布
-        if task_name == "TQA Task" and 'error_indices' in locals():
+        # 如果是TQA任务，统计错误难度分布（冒烟模式只评估了子集，不统计）
+        if task_name == "TQA Task" and 'error_indices' in locals() and self.core_set is None:
             error_stats = self.analyze_tqa_errors_by_difficulty(questions, error_indices)
             result['error_difficulty_distribution'] = error_stats
             print(f"\n   📊 TQA错误难度分布:")
@@ -552,6 +1166,9 @@ class ReasoningVFullValidation:
         print(f"\n   ✅ {task_name} 测试完成")
         print(f"      准确率: {avg_accuracy:.2f}% ({'平均' if num_runs > 1 else ''})")
         print(f"      正确数: {result['correct_count']}/{len(questions)}")
+        if smoke is not None:
+            print(f"      全集估计: {smoke['accuracy']:.2f}% ± {smoke['error_bound']:.2f}% "
+                  f"(95%区间 [{smoke['ci_low']:.2f}%, {smoke['ci_high']:.2f}%], 子集 {smoke['sample']}/{smoke['population']} 题)")
         if num_runs > 1:
             print(f"      各次运行: {[f'{a:.2f}%' for a in all_accuracies]}")
         print(f"      总时间: {avg_total_time:.1f}秒")
@@ -560,39 +1177,37 @@ class ReasoningVFullValidation:
         
         return result
     
+    @staticmethod
+    def question_outcomes(question_results: List[Dict]) -> Dict[str, float]:
+        """逐题结果 -> {题目ID: 各次运行的平均正确率}"""
+        totals: Dict[str, List[float]] = {}
+        for record in question_results:
+            totals.setdefault(record['question_id'], []).append(float(record['correct']))
+        return {index: sum(values) / len(values) for index, values in totals.items()}
+    
     def analyze_tqa_errors_by_difficulty(self, questions: List[Dict], error_indices: List[int]) -> Dict[str, Any]:
         """分析TQA错误在各难度级别的分布"""
-        from collections import Counter
-        
-        error_by_level = Counter()
-        total_by_level = Counter()
-        
-        for i, question in enumerate(questions):
-            level = question.get('level', 'Unknown')
-            total_by_level[level] += 1
-            
-            if i in error_indices:
-                error_by_level[level] += 1
+        frame = ResultFrame({
+            'level': [question.get('level', 'Unknown') for question in questions],
+            'correct': ~error_mask(len(questions), error_indices)
+        })
         
         error_stats = {}
-        for level in sorted(total_by_level.keys()):
-            total = total_by_level[level]
-            errors_count = error_by_level[level]
-            error_rate = errors_count / total * 100 if total > 0 else 0
-            accuracy = (total - errors_count) / total * 100 if total > 0 else 0
-            
+        for level, stats in frame.group('level').items():
             error_stats[level] = {
-                'total_questions': total,
-                'errors': errors_count,
-                'correct': total - errors_count,
-                'error_rate': error_rate,
-                'accuracy': accuracy
+                'total_questions': stats['total'],
+                'errors': stats['errors'],
+                'correct': stats['correct'],
+                'error_rate': stats['error_rate'],
+                'accuracy': stats['accuracy']
             }
         
         return {
             'error_stats': error_stats,
             'total_errors': len(error_indices),
-            'total_questions': len(questions)
+            'total_questions': len(questions),
+            # 错误题目按题目ID记录（位置只在本次加载内有效）
+            'error_question_ids': [questions[i].get('question_id', str(i)) for i in error_indices]
         }
         print(f"\n{'='*80}")
         print(f"📊 测试任务: {task_name}")
@@ -733,7 +1348,10 @@ class ReasoningVFullValidation:
         print(f"\n🎯 开始ReasoningV完整验证测试")
         print(f"{'='*80}")
         
-        self.load_model()
+        # 增量模式下推迟到第一个需要生成的工作项时再加载
+        if self.prompt_cache is None:
+            with self.phase("load_model"):
+                self.load_model()
         
         results = {}
         total_questions = 0
@@ -748,8 +1366,8 @@ class ReasoningVFullValidation:
         
         for task_name in task_order:
             if task_name in self.tasks:
-                # Few-shot任务运行3次取平均，其他任务运行1次
-                num_runs = 3 if task_name in few_shot_tasks else 1
+                # Few-shot任务运行3次取平均，其他任务运行1次（检索式示例是确定的，只需运行1次）
+                num_runs = 3 if task_name in few_shot_tasks and self.example_index_dir is None else 1
                 result = self.test_task(task_name, num_runs=num_runs)
                 if result:
                     results[task_name] = result
@@ -771,15 +1389,51 @@ class ReasoningVFullValidation:
         print(f"   总正确数: {total_correct}")
         print(f"   总体准确率: {overall_accuracy:.2f}%")
         
-        return {
+        output = {
             'results': results,
             'overall_accuracy': overall_accuracy,
             'total_questions': total_questions,
             'total_correct': total_correct
         }
+        cascade_results = [result['cascade'] for result in results.values() if 'cascade' in result]
+        if cascade_results:
+            output['cascade'] = self.summarize_cascade(results)
+            print(f"\n🪜 级联总体成本-准确率曲线（{', '.join(output['cascade']['tasks'])}）:")
+            print_cascade_curve(output['cascade']['curve'])
+        if self.prompt_cache is not None:
+            output['incremental'] = self.prompt_cache.summary()
+            print_incremental_summary(output['incremental'])
+            self.prompt_cache.save()
+        if self.question_index is not None:
+            self.question_index.save()
+        if self.core_set is not None:
+            output['smoke'] = self.core_set.estimate(
+                {name: self.question_outcomes(result['question_results']) for name, result in results.items()},
+                list(results))
+            smoke = output['smoke']
+            print(f"\n🔥 冒烟模式总体估计: {smoke['accuracy']:.2f}% ± {smoke['error_bound']:.2f}% "
+                  f"(95%区间 [{smoke['ci_low']:.2f}%, {smoke['ci_high']:.2f}%], 评估 {smoke['sample']}/{smoke['population']} 题)")
+        if self.logit_archive is not None:
+            output['logit_archive'] = self.logit_archive.directory
+            print_archive_summary(self.logit_archive)
+        if self.backend is not None:
+            output['backend'] = self.backend.summary()
+            backend = output['backend']
+            print(f"\n🛰️ 推理服务: {backend['requests']} 个请求（失败 {backend['errors']} 个）, "
+                  f"{backend['connections']} 个连接, 平均延迟 {backend['avg_latency'] * 1000:.1f} ms")
+        return output
     
-    def save_results(self, results: Dict[str, Any]):
-        """保存结果"""
+    def summarize_cascade(self, results: Dict[str, Any]) -> Dict:
+        """把各级联任务的曲线按题目数加权合并为总体曲线（成本相加）"""
+        tasks = [name for name, result in results.items() if 'cascade' in result]
+        few_shot_cost = sum(results[name]['cascade']['few_shot_cost'] for name in tasks)
+        curve = merge_curves([results[name]['cascade']['curve'] for name in tasks],
+                             [results[name]['total_questions'] for name in tasks],
+                             [results[name]['cascade']['few_shot_cost'] for name in tasks])
+        return {'threshold': self.cascade_threshold, 'tasks': tasks, 'few_shot_cost': few_shot_cost, 'curve': curve}
+    
+    def save_results(self, results: Dict[str, Any], results_db: Optional[str] = None):
+        """保存结果（提供results_db时同时导入SQLite结果库）"""
         output = {
             'validation_results': results,
             'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
@@ -790,9 +1444,54 @@ class ReasoningVFullValidation:
             json.dump(output, f, ensure_ascii=False, indent=2)
         
         print(f"\n✅ 结果已保存到: reasoningv_full_validation_results.json")
+        
+        if results_db:
+            store = ResultsStore(results_db)
+            names = store.import_file("reasoningv_full_validation_results.json")
+            store.close()
+            print(f"💾 已导入结果库 {results_db}: {', '.join(names)}")
 
 def main():
     """主函数"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="ReasoningV优化后完整验证测试")
+    parser.add_argument("model_path", nargs="?", default="/home/ligengfei/LLM/Analogseeker-lgf/ReasoningV-7B",
+                        help="模型路径")
+    RunProfiler.add_arguments(parser)
+    RunMetrics.add_arguments(parser)
+    CompletionsBackend.add_arguments(parser)
+    parser.add_argument("--onnx", default=None, metavar="PATH",
+                        help="CPU上用ONNX Runtime打分：单token贪心工作项使用导出的选项字母图（文件不存在或模型变化时先导出）")
+    parser.add_argument("--onnx-threads", type=int, default=None, help="ONNX Runtime线程数")
+    parser.add_argument("--results-db", default=None, help="同时导入的SQLite结果库路径（如results/results.db）")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量评估：只重新生成提示词或参数哈希变化的工作项，其余复用上次运行的答案")
+    parser.add_argument("--prompt-cache-dir", default="results/prompt_cache", help="增量评估的哈希记录目录")
+    parser.add_argument("--few-shot-seed", type=int, default=None,
+                        help="Few-shot示例选择种子（增量模式默认0，否则每次随机）")
+    parser.add_argument("--save-logits", action="store_true",
+                        help="把每题的选项字母logits按 (模型, 任务, 策略) 写入压缩归档，供离线分析")
+    parser.add_argument("--logit-archive-dir", default="results/logit_archive", help="选项logit归档目录")
+    parser.add_argument("--archive-candidates", action="store_true",
+                        help="配合--save-logits：TQA错误模式优化的每个候选策略都在全部题目上打分归档（供strategy_optimizer.py离线优化）")
+    parser.add_argument("--question-index", default="results/question_index.json",
+                        help="题目ID -> 位置 索引文件（空字符串表示不写）")
+    parser.add_argument("--smoke", type=int, default=None, metavar="SIZE",
+                        help="冒烟模式：只评估按 任务/难度/路由类型 分层抽取的约SIZE题，报告全集准确率估计和误差界")
+    parser.add_argument("--core-set-path", default="results/core_set.json", help="核心子集文件（题目不变时复用）")
+    parser.add_argument("--core-set-seed", type=int, default=0, help="核心子集抽样种子")
+    parser.add_argument("--sequential-runs", action="store_true",
+                        help="Few-shot任务的多次运行逐次执行（默认合并为一次批量执行，示例集前缀只预填充一次）")
+    parser.add_argument("--retrieval-examples", action="store_true",
+                        help="检索式Few-shot示例：每题使用BM25最相似的有效题目（确定性选择，Few-shot任务只运行1次）")
+    parser.add_argument("--example-index-dir", default="results/fewshot_index", help="示例检索索引目录")
+    parser.add_argument("--cascade-threshold", type=float, default=None,
+                        help="置信度门控级联：Few-shot任务先用零样本模板打分，选项概率margin低于该阈值才升级到Few-shot")
+    parser.add_argument("--cascade-sweep", default=None,
+                        help="成本-准确率曲线扫描的阈值（逗号分隔，如0,0.1,0.3,1.01；超过工作阈值的点需要额外生成Few-shot答案）")
+    args = parser.parse_args()
+    
     print("🚀 ReasoningV优化后完整验证测试工具")
     print("使用所有优化后的策略配置，完整测试AMSBench所有题目")
     print("确保准确率可重复")
@@ -801,13 +1500,44 @@ def main():
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
     
-    reasoningv_path = "/home/ligengfei/LLM/Analogseeker-lgf/ReasoningV-7B"
-    
-    validator = ReasoningVFullValidation(reasoningv_path)
-    results = validator.run_full_validation()
+    validator = ReasoningVFullValidation(args.model_path)
+    validator.profiler = RunProfiler.from_args(args)
+    validator.metrics = RunMetrics.from_args(args)
+    validator.backend = CompletionsBackend.from_args(args, args.model_path)
+    validator.onnx_path = args.onnx
+    validator.onnx_threads = args.onnx_threads
+    validator.few_shot_seed = args.few_shot_seed
+    validator.cascade_threshold = args.cascade_threshold
+    validator.batch_few_shot_runs = not args.sequential_runs
+    if args.question_index:
+        validator.question_index = QuestionIndex(args.question_index)
+    if args.smoke is not None:
+        task_questions = {task_name: validator.load_task_data(task_name) for task_name in validator.tasks}
+        validator.core_set = CoreSet.for_tasks(task_questions, args.smoke, args.core_set_path, args.core_set_seed)
+        print_core_set(validator.core_set)
+    if args.save_logits:
+        validator.logit_archive = LogitArchive.for_model_path(args.model_path, args.logit_archive_dir)
+        validator.archive_candidates = args.archive_candidates
+    if args.retrieval_examples:
+        validator.example_index_dir = args.example_index_dir
+    if args.cascade_sweep:
+        validator.cascade_sweep = [float(t) for t in args.cascade_sweep.split(",")]
+    if any(t < 0 for t in [args.cascade_threshold or 0.0] + (validator.cascade_sweep or [])):
+        parser.error("级联阈值必须非负（margin取值范围为[0, 1]）")
+    if args.incremental:
+        validator.prompt_cache = PromptHashCache(args.model_path, args.prompt_cache_dir)
+        if validator.few_shot_seed is None:
+            validator.few_shot_seed = 0
+    try:
+        results = validator.run_full_validation()
+    finally:
+        if validator.metrics is not None:
+            validator.metrics.close()
+        if validator.backend is not None:
+            validator.backend.close()
     
     if results:
-        validator.save_results(results)
+        validator.save_results(results, args.results_db)
         
         # 与预期结果对比
         expected_results = {
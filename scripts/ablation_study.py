@@ -6,11 +6,20 @@
 """
 
 import json
+import math
 import torch
 import time
 import os
+import glob
+from collections import Counter
 from transformers import AutoTokenizer, AutoModelForCausalLM
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
+from option_scorer import OptionLetterScorer
+from prefix_scheduler import StrategyGroupedScheduler
+from profiling import RunProfiler
+from metrics import RunMetrics
+from shared_weights import load_shared_model
+from http_backend import CompletionsBackend
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -18,12 +27,22 @@ warnings.filterwarnings("ignore")
 class AblationStudy:
     """消融实验类"""
     
-    def __init__(self, model_path: str):
-        """初始化"""
+    def __init__(self, model_path: str, device: Optional[str] = None):
+        """初始化（device指定时模型整体放在该设备上，否则自动分配）"""
         self.model_path = model_path
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.device_map = {"": device} if device else "auto"
         self.model = None
         self.tokenizer = None
+        self.scorer = None
+        self.prefix_states = {}  # 前缀token -> 预填充的KV状态（跨配置复用）
+        self.last_run_summary = None
+        self.mmap_weights = False  # 从内存映射的safetensors加载（CPU，fork出的worker共享权重页）
+        self.constrained_decoding = False  # 约束解码：只允许选项字母/空白，生成字母后提前停止
+        self.decode_stats = {"decode_steps": 0, "max_decode_steps": 0}
+        self.profiler: Optional[RunProfiler] = None  # 剖析器（None表示不剖析）
+        self.metrics: Optional[RunMetrics] = None  # 运行指标（None表示不导出）
+        self.backend: Optional[CompletionsBackend] = None  # OpenAI兼容推理服务（None表示在本进程加载模型）
         
         # 实验配置
         self.experiments = {
@@ -123,27 +142,99 @@ class AblationStudy:
         """加载模型"""
         print(f"📥 正在加载模型: {self.model_path}")
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, trust_remote_code=True)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        if self.backend is not None:
+            print(f"✅ 使用推理服务 {self.backend.base_url}（模型 {self.backend.model}, "
+                  f"并发上限 {self.backend.max_concurrency}），本地只加载tokenizer")
+            return
+        if self.mmap_weights:
+            self.device = "cpu"
+            self.model = load_shared_model(self.model_path)
+            print("✅ 模型加载完成（内存映射权重）")
+            return
         self.model = AutoModelForCausalLM.from_pretrained(
             self.model_path,
             torch_dtype=torch.float16,
-            device_map="auto",
+            device_map=self.device_map,
             trust_remote_code=True
         )
         print("✅ 模型加载完成")
     
     def generate_answer(self, prompt: str, params: Dict) -> str:
         """生成答案"""
+        if self.backend is not None:
+            completion = self.backend.complete(prompt, params)
+            self.record_remote_decode_steps([completion], params)
+            return self.parse_answer(completion["text"])
+        
         inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        prompt_length = inputs['input_ids'].shape[1]
         
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
-                **params
+                **params,
+                **self.constraint_kwargs(prompt_length, params)
             )
         
-        answer = self.tokenizer.decode(outputs[0][inputs['input_ids'].shape[1]:], skip_special_tokens=True).strip()
+        new_tokens = outputs[:, prompt_length:]
+        self.record_decode_steps(new_tokens, params)
+        answer = self.tokenizer.decode(new_tokens[0], skip_special_tokens=True).strip()
         return answer[0] if answer else "A"
     
+    def constraint_kwargs(self, prompt_length: int, params: Dict) -> Dict:
+        """约束解码时传给generate的logits_processor和stopping_criteria"""
+        if not self.constrained_decoding:
+            return {}
+        processors, stopping = self.get_scorer().build_letter_constraints(prompt_length,
+                                                                          params.get("max_new_tokens", 1))
+        return {"logits_processor": processors, "stopping_criteria": stopping}
+    
+    def record_decode_steps(self, new_tokens: torch.Tensor, params: Dict):
+        """
+        累计实际解码步数：每行截止到第一个结束token（EOS；约束解码时还包括选项字母）为止，
+        上限为max_new_tokens
+        """
+        max_new_tokens = params.get("max_new_tokens", 1)
+        stop_ids = set()
+        if self.tokenizer.eos_token_id is not None:
+            stop_ids.add(self.tokenizer.eos_token_id)
+        if self.constrained_decoding:
+            stop_ids.update(self.get_scorer().flat_letter_token_ids)
+        for row in new_tokens.tolist():
+            steps = len(row)
+            for position, token_id in enumerate(row):
+                if token_id in stop_ids:
+                    steps = position + 1
+                    break
+            self.decode_stats["decode_steps"] += steps
+            self.decode_stats["max_decode_steps"] += max_new_tokens
+    
+    def record_remote_decode_steps(self, completions: List[Optional[Dict]], params: Dict, num_samples: int = 1):
+        """累计推理服务返回的生成token数（服务端遇到EOS即停止，失败的请求不计）"""
+        for completion in completions:
+            if completion is not None:
+                self.decode_stats["decode_steps"] += completion["completion_tokens"]
+                self.decode_stats["max_decode_steps"] += params.get("max_new_tokens", 1) * num_samples
+    
+    def run_remote(self, config: Dict, questions: List[Dict], examples: List[Dict]) -> Tuple[List[str], Dict]:
+        """
+        通过推理服务执行一个配置：全部提示词并发发送（并发数由后端限制），
+        公共前缀的复用交给服务端的前缀缓存；失败的请求按解析规则记为A
+        """
+        params = config["params"]
+        prompts = [self.build_prompt(config, item, examples) for item in questions]
+        completions = self.backend.complete_many([(prompt, params) for prompt in prompts])
+        self.record_remote_decode_steps(completions, params)
+        answers = [self.parse_answer(completion["text"]) if completion is not None else "A"
+                   for completion in completions]
+        return answers, {
+            "mode": "http",
+            "prompt_tokens": sum(c["prompt_tokens"] for c in completions if c is not None),
+            "failed_requests": sum(c is None for c in completions)
+        }
+    
     def create_few_shot_prompt(self, question: str, options: str, num_examples: int, expert_instruction: str, examples: List[Dict]) -> str:
         """创建Few-shot提示词"""
         prompt = expert_instruction + "\n\n"
@@ -162,84 +253,434 @@ class AblationStudy:
         
         return prompt
     
-    def test_task(self, task_data: List[Dict], experiment_name: str, task_name: str = "LDO") -> Dict:
-        """测试单个任务"""
-        config = self.experiments[experiment_name]
-        correct = 0
-        total = len(task_data)
-        times = []
+    def get_few_shot_examples(self, task_name: str) -> List[Dict]:
+        """获取任务的Few-shot示例"""
+        if task_name != "LDO":
+            return []
         
-        # 准备Few-shot示例（如果有）
-        examples = []
-        if config.get("use_few_shot", False) and task_name == "LDO":
-            # LDO任务的Few-shot示例
-            examples = [
-                {
-                    "question": "What determines the dropout voltage in an LDO?",
-                    "options": "A. Input voltage level\nB. Pass transistor characteristics\nC. Load current\nD. Temperature",
-                    "answer": "B"
-                },
-                {
-                    "question": "How does the error amplifier work in an LDO?",
-                    "options": "A. It compares input and output\nB. It compares reference and feedback\nC. It amplifies the load current\nD. It generates the reference voltage",
-                    "answer": "B"
-                },
-                {
-                    "question": "What is the role of the feedback network in an LDO?",
-                    "options": "A. To sense the input voltage\nB. To divide the output voltage\nC. To control the pass transistor\nD. To generate the reference",
-                    "answer": "B"
-                }
-            ]
+        # LDO任务的Few-shot示例
+        return [
+            {
+                "question": "What determines the dropout voltage in an LDO?",
+                "options": "A. Input voltage level\nB. Pass transistor characteristics\nC. Load current\nD. Temperature",
+                "answer": "B"
+            },
+            {
+                "question": "How does the error amplifier work in an LDO?",
+                "options": "A. It compares input and output\nB. It compares reference and feedback\nC. It amplifies the load current\nD. It generates the reference voltage",
+                "answer": "B"
+            },
+            {
+                "question": "What is the role of the feedback network in an LDO?",
+                "options": "A. To sense the input voltage\nB. To divide the output voltage\nC. To control the pass transistor\nD. To generate the reference",
+                "answer": "B"
+            }
+        ]
+    
+    @staticmethod
+    def format_options(options: Any) -> str:
+        """选项格式化：字典形式的选项转换为 "A. ..." 多行文本，字符串原样返回"""
+        if isinstance(options, dict):
+            return "\n".join(f"{key}. {value}" for key, value in options.items())
+        return options
+    
+    def build_prompt(self, config: Dict, item: Dict, examples: List[Dict]) -> str:
+        """按实验配置构建单题提示词"""
+        question = item.get("question", "")
+        options = self.format_options(item.get("options", ""))
+        if config.get("use_few_shot", False):
+            return self.create_few_shot_prompt(
+                question,
+                options,
+                config.get("num_examples", 1),
+                config.get("expert_instruction", ""),
+                examples
+            )
+        return config["prompt_template"].format(question=question, options=options)
+    
+    @staticmethod
+    def parse_answer(text: str) -> str:
+        """解析生成文本（与generate_answer一致：取首字符，空则为A）"""
+        text = text.strip()
+        return text[0] if text else "A"
+    
+    @staticmethod
+    def wilson_interval(correct: int, total: int, z: float = 1.96) -> Tuple[float, float]:
+        """准确率的Wilson置信区间（百分比）"""
+        if total <= 0:
+            return 0.0, 0.0
+        p = correct / total
+        denominator = 1 + z * z / total
+        center = (p + z * z / (2 * total)) / denominator
+        margin = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denominator
+        return max(0.0, center - margin) * 100, min(1.0, center + margin) * 100
+    
+    @staticmethod
+    def mean_interval(values: List[float], z: float = 1.96) -> Tuple[float, float]:
+        """[0, 1]取值的均值（如逐题命中率）的正态置信区间（百分比）"""
+        n = len(values)
+        if n == 0:
+            return 0.0, 0.0
+        mean = sum(values) / n
+        variance = sum((v - mean) ** 2 for v in values) / (n - 1) if n > 1 else 0.0
+        margin = z * math.sqrt(variance / n)
+        return max(0.0, mean - margin) * 100, min(1.0, mean + margin) * 100
+    
+    def get_scorer(self, batch_size: Optional[int] = None) -> OptionLetterScorer:
+        """获取（共享的）选项打分器"""
+        if self.scorer is None:
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            self.scorer = OptionLetterScorer(self.model, self.tokenizer, batch_size or 8)
+        if batch_size is not None:
+            self.scorer.batch_size = batch_size
+        return self.scorer
+    
+    def get_prefix_state(self, prefix_ids: List[int]) -> Dict:
+        """获取前缀token的KV状态：与已预填充前缀公共token最多的作为父状态，只计算其余部分"""
+        key = tuple(prefix_ids)
+        if self.metrics is not None:
+            self.metrics.observe_cache("prefix", key in self.prefix_states)
+        if key not in self.prefix_states:
+            parent = max(self.prefix_states.values(), default=None,
+                         key=lambda state: len(os.path.commonprefix([state["input_ids"], list(prefix_ids)])))
+            self.prefix_states[key] = self.scorer.prefill_ids(prefix_ids, parent)
+        return self.prefix_states[key]
+    
+    @staticmethod
+    def is_single_token_greedy(params: Dict) -> bool:
+        """判断配置是否为单token贪心解码（可用一次前向打分代替generate；重复惩罚会改变logits，不能代替）"""
+        return (not params.get("do_sample", False) and params.get("max_new_tokens", 1) == 1
+                and params.get("repetition_penalty", 1.0) == 1.0)
+    
+    def generate_answers_batch(self, prompts: List[str], params: Dict, batch_size: int = 8) -> List[str]:
+        """批量生成答案（左填充，用于采样或多token配置）"""
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        padding_side = self.tokenizer.padding_side
+        self.tokenizer.padding_side = "left"
+        answers = []
+        try:
+            for start in range(0, len(prompts), batch_size):
+                inputs = self.tokenizer(prompts[start:start + batch_size], return_tensors="pt",
+                                        padding=True).to(self.device)
+                prompt_length = inputs['input_ids'].shape[1]
+                with torch.no_grad():
+                    outputs = self.model.generate(
+                        **inputs,
+                        **params,
+                        **self.constraint_kwargs(prompt_length, params),
+                        pad_token_id=self.tokenizer.pad_token_id
+                    )
+                new_tokens = outputs[:, prompt_length:]
+                self.record_decode_steps(new_tokens, params)
+                for row in new_tokens:
+                    answers.append(self.parse_answer(self.tokenizer.decode(row, skip_special_tokens=True)))
+        finally:
+            self.tokenizer.padding_side = padding_side
+        return answers
+    
+    def run_batched(self, config: Dict, questions: List[Dict], examples: List[Dict],
+                    batch_size: int = 8) -> Tuple[List[str], Dict]:
+        """
+        批量执行一个配置
         
-        print(f"\n🧪 实验: {config['name']}")
-        print(f"   测试题目数: {total}")
+        - Few-shot配置：整条提示词分词后，所有题目的公共token前缀（示例部分）只预填充一次，KV在批内共享；
+          在token层面切分，前缀和后缀的token与整条提示词分词完全一致（不受BPE跨边界合并影响）；
+          前缀互相嵌套的配置（few_shot_1/2/3）复用已计算的公共token
+        - 单token贪心配置：一次前向取整词表argmax，等价于max_new_tokens=1的generate
+        - 采样/多token配置：左填充批量generate
         
-        for i, item in enumerate(task_data[:10]):  # 只测试前10题以节省时间
-            question = item.get("question", "")
-            options = item.get("options", "")
-            groundtruth = item.get("ground_truth", item.get("groundtruth", "A"))
-            
-            # 构建提示词
-            if config.get("use_few_shot", False):
-                prompt = self.create_few_shot_prompt(
-                    question, 
-                    options, 
-                    config.get("num_examples", 1),
-                    config.get("expert_instruction", ""),
-                    examples
-                )
-            else:
-                prompt = config["prompt_template"].format(question=question, options=options)
-            
-            # 生成答案
-            start_time = time.time()
+        Returns:
+            (按题目顺序的答案列表, 计算统计)
+        """
+        params = config["params"]
+        prompts = [self.build_prompt(config, item, examples) for item in questions]
+        stats = {"mode": "generate", "prompt_tokens": 0, "prefix_tokens_computed": 0, "prefix_tokens_reused": 0}
+        
+        if not self.is_single_token_greedy(params):
+            order = sorted(range(len(prompts)), key=lambda i: len(prompts[i]))
+            scheduled = self.generate_answers_batch([prompts[i] for i in order], params, batch_size)
+            return StrategyGroupedScheduler.restore(scheduled, order), stats
+        
+        scorer = self.get_scorer(batch_size)
+        shared = 0
+        if config.get("use_few_shot", False) and prompts:
+            # 与score_prompts相同的分词；每题至少保留一个后缀token
+            encoded = self.tokenizer(prompts)["input_ids"]
+            shared = min(len(os.path.commonprefix(encoded)), min(len(ids) for ids in encoded) - 1)
+        
+        if shared > 0:
+            # 所有题目共享同一个示例前缀
+            computed_before = tuple(encoded[0][:shared]) in self.prefix_states
+            state = self.get_prefix_state(encoded[0][:shared])
+            order = sorted(range(len(encoded)), key=lambda i: len(encoded[i]))
+            scores = scorer.score_with_prefixes([state], [(0, encoded[i][shared:]) for i in order], batch_size)
+            stats.update({
+                "mode": "shared_prefix",
+                "prompt_tokens": scores["prompt_tokens"],
+                "prefix_tokens_computed": 0 if computed_before else state["computed_tokens"],
+                "prefix_tokens_reused": state["length"] * len(encoded)
+                                        - (0 if computed_before else state["computed_tokens"])
+            })
+        else:
+            order = sorted(range(len(prompts)), key=lambda i: len(prompts[i]))
+            scores = scorer.score_prompts([prompts[i] for i in order], batch_size)
+            stats.update({"mode": "batched_forward", "prompt_tokens": scores["prompt_tokens"]})
+        
+        scheduled = scorer.decode_greedy(scores["top_token_ids"], parse=self.parse_answer)
+        return StrategyGroupedScheduler.restore(scheduled, order), stats
+    
+    def run_sequential(self, config: Dict, questions: List[Dict], examples: List[Dict]) -> List[str]:
+        """逐题执行一个配置（原始实现，用作参考或批量执行失败时的回退）"""
+        answers = []
+        for i, item in enumerate(questions):
             try:
-                answer = self.generate_answer(prompt, config["params"])
-                if answer.upper() == groundtruth.upper():
-                    correct += 1
+                answers.append(self.generate_answer(self.build_prompt(config, item, examples), config["params"]))
             except Exception as e:
                 print(f"   错误 (题目 {i+1}): {e}")
-                answer = "A"
+                answers.append("A")
             
-            times.append(time.time() - start_time)
-            
-            if (i + 1) % 5 == 0:
-                print(f"   进度: {i+1}/{min(10, total)}")
+            if (i + 1) % 50 == 0:
+                print(f"   进度: {i+1}/{len(questions)}")
+        return answers
+    
+    def execute_config(self, config: Dict, questions: List[Dict], examples: List[Dict],
+                       batch_size: int = 8, sequential: bool = False) -> Tuple[List[str], Dict]:
+        """执行一个配置（批量执行失败时回退到逐题执行）"""
+        if sequential:
+            return self.run_sequential(config, questions, examples), {"mode": "sequential"}
+        if self.backend is not None:
+            return self.run_remote(config, questions, examples)
+        try:
+            return self.run_batched(config, questions, examples, batch_size)
+        except Exception as e:
+            print(f"   ⚠️ 批量执行失败，回退到逐题执行: {e}")
+            return self.run_sequential(config, questions, examples), {"mode": "sequential"}
+    
+    def execute_profiled(self, config: Dict, questions: List[Dict], examples: List[Dict], batch_size: int,
+                         sequential: bool, task_name: str, experiment_name: str) -> Tuple[List[str], Dict]:
+        """
+        剖析窗口内的题目单独执行并剖析，窗口前后的题目正常执行；
+        计算统计按片段累加（窗口边界处的批次划分与不剖析时略有不同，答案不受影响）
+        """
+        lo, hi = self.profiler.window(len(questions))
+        answers: List[str] = []
+        stats: Dict = {}
+        for start, end in [(0, lo), (lo, hi), (hi, len(questions))]:
+            if start >= end:
+                continue
+            if start == lo and end == hi:
+                with self.profiler.capture(task_name, experiment_name, end - start):
+                    part, part_stats = self.execute_config(config, questions[start:end], examples,
+                                                           batch_size, sequential)
+            else:
+                part, part_stats = self.execute_config(config, questions[start:end], examples,
+                                                       batch_size, sequential)
+            answers.extend(part)
+            for key, value in part_stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats[key] = stats.get(key, 0) + value
+                else:
+                    stats.setdefault(key, value)
+        return answers, stats
+    
+    def evaluate_config(self, config: Dict, task_data: List[Dict], task_name: str = "LDO",
+                        experiment_name: str = "custom", max_questions: Optional[int] = None,
+                        batch_size: int = 8, sequential: bool = False) -> Dict:
+        """
+        在任务数据上评估一个实验配置
+        
+        Args:
+            config: 实验配置（格式同self.experiments中的条目）
+            task_data: 任务数据
+            task_name: 任务名称
+            experiment_name: 实验名称（用于结果记录）
+            max_questions: 最多测试的题目数，None表示全部
+            batch_size: 批大小
+            sequential: 是否逐题执行（原始实现）
+        """
+        questions = task_data if max_questions is None else task_data[:max_questions]
+        total = len(questions)
+        
+        # 准备Few-shot示例（如果有）
+        examples = self.get_few_shot_examples(task_name) if config.get("use_few_shot", False) else []
+        
+        print(f"\n🧪 实验: {config.get('name', experiment_name)}")
+        print(f"   测试题目数: {total}")
+        
+        start_time = time.time()
+        self.decode_stats = {"decode_steps": 0, "max_decode_steps": 0}
+        if self.profiler is None:
+            answers, stats = self.execute_config(config, questions, examples, batch_size, sequential)
+        else:
+            answers, stats = self.execute_profiled(config, questions, examples, batch_size, sequential,
+                                                   task_name, experiment_name)
+        elapsed = time.time() - start_time
+        
+        correct = 0
+        for item, answer in zip(questions, answers):
+            groundtruth = item.get("ground_truth", item.get("groundtruth", "A"))
+            if answer.upper() == groundtruth.upper():
+                correct += 1
+            if self.metrics is not None:
+                self.metrics.observe_question(task_name, experiment_name, answer.upper() == groundtruth.upper())
+        if self.metrics is not None:
+            self.metrics.phase_latency.observe(elapsed, phase="execute_config")
+            self.metrics.prefill_tokens.inc(stats.get("prompt_tokens", 0) + stats.get("prefix_tokens_computed", 0),
+                                            task=task_name)
         
-        accuracy = (correct / min(10, total)) * 100 if total > 0 else 0
-        avg_time = sum(times) / len(times) if times else 0
+        accuracy = (correct / total) * 100 if total > 0 else 0
+        ci_low, ci_high = self.wilson_interval(correct, total)
+        print(f"   准确率: {accuracy:.2f}% (95% CI: {ci_low:.2f}% - {ci_high:.2f}%), 用时 {elapsed:.2f}秒")
+        if self.decode_stats["max_decode_steps"] > 0:
+            stats = dict(stats, **self.summarize_decode_steps(self.decode_stats["decode_steps"],
+                                                              self.decode_stats["max_decode_steps"], total))
         
         return {
             "experiment": experiment_name,
-            "name": config["name"],
+            "name": config.get("name", experiment_name),
             "correct": correct,
-            "total": min(10, total),
+            "total": total,
             "accuracy": accuracy,
-            "avg_time": avg_time
+            "ci_low": ci_low,
+            "ci_high": ci_high,
+            "avg_time": elapsed / total if total > 0 else 0,
+            "total_time": elapsed,
+            "execution": stats
+        }
+    
+    def summarize_decode_steps(self, decode_steps: int, max_decode_steps: int, num_rows: int) -> Dict:
+        """汇总解码步数，打印并返回平均每行节省的解码步数"""
+        saved = (max_decode_steps - decode_steps) / num_rows if num_rows > 0 else 0.0
+        label = "约束解码" if self.constrained_decoding else "无约束解码"
+        print(f"   ⏩ {label}: 解码 {decode_steps}/{max_decode_steps} 步, 平均每次生成节省 {saved:.2f} 步")
+        return {
+            "constrained": self.constrained_decoding,
+            "decode_steps": decode_steps,
+            "max_decode_steps": max_decode_steps,
+            "avg_decode_steps_saved": saved
         }
     
-    def run_ablation_study(self, task_data: List[Dict], task_name: str = "LDO") -> Dict:
-        """运行消融实验"""
+    def evaluate_multi_sample(self, config: Dict, task_data: List[Dict], task_name: str = "LDO",
+                              experiment_name: str = "custom", num_samples: int = 8,
+                              max_questions: Optional[int] = None, batch_size: int = 8,
+                              probe_questions: int = 8, seed: Optional[int] = 42) -> Dict:
+        """
+        多次采样评估（用于do_sample=True的配置）：每题在一次批量调用中采样num_samples次，
+        报告多数投票答案、每题答案分布和期望准确率（单次采样准确率的无偏估计）；
+        返回的 correct / accuracy / ci_low / ci_high 都是多数投票的结果（Wilson区间），
+        期望准确率及其95%正态区间（按题目间命中率的方差）在 expected_* 字段中
+        
+        Args:
+            num_samples: 每题采样次数
+            probe_questions: 用于估算逐题串行耗时的题目数（逐题generate一次后外推到 N 次串行运行）
+        """
+        questions = task_data if max_questions is None else task_data[:max_questions]
+        total = len(questions)
+        examples = self.get_few_shot_examples(task_name) if config.get("use_few_shot", False) else []
+        
+        print(f"\n🧪 实验: {config.get('name', experiment_name)}（每题采样 {num_samples} 次）")
+        print(f"   测试题目数: {total}")
+        
+        prompts = [self.build_prompt(config, item, examples) for item in questions]
+        order = sorted(range(total), key=lambda i: len(prompts[i]))
+        
+        start_time = time.time()
+        if self.backend is not None:
+            # 服务端在一个请求中采样num_samples次（n参数）
+            sampled = self.backend.sample([prompts[i] for i in order], config["params"], num_samples, seed)
+        else:
+            sampled = self.get_scorer(batch_size).sample([prompts[i] for i in order], config["params"],
+                                                         num_samples, batch_size, seed, self.constrained_decoding)
+        elapsed = time.time() - start_time
+        samples = StrategyGroupedScheduler.restore(sampled["samples"], order)
+        
+        majority_correct = 0
+        expected_correct = 0.0
+        per_question = []
+        for item, texts in zip(questions, samples):
+            groundtruth = item.get("ground_truth", item.get("groundtruth", "A")).upper()
+            answers = [self.parse_answer(text).upper() for text in texts]
+            distribution = Counter(answers)
+            majority = distribution.most_common(1)[0][0]
+            hit_rate = distribution.get(groundtruth, 0) / len(answers)
+            majority_correct += majority == groundtruth
+            expected_correct += hit_rate
+            if self.metrics is not None:
+                self.metrics.observe_question(task_name, experiment_name, majority == groundtruth)
+            per_question.append({
+                "ground_truth": groundtruth,
+                "majority": majority,
+                "distribution": dict(distribution),
+                "hit_rate": hit_rate
+            })
+        
+        # 估算N次逐题串行运行的耗时
+        probe = questions[:min(probe_questions, total)]
+        probe_start = time.time()
+        self.run_sequential(config, probe, examples)
+        probe_time = time.time() - probe_start
+        sequential_estimate = probe_time / len(probe) * total * num_samples if probe else 0
+        
+        expected_accuracy = expected_correct / total * 100 if total > 0 else 0
+        majority_accuracy = majority_correct / total * 100 if total > 0 else 0
+        ci_low, ci_high = self.wilson_interval(majority_correct, total)
+        expected_ci_low, expected_ci_high = self.mean_interval([row["hit_rate"] for row in per_question])
+        speedup = sequential_estimate / elapsed if elapsed > 0 else None
+        if self.metrics is not None:
+            self.metrics.phase_latency.observe(elapsed, phase="multi_sample")
+            self.metrics.prefill_tokens.inc(sampled["prompt_tokens"], task=task_name)
+        decode_summary = self.summarize_decode_steps(sampled["decode_steps"], sampled["max_decode_steps"],
+                                                     total * num_samples)
+        print(f"   多数投票准确率: {majority_accuracy:.2f}% (95% CI: {ci_low:.2f}% - {ci_high:.2f}%), "
+              f"期望准确率: {expected_accuracy:.2f}% (95% CI: {expected_ci_low:.2f}% - {expected_ci_high:.2f}%)")
+        print(f"   用时 {elapsed:.2f}秒, 估算{num_samples}次逐题串行运行 {sequential_estimate:.2f}秒"
+              + (f" ({speedup:.1f}x)" if speedup else ""))
+        
+        return {
+            "experiment": experiment_name,
+            "name": config.get("name", experiment_name),
+            "num_samples": num_samples,
+            "estimator": "majority_vote",
+            "correct": majority_correct,
+            "total": total,
+            "accuracy": majority_accuracy,
+            "ci_low": ci_low,
+            "ci_high": ci_high,
+            "majority_vote_accuracy": majority_accuracy,
+            "expected_correct": expected_correct,
+            "expected_accuracy": expected_accuracy,
+            "expected_ci_low": expected_ci_low,
+            "expected_ci_high": expected_ci_high,
+            "avg_time": elapsed / total if total > 0 else 0,
+            "total_time": elapsed,
+            "sequential_estimate": sequential_estimate,
+            "speedup": speedup,
+            "execution": dict({"mode": "multi_sample", "prompt_tokens": sampled["prompt_tokens"]},
+                              **decode_summary),
+            "per_question": per_question
+        }
+    
+    def test_task(self, task_data: List[Dict], experiment_name: str, task_name: str = "LDO",
+                  max_questions: Optional[int] = None, batch_size: int = 8, num_samples: int = 1) -> Dict:
+        """测试单个任务（默认使用全部题目；num_samples>1时采样配置改为多次采样评估）"""
+        config = self.experiments[experiment_name]
+        if num_samples > 1 and config["params"].get("do_sample", False):
+            return self.evaluate_multi_sample(config, task_data, task_name, experiment_name, num_samples,
+                                              max_questions, batch_size)
+        return self.evaluate_config(config, task_data, task_name, experiment_name, max_questions, batch_size)
+    
+    def run_ablation_study(self, task_data: List[Dict], task_name: str = "LDO",
+                           max_questions: Optional[int] = None, batch_size: int = 8,
+                           measure_plain_pass: bool = False, num_samples: int = 1) -> Dict:
+        """
+        运行消融实验（共享一次模型加载，各配置批量执行并复用公共前缀）
+        
+        Args:
+            measure_plain_pass: 额外逐题运行一次params_only配置作为"普通评估"耗时参考
+            num_samples: 采样配置（baseline / prompt_only）每题的采样次数
+        """
         print("=" * 80)
         print(f"消融实验: {task_name} 任务")
         print("=" * 80)
@@ -257,38 +698,89 @@ class AblationStudy:
             "full_optimization"
         ]
         
+        ablation_start = time.time()
         for exp_name in experiment_order:
-            result = self.test_task(task_data, exp_name, task_name)
+            result = self.test_task(task_data, exp_name, task_name, max_questions, batch_size, num_samples)
             results[exp_name] = result
+        ablation_time = time.time() - ablation_start
+        
+        plain_pass = None
+        if measure_plain_pass:
+            print("\n⏱️ 参考: 逐题执行一次params_only（普通评估）")
+            plain_pass = self.evaluate_config(self.experiments["params_only"], task_data, task_name,
+                                              "params_only_sequential", max_questions, sequential=True)
+        
+        reference_time = plain_pass["total_time"] if plain_pass else results["params_only"]["total_time"]
+        self.last_run_summary = {
+            "task_name": task_name,
+            "num_questions": results["params_only"]["total"],
+            "ablation_time": ablation_time,
+            "reference": "params_only_sequential" if plain_pass else "params_only",
+            "reference_time": reference_time,
+            "time_ratio": ablation_time / reference_time if reference_time > 0 else None,
+            "prefix_states": len(self.prefix_states)
+        }
+        if self.backend is not None:
+            self.last_run_summary["backend"] = self.backend.summary()
         
         return results
     
-    def save_results(self, results: Dict, output_file: str):
-        """保存结果"""
+    def save_results(self, results: Dict, output_file: str, summary: Optional[Dict] = None):
+        """保存结果（提供summary时一并写入耗时汇总）"""
+        output = dict(results, summary=summary) if summary else results
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
+            json.dump(output, f, indent=2, ensure_ascii=False)
         print(f"\n✅ 结果已保存到: {output_file}")
 
 
+def load_task_data(path: str) -> List[Dict]:
+    """加载任务数据：单个JSON文件，或包含多个JSON文件的目录（按文件名排序）"""
+    files = sorted(glob.glob(os.path.join(path, "*.json"))) if os.path.isdir(path) else [path]
+    task_data = []
+    for file_path in files:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            if isinstance(data, list):
+                task_data.extend(data)
+            else:
+                task_data.append(data)
+    return task_data
+
+
 def main():
     """主函数"""
-    import sys
+    import argparse
     
-    if len(sys.argv) < 2:
-        print("用法: python ablation_study.py <model_path> [task_data_file]")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="消融实验")
+    parser.add_argument("model_path", help="模型路径")
+    parser.add_argument("task_data", nargs="?", default=None, help="任务数据文件或目录")
+    parser.add_argument("--task-name", default="LDO", help="任务名称（决定Few-shot示例）")
+    parser.add_argument("--max-questions", type=int, default=None, help="最多测试的题目数（默认全部）")
+    parser.add_argument("--batch-size", type=int, default=8, help="批大小")
+    parser.add_argument("--samples", type=int, default=1,
+                        help="采样配置每题的采样次数（>1时报告多数投票和期望准确率）")
+    parser.add_argument("--measure-plain-pass", action="store_true",
+                        help="额外逐题运行一次params_only，作为整体耗时倍数的参考")
+    parser.add_argument("--constrained", action="store_true",
+                        help="约束解码：只允许生成选项字母A-E和空白，生成字母后提前停止")
+    RunProfiler.add_arguments(parser)
+    RunMetrics.add_arguments(parser)
+    CompletionsBackend.add_arguments(parser)
+    args = parser.parse_args()
     
-    model_path = sys.argv[1]
-    task_data_file = sys.argv[2] if len(sys.argv) > 2 else None
-    
-    # 创建消融实验对象
-    study = AblationStudy(model_path)
+    # 创建消融实验对象（所有配置共享一次模型加载）
+    study = AblationStudy(args.model_path)
+    study.backend = CompletionsBackend.from_args(args, args.model_path)
+    if study.backend is not None and args.constrained:
+        print("⚠️ 推理服务不支持约束解码，--constrained 将被忽略")
+    study.constrained_decoding = args.constrained and study.backend is None
+    study.profiler = RunProfiler.from_args(args)
+    study.metrics = RunMetrics.from_args(args)
     study.load_model()
     
-    # 加载任务数据（示例）
-    if task_data_file and os.path.exists(task_data_file):
-        with open(task_data_file, 'r', encoding='utf-8') as f:
-            task_data = json.load(f)
+    # 加载任务数据
+    if args.task_data and os.path.exists(args.task_data):
+        task_data = load_task_data(args.task_data)
     else:
         # 使用示例数据
         task_data = [
@@ -300,19 +792,32 @@ def main():
         ] * 10
     
     # 运行消融实验
-    results = study.run_ablation_study(task_data, "LDO")
+    try:
+        results = study.run_ablation_study(task_data, args.task_name, args.max_questions, args.batch_size,
+                                           args.measure_plain_pass, args.samples)
+    finally:
+        if study.metrics is not None:
+            study.metrics.close()
+        if study.backend is not None:
+            study.backend.close()
     
     # 保存结果
     output_file = "results/ablation_study_results.json"
     os.makedirs("results", exist_ok=True)
-    study.save_results(results, output_file)
+    study.save_results(results, output_file, study.last_run_summary)
     
     # 打印总结
     print("\n" + "=" * 80)
     print("消融实验结果总结")
     print("=" * 80)
     for exp_name, result in results.items():
-        print(f"{result['name']:30s} | 准确率: {result['accuracy']:6.2f}% | 平均时间: {result['avg_time']:.3f}s")
+        print(f"{result['name']:30s} | 准确率: {result['accuracy']:6.2f}% "
+              f"[{result['ci_low']:6.2f}%, {result['ci_high']:6.2f}%] | 平均时间: {result['avg_time']:.3f}s")
+    
+    summary = study.last_run_summary
+    ratio = f"{summary['time_ratio']:.2f}x" if summary['time_ratio'] is not None else "N/A"
+    print(f"\n总耗时: {summary['ablation_time']:.1f}秒 ({summary['num_questions']} 题 × {len(results)} 个配置), "
+          f"为{summary['reference']}耗时的 {ratio}")
 
 
 if __name__ == "__main__":
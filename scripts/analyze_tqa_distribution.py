@@ -4,8 +4,9 @@
 
 import json
 from pathlib import Path
-from collections import Counter, defaultdict
+from collections import Counter
 from question_router import QuestionRouter
+from aggregation import ResultFrame
 
 
 def analyze_tqa_distribution():
@@ -27,36 +28,37 @@ def analyze_tqa_distribution():
     
     router = QuestionRouter()
     
-    # 分析统计
-    stats = {
-        'by_difficulty': defaultdict(lambda: {'total': 0, 'by_type': Counter()}),
-        'by_type': Counter(),
-        'by_strategy': Counter(),
-        'details': []
-    }
-    
+    details = []
     for i, item in enumerate(tqa_data):
         question = item.get('question', '')
         level = item.get('level', 'Unknown')
         
-        # 分类问题类型
-        q_type, strategy, confidence = router.classify_question(question)
-        
-        # 统计
-        stats['by_difficulty'][level]['total'] += 1
-        stats['by_difficulty'][level]['by_type'][q_type] += 1
-        stats['by_type'][q_type] += 1
-        stats['by_strategy'][strategy] += 1
+        # 分类问题类型（classify_question 返回 (问题类型, 提示词前缀)）
+        q_type, strategy = router.classify_question(question)
         
-        stats['details'].append({
+        details.append({
             'index': i,
             'level': level,
-            'question_type': q_type,
+            'question_type': q_type.value,
             'strategy': strategy,
-            'confidence': confidence,
             'question_preview': question[:80] + '...' if len(question) > 80 else question
         })
     
+    # 分组统计（bincount归约，一次得到各组合的计数）
+    frame = ResultFrame.from_records(details, ['level', 'question_type', 'strategy'])
+    by_difficulty = {}
+    for level, count in frame.counts('level').items():
+        by_difficulty[level] = {'total': count, 'by_type': Counter()}
+    for (level, q_type), count in frame.counts(['level', 'question_type']).items():
+        by_difficulty[level]['by_type'][q_type] = count
+    
+    stats = {
+        'by_difficulty': by_difficulty,
+        'by_type': Counter(frame.counts('question_type')),
+        'by_strategy': Counter(frame.counts('strategy')),
+        'details': details
+    }
+    
     return stats
 
 
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试套件 (Benchmark Suite)
+在CPU上运行的微基准（路由、提示词构建、数据加载）和端到端基准
+（随机权重小模型 + AMSBench格式合成数据上运行ReasoningVFullValidation），
+结果写入JSON文件，可与保存的基线对比以发现性能回退
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from http_backend import GREEDY_PARAMS, CompletionsBackend, MockCompletionsServer
+from question_ids import assign_question_ids
+from question_router import QuestionRouter
+from synthetic_data import CIRCUIT_WORDS, ROUTER_PHRASES, SyntheticTaskGenerator
+
+# 小模型分词器的训练语料额外包含的提示词模板文本
+_TEMPLATE_TEXT = ("Question: Options: Answer: Examples: Example Now solve this: Answer precisely: "
+                  "Analyze carefully: Calculate precisely: Compare and analyze: You are an expert circuit "
+                  "A. B. C. D. E.")
+
+
+def _write_synthetic_configs(work_dir: str, tqa_questions: List[Dict]):
+    """写入与真实优化结果同格式的配置：LDO使用Few-shot，TQA按路由生成strategy_map"""
+    params = {"max_new_tokens": 1, "temperature": 0.0, "do_sample": False,
+              "repetition_penalty": 1.0, "top_p": 1.0, "top_k": 1, "use_cache": True}
+    latest = {"optimization_results": {"LDO": {"strategy": {
+        "expert_instruction": "You are an LDO circuit expert.",
+        "params": params,
+        "use_few_shot": True,
+        "num_examples": 2
+    }}}}
+    with open(os.path.join(work_dir, "reasoningv_latest_optimization_results.json"), 'w', encoding='utf-8') as f:
+        json.dump(latest, f, ensure_ascii=False)
+
+    router = QuestionRouter()
+    strategy_map = {}
+    for item, qid in zip(tqa_questions, assign_question_ids([dict(item) for item in tqa_questions])):
+        strategy = router.get_strategy_for_question(item["question"], "TQA")
+        strategy_map[qid] = {"prompt": strategy["prompt"], "params": strategy["params"]}
+    pattern = {"optimization_results": {"result": {"strategy_map": strategy_map,
+                                                    "strategy_map_keys": "question_id"}}}
+    with open(os.path.join(work_dir, "reasoningv_tqa_pattern_optimization_results.json"), 'w',
+              encoding='utf-8') as f:
+        json.dump(pattern, f, ensure_ascii=False)
+
+
+def build_tiny_model(output_dir: str, seed: int = 0, hidden_size: int = 64, num_layers: int = 2) -> str:
+    """
+    构建随机权重的小型因果语言模型（Qwen2结构）和本地训练的BPE分词器，无需下载
+
+    Returns:
+        模型目录
+    """
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+
+    rng = random.Random(seed)
+    corpus = [" ".join(rng.choice(CIRCUIT_WORDS) for _ in range(20)) + " " + _TEMPLATE_TEXT
+              for _ in range(200)]
+    corpus += [phrase for phrases in ROUTER_PHRASES.values() for phrase in phrases]
+
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=512, special_tokens=["<|endoftext|>"],
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tokenizer.train_from_iterator(corpus, trainer)
+    fast_tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>",
+                                             pad_token="<|endoftext|>")
+    fast_tokenizer.save_pretrained(output_dir)
+
+    config = Qwen2Config(
+        vocab_size=len(fast_tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=4096,
+        eos_token_id=fast_tokenizer.eos_token_id,
+        tie_word_embeddings=True
+    )
+    torch.manual_seed(seed)
+    Qwen2ForCausalLM(config).save_pretrained(output_dir)
+    return output_dir
+
+
+class BenchmarkSuite:
+    """基准测试套件 - 每个基准重复多轮，记录单次操作耗时的统计量"""
+
+    def __init__(self, work_dir: str, num_questions: int = 50, repeats: int = 5, seed: int = 0):
+        """
+        初始化套件
+
+        Args:
+            work_dir: 工作目录（写入合成数据，验证器在该目录下以相对路径读取）
+            num_questions: 每个任务的合成题目数
+            repeats: 微基准的重复轮数
+            seed: 合成数据和模型的随机种子
+        """
+        self.work_dir = work_dir
+        self.num_questions = num_questions
+        self.repeats = max(1, repeats)
+        self.seed = seed
+        self.results: Dict[str, Dict] = {}
+        self.console = sys.stdout  # 被测代码的输出被屏蔽时，测量结果仍打印到这里
+
+    @contextlib.contextmanager
+    def _in_work_dir(self, quiet: bool = True):
+        """切换到工作目录（验证器使用相对路径），可选地屏蔽被测代码的打印输出"""
+        cwd = os.getcwd()
+        os.chdir(self.work_dir)
+        try:
+            if quiet:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    yield
+            else:
+                yield
+        finally:
+            os.chdir(cwd)
+
+    @staticmethod
+    def autorange(func: Callable[[], Any], min_seconds: float = 0.05) -> int:
+        """确定每轮调用次数，使一轮耗时不少于min_seconds（减少计时噪声）"""
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            if time.perf_counter() - start >= min_seconds:
+                return number
+            number *= 2
+
+    def measure(self, name: str, func: Callable[[], Any], number: Optional[int] = None,
+                repeats: Optional[int] = None, items_per_call: int = 1, warmup: bool = True) -> Dict:
+        """
+        测量一个基准：预热一次后重复repeats轮，每轮调用number次（None表示自动确定）
+
+        Returns:
+            {unit, repeats, number, min, median, mean, stdev, per_item}（秒/次调用）
+        """
+        repeats = repeats or self.repeats
+        if warmup:
+            func()
+        if number is None:
+            number = self.autorange(func)
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            samples.append((time.perf_counter() - start) / number)
+
+        median = statistics.median(samples)
+        record = {
+            "unit": "s/call",
+            "repeats": repeats,
+            "number": number,
+            "min": min(samples),
+            "median": median,
+            "mean": statistics.mean(samples),
+            "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+            "items_per_call": items_per_call,
+            "per_item": median / items_per_call if items_per_call else median
+        }
+        self.results[name] = record
+        print(f"   ⏱️ {name:<38s} 中位数 {median * 1000:10.3f} ms/次"
+              f"  ({record['per_item'] * 1e6:9.2f} µs/项, ±{record['stdev'] * 1000:.3f} ms)", file=self.console)
+        return record
+
+    def prepare(self):
+        """写入合成数据和配置"""
+        from ReasoningV完整验证测试 import ReasoningVFullValidation
+
+        with self._in_work_dir():
+            tasks = ReasoningVFullValidation("unused").tasks
+        SyntheticTaskGenerator(seed=self.seed).write_amsbench(self.work_dir, self.num_questions, tasks)
+        with open(os.path.join(self.work_dir, tasks["TQA Task"]["data_file"]), 'r', encoding='utf-8') as f:
+            tqa_questions = json.load(f)
+        _write_synthetic_configs(self.work_dir, tqa_questions)
+        print(f"📁 合成数据: {len(tasks)} 个任务 × {self.num_questions} 题 → {self.work_dir}")
+
+    def bench_routing(self):
+        """路由微基准：单题分类、批量分类、策略选择"""
+        router = QuestionRouter()
+        questions = [item["question"] for item in SyntheticTaskGenerator(seed=self.seed).generate(200, stream="router")]
+
+        self.measure("router.classify_question", lambda: [router.classify_question(q) for q in questions],
+                     items_per_call=len(questions))
+        self.measure("router.get_strategy_for_question",
+                     lambda: [router.get_strategy_for_question(q) for q in questions],
+                     items_per_call=len(questions))
+        self.measure("router.batch_classify", lambda: router.batch_classify(questions),
+                     items_per_call=len(questions))
+
+    def bench_prompt_rendering(self):
+        """提示词构建微基准：模板提示词、Few-shot提示词、整任务工作项"""
+        from ReasoningV完整验证测试 import DEFAULT_PROMPT, ReasoningVFullValidation
+
+        with self._in_work_dir():
+            validator = ReasoningVFullValidation("unused")
+            questions = validator.load_task_data("LDO Task")
+            examples = validator.load_few_shot_examples("LDO Task", num_examples=3)
+            config = validator.optimized_configs.get("LDO Task", {})
+
+            self.measure("validator.build_prompt",
+                         lambda: [validator.build_prompt(DEFAULT_PROMPT, q["question"], q["options"])
+                                  for q in questions],
+                         items_per_call=len(questions))
+            self.measure("validator.build_few_shot_prompt",
+                         lambda: [validator.build_few_shot_prompt("LDO Task", q["question"], q["options"], examples)
+                                  for q in questions],
+                         items_per_call=len(questions))
+            self.measure("validator.build_work_items[LDO]",
+                         lambda: validator.build_work_items("LDO Task", questions, config, examples),
+                         items_per_call=len(questions))
+
+            tqa_questions = validator.load_task_data("TQA Task")
+            tqa_config = validator.optimized_configs.get("TQA Task", {})
+            self.measure("validator.build_work_items[TQA]",
+                         lambda: validator.build_work_items("TQA Task", tqa_questions, tqa_config),
+                         items_per_call=len(tqa_questions))
+
+    def bench_data_loading(self):
+        """数据加载微基准：目录模式与单文件模式"""
+        from ReasoningV完整验证测试 import ReasoningVFullValidation
+
+        with self._in_work_dir():
+            validator = ReasoningVFullValidation("unused")
+            self.measure("validator.load_task_data[directory]", lambda: validator.load_task_data("LDO Task"),
+                         items_per_call=self.num_questions)
+            self.measure("validator.load_task_data[single_file]", lambda: validator.load_task_data("TQA Task"),
+                         items_per_call=self.num_questions)
+
+    def bench_http_backend(self, latency: float = 0.01, concurrency: tuple = (1, 2, 4, 8)):
+        """
+        HTTP后端基准：本地模拟推理服务（每个请求固定延迟）上，不同并发上限下整批请求的耗时，
+        检查吞吐随并发数扩展、连接池复用连接
+        """
+        from ReasoningV完整验证测试 import DEFAULT_PROMPT, ReasoningVFullValidation
+
+        with self._in_work_dir():
+            validator = ReasoningVFullValidation("unused")
+            prompts = [validator.build_prompt(DEFAULT_PROMPT, q["question"], q["options"])
+                       for q in validator.load_task_data("LDO Task")]
+
+        server = MockCompletionsServer(latency).start()
+        try:
+            baseline = None
+            for limit in concurrency:
+                backend = CompletionsBackend(server.url, "mock", max_concurrency=limit)
+                try:
+                    record = self.measure(f"http_backend.complete_many[c={limit}]",
+                                          lambda: backend.complete_many([(p, GREEDY_PARAMS) for p in prompts],
+                                                                        raise_errors=True),
+                                          number=1, repeats=min(self.repeats, 3), items_per_call=len(prompts))
+                    record["connections"] = backend.pool.opened
+                finally:
+                    backend.close()
+                baseline = baseline or record["median"]
+                record["scaling"] = baseline / record["median"]
+                print(f"      并发上限 {limit}: {len(prompts) / record['median']:.0f} 题/秒, "
+                      f"{record['scaling']:.1f}x, {record['connections']} 个连接", file=self.console)
+        finally:
+            server.stop()
+
+    def bench_end_to_end(self, model_path: Optional[str] = None, repeats: int = 1):
+        """
+        端到端基准：小模型上的generate_answer和完整验证流程
+
+        Args:
+            model_path: 模型路径，默认在工作目录下构建随机权重小模型
+            repeats: 完整验证的重复次数
+        """
+        import torch
+        from ReasoningV完整验证测试 import ReasoningVFullValidation
+
+        if model_path is None:
+            model_path = build_tiny_model(os.path.join(self.work_dir, "tiny_model"), self.seed)
+        torch.manual_seed(self.seed)
+
+        with self._in_work_dir():
+            validator = ReasoningVFullValidation(model_path)
+
+            def reload_model():
+                validator.model = None
+                validator.load_model()
+
+            self.measure("validator.load_model", reload_model, number=1, repeats=1)
+
+            questions = validator.load_task_data("LDO Task")
+            prompt = validator.build_prompt(validator.optimized_configs["Bandgap Task"]["prompt"],
+                                            questions[0]["question"], questions[0]["options"])
+            params = validator.optimized_configs["Bandgap Task"]["params"]
+            self.measure("validator.generate_answer", lambda: validator.generate_answer(prompt, params),
+                         number=10)
+
+            holder = {}
+            record = self.measure("validator.run_full_validation",
+                                  lambda: holder.update(validator.run_full_validation()),
+                                  number=1, repeats=repeats, warmup=False)
+        total = holder.get("total_questions", 0)
+        record["total_questions"] = total
+        record["per_item"] = record["median"] / total if total else record["median"]
+        print(f"      完整验证: {total} 题（Few-shot任务×3次运行）, 每题 {record['per_item'] * 1000:.2f} ms")
+        self.bench_onnx(model_path)
+
+    def bench_onnx(self, model_path: str):
+        """ONNX基准：导出选项字母图，在TQA题目上与PyTorch CPU对比每题耗时并检查答案与generate_answer一致"""
+        from onnx_export import OnnxLetterScorer, compare_with_pytorch, load_cpu_validator, load_task_prompts
+        from ReasoningV完整验证测试 import DEFAULT_PARAMS
+
+        with self._in_work_dir():
+            validator = load_cpu_validator(model_path)
+            prompts = load_task_prompts(validator, "TQA Task")
+            scorer = OnnxLetterScorer.for_model(model_path, os.path.join(self.work_dir, "onnx", "letter_head.onnx"),
+                                                validator.tokenizer)
+            stats = compare_with_pytorch(validator, scorer, prompts, DEFAULT_PARAMS)
+        for name, key in [("onnx.score_prompts", "onnx_time"), ("pytorch.score_prompts", "pytorch_time")]:
+            self.results[name] = {"unit": "s/call", "repeats": 1, "number": 1, "min": stats[key],
+                                  "median": stats[key], "mean": stats[key], "stdev": 0.0,
+                                  "items_per_call": 1, "per_item": stats[key]}
+        self.results["onnx.score_prompts"].update(agreement=stats["agreement"],
+                                                  max_logit_diff=stats["max_logit_diff"])
+        print(f"   ⏱️ {'onnx.score_prompts':<38s} {stats['onnx_time'] * 1000:10.3f} ms/题"
+              f"  (PyTorch批量 {stats['pytorch_time'] * 1000:.3f} ms/题, generate_answer "
+              f"{stats['reference_time'] * 1000:.3f} ms/题, 答案一致率 {stats['agreement']:.1f}%)", file=self.console)
+
+    def run(self, end_to_end: bool = True, model_path: Optional[str] = None) -> Dict[str, Any]:
+        """运行全部基准，返回可保存的结果字典"""
+        self.prepare()
+        print("\n🔬 微基准")
+        self.bench_routing()
+        self.bench_prompt_rendering()
+        self.bench_data_loading()
+        print("\n🛰️ HTTP后端基准（本地模拟推理服务）")
+        self.bench_http_backend()
+        if end_to_end:
+            print("\n🚀 端到端基准")
+            self.bench_end_to_end(model_path)
+        return {
+            "environment": environment_info(),
+            "settings": {"num_questions": self.num_questions, "repeats": self.repeats, "seed": self.seed},
+            "benchmarks": self.results
+        }
+
+
+def environment_info() -> Dict[str, Any]:
+    """记录运行环境（对比基线时需要环境一致）"""
+    info = {
+        "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count()
+    }
+    try:
+        import torch
+        import transformers
+        info["torch"] = torch.__version__
+        info["transformers"] = transformers.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+
+def compare_with_baseline(current: Dict[str, Any], baseline: Dict[str, Any],
+                          threshold: float = 1.25) -> List[Dict]:
+    """
+    与基线对比每个基准的中位数耗时
+
+    Args:
+        threshold: 当前/基线比值超过该值视为回退（低于 1/threshold 视为提升）
+
+    Returns:
+        对比行列表 [{name, baseline, current, ratio, status}]
+    """
+    rows = []
+    baseline_benchmarks = baseline.get("benchmarks", {})
+    for name, record in current.get("benchmarks", {}).items():
+        reference = baseline_benchmarks.get(name)
+        if reference is None or reference.get("per_item", 0) <= 0:
+            rows.append({"name": name, "baseline": None, "current": record["per_item"], "ratio": None,
+                         "status": "new"})
+            continue
+        ratio = record["per_item"] / reference["per_item"]
+        if ratio > threshold:
+            status = "regression"
+        elif ratio < 1 / threshold:
+            status = "improvement"
+        else:
+            status = "unchanged"
+        rows.append({"name": name, "baseline": reference["per_item"], "current": record["per_item"],
+                     "ratio": ratio, "status": status})
+    return rows
+
+
+def print_comparison(rows: List[Dict], threshold: float):
+    """打印基线对比表"""
+    icons = {"regression": "❌", "improvement": "🚀", "unchanged": "✅", "new": "🆕"}
+    print(f"\n📊 与基线对比（每项耗时中位数，阈值 {threshold:.2f}x）")
+    print(f"{'基准':<40} {'基线(µs/项)':>14} {'当前(µs/项)':>14} {'比值':>8}")
+    print("-" * 82)
+    for row in rows:
+        baseline = f"{row['baseline'] * 1e6:14.2f}" if row["baseline"] is not None else f"{'-':>14}"
+        ratio = f"{row['ratio']:7.2f}x" if row["ratio"] is not None else f"{'-':>8}"
+        print(f"{icons[row['status']]} {row['name']:<38} {baseline} {row['current'] * 1e6:14.2f} {ratio}")
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="CPU基准测试套件（微基准 + 小模型端到端）")
+    parser.add_argument("--output", default="results/benchmark_results.json", help="结果文件")
+    parser.add_argument("--baseline", default=None, help="基线结果文件（提供时输出对比，回退时返回码为1）")
+    parser.add_argument("--save-baseline", default=None, help="把本次结果另存为基线")
+    parser.add_argument("--threshold", type=float, default=1.25, help="判定回退的耗时比值阈值")
+    parser.add_argument("--questions", type=int, default=50, help="每个任务的合成题目数")
+    parser.add_argument("--repeats", type=int, default=5, help="微基准重复轮数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--model-path", default=None, help="端到端使用的模型（默认构建随机权重小模型）")
+    parser.add_argument("--skip-e2e", action="store_true", help="只运行微基准")
+    parser.add_argument("--work-dir", default=None, help="合成数据目录（默认临时目录）")
+    args = parser.parse_args()
+
+    import torch
+    torch.set_num_threads(max(1, min(4, os.cpu_count() or 1)))
+
+    with tempfile.TemporaryDirectory(prefix="reasoningv_bench_") as tmp_dir:
+        work_dir = os.path.abspath(args.work_dir or tmp_dir)
+        os.makedirs(work_dir, exist_ok=True)
+        suite = BenchmarkSuite(work_dir, args.questions, args.repeats, args.seed)
+        results = suite.run(end_to_end=not args.skip_e2e, model_path=args.model_path)
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows = compare_with_baseline(results, baseline, args.threshold)
+        print_comparison(rows, args.threshold)
+        if any(row["status"] == "regression" for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+置信度门控级联 (Confidence-gated Cascade)
+先用廉价策略给每道题打分，取选项字母概率的最大值与次大值之差（margin）作为置信度，
+只有margin低于阈值的题目才升级到昂贵策略；按阈值扫描得到 成本-准确率 曲线
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from option_scorer import OPTION_LETTERS
+
+DEFAULT_THRESHOLDS = (0.0, 0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.7, 1.0)
+
+
+def letter_probabilities(letter_logits, valid_letters: Sequence[Optional[Sequence[str]]]) -> np.ndarray:
+    """
+    选项字母logits [N, 5] -> 题目实际提供的选项范围内归一化的概率 [N, 5]
+
+    Args:
+        letter_logits: OptionLetterScorer 返回的字母logits（Tensor或数组）
+        valid_letters: 每题的有效选项字母（None表示全部字母）
+    """
+    logits = np.asarray(letter_logits, dtype=np.float64).reshape(-1, len(OPTION_LETTERS))
+    valid = np.ones(logits.shape, dtype=bool)
+    for row, letters in enumerate(valid_letters):
+        if letters:
+            valid[row] = [letter in letters for letter in OPTION_LETTERS]
+    logits = np.where(valid & np.isfinite(logits), logits, -np.inf)
+    top = logits.max(axis=1, keepdims=True)
+    top = np.where(np.isfinite(top), top, 0.0)
+    weights = np.exp(logits - top)
+    totals = weights.sum(axis=1, keepdims=True)
+    return np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+
+
+def option_margins(probabilities: np.ndarray) -> Dict:
+    """
+    每题的预测字母和置信度margin（最大概率 - 次大概率）
+
+    Returns:
+        {predicted: 字母列表, confidence: [N] 最大概率, margin: [N]}
+    """
+    ordered = np.sort(probabilities, axis=1)
+    return {
+        "predicted": [OPTION_LETTERS[int(col)] for col in probabilities.argmax(axis=1)],
+        "confidence": ordered[:, -1],
+        "margin": ordered[:, -1] - ordered[:, -2]
+    }
+
+
+def cascade_curve(margins: Sequence[float], cheap_correct: Sequence[bool], expensive_correct: Sequence,
+                  cheap_cost: Sequence[float], expensive_cost: Sequence[float],
+                  thresholds: Sequence[float], total_questions: Optional[int] = None,
+                  baseline_cost: Optional[float] = None) -> List[Dict]:
+    """
+    按阈值扫描级联的准确率和成本（margin < 阈值的题目升级到昂贵策略）
+
+    Args:
+        margins: 廉价策略的margin
+        cheap_correct / expensive_correct: 两种策略各自是否答对
+            （expensive_correct 只需覆盖 margin < max(thresholds) 的题目，其余可为None）
+        cheap_cost / expensive_cost: 每题两种策略的成本（如预填充token数）
+        thresholds: 扫描的阈值
+        total_questions: 准确率的分母（默认为题目数，未构建工作项的题目计为错误）
+        baseline_cost: cost_fraction 的基准成本（默认为全部使用昂贵策略的成本）
+
+    Returns:
+        [{threshold, accuracy, escalated, escalated_fraction, cost, cost_fraction}]
+    """
+    margins = np.asarray(margins, dtype=np.float64)
+    cheap_correct = np.asarray(cheap_correct, dtype=bool)
+    expensive = np.array([bool(c) if c is not None else False for c in expensive_correct], dtype=bool)
+    cheap_cost = np.asarray(cheap_cost, dtype=np.float64)
+    expensive_cost = np.asarray(expensive_cost, dtype=np.float64)
+    total_questions = total_questions if total_questions is not None else len(margins)
+    if baseline_cost is None:
+        baseline_cost = float(expensive_cost.sum())
+
+    curve = []
+    for threshold in sorted(thresholds):
+        escalated = margins < threshold
+        correct = np.where(escalated, expensive, cheap_correct)
+        cost = float(cheap_cost.sum() + expensive_cost[escalated].sum())
+        curve.append({
+            "threshold": float(threshold),
+            "accuracy": float(correct.sum() / total_questions * 100) if total_questions > 0 else 0.0,
+            "escalated": int(escalated.sum()),
+            "escalated_fraction": float(escalated.mean()) if len(margins) else 0.0,
+            "cost": cost,
+            "cost_fraction": cost / baseline_cost if baseline_cost > 0 else 0.0
+        })
+    return curve
+
+
+def average_curves(curves: Sequence[List[Dict]]) -> List[Dict]:
+    """多次运行的曲线按阈值逐点取平均（各次运行的阈值相同）"""
+    if not curves:
+        return []
+    averaged = []
+    for points in zip(*curves):
+        point = {"threshold": points[0]["threshold"]}
+        for key in ("accuracy", "escalated", "escalated_fraction", "cost", "cost_fraction"):
+            point[key] = float(np.mean([p[key] for p in points]))
+        averaged.append(point)
+    return averaged
+
+
+def merge_curves(curves: Sequence[List[Dict]], total_questions: Sequence[int],
+                 baseline_costs: Sequence[float]) -> List[Dict]:
+    """把多个任务的曲线合并为总体曲线（准确率按题目数加权，成本相加，阈值需相同）"""
+    questions = sum(total_questions)
+    baseline = sum(baseline_costs)
+    merged = []
+    for points in zip(*curves):
+        cost = sum(point["cost"] for point in points)
+        escalated = sum(point["escalated"] for point in points)
+        merged.append({
+            "threshold": points[0]["threshold"],
+            "accuracy": sum(point["accuracy"] * n for point, n in zip(points, total_questions)) / questions
+            if questions else 0.0,
+            "escalated": escalated,
+            "escalated_fraction": escalated / questions if questions else 0.0,
+            "cost": cost,
+            "cost_fraction": cost / baseline if baseline > 0 else 0.0
+        })
+    return merged
+
+
+def print_cascade_curve(curve: List[Dict], cost_unit: str = "tokens"):
+    """打印 成本-准确率 曲线"""
+    print(f"   {'阈值':>6} {'准确率':>8} {'升级比例':>8} {'成本(' + cost_unit + ')':>12} {'相对成本':>8}")
+    for point in curve:
+        print(f"   {point['threshold']:>6.3f} {point['accuracy']:>7.2f}% {point['escalated_fraction'] * 100:>7.1f}% "
+              f"{point['cost']:>12.0f} {point['cost_fraction'] * 100:>7.1f}%")
+
+
+def test_cascade():
+    """测试级联：概率归一化、margin和曲线端点"""
+    logits = np.array([[4.0, 0.0, 0.0, 0.0, 9.0],
+                       [1.0, 1.0, -np.inf, 0.0, 0.0],
+                       [0.0, 3.0, 0.0, 0.0, 0.0]])
+    probabilities = letter_probabilities(logits, [["A", "B", "C", "D"], None, ["A", "B"]])
+    assert np.allclose(probabilities.sum(axis=1), 1.0)
+    assert probabilities[0, 4] == 0.0 and probabilities[1, 2] == 0.0
+    margins = option_margins(probabilities)
+    assert margins["predicted"] == ["A", "A", "B"]
+    assert margins["margin"][1] == 0.0 and margins["margin"][0] > 0.9
+
+    rng = np.random.default_rng(0)
+    n = 1000
+    margin = rng.random(n)
+    # 廉价策略在高margin题目上更准
+    cheap = rng.random(n) < 0.3 + 0.6 * margin
+    expensive = rng.random(n) < 0.7
+    curve = cascade_curve(margin, cheap, expensive, np.full(n, 100), np.full(n, 900), [0.0, 0.5, 1.01])
+    assert curve[0]["escalated"] == 0 and curve[0]["accuracy"] == cheap.mean() * 100
+    assert curve[-1]["escalated"] == n and abs(curve[-1]["accuracy"] - expensive.mean() * 100) < 1e-9
+    assert abs(curve[-1]["cost_fraction"] - 1000 / 900) < 1e-9
+    assert curve[0]["cost"] < curve[1]["cost"] < curve[2]["cost"]
+    # 以两种策略都全量运行为基准
+    curve = cascade_curve(margin, cheap, expensive, np.full(n, 100), np.full(n, 900), [1.01], baseline_cost=n * 1000)
+    assert abs(curve[0]["cost_fraction"] - 1.0) < 1e-9
+    print("✅ 置信度级联测试通过")
+
+
+if __name__ == "__main__":
+    test_cascade()
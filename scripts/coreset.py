@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分层核心子集 (Stratified Core-set)
+按 (任务, 难度级别, 路由类型) 分层抽取一个小的题目子集，每题带Horvitz-Thompson权重（层内总题数/层内抽样数），
+用分层估计量从子集上的结果估计全集准确率并给出误差界，替代"只测前N题"的冒烟测试
+"""
+
+import hashlib
+import json
+import math
+import os
+import time
+import warnings
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from question_ids import assign_question_ids
+from question_router import QuestionRouter
+
+DEFAULT_CORE_SET_PATH = "results/core_set.json"
+Z_95 = 1.959963984540054
+MIN_STRATUM_MEMBERS = 5  # 成员少于此数的层并入同任务的合并层
+
+
+def stratum_key(task_name: str, question: Dict, router: QuestionRouter) -> str:
+    """题目的分层键：任务 / 难度级别 / 路由类型"""
+    router_type, _ = router.classify_question(question.get('question', ''))
+    return f"{task_name}|{question.get('level') or 'Unknown'}|{router_type.value}"
+
+
+def merge_strata(members: Dict[str, List[Tuple[str, str]]], size: int, min_per_stratum: int = 2,
+                 min_members: int = MIN_STRATUM_MEMBERS) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    合并过细的分层：成员少于min_members的层并入同任务的"任务|*|*"层；
+    每层至少min_per_stratum题超出目标大小时，依次去掉路由类型、难度级别维度（"*"表示已合并）
+
+    Returns:
+        {分层键: [(任务, 题目ID)]}（层内按任务和题目ID排序）
+    """
+    for depth in (3, 2, 1):
+        merged: Dict[str, List[Tuple[str, str]]] = {}
+        for key, entries in members.items():
+            parts = key.split("|")
+            merged.setdefault("|".join(parts[:depth] + ["*"] * (len(parts) - depth)), []).extend(entries)
+        for key in [key for key, entries in merged.items() if len(entries) < min_members]:
+            rest = key.split("|")[0] + "|*|*"
+            if key != rest:
+                merged.setdefault(rest, []).extend(merged.pop(key))
+        if sum(min(len(entries), min_per_stratum) for entries in merged.values()) <= size:
+            break
+    return {key: sorted(entries) for key, entries in merged.items()}
+
+
+def allocate(populations: Sequence[int], size: int, min_per_stratum: int = 2) -> List[int]:
+    """
+    按比例分配各层的抽样数（最大余数法），每层至少min_per_stratum题（不超过层大小）以便估计层内方差
+
+    Returns:
+        各层抽样数
+    """
+    populations = np.asarray(populations, dtype=np.int64)
+    floor = np.minimum(populations, min_per_stratum)
+    budget = max(size, int(floor.sum())) - int(floor.sum())
+    room = populations - floor
+    if budget <= 0 or room.sum() == 0:
+        return floor.tolist()
+    budget = min(budget, int(room.sum()))
+    share = room / room.sum() * budget
+    counts = np.floor(share).astype(np.int64)
+    for stratum in np.argsort(-(share - counts), kind="stable")[:budget - int(counts.sum())]:
+        counts[stratum] += 1
+    return (floor + np.minimum(counts, room)).tolist()
+
+
+def questions_fingerprint(task_questions: Dict[str, List[Dict]]) -> str:
+    """各任务题目ID集合的指纹（与加载顺序无关），题目增删或内容变化时核心子集失效"""
+    payload = json.dumps({task: sorted(q["question_id"] for q in questions)
+                          for task, questions in sorted(task_questions.items())}, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CoreSet:
+    """分层核心子集：{任务: 选中的题目ID}，以及各层的总题数和抽样数"""
+
+    def __init__(self, strata: Dict[str, Dict], selection: Dict[str, List[Tuple[str, str]]], fingerprint: str,
+                 seed: int = 0, target_size: Optional[int] = None):
+        """
+        Args:
+            strata: {分层键: {population, sample}}
+            selection: {任务: [(题目ID, 分层键)]}
+            fingerprint: 构建时的题目指纹
+            target_size: 构建时请求的子集大小
+        """
+        self.strata = strata
+        self.selection = selection
+        self.fingerprint = fingerprint
+        self.seed = seed
+        self.target_size = target_size
+        self.selected = {task: {qid for qid, _ in entries} for task, entries in selection.items()}
+
+    @classmethod
+    def build(cls, task_questions: Dict[str, List[Dict]], size: int, seed: int = 0,
+              min_per_stratum: int = 2) -> "CoreSet":
+        """
+        分层抽样
+
+        Args:
+            task_questions: {任务: 题目列表}（没有question_id的题目先分配ID）
+            size: 目标子集大小（过细的分层先合并；只有任务数 × min_per_stratum 超过目标大小时实际大小才会更大）
+        """
+        router = QuestionRouter()
+        members: Dict[str, List[Tuple[str, str]]] = {}
+        for task_name, questions in task_questions.items():
+            if any("question_id" not in question for question in questions):
+                assign_question_ids(questions)
+            # 层内按题目ID排序，抽样结果与加载顺序无关
+            for question in sorted(questions, key=lambda q: q["question_id"]):
+                members.setdefault(stratum_key(task_name, question, router), []).append(
+                    (task_name, question["question_id"]))
+
+        members = merge_strata(members, size, min_per_stratum)
+        keys = sorted(members)
+        counts = allocate([len(members[key]) for key in keys], size, min_per_stratum)
+        if sum(counts) > size:
+            warnings.warn(f"核心子集目标大小 {size} 不足以在每层抽 {min_per_stratum} 题，"
+                          f"实际抽取 {sum(counts)} 题（{len(keys)} 层）")
+        rng = np.random.default_rng(seed)
+        strata, selection = {}, {task: [] for task in task_questions}
+        for key, count in zip(keys, counts):
+            chosen = rng.choice(len(members[key]), size=count, replace=False)
+            for member in sorted(chosen):
+                task_name, qid = members[key][member]
+                selection[task_name].append((qid, key))
+            strata[key] = {"population": len(members[key]), "sample": int(count)}
+        for entries in selection.values():
+            entries.sort()
+        return cls(strata, selection, questions_fingerprint(task_questions), seed, size)
+
+    @property
+    def size(self) -> int:
+        return sum(stratum["sample"] for stratum in self.strata.values())
+
+    @property
+    def population(self) -> int:
+        return sum(stratum["population"] for stratum in self.strata.values())
+
+    def contains(self, task_name: str, qid: str) -> bool:
+        """题目是否在子集中（子集中没有的任务视为全部不选）"""
+        return qid in self.selected.get(task_name, ())
+
+    def weights(self, task_name: str) -> Dict[str, float]:
+        """{题目ID: 权重}（层内总题数 / 层内抽样数）"""
+        return {qid: self.strata[key]["population"] / self.strata[key]["sample"]
+                for qid, key in self.selection.get(task_name, [])}
+
+    def estimate(self, outcomes: Dict[str, Dict[str, float]], tasks: Optional[Sequence[str]] = None) -> Dict:
+        """
+        分层估计全集准确率
+
+        Args:
+            outcomes: {任务: {题目ID: 正确率(0-1，多次运行可取平均)}}，子集中缺失的题目计为错误
+            tasks: 参与估计的任务（默认为子集中的全部任务）
+
+        Returns:
+            {accuracy, stderr, error_bound, ci_low, ci_high, sample, population}（百分数，误差界为95%正态区间半宽）
+        """
+        tasks = list(tasks) if tasks is not None else list(self.selection)
+        values: Dict[str, List[float]] = {}
+        for task_name in tasks:
+            task_outcomes = outcomes.get(task_name, {})
+            for qid, key in self.selection.get(task_name, []):
+                values.setdefault(key, []).append(float(task_outcomes.get(qid, 0.0)))
+
+        population = sum(self.strata[key]["population"] for key in values)
+        if population == 0:
+            return {"accuracy": 0.0, "stderr": 0.0, "error_bound": 0.0, "ci_low": 0.0, "ci_high": 0.0,
+                    "sample": 0, "population": 0}
+        mean, variance = 0.0, 0.0
+        for key, stratum_values in values.items():
+            big_n, n = self.strata[key]["population"], len(stratum_values)
+            share = big_n / population
+            p = float(np.mean(stratum_values))
+            mean += share * p
+            if n < big_n:
+                # 层内样本很少（常见n=2）时样本方差经常恰好为0，改用平滑的伯努利方差 p~(1-p~)，
+                # p~ = (k+1)/(n+2)，取两者中较大者；只有一题的层按上界0.25；有限总体校正 (1 - n/N)
+                smoothed = (sum(stratum_values) + 1) / (n + 2)
+                s2 = max(float(np.var(stratum_values, ddof=1)), smoothed * (1 - smoothed)) if n > 1 else 0.25
+                variance += share ** 2 * (1 - n / big_n) * s2 / n
+        stderr = math.sqrt(variance)
+        bound = Z_95 * stderr
+        return {
+            "accuracy": mean * 100,
+            "stderr": stderr * 100,
+            "error_bound": bound * 100,
+            "ci_low": max(0.0, mean - bound) * 100,
+            "ci_high": min(1.0, mean + bound) * 100,
+            "sample": sum(len(v) for v in values.values()),
+            "population": population
+        }
+
+    def save(self, path: str = DEFAULT_CORE_SET_PATH):
+        """写出子集（复用同一子集才能比较不同配置的冒烟结果）"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "fingerprint": self.fingerprint,
+                "seed": self.seed,
+                "size": self.target_size,
+                "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
+                "strata": self.strata,
+                "selection": {task: [[qid, key] for qid, key in entries]
+                              for task, entries in self.selection.items()}
+            }, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str, task_questions: Optional[Dict[str, List[Dict]]] = None) -> Optional["CoreSet"]:
+        """读取子集；提供题目时校验指纹，题目变化则返回None"""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if task_questions is not None and data.get("fingerprint") != questions_fingerprint(task_questions):
+            return None
+        selection = {task: [(qid, key) for qid, key in entries]
+                     for task, entries in data["selection"].items()}
+        return cls(data["strata"], selection, data["fingerprint"], data.get("seed", 0), data.get("size"))
+
+    @classmethod
+    def for_tasks(cls, task_questions: Dict[str, List[Dict]], size: int, path: str = DEFAULT_CORE_SET_PATH,
+                  seed: int = 0) -> "CoreSet":
+        """读取已保存的子集（题目未变且大小/种子相同时复用），否则重新抽样并保存"""
+        core_set = cls.load(path, task_questions)
+        if core_set is not None and core_set.seed == seed and core_set.requested_size(size):
+            print(f"📂 复用核心子集 {path}（{core_set.size}/{core_set.population} 题）")
+            return core_set
+        core_set = cls.build(task_questions, size, seed)
+        core_set.save(path)
+        print(f"🎯 构建核心子集（{core_set.size}/{core_set.population} 题, {len(core_set.strata)} 层）-> {path}")
+        return core_set
+
+    def requested_size(self, size: int) -> bool:
+        """已保存的子集是否就是按该目标大小抽出的（没有记录目标大小的旧文件重新抽样）"""
+        return self.target_size == size
+
+
+def print_core_set(core_set: CoreSet):
+    """打印各任务的抽样数"""
+    by_task: Dict[str, List[int]] = {}
+    for key, stratum in core_set.strata.items():
+        counts = by_task.setdefault(key.split("|")[0], [0, 0, 0])
+        counts[0] += stratum["sample"]
+        counts[1] += stratum["population"]
+        counts[2] += 1
+    for task_name, (sample, population, strata) in by_task.items():
+        print(f"   {task_name}: {sample}/{population} 题 ({strata} 层)")
+
+
+def test_coreset():
+    """测试核心子集：分配守恒，估计无偏，误差界的覆盖率接近95%"""
+    rng = np.random.default_rng(0)
+    levels = ["Graduate", "Undergraduate", None]
+    words = ["What is the gain", "Why does the loop oscillate", "Calculate the bias current",
+             "Compare the two topologies", "Which is the best choice"]
+    task_questions, truth = {}, {}
+    for task_name, n in [("LDO Task", 400), ("TQA Task", 1200), ("Opamp Task", 150)]:
+        questions = [{"question": f"{words[rng.integers(0, 5)]} #{i}?", "level": levels[rng.integers(0, 3)]}
+                     for i in range(n)]
+        task_questions[task_name] = questions
+        # 正确率随难度和任务变化，分层才有意义
+        rate = np.array([{"Graduate": 0.5, "Undergraduate": 0.8}.get(q["level"], 0.95) for q in questions])
+        truth[task_name] = rng.random(n) < rate * (0.9 if task_name == "LDO Task" else 1.0)
+    full = sum(t.sum() for t in truth.values()) / sum(len(t) for t in truth.values()) * 100
+
+    positions = {task: {q["question_id"]: p for p, q in enumerate(questions)}
+                 for task, questions in task_questions.items() if assign_question_ids(questions)}
+    core_set = CoreSet.build(task_questions, 150, seed=0)
+    assert sum(s["population"] for s in core_set.strata.values()) == 1750
+    assert 150 <= core_set.size <= 150 + 2 * len(core_set.strata)
+    # 题目加载顺序变化不影响抽样结果
+    reordered = CoreSet.build({task: questions[::-1] for task, questions in task_questions.items()}, 150, seed=0)
+    assert reordered.selected == core_set.selected and reordered.fingerprint == core_set.fingerprint
+    # 全部题目都选中时估计值等于真实值、误差为0
+    everything = CoreSet.build(task_questions, 1750)
+    exact = everything.estimate({task: {q["question_id"]: float(t[p]) for p, q in enumerate(task_questions[task])}
+                                 for task, t in truth.items()})
+    assert abs(exact["accuracy"] - full) < 1e-9 and exact["error_bound"] == 0.0
+
+    covered, trials, errors = 0, 200, []
+    for seed in range(trials):
+        sample = CoreSet.build(task_questions, 150, seed=seed)
+        outcomes = {task: {qid: float(truth[task][positions[task][qid]]) for qid in sample.selected[task]}
+                    for task in task_questions}
+        estimate = sample.estimate(outcomes)
+        covered += estimate["ci_low"] <= full <= estimate["ci_high"]
+        errors.append(estimate["accuracy"] - full)
+    coverage = covered / trials
+    assert abs(np.mean(errors)) < 1.0, np.mean(errors)
+    assert coverage > 0.88, coverage
+
+    # 小任务、均匀正确率：过细的层合并后目标大小不被突破，层内n=2时误差界也不会塌缩为0
+    small = [{"question": f"{words[rng.integers(0, 5)]} #{i}?", "level": levels[rng.integers(0, 3)]}
+             for i in range(40)]
+    assign_question_ids(small)
+    small_truth = {q["question_id"]: float(rng.random() < 0.425) for q in small}
+    small_full = np.mean(list(small_truth.values())) * 100
+    uniform = [{"question": f"What is the gain #{i}?", "level": levels[i % 3]} for i in range(120)]
+    assign_question_ids(uniform)
+    uniform_truth = {q["question_id"]: float(rng.random() < 0.425) for q in uniform}
+    uniform_full = np.mean(list(uniform_truth.values())) * 100
+    for questions, answers, target, size in [(small, small_truth, small_full, 20),
+                                             (uniform, uniform_truth, uniform_full, 6)]:
+        small_covered = 0
+        for seed in range(trials):
+            sample = CoreSet.build({"Bandgap Task": questions}, size, seed=seed)
+            assert sample.size == size
+            outcomes = {"Bandgap Task": {qid: answers[qid] for qid in sample.selected["Bandgap Task"]}}
+            small_estimate = sample.estimate(outcomes)
+            assert small_estimate["error_bound"] > 0
+            small_covered += small_estimate["ci_low"] <= target <= small_estimate["ci_high"]
+        assert small_covered / trials > 0.88, (size, small_covered / trials)
+    assert len(CoreSet.build({"Bandgap Task": uniform}, 6).strata) == 3
+
+    # 任务数 × 每层最少题数超过目标大小时给出警告
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        CoreSet.build(task_questions, 4)
+    assert any("目标大小" in str(w.message) for w in caught)
+    print(f"✅ 核心子集测试通过（{core_set.size}/1750 题, 平均偏差 {np.mean(errors):+.2f}%, "
+          f"误差界 ±{estimate['error_bound']:.1f}%, 95%区间覆盖率 {coverage * 100:.0f}%）")
+
+
+if __name__ == "__main__":
+    test_coreset()
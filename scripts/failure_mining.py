@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+失败案例挖掘 (Failure Mining)
+对两个模型的逐题预测做向量化的集合运算（按题目键对齐后用布尔掩码划分对/错），
+按任务、难度级别和路由类型分组统计失败，统计检验选项位置偏见，并输出排序后的案例列表
+"""
+
+import math
+import re
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from question_router import QuestionRouter
+from results_store import ResultsStore, normalize_model, normalize_task
+
+PARTITIONS = ("both_right", "a_only", "b_only", "both_wrong")
+
+_WORD = re.compile(r"[a-z][a-z0-9]+")
+_STOPWORDS = {"the", "of", "and", "for", "in", "to", "is", "an", "on", "by", "with", "what", "which",
+              "how", "why", "does", "are", "its", "that", "this", "from", "be", "as", "at", "or"}
+
+
+def _chi2_sf(x: float, df: int) -> float:
+    """卡方分布的生存函数 P(X >= x)（正则化上不完全伽马函数，无需scipy）"""
+    if x <= 0:
+        return 1.0
+    a, z = df / 2.0, x / 2.0
+    log_prefix = a * math.log(z) - z - math.lgamma(a)
+    if z < a + 1:
+        # 级数展开求下不完全伽马
+        term = total = 1.0 / a
+        n = a
+        for _ in range(500):
+            n += 1
+            term *= z / n
+            total += term
+            if term < total * 1e-15:
+                break
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+    # 连分式求上不完全伽马（Lentz算法）
+    b = z + 1 - a
+    c = 1.0 / 1e-300
+    d = 1.0 / b
+    h = d
+    for i in range(1, 500):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = 1e-300 if abs(d) < 1e-300 else d
+        c = b + an / c
+        c = 1e-300 if abs(c) < 1e-300 else c
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, math.exp(log_prefix) * h)
+
+
+def parse_options(options) -> Dict[str, str]:
+    """选项统一为 {字母: 文本}（支持字典和"A. ...\\nB. ..."字符串）"""
+    if isinstance(options, dict):
+        return {str(k).strip().upper(): str(v) for k, v in options.items()}
+    parsed = {}
+    for line in str(options or "").splitlines():
+        match = re.match(r"\s*([A-Ea-e])[.)：:、]\s*(.*)", line)
+        if match:
+            parsed[match.group(1).upper()] = match.group(2)
+    return parsed
+
+
+def content_words(text: str) -> set:
+    """文本中的实词集合（小写，去停用词）"""
+    return {word for word in _WORD.findall(str(text).lower()) if word not in _STOPWORDS}
+
+
+def predictions_from_rows(rows: Iterable[Dict]) -> Dict[str, np.ndarray]:
+    """
+    逐题结果行 -> 列式数组
+
+    Args:
+        rows: [{task, question_id, groundtruth, predicted, 可选: correct, level}]
+
+    Returns:
+        {key, task, question_id, level, groundtruth, predicted, correct}，key为"任务/题目ID"
+    """
+    rows = list(rows)
+    task = np.array([normalize_task(str(r.get("task", ""))) for r in rows], dtype=object)
+    question_id = np.array([str(r.get("question_id", r.get("index"))) for r in rows], dtype=object)
+    groundtruth = np.array([str(r.get("groundtruth") or "").strip().upper() for r in rows], dtype=object)
+    predicted = np.array([str(r.get("predicted") or "").strip().upper() for r in rows], dtype=object)
+    correct = np.array([bool(r["correct"]) if r.get("correct") is not None else None for r in rows], dtype=object)
+    missing = np.equal(correct, None)
+    correct[missing] = groundtruth[missing] == predicted[missing]
+    return {
+        "key": task + "/" + question_id,
+        "task": task,
+        "question_id": question_id,
+        "level": np.array([r.get("level") or "Unknown" for r in rows], dtype=object),
+        "groundtruth": groundtruth,
+        "predicted": predicted,
+        "correct": correct.astype(bool)
+    }
+
+
+class FailureMiner:
+    """两个模型逐题预测的失败挖掘器"""
+
+    def __init__(self, predictions_a: Dict[str, np.ndarray], predictions_b: Dict[str, np.ndarray],
+                 name_a: str = "ReasoningV", name_b: str = "Analogseeker",
+                 question_texts: Optional[Dict[str, str]] = None):
+        """
+        按题目键对齐两个模型的预测
+
+        Args:
+            predictions_a / predictions_b: predictions_from_rows的输出
+            question_texts: {key: 题目文本}（提供时按路由类型分组，否则路由类型为unknown）
+        """
+        self.name_a, self.name_b = name_a, name_b
+        # 向量化对齐：只保留两个模型都回答过的题
+        keys, index_a, index_b = np.intersect1d(predictions_a["key"].astype(str), predictions_b["key"].astype(str),
+                                                assume_unique=False, return_indices=True)
+        self.keys = keys
+        self.a = {name: column[index_a] for name, column in predictions_a.items()}
+        self.b = {name: column[index_b] for name, column in predictions_b.items()}
+        self.router_type = self._router_types(question_texts or {})
+
+        correct_a, correct_b = self.a["correct"], self.b["correct"]
+        self.masks = {
+            "both_right": correct_a & correct_b,
+            "a_only": correct_a & ~correct_b,
+            "b_only": ~correct_a & correct_b,
+            "both_wrong": ~correct_a & ~correct_b
+        }
+
+    def _router_types(self, question_texts: Dict[str, str]) -> np.ndarray:
+        """每道题的路由类型（相同文本只分类一次）"""
+        types = np.full(len(self.keys), "unknown", dtype=object)
+        if not question_texts:
+            return types
+        router = QuestionRouter()
+        cache = {}
+        for i, key in enumerate(self.keys):
+            text = question_texts.get(key)
+            if text is None:
+                continue
+            if text not in cache:
+                cache[text] = router.classify_question(text)[0].value
+            types[i] = cache[text]
+        return types
+
+    @classmethod
+    def from_store(cls, store: ResultsStore, model_a: str = "ReasoningV", model_b: str = "Analogseeker",
+                   run_a: str = None, run_b: str = None, task: str = None,
+                   question_texts: Optional[Dict[str, str]] = None) -> "FailureMiner":
+        """从结果库读取两个模型的逐题结果（默认各自最近一次运行）"""
+        rows_a = store.question_results(model_a, task, run_a)
+        rows_b = store.question_results(model_b, task, run_b)
+        return cls(predictions_from_rows(rows_a), predictions_from_rows(rows_b),
+                   normalize_model(model_a), normalize_model(model_b), question_texts)
+
+    @property
+    def total(self) -> int:
+        return len(self.keys)
+
+    def partitions(self) -> Dict[str, int]:
+        """四个对/错分区的题数"""
+        return {name: int(mask.sum()) for name, mask in self.masks.items()}
+
+    def breakdown(self, by: str = "task") -> Dict[str, Dict]:
+        """
+        按分组统计各分区题数和两模型准确率
+
+        Args:
+            by: "task"、"level" 或 "router_type"
+        """
+        labels = self.router_type if by == "router_type" else self.a[by]
+        groups, inverse = np.unique(labels.astype(str), return_inverse=True)
+        totals = np.bincount(inverse, minlength=len(groups))
+        counts = {name: np.bincount(inverse, weights=mask, minlength=len(groups))
+                  for name, mask in self.masks.items()}
+
+        breakdown = {}
+        for g, group in enumerate(groups):
+            row = {"total": int(totals[g])}
+            row.update({name: int(counts[name][g]) for name in PARTITIONS})
+            row[f"accuracy_{self.name_a}"] = (row["both_right"] + row["a_only"]) / row["total"] * 100
+            row[f"accuracy_{self.name_b}"] = (row["both_right"] + row["b_only"]) / row["total"] * 100
+            breakdown[str(group)] = row
+        return breakdown
+
+    def option_bias(self, model: str = "a", alpha: float = 0.05) -> Dict:
+        """
+        选项位置偏见检验：预测字母分布与正确答案字母分布的卡方拟合优度检验，
+        以及逐字母的二项z检验（Bonferroni校正）
+
+        Returns:
+            {chi2, df, p_value, biased, biased_letters, letters: {字母: {predicted, expected, ratio, z, p_value}}}
+        """
+        column = self.a if model == "a" else self.b
+        letters = sorted(letter for letter in set(column["groundtruth"]) if re.fullmatch(r"[A-Z]", letter))
+        valid = np.isin(column["predicted"], letters)
+        n = int(valid.sum())
+        result = {"model": self.name_a if model == "a" else self.name_b, "num_predictions": n,
+                  "format_errors": int((~valid).sum()), "letters": {}, "biased_letters": []}
+        if n == 0 or len(letters) < 2:
+            result.update({"chi2": 0.0, "df": 0, "p_value": 1.0, "biased": False})
+            return result
+
+        # 预测字母计数 vs 以正确答案分布为期望的计数
+        predicted_counts = np.array([(column["predicted"][valid] == letter).sum() for letter in letters], dtype=float)
+        expected_share = np.array([(column["groundtruth"][valid] == letter).sum() for letter in letters], dtype=float) / n
+        expected_share = np.clip(expected_share, 1e-9, None)
+        expected_counts = expected_share * n
+        chi2 = float(((predicted_counts - expected_counts) ** 2 / expected_counts).sum())
+        df = len(letters) - 1
+        p_value = _chi2_sf(chi2, df)
+
+        threshold = alpha / len(letters)
+        for letter, observed, share in zip(letters, predicted_counts, expected_share):
+            std = math.sqrt(n * share * (1 - share)) or 1e-9
+            z = (observed - n * share) / std
+            letter_p = math.erfc(abs(z) / math.sqrt(2))
+            result["letters"][letter] = {"predicted": int(observed), "expected": n * share,
+                                         "ratio": observed / (n * share), "z": z, "p_value": letter_p}
+            # 只把显著偏多的字母记为偏见
+            if z > 0 and letter_p < threshold:
+                result["biased_letters"].append(letter)
+        result.update({"chi2": chi2, "df": df, "p_value": p_value, "biased": p_value < alpha})
+        return result
+
+    def ranked_cases(self, partition: str = "a_only", limit: Optional[int] = 20, by: str = "router_type") -> List[Dict]:
+        """
+        排序后的案例列表
+
+        排序依据：失败模型在同组（任务 + by分组）内的准确率越高，该题失败越反常，排名越靠前；
+        同分时预测落在偏见字母上的排在后面（多半是偏见而非知识性错误）
+
+        Args:
+            partition: "a_only"（A对B错）、"b_only"（B对A错）或 "both_wrong"
+        """
+        indices = np.flatnonzero(self.masks[partition])
+        if len(indices) == 0:
+            return []
+        failing = self.a if partition == "b_only" else self.b
+        labels = self.router_type if by == "router_type" else self.a[by]
+        group_labels = (self.a["task"] + "|" + labels).astype(str)
+        groups, inverse = np.unique(group_labels, return_inverse=True)
+        group_accuracy = (np.bincount(inverse, weights=failing["correct"], minlength=len(groups))
+                          / np.bincount(inverse, minlength=len(groups)))
+
+        biased = set(self.option_bias("b" if partition != "b_only" else "a")["biased_letters"])
+        on_biased = np.isin(failing["predicted"][indices], list(biased)) if biased else np.zeros(len(indices), bool)
+        scores = group_accuracy[inverse[indices]]
+        order = np.lexsort((on_biased, -scores))
+        if limit is not None:
+            order = order[:limit]
+
+        cases = []
+        for rank, position in enumerate(order, 1):
+            i = indices[position]
+            cases.append({
+                "rank": rank,
+                "task": self.a["task"][i],
+                "question_id": self.a["question_id"][i],
+                "level": self.a["level"][i],
+                "router_type": self.router_type[i],
+                "groundtruth": self.a["groundtruth"][i],
+                f"{self.name_a}_predicted": self.a["predicted"][i],
+                f"{self.name_b}_predicted": self.b["predicted"][i],
+                "group_accuracy": float(scores[position]) * 100,
+                "on_biased_letter": bool(on_biased[position])
+            })
+        return cases
+
+    def summary(self, limit: int = 20) -> Dict:
+        """完整挖掘结果"""
+        return {
+            "models": [self.name_a, self.name_b],
+            "total_questions": self.total,
+            "partitions": self.partitions(),
+            "by_task": self.breakdown("task"),
+            "by_level": self.breakdown("level"),
+            "by_router_type": self.breakdown("router_type"),
+            "option_bias": {self.name_a: self.option_bias("a"), self.name_b: self.option_bias("b")},
+            "cases": {partition: self.ranked_cases(partition, limit) for partition in ("a_only", "b_only", "both_wrong")}
+        }
+
+
+def classify_error_type(question: Dict, ground_truth: str, predicted: str, options,
+                        biased_letters: Iterable[str] = (), other_predicted: Optional[str] = None) -> str:
+    """
+    单题错误类型
+
+    - 格式错误：预测不是合法选项字母
+    - 选项偏见：预测落在该模型统计上显著偏多的字母上
+    - 共同干扰项：两个模型选了同一个错误选项（多为题目/选项本身的迷惑性）
+    - 幻觉错误：所选选项与题目没有任何实词重叠，而正确选项有
+    - 逻辑错误：其余情况（所选选项与题目相关但推理有误）
+    """
+    options = parse_options(options)
+    predicted = str(predicted or "").strip().upper()
+    ground_truth = str(ground_truth or "").strip().upper()
+    if predicted not in options and not re.fullmatch(r"[A-E]", predicted):
+        return "格式错误"
+    if predicted in set(biased_letters):
+        return "选项偏见"
+    if other_predicted is not None and str(other_predicted).strip().upper() == predicted:
+        return "共同干扰项"
+
+    question_words = content_words(question.get("question", "") if isinstance(question, dict) else question)
+    predicted_overlap = question_words & content_words(options.get(predicted, ""))
+    truth_overlap = question_words & content_words(options.get(ground_truth, ""))
+    if options.get(predicted) and not predicted_overlap and truth_overlap:
+        return "幻觉错误"
+    return "逻辑错误"
+
+
+def test_failure_mining():
+    """测试失败挖掘：分区与逐题循环一致、偏见检验能检出注入的偏见、大规模耗时"""
+    import time
+
+    rng = np.random.default_rng(0)
+    n = 200000
+    letters = np.array(list("ABCD"), dtype=object)
+    groundtruth = letters[rng.integers(0, 4, n)]
+    tasks = np.array(["TQA", "LDO", "Caption"], dtype=object)[rng.integers(0, 3, n)]
+
+    def make(skill, bias_letter=None):
+        predicted = groundtruth.copy()
+        wrong = rng.random(n) > skill
+        predicted[wrong] = letters[rng.integers(0, 4, wrong.sum())]
+        if bias_letter:
+            predicted[wrong & (rng.random(n) < 0.6)] = bias_letter
+        return [{"task": t, "question_id": i, "groundtruth": g, "predicted": p,
+                 "level": "Graduate" if i % 2 else "Undergraduate"}
+                for i, (t, g, p) in enumerate(zip(tasks, groundtruth, predicted))]
+
+    rows_a, rows_b = make(0.9), make(0.8, bias_letter="A")
+    start = time.perf_counter()
+    miner = FailureMiner(predictions_from_rows(rows_a), predictions_from_rows(rows_b))
+    partitions = miner.partitions()
+    bias_b = miner.option_bias("b")
+    bias_a = miner.option_bias("a")
+    cases = miner.ranked_cases("a_only", 10)
+    miner.breakdown("task")
+    elapsed = time.perf_counter() - start
+
+    # 与逐题循环的结果核对
+    expected_a_only = sum(1 for a, b in zip(rows_a, rows_b)
+                          if a["predicted"] == a["groundtruth"] and b["predicted"] != b["groundtruth"])
+    assert partitions["a_only"] == expected_a_only, (partitions, expected_a_only)
+    assert sum(partitions.values()) == n
+    assert bias_b["biased"] and bias_b["biased_letters"] == ["A"], bias_b["biased_letters"]
+    assert not bias_a["biased_letters"], bias_a
+    assert len(cases) == 10 and all(case["ReasoningV_predicted"] == case["groundtruth"] for case in cases)
+
+    question = {"question": "What sets the dropout voltage of an LDO regulator?"}
+    options = "A. The pass transistor saturation voltage\nB. The color of the package\nC. Banana\nD. Unknown"
+    assert classify_error_type(question, "A", "B", options) == "幻觉错误"
+    assert classify_error_type(question, "A", "B", options, biased_letters=["B"]) == "选项偏见"
+    assert classify_error_type(question, "A", "Z", options) == "格式错误"
+    print(f"✅ 失败挖掘测试通过（{n} 题 × 2 模型，{elapsed:.2f}秒）")
+
+
+if __name__ == "__main__":
+    test_failure_mining()
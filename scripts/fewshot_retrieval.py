@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+检索式Few-shot示例选择 (Retrieval-based Few-shot Selection)
+每个任务离线构建BM25索引并预先计算每道题的近邻表，选择示例时直接查表（亚毫秒级）：
+返回与当前题目最相似的k道有效题目（题目本身及文本完全相同的重复题除外）；
+索引持久化到磁盘，加载时与数据集指纹比较，数据变化则重新构建
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_INDEX_DIR = "results/fewshot_index"
+INDEX_VERSION = 1
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {"the", "of", "and", "for", "in", "to", "is", "an", "on", "by", "with", "what", "which",
+              "how", "why", "does", "are", "its", "that", "this", "from", "be", "as", "at", "or", "a"}
+
+
+def tokenize(text: str) -> List[str]:
+    """小写分词并去停用词（保留重复词，用于BM25词频）"""
+    return [token for token in _TOKEN.findall(str(text).lower()) if token not in _STOPWORDS]
+
+
+def question_text(question: Dict) -> str:
+    """用于检索的文本：题干 + 选项内容"""
+    options = question.get('options') or {}
+    if isinstance(options, dict):
+        options = " ".join(str(value) for value in options.values())
+    return f"{question.get('question', '')} {options}"
+
+
+def is_valid_example(question: Dict, groundtruth_field: str) -> bool:
+    """可作为示例的题目（与load_few_shot_examples的筛选条件一致）"""
+    return bool(question.get('question') and question.get('options') and question.get(groundtruth_field))
+
+
+def dataset_fingerprint(questions: Sequence[Dict], groundtruth_field: str, params: Dict) -> str:
+    """数据集 + 索引参数的指纹（题目、选项、答案或参数任一变化即视为过期）"""
+    payload = json.dumps({
+        "version": INDEX_VERSION,
+        "params": params,
+        "questions": [[q.get('question'), q.get('options'), q.get(groundtruth_field)] for q in questions]
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class FewShotIndex:
+    """BM25索引 + 预计算近邻表"""
+
+    def __init__(self, questions: Sequence[Dict], groundtruth_field: str, k1: float = 1.5, b: float = 0.75,
+                 top_k: int = 16, build: bool = True):
+        """
+        初始化索引
+
+        Args:
+            questions: 任务的全部题目（近邻表按题目在列表中的位置索引）
+            groundtruth_field: 正确答案字段
+            k1 / b: BM25参数
+            top_k: 近邻表中每题保留的近邻数
+            build: 是否立即构建（从磁盘加载时为False）
+        """
+        self.questions = list(questions)
+        self.groundtruth_field = groundtruth_field
+        self.params = {"k1": k1, "b": b, "top_k": top_k}
+        self.fingerprint = dataset_fingerprint(self.questions, groundtruth_field, self.params)
+        self.vocab: Dict[str, int] = {}
+        self.postings_indptr = np.zeros(1, dtype=np.int64)
+        self.postings_docs = np.zeros(0, dtype=np.int32)
+        self.postings_weights = np.zeros(0, dtype=np.float32)
+        self.neighbors = np.zeros((len(self.questions), 0), dtype=np.int32)
+        self.texts = [question_text(q).strip().lower() for q in self.questions]
+        self.valid = np.array([is_valid_example(q, groundtruth_field) for q in self.questions], dtype=bool)
+        # 文本完全相同的题目互为重复（同一道题出现在多个文件中），不能作为彼此的示例
+        self.text_groups: Dict[str, int] = {}
+        self.duplicate_group = np.array([self.text_groups.setdefault(text, len(self.text_groups))
+                                         for text in self.texts], dtype=np.int64)
+        if build:
+            self.build()
+
+    # ------------------------------------------------------------------ 构建
+
+    def build(self):
+        """构建BM25倒排表（按词存放 文档, 权重）并计算每道题的近邻表"""
+        k1, b = self.params["k1"], self.params["b"]
+        documents = [tokenize(text) for text in self.texts]
+        num_docs = len(documents)
+
+        term_docs: Dict[str, Dict[int, int]] = {}
+        for doc, tokens in enumerate(documents):
+            for token in tokens:
+                counts = term_docs.setdefault(token, {})
+                counts[doc] = counts.get(doc, 0) + 1
+
+        lengths = np.array([len(tokens) for tokens in documents], dtype=np.float64)
+        avg_length = lengths.mean() if num_docs and lengths.mean() > 0 else 1.0
+        self.vocab = {term: t for t, term in enumerate(sorted(term_docs))}
+
+        indptr, docs, weights = [0], [], []
+        for term in sorted(term_docs):
+            counts = term_docs[term]
+            doc_ids = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+            tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+            idf = np.log(1 + (num_docs - len(counts) + 0.5) / (len(counts) + 0.5))
+            norm = k1 * (1 - b + b * lengths[doc_ids] / avg_length)
+            docs.append(doc_ids)
+            weights.append((idf * tf * (k1 + 1) / (tf + norm)).astype(np.float32))
+            indptr.append(indptr[-1] + len(counts))
+        self.postings_indptr = np.array(indptr, dtype=np.int64)
+        self.postings_docs = np.concatenate(docs) if docs else np.zeros(0, dtype=np.int32)
+        self.postings_weights = np.concatenate(weights) if weights else np.zeros(0, dtype=np.float32)
+
+        top_k = self.params["top_k"]
+        self.neighbors = np.full((num_docs, top_k), -1, dtype=np.int32)
+        for doc, tokens in enumerate(documents):
+            ranked = self._rank(self._scores(tokens), exclude_group=self.duplicate_group[doc], limit=top_k)
+            self.neighbors[doc, :len(ranked)] = ranked
+
+    def _scores(self, tokens: Sequence[str]) -> np.ndarray:
+        """查询词对全部文档的BM25得分（每个不同的词计一次）"""
+        term_ids = [self.vocab[token] for token in set(tokens) if token in self.vocab]
+        scores = np.zeros(len(self.questions), dtype=np.float64)
+        if not term_ids:
+            return scores
+        spans = [np.arange(self.postings_indptr[t], self.postings_indptr[t + 1]) for t in term_ids]
+        positions = np.concatenate(spans)
+        return np.bincount(self.postings_docs[positions], weights=self.postings_weights[positions],
+                           minlength=len(self.questions))
+
+    def _rank(self, scores: np.ndarray, exclude_group: Optional[int] = None, limit: int = 16,
+              exclude: Sequence[int] = ()) -> List[int]:
+        """按得分降序（同分按位置）取有效示例，排除重复组和指定位置；重复的题目只取一道"""
+        candidates = self.valid.copy()
+        if exclude_group is not None:
+            candidates &= self.duplicate_group != exclude_group
+        for position in exclude:
+            candidates[position] = False
+        positions = np.flatnonzero(candidates)
+        ranked = positions[np.lexsort((positions, -scores[positions]))]
+        _, first = np.unique(self.duplicate_group[ranked], return_index=True)
+        return ranked[np.sort(first)[:limit]].tolist()
+
+    # ------------------------------------------------------------------ 查询
+
+    def neighbor_indices(self, index: int, k: int) -> List[int]:
+        """第index道题的k个近邻位置（查表；超过预计算的数量时现场计算）"""
+        if k <= self.neighbors.shape[1]:
+            row = self.neighbors[index, :k]
+            return row[row >= 0].tolist()
+        return self._rank(self._scores(tokenize(self.texts[index])), exclude_group=self.duplicate_group[index],
+                          limit=k)
+
+    def examples(self, index: int, k: int) -> List[Dict]:
+        """第index道题的k个Few-shot示例（按相似度降序）"""
+        return [self.questions[position] for position in self.neighbor_indices(index, k)]
+
+    def query(self, text: str, k: int, exclude: Sequence[int] = ()) -> List[int]:
+        """任意文本的k个近邻位置（不在数据集中的题目使用）"""
+        text = text.strip().lower()
+        return self._rank(self._scores(tokenize(text)), exclude_group=self.text_groups.get(text), limit=k,
+                          exclude=exclude)
+
+    # ------------------------------------------------------------------ 持久化
+
+    def save(self, path: str):
+        """保存到npz（原子替换）"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            metadata=np.array(json.dumps({"version": INDEX_VERSION, "fingerprint": self.fingerprint,
+                                          "params": self.params, "groundtruth_field": self.groundtruth_field,
+                                          "num_questions": len(self.questions)})),
+            vocab=np.array(sorted(self.vocab, key=self.vocab.get), dtype=str),
+            postings_indptr=self.postings_indptr,
+            postings_docs=self.postings_docs,
+            postings_weights=self.postings_weights,
+            neighbors=self.neighbors
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, questions: Sequence[Dict], groundtruth_field: str,
+             **params) -> Optional["FewShotIndex"]:
+        """从磁盘加载；文件不存在、版本不符或数据集指纹不一致（已过期）时返回None"""
+        if not os.path.exists(path):
+            return None
+        index = cls(questions, groundtruth_field, build=False, **params)
+        with np.load(path, allow_pickle=False) as data:
+            metadata = json.loads(str(data["metadata"]))
+            if metadata.get("version") != INDEX_VERSION or metadata.get("fingerprint") != index.fingerprint:
+                return None
+            index.vocab = {term: t for t, term in enumerate(data["vocab"].tolist())}
+            index.postings_indptr = data["postings_indptr"]
+            index.postings_docs = data["postings_docs"]
+            index.postings_weights = data["postings_weights"]
+            index.neighbors = data["neighbors"]
+        return index
+
+    @classmethod
+    def for_task(cls, task_name: str, questions: Sequence[Dict], groundtruth_field: str,
+                 index_dir: str = DEFAULT_INDEX_DIR, **params) -> "FewShotIndex":
+        """加载任务的索引，不存在或已过期时重新构建并保存"""
+        path = os.path.join(index_dir, task_name.replace(" ", "_") + ".npz")
+        index = cls.load(path, questions, groundtruth_field, **params)
+        if index is not None:
+            print(f"   🔎 已加载 {task_name} 示例索引 ({len(questions)} 题)")
+            return index
+
+        start_time = time.time()
+        index = cls(questions, groundtruth_field, **params)
+        index.save(path)
+        print(f"   🔎 已构建 {task_name} 示例索引 ({len(questions)} 题, {len(index.vocab)} 词, "
+              f"{time.time() - start_time:.2f}秒) -> {path}")
+        return index
+
+
+def test_fewshot_retrieval():
+    """测试检索式示例选择：排除自身和重复题、近邻相关、查表亚毫秒、过期检测"""
+    import tempfile
+    from synthetic_data import SyntheticTaskGenerator
+
+    questions = SyntheticTaskGenerator(seed=0).generate(600, "ground_truth")
+    # 构造一道重复题和一道无答案的题
+    questions.append(dict(questions[10]))
+    questions[5] = dict(questions[5], ground_truth="")
+
+    with tempfile.TemporaryDirectory() as root:
+        index = FewShotIndex.for_task("LDO Task", questions, "ground_truth", index_dir=root)
+        for position in range(len(questions)):
+            neighbors = index.neighbor_indices(position, 8)
+            assert position not in neighbors and 5 not in neighbors
+            assert len(neighbors) == len(set(neighbors)) == 8
+        assert 10 not in index.neighbor_indices(len(questions) - 1, 16)
+        assert len(questions) - 1 not in index.neighbor_indices(10, 16)
+        assert not {10, len(questions) - 1} <= set(index.neighbor_indices(11, 600))
+        assert index.query(questions[0]["question"] + " " + " ".join(questions[0]["options"].values()), 4) \
+            == index.neighbor_indices(0, 4)
+
+        # 最近邻与题目共享的词多于随机题目
+        shared = lambda a, b: len(set(tokenize(index.texts[a])) & set(tokenize(index.texts[b])))
+        nearest = np.mean([shared(p, index.neighbor_indices(p, 1)[0]) for p in range(100)])
+        random_pair = np.mean([shared(p, (p + 300) % 600) for p in range(100)])
+        assert nearest > random_pair, (nearest, random_pair)
+
+        start = time.perf_counter()
+        for position in range(len(questions)):
+            index.examples(position, 4)
+        per_lookup = (time.perf_counter() - start) / len(questions)
+        assert per_lookup < 1e-3, per_lookup
+
+        # 重新加载：未变化时直接复用，数据变化时判定过期
+        path = os.path.join(root, "LDO_Task.npz")
+        reloaded = FewShotIndex.load(path, questions, "ground_truth")
+        assert reloaded is not None and reloaded.neighbor_indices(3, 8) == index.neighbor_indices(3, 8)
+        changed = [dict(q) for q in questions]
+        changed[0]["question"] += " (revised)"
+        assert FewShotIndex.load(path, changed, "ground_truth") is None
+        assert FewShotIndex.load(path, questions, "ground_truth", top_k=8) is None
+        assert index.neighbor_indices(3, 20)[:16] == index.neighbor_indices(3, 16)
+    print(f"✅ 检索式示例选择测试通过（查表 {per_lookup * 1e6:.1f}µs/题）")
+
+
+if __name__ == "__main__":
+    test_fewshot_retrieval()
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OpenAI兼容HTTP推理后端 (OpenAI-compatible HTTP Backend)
+模型由独立的本地推理服务（vLLM、llama.cpp server等）提供时，把提示词发送到 /v1/completions：
+keep-alive连接池复用TCP连接，线程池并发请求且并发数有上限；
+选项打分使用返回的top logprobs（与本地logits只差每行一个常数，字母间的softmax和argmax不变）
+"""
+
+import hashlib
+import http.client
+import json
+import math
+import os
+import queue
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from option_scorer import OPTION_LETTERS, extract_option
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_TOP_LOGPROBS = 20
+GREEDY_PARAMS = {"max_new_tokens": 1, "do_sample": False}
+
+
+def letter_logprobs(top_logprobs: Optional[Dict[str, float]]) -> np.ndarray:
+    """
+    第一个生成位置的top logprobs -> 各选项字母的分数 [5]
+
+    去掉空白后等于字母的token都算（"A"、" A"等写法取最大值），不在top-k中的字母为-inf；
+    服务没有返回logprobs时全部为NaN（与归档中"未打分"一致）
+    """
+    if top_logprobs is None:
+        return np.full(len(OPTION_LETTERS), np.nan, dtype=np.float32)
+    scores = np.full(len(OPTION_LETTERS), -np.inf, dtype=np.float32)
+    for token, logprob in top_logprobs.items():
+        letter = token.strip()
+        if letter in OPTION_LETTERS and logprob is not None:
+            col = OPTION_LETTERS.index(letter)
+            scores[col] = max(scores[col], logprob)
+    return scores
+
+
+class ConnectionPool:
+    """keep-alive HTTP连接池：同时使用的连接数不超过size，用完放回复用，出错的连接关闭丢弃"""
+
+    def __init__(self, base_url: str, size: int = DEFAULT_MAX_CONCURRENCY, timeout: float = 300.0):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.https = parsed.scheme == "https"
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max(1, size))
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def _connect(self) -> http.client.HTTPConnection:
+        """新建连接"""
+        with self._lock:
+            self.opened += 1
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method: str, path: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, bytes]:
+        """
+        发送一个请求（占用一个连接槽位，槽位用完时等待）
+
+        Returns:
+            (状态码, 响应体)
+        """
+        with self._slots:
+            try:
+                connection, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                connection, reused = self._connect(), False
+            while True:
+                try:
+                    connection.request(method, self.base_path + path, body, headers)
+                    response = connection.getresponse()
+                    data = response.read()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    connection.close()
+                    # 空闲连接可能已被服务端关闭，换一个新连接重试一次（请求尚未被处理）
+                    if not reused:
+                        raise
+                    connection, reused = self._connect(), False
+                    continue
+                except BaseException:
+                    connection.close()
+                    raise
+                if response.will_close:
+                    connection.close()
+                else:
+                    self._idle.put(connection)
+                return response.status, data
+
+    def close(self):
+        """关闭全部空闲连接"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class CompletionsBackend:
+    """OpenAI兼容completions接口的推理后端（接口与OptionLetterScorer的打分/采样结果格式一致）"""
+
+    def __init__(self, base_url: str, model: str, api_key: Optional[str] = None,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, timeout: float = 300.0,
+                 top_logprobs: int = DEFAULT_TOP_LOGPROBS):
+        """
+        Args:
+            base_url: 服务地址（含/v1，如 http://127.0.0.1:8000/v1）
+            model: 服务端的模型名
+            api_key: 可选的Bearer token
+            max_concurrency: 同时进行的请求数上限（也是连接池大小）
+            timeout: 单个请求的超时（秒）
+            top_logprobs: 每个位置返回的logprobs数（选项打分用，0表示不请求）
+        """
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self.top_logprobs = top_logprobs
+        self.pool = ConnectionPool(self.base_url, self.max_concurrency, timeout)
+        self.headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency": 0.0}
+
+    def request_body(self, prompt: str, params: Dict, n: int = 1, seed: Optional[int] = None) -> Dict:
+        """生成参数（本地generate的写法） -> completions请求体；贪心解码时温度为0"""
+        body = {
+            "model": self.model,
+            "prompt": prompt,
+            "max_tokens": params.get("max_new_tokens", 1),
+            "n": n
+        }
+        if params.get("do_sample", False):
+            body["temperature"] = params.get("temperature", 1.0)
+            body["top_p"] = params.get("top_p", 1.0)
+            if params.get("top_k", 0) > 0:
+                body["top_k"] = params["top_k"]
+        else:
+            body["temperature"] = 0.0
+        if params.get("repetition_penalty", 1.0) != 1.0:
+            body["repetition_penalty"] = params["repetition_penalty"]
+        if seed is not None:
+            body["seed"] = seed
+        if self.top_logprobs > 0:
+            body["logprobs"] = self.top_logprobs
+        return body
+
+    def post(self, path: str, payload: Dict) -> Dict:
+        """POST一个JSON请求，非2xx状态码抛出RuntimeError"""
+        status, data = self.pool.request("POST", path, json.dumps(payload).encode("utf-8"), self.headers)
+        if status >= 300:
+            raise RuntimeError(f"推理服务返回 {status}: {data[:200].decode('utf-8', 'replace')}")
+        return json.loads(data)
+
+    def complete(self, prompt: str, params: Dict, n: int = 1, seed: Optional[int] = None) -> Dict:
+        """
+        补全一个提示词
+
+        Returns:
+            {texts: n个生成文本, text: 第一个生成文本, letter_logits: 第一个生成位置的字母分数 [5],
+             prompt_tokens, completion_tokens, latency}
+        """
+        start = time.perf_counter()
+        try:
+            response = self.post("/completions", self.request_body(prompt, params, n, seed))
+        except Exception:
+            with self._lock:
+                self.stats["requests"] += 1
+                self.stats["errors"] += 1
+            raise
+        latency = time.perf_counter() - start
+
+        choices = sorted(response.get("choices", []), key=lambda choice: choice.get("index", 0))
+        if not choices:
+            raise RuntimeError("推理服务没有返回choices")
+        logprobs = choices[0].get("logprobs") or {}
+        top = (logprobs.get("top_logprobs") or [None])[0]
+        usage = response.get("usage") or {}
+        result = {
+            "texts": [choice.get("text", "") for choice in choices],
+            "text": choices[0].get("text", ""),
+            "letter_logits": letter_logprobs(top),
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "latency": latency
+        }
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["prompt_tokens"] += result["prompt_tokens"]
+            self.stats["completion_tokens"] += result["completion_tokens"]
+            self.stats["latency"] += latency
+        return result
+
+    def answer(self, prompt: str, params: Dict) -> Tuple[str, Dict]:
+        """生成并解析选项字母（与验证脚本generate_answer的解析规则一致）"""
+        completion = self.complete(prompt, params)
+        return extract_option(completion["text"].strip()), completion
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """请求线程池（线程数即并发上限）"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix="completions")
+        return self._executor
+
+    def complete_many(self, requests: Sequence[Tuple[str, Dict]], n: int = 1, seed: Optional[int] = None,
+                      raise_errors: bool = False) -> List[Optional[Dict]]:
+        """
+        并发补全多个 (提示词, 生成参数)，结果与输入顺序一致
+
+        Args:
+            raise_errors: 为False时失败的请求结果为None（与本地生成失败的处理一致）
+        """
+        def run(request: Tuple[str, Dict]) -> Optional[Dict]:
+            try:
+                return self.complete(request[0], request[1], n, seed)
+            except Exception:
+                if raise_errors:
+                    raise
+                return None
+
+        return list(self.executor.map(run, requests))
+
+    def score_prompts(self, prompts: Sequence[str]) -> Dict:
+        """
+        批量取最后位置的选项字母分数（贪心生成1个token时的logprobs）
+
+        Returns:
+            {letter_logits: [N, 5] float32, prompt_tokens: 预填充token总数}
+        """
+        completions = self.complete_many([(prompt, GREEDY_PARAMS) for prompt in prompts], raise_errors=True)
+        return {
+            "letter_logits": (np.stack([c["letter_logits"] for c in completions]) if completions
+                              else np.empty((0, len(OPTION_LETTERS)), dtype=np.float32)),
+            "prompt_tokens": sum(c["prompt_tokens"] for c in completions)
+        }
+
+    def sample(self, prompts: Sequence[str], params: Dict, num_samples: int, seed: Optional[int] = None) -> Dict:
+        """
+        每个提示词在一个请求中采样num_samples次（n参数，服务端只预填充一次）
+
+        Returns:
+            {samples, prompt_tokens, decode_steps, max_decode_steps}（与OptionLetterScorer.sample一致）
+        """
+        completions = self.complete_many([(prompt, params) for prompt in prompts], num_samples, seed,
+                                         raise_errors=True)
+        return {
+            "samples": [c["texts"] for c in completions],
+            "prompt_tokens": sum(c["prompt_tokens"] for c in completions),
+            "decode_steps": sum(c["completion_tokens"] for c in completions),
+            "max_decode_steps": params.get("max_new_tokens", 1) * num_samples * len(prompts)
+        }
+
+    def summary(self) -> Dict:
+        """请求统计（连接数为连接池累计新建的连接）"""
+        requests = self.stats["requests"]
+        return dict(self.stats, connections=self.pool.opened, max_concurrency=self.max_concurrency,
+                    avg_latency=self.stats["latency"] / requests if requests else 0.0)
+
+    def close(self):
+        """关闭线程池和连接"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.pool.close()
+
+    @staticmethod
+    def add_arguments(parser):
+        """为命令行添加HTTP后端参数"""
+        parser.add_argument("--endpoint", default=None,
+                            help="OpenAI兼容推理服务地址（如 http://127.0.0.1:8000/v1；提供时不在本进程加载模型）")
+        parser.add_argument("--served-model", default=None, help="服务端的模型名（默认为模型目录名）")
+        parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                            help="同时进行的请求数上限")
+        parser.add_argument("--top-logprobs", type=int, default=DEFAULT_TOP_LOGPROBS,
+                            help="每个位置请求的logprobs数（选项打分用）")
+        parser.add_argument("--request-timeout", type=float, default=300.0, help="单个请求的超时（秒）")
+
+    @classmethod
+    def from_args(cls, args, model_path: str = "") -> Optional["CompletionsBackend"]:
+        """根据命令行参数创建后端（API key取自环境变量OPENAI_API_KEY），未指定--endpoint时返回None"""
+        if not getattr(args, "endpoint", None):
+            return None
+        model = args.served_model or os.path.basename(os.path.normpath(model_path)) or "default"
+        return cls(args.endpoint, model, os.environ.get("OPENAI_API_KEY"), args.max_concurrency,
+                   args.request_timeout, args.top_logprobs)
+
+
+def mock_letter_logprobs(prompt: str) -> Dict[str, float]:
+    """模拟服务的确定性logprobs：由提示词哈希得到五个字母和一个非字母token的分布"""
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    logits = [digest[i] / 32.0 for i in range(len(OPTION_LETTERS) + 1)]
+    norm = math.log(sum(math.exp(x) for x in logits))
+    tokens = [" " + letter for letter in OPTION_LETTERS] + ["\n"]
+    return {token: x - norm for token, x in zip(tokens, logits)}
+
+
+class MockCompletionsServer:
+    """本地模拟的OpenAI兼容推理服务（测试/基准用）：每个请求固定延迟，答案由提示词哈希确定"""
+
+    def __init__(self, latency: float = 0.02, port: int = 0, host: str = "127.0.0.1"):
+        """
+        Args:
+            latency: 每个请求的处理时间（秒），模拟服务端一次前向；并发请求的延迟互相重叠
+            port: 端口（0表示自动分配）
+        """
+        server_ref = self
+        self.latency = latency
+        self.requests = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_next = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 响应头和响应体分两次写出，关闭Nagle避免与客户端的延迟ACK叠加出40ms停顿
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with server_ref._lock:
+                    server_ref.connections += 1
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/completions"):
+                    self.reply(404, {"error": {"message": "not found"}})
+                    return
+                with server_ref._lock:
+                    server_ref.requests += 1
+                    server_ref.in_flight += 1
+                    server_ref.max_in_flight = max(server_ref.max_in_flight, server_ref.in_flight)
+                    failing = server_ref.fail_next > 0
+                    server_ref.fail_next -= failing
+                try:
+                    time.sleep(server_ref.latency)
+                    if failing:
+                        self.reply(500, {"error": {"message": "mock failure"}})
+                    else:
+                        self.reply(200, server_ref.completion(body))
+                finally:
+                    with server_ref._lock:
+                        server_ref.in_flight -= 1
+
+            def reply(self, status: int, payload: Dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f"http://{host}:{self.port}/v1"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-completions", daemon=True)
+
+    @staticmethod
+    def completion(body: Dict) -> Dict:
+        """按请求体构造completions响应（贪心取概率最大的字母，采样按分布抽取）"""
+        prompt = body.get("prompt", "")
+        top = mock_letter_logprobs(prompt)
+        tokens = list(top)
+        probabilities = [math.exp(top[token]) for token in tokens]
+        rng = random.Random(f"{prompt}:{body.get('seed')}")
+        choices = []
+        for index in range(body.get("n", 1)):
+            if body.get("temperature", 1.0) == 0:
+                token = max(tokens, key=top.get)
+            else:
+                token = rng.choices(tokens, probabilities)[0]
+            choice = {"index": index, "text": token, "finish_reason": "length"}
+            if body.get("logprobs"):
+                k = body["logprobs"]
+                choice["logprobs"] = {"tokens": [token], "token_logprobs": [top[token]],
+                                      "top_logprobs": [dict(sorted(top.items(), key=lambda kv: -kv[1])[:k])]}
+            choices.append(choice)
+        return {
+            "id": "cmpl-mock",
+            "object": "text_completion",
+            "model": body.get("model"),
+            "choices": choices,
+            "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(choices),
+                      "total_tokens": len(prompt.split()) + len(choices)}
+        }
+
+    def start(self) -> "MockCompletionsServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def measure_throughput(url: str, prompts: Sequence[str], max_concurrency: int) -> Dict:
+    """用新的后端实例把全部提示词发送一遍，返回 {elapsed, throughput, connections}"""
+    backend = CompletionsBackend(url, "mock", max_concurrency=max_concurrency)
+    try:
+        start = time.perf_counter()
+        backend.complete_many([(prompt, GREEDY_PARAMS) for prompt in prompts], raise_errors=True)
+        elapsed = time.perf_counter() - start
+        return {"elapsed": elapsed, "throughput": len(prompts) / elapsed, "connections": backend.pool.opened}
+    finally:
+        backend.close()
+
+
+def test_http_backend():
+    """测试HTTP后端：答案/打分与模拟服务一致，并发受上限约束，连接复用，吞吐随并发数提升"""
+    server = MockCompletionsServer(latency=0.02).start()
+    try:
+        prompts = [f"Question: mock question {i}\nAnswer:" for i in range(32)]
+        backend = CompletionsBackend(server.url, "mock", max_concurrency=4, top_logprobs=5)
+
+        for prompt in prompts[:8]:
+            answer, completion = backend.answer(prompt, GREEDY_PARAMS)
+            top = mock_letter_logprobs(prompt)
+            assert answer == extract_option(max(top, key=top.get).strip())
+            # 只请求了top-5，第六个token（可能是某个字母）不在返回结果中
+            expected = letter_logprobs(dict(sorted(top.items(), key=lambda kv: -kv[1])[:5]))
+            assert np.array_equal(completion["letter_logits"], expected)
+
+        scores = backend.score_prompts(prompts)
+        assert scores["letter_logits"].shape == (len(prompts), len(OPTION_LETTERS))
+        assert server.max_in_flight <= 4 and backend.pool.opened <= 4, (server.max_in_flight, backend.pool.opened)
+
+        sampled = backend.sample(prompts[:3], {"max_new_tokens": 1, "do_sample": True, "temperature": 1.0}, 8, seed=0)
+        assert [len(texts) for texts in sampled["samples"]] == [8, 8, 8]
+
+        server.fail_next = 1
+        assert backend.complete_many([(prompts[0], GREEDY_PARAMS)])[0] is None
+        backend.close()
+
+        serial = measure_throughput(server.url, prompts, 1)
+        parallel = measure_throughput(server.url, prompts, 8)
+        speedup = parallel["throughput"] / serial["throughput"]
+        assert serial["connections"] == 1 and parallel["connections"] <= 8, (serial, parallel)
+        assert speedup > 3, speedup
+    finally:
+        server.stop()
+    print(f"✅ HTTP后端测试通过（{len(prompts)} 题: 并发1 {serial['throughput']:.0f} 题/秒, "
+          f"并发8 {parallel['throughput']:.0f} 题/秒, {speedup:.1f}x, 连接 {parallel['connections']} 个）")
+
+
+def main():
+    """命令行入口：运行自检，或在本地端口启动模拟服务"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="OpenAI兼容HTTP推理后端")
+    parser.add_argument("--mock-server", action="store_true", help="启动模拟推理服务（Ctrl+C退出）")
+    parser.add_argument("--port", type=int, default=8000, help="模拟服务端口")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟服务每个请求的延迟（秒）")
+    args = parser.parse_args()
+
+    if not args.mock_server:
+        test_http_backend()
+        return
+    server = MockCompletionsServer(args.latency, args.port).start()
+    print(f"🛰️ 模拟推理服务: {server.url}（每个请求 {args.latency * 1000:.0f} ms）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
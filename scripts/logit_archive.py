@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+选项logit归档 (Option-logit Archive)
+验证时把每道题的完整选项字母logit向量按 (模型, 任务, 策略) 写入压缩的列式npz文件，
+之后的校准、集成、策略重选和阈值调优都可以直接在归档上计算，不需要重新运行模型
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+import warnings
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from option_scorer import OPTION_LETTERS
+from prompt_cache import model_fingerprint
+
+DEFAULT_ARCHIVE_DIR = "results/logit_archive"
+INDEX_FILE = "index.json"
+
+
+def archive_slug(name: str, max_length: int = 40) -> str:
+    """任务名/策略标签 -> 文件名（保留可读部分，附加短哈希避免截断后重名）"""
+    readable = re.sub(r"[^0-9A-Za-z一-鿿]+", "_", name).strip("_")[:max_length] or "base"
+    return f"{readable}_{hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]}"
+
+
+def template_label(template: str) -> str:
+    """
+    提示词模板 -> 显示标签：{question}之前的前缀，{options}之后除"Answer:"外还有指令时一并附上
+    （归档按完整模板区分策略，前缀相同的模板只在显示上共用前缀）
+    """
+    prefix = template.split("{question}")[0].strip() or "base"
+    suffix = template.split("{options}")[-1] if "{options}" in template else ""
+    suffix = re.sub(r"\s*Answer:\s*$", "", suffix).strip()
+    return f"{prefix} … {suffix}" if suffix else prefix
+
+
+class LogitArchive:
+    """某个模型的选项logit归档：每个 (任务, 策略) 一个npz文件，index.json记录原始名称到文件的映射"""
+
+    def __init__(self, model_name: str, root: str = DEFAULT_ARCHIVE_DIR, fingerprint: str = ""):
+        """
+        Args:
+            model_name: 模型名（归档子目录名）
+            root: 归档根目录
+            fingerprint: 模型标识（写入每个文件的元数据，读取时不校验）
+        """
+        self.model_name = model_name
+        self.root = root
+        self.fingerprint = fingerprint
+        self.directory = os.path.join(root, model_name)
+        self.index: Dict[str, Dict[str, str]] = {}
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+
+    @classmethod
+    def for_model_path(cls, model_path: str, root: str = DEFAULT_ARCHIVE_DIR) -> "LogitArchive":
+        """按模型路径创建（子目录为模型目录名）"""
+        return cls(os.path.basename(os.path.normpath(model_path)), root, model_fingerprint(model_path))
+
+    def tasks(self) -> List[str]:
+        """已归档的任务"""
+        return list(self.index)
+
+    def strategies(self, task_name: str) -> List[str]:
+        """某任务已归档的策略"""
+        return list(self.index.get(task_name, {}))
+
+    def path(self, task_name: str, strategy: str) -> str:
+        """(任务, 策略) 的归档文件路径"""
+        filename = self.index.get(task_name, {}).get(strategy)
+        if filename is None:
+            filename = os.path.join(archive_slug(task_name), archive_slug(strategy) + ".npz")
+        return os.path.join(self.directory, filename)
+
+    def save(self, task_name: str, strategy: str, logits: np.ndarray, groundtruth: Sequence[str],
+             question_ids: Sequence[str], meta: Optional[Dict] = None):
+        """
+        写入一个 (任务, 策略) 的logits（覆盖旧文件）
+
+        Args:
+            logits: [运行数, 题数, 选项数]，未使用该策略或未构建提示词的题目为NaN
+            groundtruth: 每题的标准答案字母
+            question_ids: 每题的标识
+            meta: 附加元数据（如提示词模板、生成参数）
+        """
+        logits = np.asarray(logits, dtype=np.float32)
+        if logits.ndim == 2:
+            logits = logits[None]
+        path = self.path(task_name, strategy)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        meta = dict(meta or {}, model=self.model_name, fingerprint=self.fingerprint, task=task_name,
+                    strategy=strategy, runs=int(logits.shape[0]), timestamp=time.strftime('%Y-%m-%d %H:%M:%S'))
+        tmp_path = path[:-len(".npz")] + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            logits=logits,
+            groundtruth=np.asarray([str(g) for g in groundtruth]),
+            question_ids=np.asarray([str(q) for q in question_ids]),
+            letters=np.asarray(OPTION_LETTERS),
+            meta=np.asarray(json.dumps(meta, ensure_ascii=False))
+        )
+        os.replace(tmp_path, path)
+
+        self.index.setdefault(task_name, {})[strategy] = os.path.relpath(path, self.directory)
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with open(index_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=2)
+        os.replace(index_path + ".tmp", index_path)
+
+    def load(self, task_name: str, strategy: str) -> Dict:
+        """
+        读取一个 (任务, 策略) 的全部列
+
+        Returns:
+            {logits: [运行数, 题数, 选项数], groundtruth, question_ids, letters, meta}
+        """
+        path = self.path(task_name, strategy)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"没有 {self.model_name} / {task_name} / {strategy} 的logit归档: {path}")
+        with np.load(path) as data:
+            return {
+                "logits": data["logits"],
+                "groundtruth": data["groundtruth"],
+                "question_ids": data["question_ids"],
+                "letters": data["letters"].tolist(),
+                "meta": json.loads(str(data["meta"]))
+            }
+
+    def logits(self, task_name: str, strategy: str, run: Optional[int] = 0) -> np.ndarray:
+        """
+        题目 × 选项 的logits数组
+
+        Args:
+            run: 第几次运行；None表示各次运行取平均（忽略NaN）
+        """
+        logits = self.load(task_name, strategy)["logits"]
+        if run is not None:
+            return logits[run]
+        with warnings.catch_warnings():
+            # 全部运行都是NaN的题目保持NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return np.nanmean(logits, axis=0)
+
+    def stack(self, task_name: str, strategies: Optional[Sequence[str]] = None, run: Optional[int] = None) -> Dict:
+        """
+        多个策略叠成 题目 × 策略 × 选项 张量
+
+        Args:
+            strategies: 策略标签（默认为该任务已归档的全部策略）
+            run: 第几次运行；None表示各次运行取平均
+
+        Returns:
+            {logits: [题数, 策略数, 选项数], strategies, meta: 各策略的元数据, groundtruth, question_ids, letters}
+        """
+        strategies = list(strategies) if strategies is not None else self.strategies(task_name)
+        if not strategies:
+            raise ValueError(f"{self.model_name} / {task_name} 没有已归档的策略")
+        columns, metas = [], []
+        for strategy in strategies:
+            data = self.load(task_name, strategy)
+            if columns and data["logits"].shape[1] != columns[0].shape[0]:
+                raise ValueError(f"策略 {strategy} 的题数 {data['logits'].shape[1]} 与其他策略不一致")
+            if run is not None:
+                columns.append(data["logits"][run])
+            else:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    columns.append(np.nanmean(data["logits"], axis=0))
+            metas.append(data["meta"])
+        return {
+            "logits": np.stack(columns, axis=1),
+            "strategies": strategies,
+            "meta": metas,
+            "groundtruth": data["groundtruth"],
+            "question_ids": data["question_ids"],
+            "letters": data["letters"]
+        }
+
+    def summary(self) -> Dict[str, Dict[str, Dict]]:
+        """各 (任务, 策略) 的题数、覆盖题数和准确率（argmax）"""
+        summary = {}
+        for task_name in self.tasks():
+            for strategy in self.strategies(task_name):
+                data = self.load(task_name, strategy)
+                logits = data["logits"]
+                covered = ~np.isnan(logits).any(axis=2)
+                predicted = np.asarray(data["letters"])[np.nan_to_num(logits, nan=-np.inf).argmax(axis=2)]
+                correct = covered & (predicted == data["groundtruth"][None])
+                summary.setdefault(task_name, {})[strategy] = {
+                    "label": data["meta"].get("label", strategy),
+                    "runs": int(logits.shape[0]),
+                    "questions": int(logits.shape[1]),
+                    "covered": int(covered[0].sum()),
+                    "accuracy": float(correct.sum(axis=1).mean() / logits.shape[1] * 100) if logits.shape[1] else 0.0
+                }
+        return summary
+
+
+def print_archive_summary(archive: LogitArchive):
+    """打印归档内容"""
+    print(f"\n🗄️ 选项logit归档: {archive.directory}")
+    for task_name, strategies in archive.summary().items():
+        for strategy, stats in strategies.items():
+            label = stats["label"] if len(stats["label"]) <= 60 else stats["label"][:57] + "..."
+            print(f"   {task_name} / {label}: {stats['covered']}/{stats['questions']} 题, "
+                  f"{stats['runs']} 次运行, argmax准确率 {stats['accuracy']:.2f}%")
+
+
+def test_logit_archive():
+    """测试归档：写入读取一致，多次运行取平均，分析只需毫秒级"""
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    n = 5000
+    logits = rng.normal(size=(3, n, len(OPTION_LETTERS))).astype(np.float32)
+    logits[:, :10] = np.nan
+    groundtruth = np.asarray(OPTION_LETTERS[:4])[rng.integers(0, 4, n)]
+    strategy = "You are an expert in analog circuit design. Analyze carefully:"
+    with tempfile.TemporaryDirectory() as root:
+        archive = LogitArchive("tiny", root)
+        archive.save("LDO Task", strategy, logits, groundtruth, [str(i) for i in range(n)], {"params": {}})
+        archive.save("LDO Task", "base", logits[0], groundtruth, [str(i) for i in range(n)])
+
+        reloaded = LogitArchive("tiny", root)
+        assert reloaded.strategies("LDO Task") == [strategy, "base"]
+        start = time.perf_counter()
+        loaded = reloaded.logits("LDO Task", strategy, run=1)
+        accuracy = (np.asarray(OPTION_LETTERS)[np.nan_to_num(loaded, nan=-np.inf).argmax(axis=1)] == groundtruth).mean()
+        elapsed = time.perf_counter() - start
+        assert loaded.shape == (n, len(OPTION_LETTERS))
+        assert np.array_equal(loaded, logits[1], equal_nan=True)
+        assert np.allclose(reloaded.logits("LDO Task", strategy, run=None)[10:], logits[:, 10:].mean(axis=0), atol=1e-6)
+        assert reloaded.load("LDO Task", "base")["logits"].shape == (1, n, len(OPTION_LETTERS))
+        assert reloaded.summary()["LDO Task"]["base"]["covered"] == n - 10
+        assert template_label("Question: {question}\n\nOptions:\n{options}\n\nAnswer:") == "Question:"
+        assert template_label("Question: {question}\n\nOptions:\n{options}\n\nPay special attention to option A. "
+                              "Answer:") == "Question: … Pay special attention to option A."
+        stacked = reloaded.stack("LDO Task", run=0)
+        assert stacked["logits"].shape == (n, 2, len(OPTION_LETTERS))
+        assert np.array_equal(stacked["logits"][:, 0], stacked["logits"][:, 1], equal_nan=True)
+    print(f"✅ 选项logit归档测试通过（读取+准确率 {elapsed * 1000:.1f}ms, 准确率 {accuracy * 100:.1f}%）")
+
+
+if __name__ == "__main__":
+    test_logit_archive()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标 (Run Metrics)
+计数器、仪表和直方图的指标注册表，按OpenMetrics文本格式导出：
+定期写入文件，或在本地端口上提供 /metrics，长时间运行时无需抓取日志即可观察进度
+"""
+
+import bisect
+import contextlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# 默认延迟分桶（秒）
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    """转义标签值中的反斜杠、双引号和换行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指标基类：按标签值元组保存样本"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _label_text(self, key: Tuple[str, ...], extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# TYPE {self.name} {self.type_name}", f"# HELP {self.name} {_escape(self.documentation)}"]
+        with self._lock:
+            lines.extend(self.samples())
+        return lines
+
+
+class CounterMetric(_Metric):
+    """计数器：只增不减（导出时样本名加 _total 后缀）"""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        if amount < 0:
+            raise ValueError("计数器只能增加")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}_total{self._label_text(key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class GaugeMetric(_Metric):
+    """仪表：可任意设置的当前值"""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self._label_text(key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class HistogramMetric(_Metric):
+    """直方图：累计分桶计数 + 总和 + 次数"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            state["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """记录with块的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._label_text(key, [('le', _format_value(bound))])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"指标 {metric.name} 已以不同类型或标签注册")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> CounterMetric:
+        return self._register(CounterMetric(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> GaugeMetric:
+        return self._register(GaugeMetric(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> HistogramMetric:
+        return self._register(HistogramMetric(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """按OpenMetrics文本格式导出所有指标"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsFileExporter:
+    """定期把指标写入文件（先写临时文件再原子替换，读取方不会看到写了一半的内容）"""
+
+    def __init__(self, registry: MetricsRegistry, path: str, interval: float = 10.0):
+        self.registry = registry
+        self.path = path
+        self.interval = max(0.1, interval)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def write(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.registry.render())
+        os.replace(tmp_path, self.path)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self):
+        self.write()
+        self._thread = threading.Thread(target=self._loop, name="metrics-file-exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止并写出最终值"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+
+class MetricsServer:
+    """在本地端口上提供 GET /metrics（后台线程）"""
+
+    def __init__(self, registry: MetricsRegistry, port: int = 9108, host: str = "127.0.0.1"):
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry_ref.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class RunMetrics:
+    """验证/消融运行的标准指标集合"""
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None, prefix: str = "reasoningv"):
+        self.registry = registry or MetricsRegistry()
+        self.questions = self.registry.counter(f"{prefix}_questions", "已处理的题目数", ("task", "strategy"))
+        self.correct = self.registry.counter(f"{prefix}_questions_correct", "答对的题目数", ("task", "strategy"))
+        self.prefill_tokens = self.registry.counter(f"{prefix}_prefill_tokens", "预填充的token数", ("task",))
+        self.cache_hits = self.registry.counter(f"{prefix}_cache_hits", "缓存命中次数", ("cache",))
+        self.cache_misses = self.registry.counter(f"{prefix}_cache_misses", "缓存未命中次数", ("cache",))
+        self.phase_latency = self.registry.histogram(f"{prefix}_phase_latency_seconds", "各阶段耗时（秒）",
+                                                     ("phase",))
+        self.accuracy = self.registry.gauge(f"{prefix}_task_accuracy", "当前任务准确率（0-1）", ("task",))
+        self.prefix_hit_ratio = self.registry.gauge(f"{prefix}_prefix_hit_ratio",
+                                                    "调度后相邻提示词的前缀命中率（0-1）", ("task",))
+        self.exporters: List = []
+        self._task_totals: Dict[str, List[int]] = {}
+
+    def observe_question(self, task: str, strategy: str, correct: bool):
+        """记录一道题的结果并更新该任务的当前准确率"""
+        self.questions.inc(task=task, strategy=strategy)
+        if correct:
+            self.correct.inc(task=task, strategy=strategy)
+        totals = self._task_totals.setdefault(task, [0, 0])
+        totals[0] += int(bool(correct))
+        totals[1] += 1
+        self.accuracy.set(totals[0] / totals[1], task=task)
+
+    def observe_cache(self, cache: str, hit: bool):
+        """记录一次缓存访问"""
+        (self.cache_hits if hit else self.cache_misses).inc(cache=cache)
+
+    def phase(self, phase: str):
+        """记录阶段耗时的上下文管理器"""
+        return self.phase_latency.time(phase=phase)
+
+    def start_exporters(self, file_path: Optional[str] = None, interval: float = 10.0,
+                        port: Optional[int] = None):
+        """启动文件导出和/或HTTP服务"""
+        if file_path:
+            exporter = MetricsFileExporter(self.registry, file_path, interval)
+            exporter.start()
+            self.exporters.append(exporter)
+            print(f"📈 指标每 {exporter.interval:.0f} 秒写入: {file_path}")
+        if port is not None:
+            server = MetricsServer(self.registry, port)
+            server.start()
+            self.exporters.append(server)
+            print(f"📈 指标服务: http://127.0.0.1:{server.port}/metrics")
+
+    def close(self):
+        """停止导出（文件导出会写出最终值）"""
+        for exporter in self.exporters:
+            exporter.stop()
+        self.exporters = []
+
+    @staticmethod
+    def add_arguments(parser):
+        """为命令行添加指标导出参数"""
+        parser.add_argument("--metrics-file", default=None, help="定期写入OpenMetrics文本文件的路径")
+        parser.add_argument("--metrics-interval", type=float, default=10.0, help="指标文件写入间隔（秒）")
+        parser.add_argument("--metrics-port", type=int, default=None, help="在本地端口提供 /metrics")
+
+    @classmethod
+    def from_args(cls, args) -> Optional["RunMetrics"]:
+        """根据命令行参数创建指标并启动导出，未开启时返回None"""
+        if not getattr(args, "metrics_file", None) and getattr(args, "metrics_port", None) is None:
+            return None
+        metrics = cls()
+        metrics.start_exporters(args.metrics_file, args.metrics_interval, args.metrics_port)
+        return metrics
+
+
+def test_metrics():
+    """测试指标注册表和导出格式"""
+    import urllib.request
+
+    metrics = RunMetrics()
+    for correct in [True, False, True, True]:
+        metrics.observe_question("LDO Task", "few_shot", correct)
+    metrics.prefill_tokens.inc(1234, task="LDO Task")
+    metrics.observe_cache("prefix", True)
+    metrics.phase_latency.observe(0.003, phase="generate")
+    metrics.phase_latency.observe(0.2, phase="generate")
+
+    text = metrics.registry.render()
+    assert 'reasoningv_questions_total{task="LDO Task",strategy="few_shot"} 4' in text
+    assert 'reasoningv_task_accuracy{task="LDO Task"} 0.75' in text
+    assert 'reasoningv_phase_latency_seconds_bucket{phase="generate",le="0.005"} 1' in text
+    assert 'reasoningv_phase_latency_seconds_bucket{phase="generate",le="+Inf"} 2' in text
+    assert text.endswith("# EOF\n")
+
+    server = MetricsServer(metrics.registry, port=0)
+    server.start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            assert response.headers["Content-Type"] == OPENMETRICS_CONTENT_TYPE
+            assert response.read().decode("utf-8") == text
+    finally:
+        server.stop()
+    print(text)
+    print("✅ 指标测试通过")
+
+
+if __name__ == "__main__":
+    test_metrics()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+双模型级联 (Two-model Cascade)
+ReasoningV 和 Analogseeker 共用同一套数据加载和提示词构建：
+先由第一个模型对每道题打分，选项概率margin低于阈值的题目交给第二个模型回答；
+内存允许时两个模型同时常驻（逐任务交替打分），否则先跑完第一个模型、释放后再加载第二个。
+报告级联准确率、转交比例和计算量（2 × 参数量 × 预填充token数），并与两个模型都全量运行对比
+"""
+
+import gc
+import glob
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from ReasoningV完整验证测试 import DEFAULT_PARAMS, DEFAULT_PROMPT, ReasoningVFullValidation
+from cascade import (DEFAULT_THRESHOLDS, cascade_curve, letter_probabilities, merge_curves, option_margins,
+                     print_cascade_curve)
+from option_scorer import OptionLetterScorer
+from results_store import normalize_model
+
+# 同时常驻时为激活值和KV缓存预留的内存比例
+MEMORY_HEADROOM = 0.9
+
+TASK_ORDER = ["LDO Task", "Comparator Task", "Bandgap Task", "TQA Task", "Caption Task", "Opamp Task"]
+
+
+def weight_file_bytes(model_path: str) -> int:
+    """模型目录下权重文件的总大小（字节）"""
+    patterns = ("*.safetensors", "*.bin", "*.pt")
+    return sum(os.path.getsize(path) for pattern in patterns
+               for path in glob.glob(os.path.join(model_path, pattern)))
+
+
+def available_memory() -> Optional[int]:
+    """当前设备的可用内存（字节）：GPU取空闲显存，CPU取MemAvailable；无法获取时为None"""
+    if torch.cuda.is_available():
+        return torch.cuda.mem_get_info()[0]
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def flops_per_token(num_parameters: int) -> float:
+    """前向计算每个token的近似浮点运算量"""
+    return 2.0 * num_parameters
+
+
+class ModelCascade:
+    """双模型级联评估器"""
+
+    def __init__(self, primary_path: str, secondary_path: str, primary_name: Optional[str] = None,
+                 secondary_name: Optional[str] = None, batch_size: int = 8, keep_resident: bool = True):
+        """
+        初始化级联评估器
+
+        Args:
+            primary_path / secondary_path: 先回答的模型和接收转交题目的模型
+            primary_name / secondary_name: 报告中的模型名（默认从路径推断）
+            batch_size: 打分批大小
+            keep_resident: 内存允许时两个模型同时常驻
+        """
+        self.names = [primary_name or normalize_model(os.path.basename(os.path.normpath(primary_path))),
+                      secondary_name or normalize_model(os.path.basename(os.path.normpath(secondary_path)))]
+        if self.names[0] == self.names[1]:
+            self.names = [f"{self.names[0]}#1", f"{self.names[1]}#2"]
+        self.models = {
+            name: {"path": path, "model": None, "tokenizer": None, "num_parameters": 0, "resident_bytes": 0}
+            for name, path in zip(self.names, [primary_path, secondary_path])
+        }
+        self.batch_size = batch_size
+        self.keep_resident = keep_resident
+        self.resident = False
+
+        # 共享的数据/提示词流水线（任务目录、数据加载、工作项构建）
+        self.pipeline = ReasoningVFullValidation(primary_path)
+
+        print(f"🔗 双模型级联: {self.names[0]} → {self.names[1]}")
+
+    # ------------------------------------------------------------------ 模型
+
+    def load(self, name: str):
+        """加载模型（GPU上FP16，CPU上FP32，与验证脚本一致）"""
+        entry = self.models[name]
+        if entry["model"] is not None:
+            return
+
+        print(f"\n📥 正在加载 {name}: {entry['path']}")
+        tokenizer = AutoTokenizer.from_pretrained(entry["path"], trust_remote_code=True)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        if torch.cuda.is_available():
+            model_kwargs = {"torch_dtype": torch.float16, "device_map": {"": 0}}
+        else:
+            model_kwargs = {"torch_dtype": torch.float32}
+        model = AutoModelForCausalLM.from_pretrained(entry["path"], low_cpu_mem_usage=True,
+                                                     trust_remote_code=True, **model_kwargs)
+        model.eval()
+
+        entry["model"], entry["tokenizer"] = model, tokenizer
+        entry["num_parameters"] = sum(p.numel() for p in model.parameters())
+        entry["resident_bytes"] = sum(p.numel() * p.element_size() for p in model.parameters())
+        print(f"✅ {name} 加载完成 ({entry['num_parameters'] / 1e6:.1f}M 参数, "
+              f"{entry['resident_bytes'] / 1024 ** 2:.0f}MB)")
+
+    def release(self, name: str):
+        """释放模型占用的内存（分词器保留，用于统计token数）"""
+        entry = self.models[name]
+        entry["model"] = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        print(f"🗑️ 已释放 {name}")
+
+    def fits_together(self) -> bool:
+        """
+        第一个模型加载后判断第二个模型能否同时常驻：
+        按第一个模型 实际占用/权重文件 的比例估计第二个模型的占用，与可用内存（留出余量）比较
+        """
+        primary, secondary = (self.models[name] for name in self.names)
+        available = available_memory()
+        primary_file_bytes = weight_file_bytes(primary["path"])
+        if available is None or primary_file_bytes == 0:
+            return False
+        estimate = weight_file_bytes(secondary["path"]) * primary["resident_bytes"] / primary_file_bytes
+        fits = estimate < available * MEMORY_HEADROOM
+        print(f"   💾 {self.names[1]} 预计占用 {estimate / 1024 ** 2:.0f}MB, 可用 {available / 1024 ** 2:.0f}MB → "
+              f"{'同时常驻' if fits else '依次加载'}")
+        return fits
+
+    # ------------------------------------------------------------------ 数据与打分
+
+    def prepare_task(self, task_name: str) -> Optional[Dict]:
+        """加载任务数据并构建共享的零样本提示词（两个模型使用完全相同的提示词）"""
+        questions = self.pipeline.load_task_data(task_name)
+        if not questions:
+            print(f"❌ 无法加载 {task_name} 数据")
+            return None
+        items = [item for item in self.pipeline.build_work_items(
+            task_name, questions, {"prompt": DEFAULT_PROMPT, "params": DEFAULT_PARAMS}) if item["prompt"] is not None]
+        return {
+            "task_name": task_name,
+            "total_questions": len(questions),
+            "items": items,
+            "valid_letters": [list(questions[item["index"]].get('options', {}).keys()) for item in items],
+            "scores": {}
+        }
+
+    def score(self, name: str, task: Dict, positions: List[int]) -> Dict:
+        """
+        用指定模型为任务中的部分工作项打分
+
+        Returns:
+            {positions, predicted, margin}
+        """
+        entry = self.models[name]
+        prompts = [task["items"][p]["prompt"] for p in positions]
+        if not prompts:
+            return {"positions": [], "predicted": [], "margin": np.zeros(0)}
+        scorer = OptionLetterScorer(entry["model"], entry["tokenizer"], self.batch_size)
+        scores = scorer.score_prompts(prompts)
+        margins = option_margins(letter_probabilities(scores["letter_logits"],
+                                                      [task["valid_letters"][p] for p in positions]))
+        return {"positions": list(positions), "predicted": margins["predicted"], "margin": margins["margin"]}
+
+    def prompt_tokens(self, name: str, task: Dict) -> np.ndarray:
+        """每个工作项在指定模型分词器下的预填充token数（不需要前向）"""
+        tokenizer = self.models[name]["tokenizer"]
+        encoded = tokenizer([item["prompt"] for item in task["items"]])["input_ids"]
+        return np.array([len(ids) for ids in encoded], dtype=np.float64)
+
+    # ------------------------------------------------------------------ 级联
+
+    def run(self, task_names: List[str], threshold: float, sweep: Optional[List[float]] = None) -> Dict[str, Any]:
+        """
+        运行双模型级联
+
+        Args:
+            task_names: 任务列表
+            threshold: 工作阈值（第一个模型margin低于该值的题目转交第二个模型）
+            sweep: 曲线扫描的阈值（默认只扫描不超过工作阈值的点；大于1的阈值表示全部转交，
+                   此时第二个模型会对全部题目打分，得到其单独的准确率）
+
+        Returns:
+            {tasks: {任务: 结果}, overall: 总体结果}
+        """
+        sweep = sorted(set(sweep if sweep is not None else [t for t in DEFAULT_THRESHOLDS if t <= threshold])
+                       | {threshold})
+        bound = max(sweep)
+        primary, secondary = self.names
+        start_time = time.time()
+
+        self.load(primary)
+        self.resident = self.keep_resident and self.fits_together()
+        if self.resident:
+            self.load(secondary)
+
+        tasks = []
+        for task_name in task_names:
+            task = self.prepare_task(task_name)
+            if task is None:
+                continue
+            print(f"\n📊 {task_name}: {len(task['items'])} 题")
+            task["scores"][primary] = self.score(primary, task, list(range(len(task["items"]))))
+            if self.resident:
+                self.score_deferred(task, bound)
+            tasks.append(task)
+
+        if not self.resident:
+            self.release(primary)
+            self.load(secondary)
+            for task in tasks:
+                self.score_deferred(task, bound)
+
+        results = {task["task_name"]: self.summarize_task(task, threshold, sweep) for task in tasks}
+        overall = self.summarize_overall(results, threshold)
+        overall["elapsed_time"] = time.time() - start_time
+        overall["resident"] = self.resident
+        return {"models": self.names, "threshold": threshold, "sweep": sweep, "tasks": results, "overall": overall}
+
+    def score_deferred(self, task: Dict, bound: float):
+        """第二个模型为margin低于扫描上界的题目打分"""
+        margins = task["scores"][self.names[0]]["margin"]
+        deferred = [p for p in range(len(task["items"])) if margins[p] < bound]
+        task["scores"][self.names[1]] = self.score(self.names[1], task, deferred)
+        print(f"   🔀 {task['task_name']}: {len(deferred)}/{len(task['items'])} 题由 {self.names[1]} 打分")
+
+    def summarize_task(self, task: Dict, threshold: float, sweep: List[float]) -> Dict:
+        """单个任务的级联结果、成本-准确率曲线和逐题预测"""
+        primary, secondary = self.names
+        items = task["items"]
+        groundtruth = [item["groundtruth"] for item in items]
+        first = task["scores"][primary]
+        second = dict(zip(task["scores"][secondary]["positions"], task["scores"][secondary]["predicted"]))
+        margins = first["margin"]
+
+        primary_correct = [pred == gt for pred, gt in zip(first["predicted"], groundtruth)]
+        secondary_correct = [second[p] == groundtruth[p] if p in second else None for p in range(len(items))]
+        primary_flops = self.prompt_tokens(primary, task) * flops_per_token(self.models[primary]["num_parameters"])
+        secondary_flops = (self.prompt_tokens(secondary, task)
+                           * flops_per_token(self.models[secondary]["num_parameters"]))
+        both_flops = float(primary_flops.sum() + secondary_flops.sum())
+        total = task["total_questions"]
+
+        curve = cascade_curve(margins, primary_correct, secondary_correct, primary_flops, secondary_flops,
+                              sweep, total, baseline_cost=both_flops)
+        point = next(point for point in curve if point["threshold"] == threshold)
+
+        question_results = []
+        for p, item in enumerate(items):
+            deferred = margins[p] < threshold
+            predicted = second[p] if deferred else first["predicted"][p]
+            question_results.append({
+                "index": item["index"],
+                "groundtruth": item["groundtruth"],
+                "predicted": predicted,
+                "correct": predicted == item["groundtruth"],
+                "strategy": secondary if deferred else primary,
+                "margin": float(margins[p])
+            })
+
+        result = {
+            "total_questions": total,
+            "accuracy": point["accuracy"],
+            "correct_count": int(sum(row["correct"] for row in question_results)),
+            "deferred": point["escalated"],
+            "deferred_fraction": point["escalated_fraction"],
+            "compute_flops": point["cost"],
+            "both_flops": both_flops,
+            "compute_fraction": point["cost_fraction"],
+            f"{primary}_accuracy": sum(primary_correct) / total * 100 if total else 0.0,
+            # 第二个模型只在全部转交时才有完整的单独准确率
+            f"{secondary}_accuracy": (sum(bool(c) for c in secondary_correct) / total * 100
+                                      if total and len(second) == len(items) else None),
+            "curve": curve,
+            "question_results": question_results
+        }
+        print(f"\n   ✅ {task['task_name']}: 级联准确率 {result['accuracy']:.2f}%, "
+              f"转交 {result['deferred']}/{len(items)} ({result['deferred_fraction'] * 100:.1f}%), "
+              f"计算量为两模型全量的 {result['compute_fraction'] * 100:.1f}%")
+        return result
+
+    def summarize_overall(self, results: Dict[str, Dict], threshold: float) -> Dict:
+        """各任务合并的总体结果"""
+        names = list(results)
+        totals = [results[name]["total_questions"] for name in names]
+        both = [results[name]["both_flops"] for name in names]
+        curve = merge_curves([results[name]["curve"] for name in names], totals, both)
+        point = next((point for point in curve if point["threshold"] == threshold), None)
+        overall = {
+            "total_questions": sum(totals),
+            "total_correct": sum(results[name]["correct_count"] for name in names),
+            "both_flops": sum(both),
+            "curve": curve
+        }
+        if point is not None:
+            overall.update({"accuracy": point["accuracy"], "deferred": point["escalated"],
+                            "deferred_fraction": point["escalated_fraction"], "compute_flops": point["cost"],
+                            "compute_fraction": point["cost_fraction"]})
+        for model in self.names:
+            accuracies = [results[name][f"{model}_accuracy"] for name in names]
+            overall[f"{model}_accuracy"] = (sum(a * n for a, n in zip(accuracies, totals)) / sum(totals)
+                                            if sum(totals) and None not in accuracies else None)
+        return overall
+
+
+def print_cascade_report(output: Dict):
+    """打印级联报告"""
+    primary, secondary = output["models"]
+    print(f"\n{'=' * 80}")
+    print(f"🔗 双模型级联报告: {primary} → {secondary} (阈值 {output['threshold']:.2f})")
+    print(f"{'=' * 80}")
+    print(f"{'任务':<18}{'级联':>9}{primary:>14}{secondary:>14}{'转交比例':>10}{'相对计算量':>10}")
+    for task_name, result in list(output["tasks"].items()) + [("总体", output["overall"])]:
+        single = [result.get(f"{model}_accuracy") for model in output["models"]]
+        single_text = "".join(f"{a:>13.2f}%" if a is not None else f"{'-':>14}" for a in single)
+        print(f"{task_name:<18}{result.get('accuracy', 0.0):>8.2f}%{single_text}"
+              f"{result.get('deferred_fraction', 0.0) * 100:>9.1f}%{result.get('compute_fraction', 0.0) * 100:>9.1f}%")
+    print(f"\n两模型全量计算量: {output['overall']['both_flops'] / 1e12:.3f} TFLOPs, "
+          f"级联: {output['overall'].get('compute_flops', 0.0) / 1e12:.3f} TFLOPs "
+          f"({'同时常驻' if output['overall']['resident'] else '依次加载'})")
+    print(f"\n🪜 总体成本-准确率曲线（成本为FLOPs，相对计算量以两模型全量为基准）:")
+    print_cascade_curve(output["overall"]["curve"], cost_unit="FLOPs")
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ReasoningV / Analogseeker 双模型级联评估")
+    parser.add_argument("primary_path", help="先回答的模型路径")
+    parser.add_argument("secondary_path", help="接收低置信度题目的模型路径")
+    parser.add_argument("--primary-name", default=None, help="第一个模型的名称（默认从路径推断）")
+    parser.add_argument("--secondary-name", default=None, help="第二个模型的名称（默认从路径推断）")
+    parser.add_argument("--threshold", type=float, default=0.2, help="转交阈值（第一个模型的选项概率margin）")
+    parser.add_argument("--sweep", default=None,
+                        help="曲线扫描的阈值（逗号分隔，如0,0.1,0.2,0.5,1.01；1.01表示全部转交）")
+    parser.add_argument("--tasks", default=None, help="任务列表（逗号分隔，默认全部任务）")
+    parser.add_argument("--batch-size", type=int, default=8, help="打分批大小")
+    parser.add_argument("--sequential", action="store_true", help="不同时常驻，先跑完第一个模型再加载第二个")
+    parser.add_argument("--output", default="model_cascade_results.json", help="结果文件")
+    args = parser.parse_args()
+
+    cascade = ModelCascade(args.primary_path, args.secondary_path, args.primary_name, args.secondary_name,
+                           batch_size=args.batch_size, keep_resident=not args.sequential)
+    tasks = args.tasks.split(",") if args.tasks else [t for t in TASK_ORDER if t in cascade.pipeline.tasks]
+    sweep = [float(t) for t in args.sweep.split(",")] if args.sweep else None
+    output = cascade.run(tasks, args.threshold, sweep)
+    print_cascade_report(output)
+
+    output["timestamp"] = time.strftime('%Y-%m-%d %H:%M:%S')
+    output["model_paths"] = [args.primary_path, args.secondary_path]
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 结果已保存到: {args.output}")
+    return output
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ONNX导出与ONNX Runtime打分 (ONNX Export & Scoring)
+把因果语言模型的前向导出为只输出最后位置选项字母logits的ONNX图（batch和序列长度为动态维度），
+在纯CPU机器上用ONNX Runtime代替PyTorch打分；附带与PyTorch CPU（generate_answer为参考实现）的
+速度对比和答案一致性检查
+"""
+
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+from option_scorer import OPTION_LETTERS, OptionLetterScorer, extract_option
+from prompt_cache import model_fingerprint
+
+DEFAULT_OPSET = 17
+INPUT_NAMES = ["input_ids", "attention_mask"]
+OUTPUT_NAMES = ["letter_logits", "top_token_id"]
+
+
+class LetterLogitsHead(torch.nn.Module):
+    """
+    导出用的前向：解码器隐藏状态只取每行最后一个有效位置过lm_head（不计算 [B, T, V] 的整段logits），
+    输出各选项字母的logits [B, 5] 和整词表argmax token [B]（后者用于复现generate_answer的贪心解析）
+    """
+
+    def __init__(self, model, letter_token_ids: Sequence[Sequence[int]]):
+        super().__init__()
+        self.decoder = model.get_decoder()
+        self.lm_head = model.get_output_embeddings()
+        self.letter_token_ids = [list(ids) for ids in letter_token_ids]
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor):
+        hidden = self.decoder(input_ids=input_ids, attention_mask=attention_mask, use_cache=False).last_hidden_state
+        # 右填充：最后一个有效位置为 有效长度-1
+        last = attention_mask.sum(dim=1) - 1
+        logits = self.lm_head(hidden[torch.arange(hidden.shape[0]), last]).float()
+        columns = []
+        for ids in self.letter_token_ids:
+            if ids:
+                columns.append(logits[:, ids].max(dim=-1).values)
+            else:
+                columns.append(torch.full_like(logits[:, 0], float("-inf")))
+        return torch.stack(columns, dim=-1), logits.argmax(dim=-1)
+
+
+def meta_path(onnx_path: str) -> str:
+    """导出元数据文件（与.onnx同名的.json）"""
+    return os.path.splitext(onnx_path)[0] + ".json"
+
+
+def export_letter_head(model_path: str, onnx_path: str, opset: int = DEFAULT_OPSET) -> Dict:
+    """
+    导出选项字母logits图（FP32，eager注意力便于追踪；超过2GB的权重由导出器写为外部数据）
+
+    Returns:
+        导出元数据 {model_path, fingerprint, letters, letter_token_ids, opset, vocab_size, export_time}
+    """
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32, trust_remote_code=True,
+                                                 attn_implementation="eager").eval()
+    letter_token_ids = OptionLetterScorer(model, tokenizer).letter_token_ids
+    head = LetterLogitsHead(model, letter_token_ids).eval()
+
+    # 追踪用的输入：两行、第二行带右填充，避免把batch或长度固化为常数
+    dummy_ids = torch.arange(16, dtype=torch.long).reshape(2, 8) % len(tokenizer)
+    dummy_mask = torch.ones_like(dummy_ids)
+    dummy_mask[1, 6:] = 0
+
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    start = time.time()
+    with torch.no_grad():
+        torch.onnx.export(
+            head, (dummy_ids, dummy_mask), onnx_path,
+            input_names=INPUT_NAMES,
+            output_names=OUTPUT_NAMES,
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "letter_logits": {0: "batch"},
+                "top_token_id": {0: "batch"}
+            },
+            opset_version=opset,
+            dynamo=False
+        )
+    meta = {
+        "model_path": model_path,
+        "fingerprint": model_fingerprint(model_path),
+        "letters": OPTION_LETTERS,
+        "letter_token_ids": letter_token_ids,
+        "opset": opset,
+        "vocab_size": int(head.lm_head.weight.shape[0]),
+        "export_time": time.time() - start
+    }
+    with open(meta_path(onnx_path), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+class OnnxLetterScorer:
+    """ONNX Runtime选项字母打分器（接口与OptionLetterScorer.score_prompts / decode_greedy一致）"""
+
+    def __init__(self, onnx_path: str, tokenizer, batch_size: int = 8, num_threads: Optional[int] = None):
+        """
+        Args:
+            onnx_path: export_letter_head导出的模型文件
+            tokenizer: 导出时模型对应的tokenizer
+            batch_size: 默认批大小
+            num_threads: ONNX Runtime算子内线程数（None表示默认）
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.onnx_path = onnx_path
+        self.tokenizer = tokenizer
+        self.batch_size = max(1, batch_size)
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.meta = {}
+        if os.path.exists(meta_path(onnx_path)):
+            with open(meta_path(onnx_path), 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+
+    @classmethod
+    def for_model(cls, model_path: str, onnx_path: str, tokenizer, batch_size: int = 8,
+                  num_threads: Optional[int] = None) -> "OnnxLetterScorer":
+        """加载导出的图；文件不存在或模型配置已变化（指纹不一致）时先重新导出"""
+        stale = True
+        if os.path.exists(onnx_path) and os.path.exists(meta_path(onnx_path)):
+            with open(meta_path(onnx_path), 'r', encoding='utf-8') as f:
+                stale = json.load(f).get("fingerprint") != model_fingerprint(model_path)
+        if stale:
+            print(f"📦 导出ONNX选项字母图: {model_path} -> {onnx_path}")
+            meta = export_letter_head(model_path, onnx_path)
+            print(f"✅ 导出完成（{meta['export_time']:.1f}秒）")
+        return cls(onnx_path, tokenizer, batch_size, num_threads)
+
+    def score_prompts(self, prompts: Sequence[str], batch_size: Optional[int] = None) -> Dict:
+        """
+        批量打分（右填充，按输入顺序切批）
+
+        Returns:
+            {letter_logits: [N, 5] float32, top_token_ids: [N] int64, prompt_tokens: 预填充token总数}
+        """
+        batch_size = batch_size or self.batch_size
+        encoded = self.tokenizer(list(prompts))["input_ids"]
+        letter_chunks, top_chunks = [], []
+        for start in range(0, len(encoded), batch_size):
+            rows = encoded[start:start + batch_size]
+            width = max(len(ids) for ids in rows)
+            input_ids = np.full((len(rows), width), self.pad_token_id, dtype=np.int64)
+            attention_mask = np.zeros((len(rows), width), dtype=np.int64)
+            for row, ids in enumerate(rows):
+                input_ids[row, :len(ids)] = ids
+                attention_mask[row, :len(ids)] = 1
+            letter_logits, top_token_id = self.session.run(
+                OUTPUT_NAMES, {"input_ids": input_ids, "attention_mask": attention_mask})
+            letter_chunks.append(letter_logits)
+            top_chunks.append(top_token_id)
+        return {
+            "letter_logits": (np.concatenate(letter_chunks) if letter_chunks
+                              else np.empty((0, len(OPTION_LETTERS)), dtype=np.float32)),
+            "top_token_ids": np.concatenate(top_chunks) if top_chunks else np.empty(0, dtype=np.int64),
+            "prompt_tokens": sum(len(ids) for ids in encoded)
+        }
+
+    def decode_greedy(self, top_token_ids: Sequence[int],
+                      parse: Callable[[str], str] = extract_option) -> List[str]:
+        """把整词表argmax token解码为答案（等价于max_new_tokens=1的贪心生成）"""
+        return [parse(self.tokenizer.decode([int(token_id)], skip_special_tokens=True).strip())
+                for token_id in top_token_ids]
+
+
+def compare_with_pytorch(validator, scorer: OnnxLetterScorer, prompts: Sequence[str],
+                         params: Dict, batch_size: int = 8) -> Dict:
+    """
+    同一批提示词上对比三条路径：generate_answer逐题生成（参考实现）、PyTorch批量前向、ONNX Runtime批量打分
+
+    Args:
+        validator: 已加载CPU模型的ReasoningVFullValidation
+        params: 单token贪心生成参数（与导出的图等价的配置）
+
+    Returns:
+        {questions, reference/pytorch/onnx 的每题耗时, 加速比, 答案一致率, 不一致的题目, 字母logits最大差}
+    """
+    order = sorted(range(len(prompts)), key=lambda i: len(prompts[i]))
+    ordered = [prompts[i] for i in order]
+
+    start = time.perf_counter()
+    reference = [validator.generate_answer(prompt, params)[0] for prompt in ordered]
+    reference_time = time.perf_counter() - start
+
+    torch_scorer = OptionLetterScorer(validator.model, validator.tokenizer, batch_size)
+    start = time.perf_counter()
+    torch_scores = torch_scorer.score_prompts(ordered)
+    torch_answers = torch_scorer.decode_greedy(torch_scores["top_token_ids"])
+    torch_time = time.perf_counter() - start
+
+    scorer.score_prompts(ordered[:batch_size], batch_size)  # 预热（首次运行的图优化/内存分配）
+    start = time.perf_counter()
+    onnx_scores = scorer.score_prompts(ordered, batch_size)
+    onnx_answers = scorer.decode_greedy(onnx_scores["top_token_ids"])
+    onnx_time = time.perf_counter() - start
+
+    total = len(ordered)
+    mismatches = [order[p] for p in range(total) if onnx_answers[p] != reference[p]]
+    difference = np.abs(onnx_scores["letter_logits"] - torch_scores["letter_logits"].numpy())
+    finite = np.isfinite(difference)
+    return {
+        "questions": total,
+        "batch_size": batch_size,
+        "reference_time": reference_time / total if total else 0.0,
+        "pytorch_time": torch_time / total if total else 0.0,
+        "onnx_time": onnx_time / total if total else 0.0,
+        "speedup_vs_reference": reference_time / onnx_time if onnx_time else None,
+        "speedup_vs_pytorch": torch_time / onnx_time if onnx_time else None,
+        "agreement": (total - len(mismatches)) / total * 100 if total else 100.0,
+        "pytorch_agreement": sum(a == b for a, b in zip(torch_answers, reference)) / total * 100 if total else 100.0,
+        "mismatches": mismatches,
+        "max_logit_diff": float(difference[finite].max()) if finite.any() else 0.0
+    }
+
+
+def print_comparison(stats: Dict):
+    """打印对比结果"""
+    print(f"\n⚖️ ONNX Runtime vs PyTorch CPU（{stats['questions']} 题, 批大小 {stats['batch_size']}）")
+    print(f"   generate_answer逐题: {stats['reference_time'] * 1000:8.2f} ms/题（参考实现）")
+    print(f"   PyTorch批量前向:     {stats['pytorch_time'] * 1000:8.2f} ms/题（答案一致率 {stats['pytorch_agreement']:.1f}%）")
+    print(f"   ONNX Runtime批量:    {stats['onnx_time'] * 1000:8.2f} ms/题（答案一致率 {stats['agreement']:.1f}%）")
+    print(f"   加速: 相对参考实现 {stats['speedup_vs_reference']:.1f}x, 相对PyTorch批量 {stats['speedup_vs_pytorch']:.1f}x, "
+          f"字母logits最大差 {stats['max_logit_diff']:.2e}")
+    if stats["mismatches"]:
+        print(f"   ⚠️ 与generate_answer不一致的题目: {stats['mismatches'][:20]}")
+
+
+def load_cpu_validator(model_path: str):
+    """创建验证器并在CPU上以FP32加载模型（有GPU时也不使用，作为PyTorch CPU基线）"""
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from ReasoningV完整验证测试 import ReasoningVFullValidation
+
+    validator = ReasoningVFullValidation(model_path)
+    validator.device = "cpu"
+    validator.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+    if validator.tokenizer.pad_token is None:
+        validator.tokenizer.pad_token = validator.tokenizer.eos_token
+    validator.model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32,
+                                                           trust_remote_code=True).eval()
+    return validator
+
+
+def load_task_prompts(validator, task_name: str, max_questions: Optional[int] = None) -> List[str]:
+    """按验证脚本的配置构建任务的提示词（Few-shot任务用固定种子选择示例），只保留单token贪心的工作项"""
+    questions = validator.load_task_data(task_name)[:max_questions]
+    config = validator.optimized_configs.get(task_name, {})
+    examples = None
+    if config.get('use_few_shot', False):
+        examples = validator.load_few_shot_examples(task_name, config.get('num_examples', 2), seed=f"0:{task_name}:0")
+    items = validator.build_work_items(task_name, questions, config, examples)
+    return [item["prompt"] for item in items if item["prompt"] is not None
+            and not item["params"].get("do_sample", False) and item["params"].get("max_new_tokens", 1) == 1]
+
+
+def test_onnx_export():
+    """测试导出：随机权重小模型上ONNX与generate_answer答案完全一致，不同batch/长度下logits与PyTorch一致"""
+    import tempfile
+    from benchmark_suite import build_tiny_model
+    from synthetic_data import SyntheticTaskGenerator
+    from ReasoningV完整验证测试 import DEFAULT_PARAMS, DEFAULT_PROMPT
+
+    torch.manual_seed(0)
+    with tempfile.TemporaryDirectory() as root:
+        model_path = build_tiny_model(os.path.join(root, "tiny_model"))
+        onnx_path = os.path.join(root, "onnx", "letter_head.onnx")
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            validator = load_cpu_validator(model_path)
+        finally:
+            os.chdir(cwd)
+        scorer = OnnxLetterScorer.for_model(model_path, onnx_path, validator.tokenizer, batch_size=5)
+        assert scorer.meta["fingerprint"] == model_fingerprint(model_path)
+
+        questions = SyntheticTaskGenerator(seed=0).generate(24)
+        prompts = [validator.build_prompt(DEFAULT_PROMPT, q["question"], q["options"]) for q in questions]
+        stats = compare_with_pytorch(validator, scorer, prompts, DEFAULT_PARAMS, batch_size=5)
+        assert stats["agreement"] == 100.0, stats
+        assert stats["max_logit_diff"] < 1e-3, stats
+        single = scorer.score_prompts(prompts[:1], batch_size=1)
+        assert np.allclose(single["letter_logits"][0], scorer.score_prompts(prompts[:7], 7)["letter_logits"][0],
+                           atol=1e-4)
+        # 已导出且模型未变时直接加载
+        assert OnnxLetterScorer.for_model(model_path, onnx_path, validator.tokenizer).meta == scorer.meta
+    print(f"✅ ONNX导出测试通过（{stats['questions']} 题答案一致, logits最大差 {stats['max_logit_diff']:.1e}, "
+          f"ONNX {stats['onnx_time'] * 1000:.2f} ms/题 vs generate_answer {stats['reference_time'] * 1000:.2f} ms/题）")
+
+
+def main():
+    """命令行入口：导出、基准对比或自检"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="导出选项字母logits的ONNX图，并与PyTorch CPU对比速度和答案")
+    subparsers = parser.add_subparsers(dest="command")
+    export_parser = subparsers.add_parser("export", help="导出ONNX图")
+    export_parser.add_argument("model_path", help="模型路径")
+    export_parser.add_argument("--output", default="results/onnx/letter_head.onnx", help="输出文件")
+    export_parser.add_argument("--opset", type=int, default=DEFAULT_OPSET, help="ONNX opset版本")
+
+    bench_parser = subparsers.add_parser("benchmark", help="在验证任务的题目上对比ONNX Runtime与PyTorch CPU")
+    bench_parser.add_argument("model_path", help="模型路径")
+    bench_parser.add_argument("--onnx", default="results/onnx/letter_head.onnx", help="ONNX文件（不存在或过期时导出）")
+    bench_parser.add_argument("--task", default="TQA Task", help="任务名")
+    bench_parser.add_argument("--max-questions", type=int, default=100, help="最多对比的题目数")
+    bench_parser.add_argument("--batch-size", type=int, default=8, help="批大小")
+    bench_parser.add_argument("--threads", type=int, default=None, help="PyTorch/ONNX Runtime线程数")
+    bench_parser.add_argument("--output", default=None, help="对比结果JSON")
+    subparsers.add_parser("test", help="运行自检")
+    args = parser.parse_args()
+
+    if args.command in (None, "test"):
+        test_onnx_export()
+        return
+    if args.command == "export":
+        meta = export_letter_head(args.model_path, args.output, args.opset)
+        print(f"✅ 已导出 {args.output}（{meta['export_time']:.1f}秒, opset {meta['opset']}）")
+        return
+
+    from ReasoningV完整验证测试 import DEFAULT_PARAMS
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    validator = load_cpu_validator(args.model_path)
+    prompts = load_task_prompts(validator, args.task, args.max_questions)
+    scorer = OnnxLetterScorer.for_model(args.model_path, args.onnx, validator.tokenizer, args.batch_size, args.threads)
+    stats = compare_with_pytorch(validator, scorer, prompts, DEFAULT_PARAMS, args.batch_size)
+    stats["task"] = args.task
+    print_comparison(stats)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, ensure_ascii=False, indent=2)
+        print(f"💾 对比结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
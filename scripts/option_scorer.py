@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+选项字母打分器 (Option Letter Scorer)
+一次前向计算批量提示词在最后位置上各选项字母（A-E）的logits，
+替代逐题generate，用于批量实验和置信度分析
+"""
+
+import os
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import torch
+from transformers import (DynamicCache, LogitsProcessor, LogitsProcessorList, StoppingCriteria,
+                          StoppingCriteriaList, TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper)
+
+OPTION_LETTERS = ["A", "B", "C", "D", "E"]
+
+
+def extract_option(answer_part: str, default: str = "A") -> str:
+    """从生成文本中提取选项字母（与验证脚本generate_answer的解析规则一致）"""
+    for option in OPTION_LETTERS:
+        if option in answer_part:
+            return option
+    return default
+
+
+def _cache_tensors(cache) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """把模型返回的KV缓存转换为每层 (key, value) 张量列表"""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, "to_legacy_cache"):
+        cache = cache.to_legacy_cache()
+    return [(kv[0], kv[1]) for kv in cache]
+
+
+def _build_cache(kv: Sequence[Tuple[torch.Tensor, torch.Tensor]], batch_size: int = 1):
+    """由每层 (key, value) 张量构造DynamicCache，按批大小扩展（expand不复制显存）"""
+    expanded = tuple(
+        (k.expand(batch_size, -1, -1, -1), v.expand(batch_size, -1, -1, -1)) for k, v in kv
+    )
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(expanded)
+    return DynamicCache(expanded)
+
+
+class OptionLetterLogitsProcessor(LogitsProcessor):
+    """约束解码：词表限制为选项字母和空白token，最后一步只允许选项字母"""
+
+    def __init__(self, letter_token_ids: Sequence[int], whitespace_token_ids: Sequence[int],
+                 prompt_length: int, max_new_tokens: int):
+        self.letter_token_ids = list(letter_token_ids)
+        self.allowed_token_ids = list(letter_token_ids) + list(whitespace_token_ids)
+        self.prompt_length = prompt_length
+        self.max_new_tokens = max_new_tokens
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        last_step = input_ids.shape[1] - self.prompt_length >= self.max_new_tokens - 1
+        allowed = self.letter_token_ids if last_step else self.allowed_token_ids
+        mask = torch.full_like(scores, float("-inf"))
+        mask[:, allowed] = 0
+        return scores + mask
+
+
+class OptionLetterStoppingCriteria(StoppingCriteria):
+    """提前停止：某一行生成出选项字母后即结束该行"""
+
+    def __init__(self, letter_token_ids: Sequence[int], prompt_length: int):
+        self.letter_token_ids = torch.tensor(sorted(set(letter_token_ids)), dtype=torch.long)
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if input_ids.shape[1] <= self.prompt_length:
+            return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        generated = input_ids[:, self.prompt_length:]
+        return torch.isin(generated, self.letter_token_ids.to(input_ids.device)).any(dim=-1)
+
+
+class OptionLetterScorer:
+    """选项字母打分器 - 右填充批量前向，取每行最后一个有效token位置的字母logits"""
+
+    def __init__(self, model, tokenizer, batch_size: int = 8):
+        """
+        初始化打分器
+
+        Args:
+            model: 已加载的因果语言模型
+            tokenizer: 对应的tokenizer
+            batch_size: 默认批大小
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.batch_size = max(1, batch_size)
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.letter_token_ids = self._build_letter_token_ids()
+        self.whitespace_token_ids = None
+
+    def _build_letter_token_ids(self) -> List[List[int]]:
+        """每个选项字母对应的候选token（"A" 和 " A" 两种写法）"""
+        letter_ids = []
+        for letter in OPTION_LETTERS:
+            ids = set()
+            for variant in (letter, " " + letter):
+                encoded = self.tokenizer.encode(variant, add_special_tokens=False)
+                if encoded and self.tokenizer.decode(encoded[-1:]).strip() == letter:
+                    ids.add(encoded[-1])
+            letter_ids.append(sorted(ids))
+        return letter_ids
+
+    @property
+    def flat_letter_token_ids(self) -> List[int]:
+        """所有选项字母token"""
+        return sorted({token_id for ids in self.letter_token_ids for token_id in ids})
+
+    def _build_whitespace_token_ids(self) -> List[int]:
+        """常见空白token（空格、换行、制表符）"""
+        ids = set()
+        for text in (" ", "  ", "\n", "\n\n", "\t", " \n"):
+            for token_id in self.tokenizer.encode(text, add_special_tokens=False):
+                if not self.tokenizer.decode([token_id]).strip():
+                    ids.add(token_id)
+        return sorted(ids)
+
+    def build_letter_constraints(self, prompt_length: int, max_new_tokens: int):
+        """
+        构造约束解码组件
+
+        Args:
+            prompt_length: 输入（左填充后）的长度
+            max_new_tokens: 最大生成token数
+
+        Returns:
+            (LogitsProcessorList, StoppingCriteriaList)
+        """
+        if self.whitespace_token_ids is None:
+            self.whitespace_token_ids = self._build_whitespace_token_ids()
+        letters = self.flat_letter_token_ids
+        processors = LogitsProcessorList([
+            OptionLetterLogitsProcessor(letters, self.whitespace_token_ids, prompt_length, max_new_tokens)
+        ])
+        stopping = StoppingCriteriaList([OptionLetterStoppingCriteria(letters, prompt_length)])
+        return processors, stopping
+
+    @property
+    def device(self):
+        return next(self.model.parameters()).device
+
+    def letter_logits(self, logits: torch.Tensor) -> torch.Tensor:
+        """从整词表logits [B, V] 中取各字母的logits [B, 5]（多个候选token取最大值）"""
+        columns = []
+        for ids in self.letter_token_ids:
+            if ids:
+                columns.append(logits[:, ids].max(dim=-1).values)
+            else:
+                columns.append(torch.full_like(logits[:, 0], float("-inf")))
+        return torch.stack(columns, dim=-1)
+
+    def _pad_right(self, sequences: Sequence[Sequence[int]]):
+        """右填充到相同长度，返回 (input_ids, attention_mask, lengths)"""
+        lengths = torch.tensor([len(seq) for seq in sequences], dtype=torch.long)
+        max_len = int(lengths.max())
+        input_ids = torch.full((len(sequences), max_len), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(sequences), max_len), dtype=torch.long)
+        for row, seq in enumerate(sequences):
+            input_ids[row, :len(seq)] = torch.tensor(seq, dtype=torch.long)
+            attention_mask[row, :len(seq)] = 1
+        return input_ids, attention_mask, lengths
+
+    def score_prompts(self, prompts: Sequence[str], batch_size: Optional[int] = None) -> Dict:
+        """
+        批量打分（按输入顺序切批，调用方负责把需要共批的提示词排在一起）
+
+        Args:
+            prompts: 完整提示词列表
+            batch_size: 批大小，默认使用初始化时的设置
+
+        Returns:
+            {letter_logits: [N, 5] float32, top_token_ids: [N], prompt_tokens: 预填充token总数}
+        """
+        batch_size = batch_size or self.batch_size
+        encoded = self.tokenizer(list(prompts))["input_ids"]
+        device = self.device
+
+        letter_chunks = []
+        top_chunks = []
+        for start in range(0, len(encoded), batch_size):
+            input_ids, attention_mask, lengths = self._pad_right(encoded[start:start + batch_size])
+            with torch.no_grad():
+                outputs = self.model(
+                    input_ids=input_ids.to(device),
+                    attention_mask=attention_mask.to(device),
+                    use_cache=False
+                )
+            last = outputs.logits[torch.arange(len(lengths)), (lengths - 1).to(device)].float()
+            letter_chunks.append(self.letter_logits(last).cpu())
+            top_chunks.append(last.argmax(dim=-1).cpu())
+
+        return {
+            "letter_logits": torch.cat(letter_chunks) if letter_chunks else torch.empty(0, len(OPTION_LETTERS)),
+            "top_token_ids": torch.cat(top_chunks) if top_chunks else torch.empty(0, dtype=torch.long),
+            "prompt_tokens": sum(len(ids) for ids in encoded)
+        }
+
+    def prefill_ids(self, input_ids: Sequence[int], parent: Optional[Dict] = None) -> Dict:
+        """
+        按token预填充共享前缀并保留其KV缓存；前缀在token层面给出（整条提示词分词后取公共token前缀），
+        避免文本切分后分别分词时BPE跨边界合并导致的token不一致
+
+        Args:
+            input_ids: 前缀token
+            parent: 已预填充的前缀状态；与input_ids的公共token前缀部分直接复用其KV，只计算其余部分
+                    （如few_shot_1/2/3的示例前缀逐层嵌套）
+
+        Returns:
+            前缀状态 {input_ids, kv, length, computed_tokens}
+        """
+        input_ids = list(input_ids)
+        offset = len(os.path.commonprefix([parent["input_ids"], input_ids])) if parent is not None else 0
+        past = None
+        if offset > 0:
+            kv = parent["kv"] if offset == parent["length"] else [(k[..., :offset, :], v[..., :offset, :])
+                                                                  for k, v in parent["kv"]]
+            if offset == len(input_ids):
+                return {"input_ids": input_ids, "kv": kv, "length": offset, "computed_tokens": 0}
+            past = _build_cache(kv)
+        delta_ids = input_ids[offset:]
+
+        device = self.device
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=torch.tensor([delta_ids], device=device),
+                attention_mask=torch.ones((1, len(input_ids)), dtype=torch.long, device=device),
+                position_ids=torch.arange(offset, len(input_ids), device=device).unsqueeze(0),
+                past_key_values=past,
+                use_cache=True
+            )
+
+        return {
+            "input_ids": input_ids,
+            "kv": _cache_tensors(outputs.past_key_values),
+            "length": len(input_ids),
+            "computed_tokens": len(delta_ids)
+        }
+
+    def score_with_prefixes(self, prefix_states: Sequence[Dict], rows: Sequence[Tuple[int, Sequence[int]]],
+                            batch_size: Optional[int] = None) -> Dict:
+        """
+        不同前缀的行混合成批打分：各前缀KV左填充到相同长度后按行拼接，填充位置用attention_mask屏蔽，
+        position_ids从各自的前缀长度开始（前缀只需各预填充一次，同一道题的多个前缀变体可放在同一批）；
+        共享的只有{question}之前的部分，如Few-shot示例和指令，题目和选项token在每行单独计算
+
+        Args:
+            prefix_states: 前缀状态列表（prefill_ids的返回值）
+            rows: [(前缀序号, 后缀token)]，按顺序切批，调用方负责把需要共批的行排在一起
+
+        Returns:
+            同score_prompts，prompt_tokens只统计实际计算的后缀token
+        """
+        batch_size = batch_size or self.batch_size
+        device = self.device
+        max_prefix = max(state["length"] for state in prefix_states)
+        # 每层 [前缀数, heads, max_prefix, dim]，短前缀在左侧补零
+        padded = []
+        for layer in range(len(prefix_states[0]["kv"])):
+            keys, values = [], []
+            for state in prefix_states:
+                k, v = state["kv"][layer]
+                pad = max_prefix - state["length"]
+                keys.append(torch.nn.functional.pad(k, (0, 0, pad, 0)))
+                values.append(torch.nn.functional.pad(v, (0, 0, pad, 0)))
+            padded.append((torch.cat(keys), torch.cat(values)))
+        prefix_lengths = torch.tensor([state["length"] for state in prefix_states], dtype=torch.long)
+
+        letter_chunks = []
+        top_chunks = []
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            owners = torch.tensor([owner for owner, _ in chunk], dtype=torch.long)
+            input_ids, suffix_mask, lengths = self._pad_right([suffix for _, suffix in chunk])
+            count, width = input_ids.shape
+            own_lengths = prefix_lengths[owners]
+            prefix_mask = (torch.arange(max_prefix).unsqueeze(0) >= (max_prefix - own_lengths).unsqueeze(1)).long()
+            position_ids = own_lengths.unsqueeze(1) + torch.arange(width).unsqueeze(0)
+            kv = [(k[owners.to(k.device)], v[owners.to(v.device)]) for k, v in padded]
+            with torch.no_grad():
+                outputs = self.model(
+                    input_ids=input_ids.to(device),
+                    attention_mask=torch.cat([prefix_mask, suffix_mask], dim=1).to(device),
+                    position_ids=position_ids.to(device),
+                    past_key_values=_build_cache(kv, count),
+                    use_cache=True
+                )
+            last = outputs.logits[torch.arange(count), (lengths - 1).to(device)].float()
+            letter_chunks.append(self.letter_logits(last).cpu())
+            top_chunks.append(last.argmax(dim=-1).cpu())
+
+        return {
+            "letter_logits": torch.cat(letter_chunks) if letter_chunks else torch.empty(0, len(OPTION_LETTERS)),
+            "top_token_ids": torch.cat(top_chunks) if top_chunks else torch.empty(0, dtype=torch.long),
+            "prompt_tokens": sum(len(suffix) for _, suffix in rows)
+        }
+
+    @staticmethod
+    def build_warpers(params: Dict) -> LogitsProcessorList:
+        """根据生成参数构造采样用的logits变换（temperature / top_k / top_p）"""
+        warpers = LogitsProcessorList()
+        temperature = params.get("temperature", 1.0)
+        if temperature and temperature != 1.0:
+            warpers.append(TemperatureLogitsWarper(temperature))
+        if params.get("top_k"):
+            warpers.append(TopKLogitsWarper(top_k=params["top_k"]))
+        if params.get("top_p", 1.0) < 1.0:
+            warpers.append(TopPLogitsWarper(top_p=params["top_p"]))
+        return warpers
+
+    def sample(self, prompts: Sequence[str], params: Dict, num_samples: int,
+               batch_size: Optional[int] = None, seed: Optional[int] = None,
+               constrained: bool = False) -> Dict:
+        """
+        每个提示词采样num_samples次：提示词只预填充一次，KV缓存按样本数复制后逐token采样
+
+        Args:
+            prompts: 提示词列表
+            params: 生成参数（max_new_tokens / temperature / top_k / top_p）
+            num_samples: 每个提示词的采样次数
+            batch_size: 每批的提示词数（实际批大小为 batch_size × num_samples）
+            seed: 随机种子
+            constrained: 是否使用约束解码（只允许选项字母/空白，生成字母后该行停止）
+
+        Returns:
+            {samples: 每个提示词的生成文本列表, prompt_tokens, decode_steps, max_decode_steps}
+            decode_steps为各行实际解码步数之和，max_decode_steps为不提前停止时的步数上限
+        """
+        batch_size = batch_size or self.batch_size
+        max_new_tokens = params.get("max_new_tokens", 1)
+        warpers = self.build_warpers(params)
+        eos_token_id = self.tokenizer.eos_token_id
+        encoded = self.tokenizer(list(prompts))["input_ids"]
+        device = self.device
+        if seed is not None:
+            torch.manual_seed(seed)
+
+        letter_ids = torch.tensor(self.flat_letter_token_ids, dtype=torch.long, device=device)
+        samples = []
+        decode_steps = 0
+        max_decode_steps = 0
+        for start in range(0, len(encoded), batch_size):
+            input_ids, attention_mask, lengths = self._pad_right(encoded[start:start + batch_size])
+            input_ids, attention_mask = input_ids.to(device), attention_mask.to(device)
+            rows = input_ids.shape[0] * num_samples
+            with torch.no_grad():
+                outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, use_cache=True)
+            logits = outputs.logits[torch.arange(len(lengths)), (lengths - 1).to(device)].float()
+
+            # 预填充结果按样本数展开：[B, ...] -> [B * num_samples, ...]
+            logits = logits.repeat_interleave(num_samples, dim=0)
+            attention_mask = attention_mask.repeat_interleave(num_samples, dim=0)
+            positions = lengths.to(device).repeat_interleave(num_samples)
+            kv = [(k.repeat_interleave(num_samples, dim=0), v.repeat_interleave(num_samples, dim=0))
+                  for k, v in _cache_tensors(outputs.past_key_values)]
+            past = _build_cache(kv, rows)
+
+            generated = torch.empty((rows, 0), dtype=torch.long, device=device)
+            finished = torch.zeros(rows, dtype=torch.bool, device=device)
+            processors = self.build_letter_constraints(0, max_new_tokens)[0] if constrained else []
+            max_decode_steps += max_new_tokens * rows
+            for step in range(max_new_tokens):
+                scores = logits
+                for processor in processors:
+                    scores = processor(generated, scores)
+                scores = warpers(generated, scores)
+                next_tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(-1)
+                # 已结束的行只填充，不计入实际解码步数
+                decode_steps += int((~finished).sum())
+                fill_id = eos_token_id if eos_token_id is not None else self.pad_token_id
+                next_tokens = torch.where(finished, torch.full_like(next_tokens, fill_id), next_tokens)
+                if eos_token_id is not None:
+                    finished |= next_tokens == eos_token_id
+                if constrained:
+                    finished |= torch.isin(next_tokens, letter_ids)
+                generated = torch.cat([generated, next_tokens.unsqueeze(-1)], dim=-1)
+                if step == max_new_tokens - 1 or bool(finished.all()):
+                    break
+
+                attention_mask = torch.cat([attention_mask, torch.ones((rows, 1), dtype=attention_mask.dtype,
+                                                                       device=device)], dim=-1)
+                with torch.no_grad():
+                    outputs = self.model(
+                        input_ids=next_tokens.unsqueeze(-1),
+                        attention_mask=attention_mask,
+                        position_ids=(positions + step).unsqueeze(-1),
+                        past_key_values=past,
+                        use_cache=True
+                    )
+                past = outputs.past_key_values
+                logits = outputs.logits[:, -1].float()
+
+            texts = [self.tokenizer.decode(row, skip_special_tokens=True) for row in generated]
+            for i in range(0, rows, num_samples):
+                samples.append(texts[i:i + num_samples])
+
+        return {
+            "samples": samples,
+            "prompt_tokens": sum(len(ids) for ids in encoded),
+            "decode_steps": decode_steps,
+            "max_decode_steps": max_decode_steps
+        }
+
+    def decode_greedy(self, top_token_ids: torch.Tensor,
+                      parse: Callable[[str], str] = extract_option) -> List[str]:
+        """把整词表argmax token解码为答案（等价于max_new_tokens=1的贪心生成），parse为答案解析规则"""
+        return [parse(self.tokenizer.decode([int(token_id)], skip_special_tokens=True).strip())
+                for token_id in top_token_ids]
+
+    @staticmethod
+    def pick_letter(letter_logits: torch.Tensor, valid_letters: Optional[Sequence[str]] = None) -> str:
+        """在题目实际提供的选项字母范围内取logits最大的字母"""
+        scores = letter_logits.clone().float()
+        if valid_letters:
+            for col, letter in enumerate(OPTION_LETTERS):
+                if letter not in valid_letters:
+                    scores[col] = float("-inf")
+        return OPTION_LETTERS[int(scores.argmax())]
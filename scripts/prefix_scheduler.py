@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+策略分组调度器 (Strategy-Grouped Scheduler)
+执行前按策略前缀、再按提示词长度重排工作项，提高前缀复用率并减少批内填充，
+执行完成后按原始顺序还原结果
+"""
+
+from typing import Any, Dict, List, Optional, Sequence
+
+
+class StrategyGroupedScheduler:
+    """策略分组调度器 - 同一策略的题目相邻执行，组内按提示词长度升序"""
+
+    def __init__(self, batch_size: int = 8, tokenizer=None):
+        """
+        初始化调度器
+
+        Args:
+            batch_size: 统计填充浪费时假设的批大小
+            tokenizer: 可选的tokenizer；提供时按token统计长度和公共前缀，否则按字符统计
+        """
+        self.batch_size = max(1, batch_size)
+        self.tokenizer = tokenizer
+
+    @staticmethod
+    def strategy_label(template: str) -> str:
+        """从提示词模板中提取策略标签（{question}之前的前缀）"""
+        prefix = template.split("{question}")[0].strip()
+        return prefix or "base"
+
+    def _units(self, items: Sequence[Dict]) -> List[Sequence]:
+        """把提示词转换为统计单元（token id列表或字符串）"""
+        prompts = [item.get("prompt") or "" for item in items]
+        if self.tokenizer is None:
+            return prompts
+        return self.tokenizer(prompts, add_special_tokens=False)["input_ids"]
+
+    def schedule(self, items: Sequence[Dict], units: Optional[List[Sequence]] = None) -> List[int]:
+        """
+        计算执行顺序
+
+        Args:
+            items: 工作项列表，每项至少包含 strategy 和 prompt
+            units: 可选的预先计算好的统计单元
+
+        Returns:
+            执行顺序（items的下标排列）
+        """
+        if units is None:
+            units = self._units(items)
+
+        # 策略组按首次出现的顺序排列，组内按长度升序，长度相同保持原顺序
+        group_rank: Dict[str, int] = {}
+        for item in items:
+            group_rank.setdefault(item.get("strategy", "base"), len(group_rank))
+
+        return sorted(
+            range(len(items)),
+            key=lambda i: (group_rank[items[i].get("strategy", "base")], len(units[i]), i)
+        )
+
+    @staticmethod
+    def restore(scheduled_results: Sequence[Any], order: Sequence[int]) -> List[Any]:
+        """把按执行顺序得到的结果还原为原始顺序"""
+        restored: List[Any] = [None] * len(order)
+        for position, original_index in enumerate(order):
+            restored[original_index] = scheduled_results[position]
+        return restored
+
+    @staticmethod
+    def _common_prefix_length(a: Sequence, b: Sequence) -> int:
+        """计算两个序列的公共前缀长度"""
+        limit = min(len(a), len(b))
+        n = 0
+        while n < limit and a[n] == b[n]:
+            n += 1
+        return n
+
+    def prefix_hit_ratio(self, units: Sequence[Sequence], order: Sequence[int]) -> float:
+        """
+        前缀命中率：按执行顺序，每个提示词与上一个提示词的公共前缀占其长度的比例
+        （对应单条目前缀缓存可复用的预填充比例）
+        """
+        total = 0
+        hits = 0
+        previous: Sequence = ()
+        for i in order:
+            current = units[i]
+            hits += self._common_prefix_length(previous, current)
+            total += len(current)
+            previous = current
+        return hits / total if total > 0 else 0.0
+
+    def padding_waste(self, units: Sequence[Sequence], order: Sequence[int]) -> float:
+        """填充浪费：按执行顺序切成批后，填充单元占批内总单元数的比例"""
+        padded = 0
+        useful = 0
+        for start in range(0, len(order), self.batch_size):
+            lengths = [len(units[i]) for i in order[start:start + self.batch_size]]
+            if not lengths:
+                continue
+            padded += max(lengths) * len(lengths)
+            useful += sum(lengths)
+        return (padded - useful) / padded if padded > 0 else 0.0
+
+    def plan(self, items: Sequence[Dict]) -> Dict[str, Any]:
+        """
+        生成调度计划并统计重排前后的前缀命中率与填充浪费
+
+        Returns:
+            {order, stats: {before, after, num_items, num_strategies, batch_size, unit}}
+        """
+        units = self._units(items)
+        original = list(range(len(items)))
+        order = self.schedule(items, units)
+
+        stats = {
+            "num_items": len(items),
+            "num_strategies": len({item.get("strategy", "base") for item in items}),
+            "batch_size": self.batch_size,
+            "unit": "token" if self.tokenizer is not None else "char",
+            "before": {
+                "prefix_hit_ratio": self.prefix_hit_ratio(units, original),
+                "padding_waste": self.padding_waste(units, original)
+            },
+            "after": {
+                "prefix_hit_ratio": self.prefix_hit_ratio(units, order),
+                "padding_waste": self.padding_waste(units, order)
+            }
+        }
+        return {"order": order, "stats": stats}
+
+
+def print_schedule_stats(stats: Dict[str, Any]):
+    """打印调度统计信息"""
+    before, after = stats["before"], stats["after"]
+    print(f"   🔀 策略分组调度: {stats['num_items']} 题, {stats['num_strategies']} 种策略 "
+          f"(批大小 {stats['batch_size']}, 单位 {stats['unit']})")
+    print(f"      前缀命中率: {before['prefix_hit_ratio']*100:.2f}% → {after['prefix_hit_ratio']*100:.2f}%")
+    print(f"      填充浪费:   {before['padding_waste']*100:.2f}% → {after['padding_waste']*100:.2f}%")
+    if "batched_items" in stats:
+        if stats["batched_items"]:
+            print(f"      按计划顺序成批执行: {stats['batched_items']}/{stats['num_items']} 题（其余逐题生成）")
+        else:
+            print(f"      ⚠️ 本次未按计划成批执行（推理服务或性能剖析模式），以上填充浪费为按批大小的估计值")
+
+
+def test_scheduler():
+    """测试调度器"""
+    templates = [
+        "Answer precisely: {question}\n\nOptions:\n{options}\n\nAnswer:",
+        "Analyze carefully: {question}\n\nOptions:\n{options}\n\nAnswer:",
+        "Question: {question}\n\nOptions:\n{options}\n\nAnswer:"
+    ]
+    items = []
+    for i in range(24):
+        template = templates[i % len(templates)]
+        question = "What is the gain of stage %d" % i + " and its bandwidth" * (i % 4)
+        items.append({
+            "index": i,
+            "strategy": StrategyGroupedScheduler.strategy_label(template),
+            "prompt": template.format(question=question, options="A. 1\nB. 2")
+        })
+
+    scheduler = StrategyGroupedScheduler(batch_size=4)
+    plan = scheduler.plan(items)
+    print_schedule_stats(plan["stats"])
+    before, after = plan["stats"]["before"], plan["stats"]["after"]
+    assert after["prefix_hit_ratio"] > before["prefix_hit_ratio"]
+    assert after["padding_waste"] < before["padding_waste"]
+
+    scheduled = [items[i]["index"] for i in plan["order"]]
+    restored = scheduler.restore(scheduled, plan["order"])
+    assert restored == list(range(len(items)))
+    print(f"   执行顺序: {plan['order']}")
+
+
+if __name__ == "__main__":
+    test_scheduler()
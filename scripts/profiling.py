@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行剖析工具 (Run Profiler)
+按需用cProfile和/或torch.profiler包住一段题目窗口的执行，
+输出以任务和策略命名的pstats文件和Chrome trace文件；
+未开启时调用方持有None，不产生任何额外开销
+"""
+
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import re
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+class RunProfiler:
+    """运行剖析器 - 只剖析每个任务执行顺序中 [start, start+count) 位置的题目"""
+
+    MODES = ("cprofile", "torch", "both")
+
+    def __init__(self, mode: str = "cprofile", output_dir: str = "results/profiles",
+                 start: int = 0, count: int = 20, top_n: int = 15):
+        """
+        初始化剖析器
+
+        Args:
+            mode: "cprofile"、"torch" 或 "both"
+            output_dir: 输出目录
+            start: 窗口起始位置（按执行顺序）
+            count: 窗口内的题目数
+            top_n: cProfile文本摘要中保留的累计耗时最高函数数
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"不支持的剖析模式: {mode}")
+        self.mode = mode
+        self.output_dir = output_dir
+        self.start = max(0, start)
+        self.count = max(1, count)
+        self.top_n = top_n
+        self.outputs: List[Dict] = []
+        self._label_counts: Dict[str, int] = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+    @staticmethod
+    def slug(text: str) -> str:
+        """把任务/策略名转换为文件名安全的标签"""
+        text = re.sub(r"[^\w.-]+", "_", text.strip(), flags=re.UNICODE).strip("_")
+        return text[:60] or "base"
+
+    def _label(self, task: str, strategy: str) -> str:
+        """任务+策略标签，同一标签重复出现时（如多次运行）追加序号"""
+        label = f"{self.slug(task)}__{self.slug(strategy)}"
+        self._label_counts[label] = self._label_counts.get(label, 0) + 1
+        count = self._label_counts[label]
+        return label if count == 1 else f"{label}__{count}"
+
+    def window(self, total: int) -> Tuple[int, int]:
+        """本次执行中需要剖析的位置区间 [lo, hi)"""
+        lo = min(self.start, total)
+        return lo, min(total, lo + self.count)
+
+    def segments(self, labels: Sequence[str], total: Optional[int] = None) -> Iterator[Tuple[int, int, str]]:
+        """
+        把窗口按策略切成连续片段
+
+        Args:
+            labels: 按执行顺序排列的每个位置的策略标签
+
+        Yields:
+            (lo, hi, strategy)
+        """
+        lo, hi = self.window(len(labels) if total is None else total)
+        position = lo
+        while position < hi:
+            end = position
+            while end < hi and labels[end] == labels[position]:
+                end += 1
+            yield position, end, labels[position]
+            position = end
+
+    @contextlib.contextmanager
+    def capture(self, task: str, strategy: str, num_questions: int):
+        """剖析with块内的执行，结束后写出pstats/Chrome trace文件"""
+        label = self._label(task, strategy)
+        profile = cProfile.Profile() if self.mode in ("cprofile", "both") else None
+        torch_profile = None
+        if self.mode in ("torch", "both"):
+            import torch
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            torch_profile = torch.profiler.profile(activities=activities, record_shapes=True)
+            torch_profile.__enter__()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            if torch_profile is not None:
+                torch_profile.__exit__(None, None, None)
+            self._write(label, task, strategy, num_questions, profile, torch_profile)
+
+    def _write(self, label: str, task: str, strategy: str, num_questions: int, profile, torch_profile):
+        """写出剖析结果并打印摘要"""
+        record = {"label": label, "task": task, "strategy": strategy, "num_questions": num_questions}
+        print(f"   🔬 剖析 {task} / {strategy}: {num_questions} 题")
+        if profile is not None:
+            path = os.path.join(self.output_dir, f"{label}.pstats")
+            profile.dump_stats(path)
+            record["pstats"] = path
+            # 累计耗时最高的函数另存为文本，便于直接查看
+            buffer = io.StringIO()
+            stats = pstats.Stats(profile, stream=buffer)
+            stats.sort_stats("cumulative").print_stats(self.top_n)
+            with open(path + ".txt", 'w', encoding='utf-8') as f:
+                f.write(buffer.getvalue())
+            record["total_seconds"] = stats.total_tt
+            print(f"      pstats: {path} (总计 {record['total_seconds']:.3f}秒)")
+        if torch_profile is not None:
+            path = os.path.join(self.output_dir, f"{label}.trace.json")
+            torch_profile.export_chrome_trace(path)
+            record["chrome_trace"] = path
+            print(f"      Chrome trace: {path}")
+        self.outputs.append(record)
+
+    def summary(self) -> List[Dict]:
+        """所有剖析输出的列表"""
+        return list(self.outputs)
+
+    @staticmethod
+    def add_arguments(parser):
+        """为命令行添加剖析参数"""
+        parser.add_argument("--profile", choices=RunProfiler.MODES, default=None,
+                            help="剖析题目窗口：cprofile、torch或both（不指定则不剖析）")
+        parser.add_argument("--profile-start", type=int, default=0, help="剖析窗口起始位置（按执行顺序）")
+        parser.add_argument("--profile-count", type=int, default=20, help="剖析窗口题目数")
+        parser.add_argument("--profile-dir", default="results/profiles", help="剖析结果输出目录")
+
+    @classmethod
+    def from_args(cls, args) -> Optional["RunProfiler"]:
+        """根据命令行参数创建剖析器，未开启时返回None"""
+        if not getattr(args, "profile", None):
+            return None
+        return cls(args.profile, args.profile_dir, args.profile_start, args.profile_count)
+
+
+def test_profiler():
+    """测试剖析器：窗口切分和文件输出"""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        profiler = RunProfiler("cprofile", output_dir, start=2, count=5)
+        labels = ["a", "a", "a", "b", "b", "c", "c", "c"]
+        segments = list(profiler.segments(labels))
+        assert segments == [(2, 3, "a"), (3, 5, "b"), (5, 7, "c")], segments
+
+        for lo, hi, strategy in segments:
+            with profiler.capture("LDO Task", strategy, hi - lo):
+                sum(i * i for i in range(10000))
+        files = sorted(os.listdir(output_dir))
+        assert [name for name in files if name.endswith(".pstats")] == \
+            ["LDO_Task__a.pstats", "LDO_Task__b.pstats", "LDO_Task__c.pstats"], files
+    print("✅ 剖析器测试通过")
+
+
+if __name__ == "__main__":
+    test_profiler()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提示词哈希缓存 (Prompt Hash Cache)
+增量重新评估：对每个渲染后的提示词连同生成参数取哈希，与上一次运行的记录比较，
+只有哈希变化（题目或策略改变）的工作项才交给模型，其余直接复用上次的答案，并统计跳过的工作量
+"""
+
+import glob
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_CACHE_DIR = "results/prompt_cache"
+WEIGHT_PATTERNS = ("*.safetensors", "*.bin", "*.index.json")
+
+
+def prompt_hash(prompt: str, params: Dict) -> str:
+    """渲染后的提示词 + 生成参数的哈希（参数按键排序，与字典顺序无关）"""
+    payload = json.dumps({"prompt": prompt, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def model_fingerprint(model_path: str) -> str:
+    """
+    模型标识：路径 + config.json内容 + 权重文件（*.safetensors/*.bin的文件名、大小和修改时间，
+    分片索引*.index.json的内容）；同一路径换了配置或权重（如重新微调后覆盖）时不复用
+    """
+    hasher = hashlib.sha256()
+    config_file = os.path.join(model_path, "config.json")
+    if os.path.exists(config_file):
+        with open(config_file, 'rb') as f:
+            hasher.update(f.read())
+    weight_files = sorted({path for pattern in WEIGHT_PATTERNS
+                           for path in glob.glob(os.path.join(model_path, pattern))})
+    for path in weight_files:
+        hasher.update(os.path.basename(path).encode("utf-8"))
+        if path.endswith(".index.json"):
+            with open(path, 'rb') as f:
+                hasher.update(f.read())
+        else:
+            stat = os.stat(path)
+            hasher.update(f":{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    digest = hasher.hexdigest()[:16] if os.path.exists(config_file) or weight_files else ""
+    return f"{os.path.abspath(model_path)}@{digest}"
+
+
+class PromptHashCache:
+    """按提示词哈希记录答案，运行结束后只保留本次运行用到的记录（即"上一次运行"）"""
+
+    def __init__(self, model_path: str, cache_dir: str = DEFAULT_CACHE_DIR):
+        """
+        初始化缓存并读取上一次运行的记录
+
+        Args:
+            model_path: 模型路径（决定缓存文件和模型标识）
+            cache_dir: 缓存目录
+        """
+        self.fingerprint = model_fingerprint(model_path)
+        name = hashlib.sha256(self.fingerprint.encode("utf-8")).hexdigest()[:12]
+        self.path = os.path.join(cache_dir, f"{os.path.basename(os.path.normpath(model_path))}_{name}.json")
+        self.previous: Dict[str, str] = {}
+        self.current: Dict[str, str] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("fingerprint") == self.fingerprint:
+                self.previous = data.get("records", {})
+
+    @staticmethod
+    def cacheable(params: Optional[Dict]) -> bool:
+        """只有确定性生成（不采样）的结果才能复用"""
+        return params is not None and not params.get("do_sample", False)
+
+    def split(self, items: List[Dict], task_name: str = "") -> Tuple[List[int], Dict[int, str]]:
+        """
+        把工作项分为需要生成的和可复用的
+
+        Args:
+            items: 工作项（含prompt/params）
+
+        Returns:
+            (需要生成的位置列表, {位置: 复用的答案})
+        """
+        stats = self.stats.setdefault(task_name, {"total": 0, "reused": 0, "evaluated": 0})
+        pending, reused = [], {}
+        for position, item in enumerate(items):
+            if item.get("prompt") is None:
+                continue
+            stats["total"] += 1
+            if not self.cacheable(item.get("params")):
+                pending.append(position)
+                continue
+            key = prompt_hash(item["prompt"], item["params"])
+            item["prompt_hash"] = key
+            answer = self.previous.get(key, self.current.get(key))
+            if answer is None:
+                pending.append(position)
+            else:
+                reused[position] = answer
+                self.current[key] = answer
+        stats["reused"] += len(reused)
+        stats["evaluated"] += len(pending)
+        return pending, reused
+
+    def record(self, item: Dict, answer: Optional[str]):
+        """记录新生成的答案（生成失败不记录，下次重试）"""
+        if answer is not None and "prompt_hash" in item:
+            self.current[item["prompt_hash"]] = answer
+
+    def task_summary(self, task_name: str) -> Dict:
+        """某任务的复用统计"""
+        stats = dict(self.stats.get(task_name, {"total": 0, "reused": 0, "evaluated": 0}))
+        stats["skipped_fraction"] = stats["reused"] / stats["total"] if stats["total"] else 0.0
+        return stats
+
+    def summary(self) -> Dict:
+        """全部任务的复用统计"""
+        total = sum(s["total"] for s in self.stats.values())
+        reused = sum(s["reused"] for s in self.stats.values())
+        return {
+            "previous_records": len(self.previous),
+            "total": total,
+            "reused": reused,
+            "evaluated": total - reused,
+            "skipped_fraction": reused / total if total else 0.0,
+            "by_task": {task: self.task_summary(task) for task in self.stats}
+        }
+
+    def save(self):
+        """写出本次运行的记录（原子替换）"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"fingerprint": self.fingerprint, "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
+                       "records": self.current}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def print_incremental_summary(summary: Dict):
+    """打印增量评估的复用统计"""
+    print(f"\n♻️ 增量评估: 复用 {summary['reused']}/{summary['total']} 个工作项 "
+          f"({summary['skipped_fraction'] * 100:.1f}% 跳过), 重新生成 {summary['evaluated']} 个")
+    for task, stats in summary["by_task"].items():
+        print(f"   {task}: 复用 {stats['reused']}/{stats['total']}, 重新生成 {stats['evaluated']}")
+
+
+def test_prompt_cache():
+    """测试提示词哈希缓存：第二次运行全部复用，改动的提示词重新生成"""
+    import tempfile
+
+    params = {"max_new_tokens": 1, "do_sample": False}
+    with tempfile.TemporaryDirectory() as root:
+        model_path = os.path.join(root, "model")
+        os.makedirs(model_path)
+        items = [{"prompt": f"Question {i}\n\nAnswer:", "params": params} for i in range(10)]
+
+        cache = PromptHashCache(model_path, os.path.join(root, "cache"))
+        pending, reused = cache.split(items, "LDO Task")
+        assert len(pending) == 10 and not reused
+        for position in pending:
+            cache.record(items[position], "A")
+        cache.save()
+
+        # 第二次运行：改动两道题的提示词，参数字典顺序不同不影响哈希
+        items = [{"prompt": f"Question {i}\n\nAnswer:", "params": {"do_sample": False, "max_new_tokens": 1}}
+                 for i in range(10)]
+        items[3]["prompt"] = "Analyze carefully: Question 3\n\nAnswer:"
+        items[7]["params"] = dict(params, max_new_tokens=3)
+        cache = PromptHashCache(model_path, os.path.join(root, "cache"))
+        pending, reused = cache.split(items, "LDO Task")
+        assert pending == [3, 7] and len(reused) == 8, (pending, reused)
+        assert cache.summary()["skipped_fraction"] == 0.8
+
+        # 同一路径下替换权重文件后模型标识改变，不再复用
+        fingerprint = model_fingerprint(model_path)
+        with open(os.path.join(model_path, "model.safetensors"), 'wb') as f:
+            f.write(b"\0" * 16)
+        updated = model_fingerprint(model_path)
+        with open(os.path.join(model_path, "model.safetensors"), 'wb') as f:
+            f.write(b"\0" * 32)
+        assert len({fingerprint, updated, model_fingerprint(model_path)}) == 3
+        assert not PromptHashCache(model_path, os.path.join(root, "cache")).previous
+    print("✅ 提示词哈希缓存测试通过")
+
+
+if __name__ == "__main__":
+    test_prompt_cache()
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提示词/参数搜索调度器 (Prompt Sweep Scheduler)
+在AblationStudy.experiments的配置之上展开搜索空间，
+用逐级减半（Successive Halving / Hyperband）在逐步增大的题目子集上评估候选配置，
+尽早淘汰表现差的候选；评估任务在多个worker上并行执行，最后输出准确率-成本排行榜
+"""
+
+import copy
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from ablation_study import AblationStudy, load_task_data
+from shared_weights import create_fork_pool
+
+# worker本地的AblationStudy（线程模式每个线程一个，进程模式每个进程一个）
+_WORKER = threading.local()
+
+
+def _init_thread_worker(model_path: str, shared_model, device: str):
+    """线程worker初始化：共享已加载的模型，tokenizer和前缀缓存各自独立"""
+    from transformers import AutoTokenizer
+
+    study = AblationStudy(model_path, device)
+    study.model = shared_model
+    study.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+    if study.tokenizer.pad_token is None:
+        study.tokenizer.pad_token = study.tokenizer.eos_token
+    _WORKER.study = study
+
+
+def _init_process_worker(model_path: str, device_queue):
+    """进程worker初始化：从设备队列领取一个设备并独立加载模型"""
+    device = device_queue.get() if device_queue is not None else None
+    study = AblationStudy(model_path, device)
+    study.load_model()
+    _WORKER.study = study
+
+
+def _init_fork_worker(model_path: str, shared_model):
+    """fork worker初始化：继承父进程内存映射加载的模型（共享权重页），其余状态各自独立"""
+    _init_thread_worker(model_path, shared_model, "cpu")
+
+
+def _evaluate_slice(config: Dict, questions: List[Dict], task_name: str, batch_size: int) -> Dict:
+    """
+    在worker上评估一个候选配置的一段题目
+
+    成本按完整提示词的token数计（与worker前缀缓存里已有哪些前缀、切片由哪个worker执行无关），
+    前缀缓存实际复用的token单独记为cached_tokens
+    """
+    study = _WORKER.study
+    result = study.evaluate_config(config, questions, task_name, config.get("name", "candidate"),
+                                   batch_size=batch_size)
+    execution = result.get("execution", {})
+    examples = study.get_few_shot_examples(task_name) if config.get("use_few_shot", False) else []
+    prompts = [study.build_prompt(config, item, examples) for item in questions]
+    return {
+        "correct": result["correct"],
+        "total": result["total"],
+        "seconds": result["total_time"],
+        "tokens": sum(len(ids) for ids in study.tokenizer(prompts)["input_ids"]) if prompts else 0,
+        "cached_tokens": execution.get("prefix_tokens_reused", 0)
+    }
+
+
+class SuccessiveHalvingSweep:
+    """逐级减半搜索 - 候选配置在嵌套的随机题目子集上评估，每一级只保留前 1/eta"""
+
+    def __init__(self, model_path: str, task_data: List[Dict], task_name: str = "LDO",
+                 num_workers: int = 1, executor: str = "thread", devices: Optional[List[str]] = None,
+                 batch_size: int = 8, seed: int = 42):
+        """
+        初始化搜索器
+
+        Args:
+            model_path: 模型路径
+            task_data: 任务数据
+            task_name: 任务名称（决定Few-shot示例）
+            num_workers: 并行worker数
+            executor: "thread"（共享一份模型权重）、"process"（每个进程独立加载，可分布到多张GPU）
+                      或 "fork"（CPU，父进程内存映射加载一次，fork出的进程共享权重页）
+            devices: 进程模式下各worker使用的设备，如 ["cuda:0", "cuda:1"]
+            batch_size: 每个worker的批大小
+            seed: 打乱题目顺序和Hyperband采样的随机种子
+        """
+        self.model_path = model_path
+        self.task_name = task_name
+        self.num_workers = max(1, num_workers)
+        self.executor_type = executor
+        self.devices = devices
+        self.batch_size = batch_size
+        self.seed = seed
+
+        # 固定种子打乱一次，所有级别使用同一顺序的前n题，子集互相嵌套
+        self.questions = list(task_data)
+        random.Random(seed).shuffle(self.questions)
+
+        # 候选配置的累计评估结果（同一候选在不同级别/分组中只评估新增题目）
+        self.evaluations: Dict[str, Dict] = {}
+        self.candidates: Dict[str, Dict] = {}
+        self.pool = None
+
+    def expand_search_space(self, search_space: Dict[str, Any], base_experiment: str = "full_optimization",
+                            experiments: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+        """
+        展开搜索空间为候选配置列表
+
+        Args:
+            search_space: {字段: 候选值列表}；"params.xxx" 表示覆盖生成参数中的xxx，
+                          "base" 可指定基础实验名称（采样、多token或repetition_penalty≠1.0的候选
+                          不走一次前向打分的快速路径，而是批量generate，参数都会生效）
+            base_experiment: 基础实验（AblationStudy.experiments中的名称）
+            experiments: 实验配置表，默认使用AblationStudy的默认配置
+
+        Returns:
+            候选配置列表，每个配置带有 name 和 overrides
+        """
+        if experiments is None:
+            experiments = AblationStudy(self.model_path).experiments
+        space = dict(search_space)
+        base_name = space.pop("base", base_experiment)
+        base = experiments[base_name]
+
+        keys = sorted(space.keys())
+        candidates = []
+        for values in itertools.product(*(space[key] for key in keys)):
+            config = copy.deepcopy(base)
+            overrides = dict(zip(keys, values))
+            for key, value in overrides.items():
+                if key.startswith("params."):
+                    config.setdefault("params", {})[key[len("params."):]] = value
+                else:
+                    config[key] = value
+            key = json.dumps({"base": base_name, **overrides}, sort_keys=True, ensure_ascii=False)
+            config["name"] = f"{base_name}#{len(candidates)}"
+            config["overrides"] = overrides
+            self.candidates[key] = config
+            candidates.append({"key": key, "config": config})
+        return candidates
+
+    def _start_pool(self):
+        """启动worker池"""
+        if self.pool is not None:
+            return
+        if self.executor_type == "process":
+            import multiprocessing
+            ctx = multiprocessing.get_context("spawn")
+            device_queue = None
+            if self.devices:
+                device_queue = ctx.Manager().Queue()
+                for i in range(self.num_workers):
+                    device_queue.put(self.devices[i % len(self.devices)])
+            self.pool = ProcessPoolExecutor(self.num_workers, mp_context=ctx, initializer=_init_process_worker,
+                                            initargs=(self.model_path, device_queue))
+        elif self.executor_type == "fork":
+            shared = AblationStudy(self.model_path, "cpu")
+            shared.mmap_weights = True
+            shared.load_model()
+            self.pool = create_fork_pool(self.num_workers, _init_fork_worker, (self.model_path, shared.model))
+        else:
+            shared = AblationStudy(self.model_path, self.devices[0] if self.devices else None)
+            shared.load_model()
+            self.pool = ThreadPoolExecutor(self.num_workers, initializer=_init_thread_worker,
+                                           initargs=(self.model_path, shared.model, shared.device))
+
+    def close(self):
+        """关闭worker池"""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _evaluate_to(self, candidates: List[Dict], num_questions: int):
+        """把每个候选评估到前num_questions题（只提交尚未评估的部分），并行执行"""
+        self._start_pool()
+        futures = []
+        for candidate in candidates:
+            record = self.evaluations.setdefault(candidate["key"], {
+                "evaluated": 0, "correct": 0, "seconds": 0.0, "tokens": 0, "cached_tokens": 0
+            })
+            start = record["evaluated"]
+            if num_questions <= start:
+                continue
+            # 按worker数切分新增题目，使单个候选也能并行
+            chunk = max(self.batch_size, math.ceil((num_questions - start) / self.num_workers))
+            for lo in range(start, num_questions, chunk):
+                hi = min(num_questions, lo + chunk)
+                futures.append((candidate["key"], self.pool.submit(
+                    _evaluate_slice, candidate["config"], self.questions[lo:hi], self.task_name, self.batch_size
+                )))
+            record["evaluated"] = num_questions
+
+        for key, future in futures:
+            partial = future.result()
+            record = self.evaluations[key]
+            record["correct"] += partial["correct"]
+            record["seconds"] += partial["seconds"]
+            record["tokens"] += partial["tokens"]
+            record["cached_tokens"] += partial["cached_tokens"]
+
+    def _accuracy(self, key: str) -> float:
+        record = self.evaluations[key]
+        return record["correct"] / record["evaluated"] * 100 if record["evaluated"] else 0.0
+
+    def successive_halving(self, candidates: List[Dict], min_questions: int, eta: int = 3,
+                           max_questions: Optional[int] = None) -> List[Dict]:
+        """
+        逐级减半
+
+        Args:
+            candidates: 候选配置列表
+            min_questions: 第一级的题目数
+            eta: 每级保留 1/eta 的候选，题目数乘以 eta
+            max_questions: 最后一级的题目数上限（默认全部题目）
+
+        Returns:
+            各级记录 [{rung, num_questions, candidates: [(name, accuracy)]}]
+        """
+        max_questions = min(max_questions or len(self.questions), len(self.questions))
+        num_questions = min(min_questions, max_questions)
+        survivors = list(candidates)
+        rungs = []
+
+        while True:
+            rung_start = time.time()
+            self._evaluate_to(survivors, num_questions)
+            ranked = sorted(survivors, key=lambda c: self._accuracy(c["key"]), reverse=True)
+            rungs.append({
+                "rung": len(rungs),
+                "num_questions": num_questions,
+                "elapsed": time.time() - rung_start,
+                "candidates": [(c["config"]["name"], self._accuracy(c["key"])) for c in ranked]
+            })
+            print(f"   级别 {len(rungs) - 1}: {len(survivors)} 个候选 × {num_questions} 题, "
+                  f"最佳 {ranked[0]['config']['name']} ({self._accuracy(ranked[0]['key']):.2f}%)")
+
+            if len(survivors) <= 1 or num_questions >= max_questions:
+                break
+            survivors = ranked[:max(1, len(ranked) // eta)]
+            num_questions = min(max_questions, num_questions * eta)
+
+        return rungs
+
+    def hyperband(self, candidates: List[Dict], max_questions: Optional[int] = None, eta: int = 3,
+                  min_questions: int = 8) -> List[Dict]:
+        """
+        Hyperband：用不同的（候选数, 起始题目数）组合运行多组逐级减半，
+        兼顾"多候选少题目"和"少候选多题目"两种极端
+
+        Returns:
+            各组逐级减半的记录
+        """
+        max_questions = min(max_questions or len(self.questions), len(self.questions))
+        s_max = max(0, int(math.floor(math.log(max(1, max_questions // min_questions), eta))))
+        rng = random.Random(self.seed)
+        brackets = []
+
+        for s in range(s_max, -1, -1):
+            n = min(len(candidates), int(math.ceil((s_max + 1) / (s + 1) * eta ** s)))
+            start_questions = max(min_questions, int(max_questions / eta ** s))
+            sampled = rng.sample(candidates, n)
+            print(f"\n📦 Hyperband 分组 s={s}: {n} 个候选, 起始 {start_questions} 题")
+            brackets.append({
+                "bracket": s,
+                "rungs": self.successive_halving(sampled, start_questions, eta, max_questions)
+            })
+
+        return brackets
+
+    def leaderboard(self) -> List[Dict]:
+        """
+        生成排行榜：按评估题目数（到达的级别）和准确率排序，并标记准确率-成本的Pareto前沿
+        （成本为完整提示词token数，与执行顺序无关；前缀缓存节省的token另列）
+        """
+        rows = []
+        for key, record in self.evaluations.items():
+            config = self.candidates[key]
+            ci_low, ci_high = AblationStudy.wilson_interval(record["correct"], record["evaluated"])
+            rows.append({
+                "name": config["name"],
+                "overrides": config.get("overrides", {}),
+                "questions_evaluated": record["evaluated"],
+                "correct": record["correct"],
+                "accuracy": self._accuracy(key),
+                "ci_low": ci_low,
+                "ci_high": ci_high,
+                "cost_tokens": record["tokens"],
+                "cost_seconds": record["seconds"],
+                "tokens_per_question": record["tokens"] / record["evaluated"] if record["evaluated"] else 0,
+                "cache_saved_tokens": record["cached_tokens"],
+                "cache_saved_fraction": record["cached_tokens"] / record["tokens"] if record["tokens"] else 0.0
+            })
+
+        rows.sort(key=lambda r: (r["questions_evaluated"], r["accuracy"]), reverse=True)
+
+        # Pareto前沿（在完整评估的候选中）：不存在准确率更高且单题成本更低的候选
+        top_n = rows[0]["questions_evaluated"] if rows else 0
+        finalists = [r for r in rows if r["questions_evaluated"] == top_n]
+        for row in rows:
+            row["pareto"] = row in finalists and not any(
+                other["accuracy"] >= row["accuracy"] and other["tokens_per_question"] < row["tokens_per_question"]
+                or other["accuracy"] > row["accuracy"] and other["tokens_per_question"] <= row["tokens_per_question"]
+                for other in finalists
+            )
+        return rows
+
+
+def print_leaderboard(rows: List[Dict], limit: int = 20):
+    """打印排行榜"""
+    print("\n" + "=" * 80)
+    print("搜索排行榜（准确率 vs 成本）")
+    print("=" * 80)
+    for i, row in enumerate(rows[:limit], 1):
+        marker = "★" if row["pareto"] else " "
+        print(f"{marker}{i:3d}. {row['name']:28s} | {row['questions_evaluated']:5d} 题 | "
+              f"准确率 {row['accuracy']:6.2f}% [{row['ci_low']:.1f}, {row['ci_high']:.1f}] | "
+              f"{row['tokens_per_question']:8.1f} tokens/题 (缓存节省 {row['cache_saved_fraction'] * 100:.0f}%) | "
+              f"{row['cost_seconds']:.1f}秒")
+        if row["overrides"]:
+            print(f"       {json.dumps(row['overrides'], ensure_ascii=False)[:150]}")
+
+
+DEFAULT_SEARCH_SPACE = {
+    "base": "full_optimization",
+    "num_examples": [1, 2, 3],
+    "expert_instruction": [
+        "You are a circuit expert.",
+        "You are an LDO circuit expert. Analyze LDO circuits by checking:\n1. Pass transistor (source fixed at VDD)\n2. Error amplifier (compares VREF with feedback)\n3. Stable bandgap reference\n4. Resistive divider feedback network\n"
+    ]
+}
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="提示词/参数逐级减半搜索")
+    parser.add_argument("model_path", help="模型路径")
+    parser.add_argument("task_data", help="任务数据文件或目录")
+    parser.add_argument("--task-name", default="LDO", help="任务名称（决定Few-shot示例）")
+    parser.add_argument("--search-space", default=None, help="搜索空间JSON文件（默认使用内置空间）")
+    parser.add_argument("--workers", type=int, default=1, help="并行worker数")
+    parser.add_argument("--executor", choices=["thread", "process", "fork"], default="thread", help="worker类型")
+    parser.add_argument("--devices", default=None, help="进程模式下的设备列表，逗号分隔，如 cuda:0,cuda:1")
+    parser.add_argument("--min-questions", type=int, default=8, help="第一级题目数")
+    parser.add_argument("--max-questions", type=int, default=None, help="最后一级题目数（默认全部）")
+    parser.add_argument("--eta", type=int, default=3, help="淘汰比例")
+    parser.add_argument("--hyperband", action="store_true", help="使用Hyperband（多组逐级减半）")
+    parser.add_argument("--batch-size", type=int, default=8, help="批大小")
+    parser.add_argument("--output", default="results/prompt_sweep_results.json", help="结果文件")
+    args = parser.parse_args()
+
+    search_space = DEFAULT_SEARCH_SPACE
+    if args.search_space:
+        with open(args.search_space, 'r', encoding='utf-8') as f:
+            search_space = json.load(f)
+
+    task_data = load_task_data(args.task_data)
+    sweep = SuccessiveHalvingSweep(
+        args.model_path, task_data, args.task_name, args.workers, args.executor,
+        args.devices.split(",") if args.devices else None, args.batch_size
+    )
+    candidates = sweep.expand_search_space(search_space)
+    print(f"🔍 搜索空间: {len(candidates)} 个候选, {len(task_data)} 题, {args.workers} 个worker ({args.executor})")
+
+    start_time = time.time()
+    try:
+        if args.hyperband:
+            schedule = {"hyperband": sweep.hyperband(candidates, args.max_questions, args.eta, args.min_questions)}
+        else:
+            schedule = {"successive_halving": sweep.successive_halving(candidates, args.min_questions, args.eta,
+                                                                      args.max_questions)}
+    finally:
+        sweep.close()
+    elapsed = time.time() - start_time
+
+    rows = sweep.leaderboard()
+    print_leaderboard(rows)
+
+    full_cost = len(candidates) * len(task_data)
+    evaluated = sum(record["evaluated"] for record in sweep.evaluations.values())
+    print(f"\n总耗时: {elapsed:.1f}秒, 评估题次: {evaluated} (全量网格需要 {full_cost}, "
+          f"节省 {(1 - evaluated / full_cost) * 100 if full_cost else 0:.1f}%)")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            "search_space": search_space,
+            "schedule": schedule,
+            "leaderboard": rows,
+            "question_evaluations": evaluated,
+            "full_grid_evaluations": full_cost,
+            "elapsed": elapsed,
+            "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+        }, f, indent=2, ensure_ascii=False)
+    print(f"✅ 结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+稳定题目ID (Stable Question IDs)
+题目身份不再依赖 glob 返回的文件顺序：加载时按规范化后的题干和选项取内容哈希作为题目ID，
+并持久化 ID -> 位置 索引；按位置记录的策略表、错误索引和结果行可以迁移到题目ID
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_INDEX_PATH = "results/question_index.json"
+ID_PREFIX = "q"
+ID_LENGTH = 16
+
+
+def normalize_text(text: Any) -> str:
+    """规范化文本：NFKC、合并空白、去掉首尾空白"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", str(text or ""))).strip()
+
+
+def normalize_options(options: Any) -> List[str]:
+    """规范化选项：字典按键排序为 "键. 值"，字符串按行拆分，列表逐项规范化"""
+    if isinstance(options, dict):
+        return [f"{normalize_text(key)}. {normalize_text(value)}" for key, value in sorted(options.items())]
+    if isinstance(options, str):
+        return [line for line in (normalize_text(line) for line in options.splitlines()) if line]
+    if isinstance(options, (list, tuple)):
+        return [normalize_text(option) for option in options]
+    return []
+
+
+def question_id(question: Dict) -> str:
+    """题目内容哈希（规范化题干 + 选项），前缀q以区别于旧的数字位置键"""
+    payload = json.dumps([normalize_text(question.get('question')), normalize_options(question.get('options'))],
+                         ensure_ascii=False)
+    return ID_PREFIX + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:ID_LENGTH]
+
+
+def is_position_key(key: Any) -> bool:
+    """旧格式的位置键（整数或数字字符串）"""
+    return isinstance(key, int) or (isinstance(key, str) and key.isdigit())
+
+
+def assign_question_ids(questions: List[Dict]) -> List[str]:
+    """
+    为每道题写入 question_id 字段（内容完全相同的重复题按出现顺序加后缀 -2, -3, ...）
+
+    Returns:
+        按位置排列的题目ID
+    """
+    seen: Dict[str, int] = {}
+    ids = []
+    for question in questions:
+        base = question_id(question)
+        seen[base] = seen.get(base, 0) + 1
+        qid = base if seen[base] == 1 else f"{base}-{seen[base]}"
+        question["question_id"] = qid
+        ids.append(qid)
+    return ids
+
+
+def migrate_position_keys(mapping: Dict, questions: List[Dict]) -> Tuple[Dict[str, Any], int, int]:
+    """
+    把按位置记录的映射迁移到题目ID（已经是题目ID的键保持不变）
+
+    Args:
+        mapping: {位置或题目ID: 值}
+        questions: 按旧位置顺序排列、已分配question_id的题目
+
+    Returns:
+        (迁移后的映射, 迁移的键数, 越界丢弃的键数)
+    """
+    migrated, moved, dropped = {}, 0, 0
+    for key, value in mapping.items():
+        if not is_position_key(key):
+            migrated[key] = value
+        elif int(key) < len(questions):
+            migrated[questions[int(key)]["question_id"]] = value
+            moved += 1
+        else:
+            dropped += 1
+    return migrated, moved, dropped
+
+
+def _task_key(task_name: str) -> str:
+    """任务名统一为短名（"TQA Task" -> "TQA"），与结果库一致"""
+    task_name = (task_name or "").strip()
+    return task_name[:-5].strip() if task_name.endswith(" Task") else task_name
+
+
+class QuestionIndex:
+    """持久化的 题目ID -> 位置 索引（按任务）"""
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = path
+        self.tasks: Dict[str, Dict[str, int]] = {}
+        self._ids: Dict[str, List[Optional[str]]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.tasks = json.load(f).get("tasks", {})
+
+    def update(self, task_name: str, questions: List[Dict]) -> Dict[str, int]:
+        """
+        用当前加载顺序更新某任务的索引
+
+        Returns:
+            {total, added, removed, moved}（moved为位置变化的题数，非0说明文件顺序变了）
+        """
+        key = _task_key(task_name)
+        previous = self.tasks.get(key, {})
+        current = {question["question_id"]: position for position, question in enumerate(questions)}
+        self.tasks[key] = current
+        self._ids.pop(key, None)
+        return {
+            "total": len(current),
+            "added": len(current.keys() - previous.keys()),
+            "removed": len(previous.keys() - current.keys()),
+            "moved": sum(1 for qid, position in current.items() if qid in previous and previous[qid] != position)
+        }
+
+    def position(self, task_name: str, qid: str) -> Optional[int]:
+        """题目ID -> 位置"""
+        return self.tasks.get(_task_key(task_name), {}).get(qid)
+
+    def id_at(self, task_name: str, position: int) -> Optional[str]:
+        """位置 -> 题目ID（用于迁移只有位置的旧结果）"""
+        key = _task_key(task_name)
+        if key not in self._ids:
+            ids: List[Optional[str]] = [None] * len(self.tasks.get(key, {}))
+            for qid, pos in self.tasks.get(key, {}).items():
+                if 0 <= pos < len(ids):
+                    ids[pos] = qid
+            self._ids[key] = ids
+        ids = self._ids[key]
+        return ids[position] if position is not None and 0 <= position < len(ids) else None
+
+    def save(self):
+        """写出索引（原子替换）"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({"timestamp": time.strftime('%Y-%m-%d %H:%M:%S'), "tasks": self.tasks}, f, ensure_ascii=False)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def migrate_strategy_map_file(config_file: str, data_file: str, output: Optional[str] = None) -> Dict[str, int]:
+    """
+    把TQA错误模式优化结果中按位置的strategy_map改写为按题目ID
+
+    Args:
+        config_file: reasoningv_tqa_pattern_optimization_results.json
+        data_file: 生成该策略表时使用的数据文件（位置按该文件的顺序解释）
+        output: 输出文件（默认覆盖config_file）
+    """
+    with open(config_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    with open(data_file, 'r', encoding='utf-8') as f:
+        questions = json.load(f)
+    assign_question_ids(questions)
+    result = data["optimization_results"]["result"]
+    result["strategy_map"], moved, dropped = migrate_position_keys(result["strategy_map"], questions)
+    result["strategy_map_keys"] = "question_id"
+    with open(output or config_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return {"migrated": moved, "dropped": dropped, "total": len(result["strategy_map"])}
+
+
+def test_question_ids():
+    """测试题目ID：与顺序和空白无关，重复题可区分，位置键迁移后指向同一道题"""
+    questions = [
+        {"question": "What is  the dropout voltage?", "options": {"B": "0.2 V", "A": "1 V"}},
+        {"question": "Why does the loop oscillate?", "options": "A. Low phase margin\nB. High gain"},
+        {"question": "What is the dropout voltage?", "options": {"A": "1 V", "B": "0.2 V"}},
+        {"question": "Calculate the bias current.", "options": {"A": "1 mA", "B": "2 mA"}},
+    ]
+    ids = assign_question_ids([dict(q) for q in questions])
+    assert ids[0] != ids[2] and ids[2] == ids[0] + "-2", ids
+    assert all(qid.startswith(ID_PREFIX) and not is_position_key(qid) for qid in ids)
+
+    # 打乱顺序后同一道题ID不变（重复题之间按出现顺序区分）
+    shuffled = [dict(questions[i]) for i in (3, 1, 0, 2)]
+    assert assign_question_ids(shuffled) == [ids[3], ids[1], ids[0], ids[2]]
+
+    legacy = {"1": "reasoning", 3: "calculation", "9": "dropped", ids[0]: "kept"}
+    loaded = [dict(q) for q in questions]
+    assign_question_ids(loaded)
+    migrated, moved, dropped = migrate_position_keys(legacy, loaded)
+    assert migrated == {ids[1]: "reasoning", ids[3]: "calculation", ids[0]: "kept"} and (moved, dropped) == (2, 1)
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as root:
+        index = QuestionIndex(os.path.join(root, "index.json"))
+        assert index.update("TQA Task", loaded)["added"] == 4
+        index.save()
+        index = QuestionIndex(os.path.join(root, "index.json"))
+        assert index.position("TQA", ids[3]) == 3 and index.id_at("TQA Task", 1) == ids[1]
+        assert index.update("TQA Task", [loaded[i] for i in (3, 1, 0, 2)])["moved"] == 3
+    print("✅ 稳定题目ID测试通过")
+
+
+def main():
+    """命令行入口：迁移按位置的策略表，或运行自检"""
+    parser = argparse.ArgumentParser(description="稳定题目ID：迁移按位置记录的strategy_map")
+    subparsers = parser.add_subparsers(dest="command")
+    migrate_parser = subparsers.add_parser("migrate-strategy-map", help="把strategy_map的位置键改写为题目ID")
+    migrate_parser.add_argument("config_file", help="如 reasoningv_tqa_pattern_optimization_results.json")
+    migrate_parser.add_argument("data_file", help="位置所对应的数据文件，如 \"TQA Task/TQA Task.json\"")
+    migrate_parser.add_argument("--output", default=None, help="输出文件（默认覆盖原文件）")
+    subparsers.add_parser("test", help="运行自检")
+    args = parser.parse_args()
+
+    if args.command in (None, "test"):
+        test_question_ids()
+        return
+    stats = migrate_strategy_map_file(args.config_file, args.data_file, args.output)
+    print(f"✅ 已迁移 {stats['migrated']} 个位置键（越界丢弃 {stats['dropped']} 个），"
+          f"strategy_map共 {stats['total']} 项 -> {args.output or args.config_file}")
+
+
+if __name__ == "__main__":
+    main()
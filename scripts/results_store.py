@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+结果库 (Results Store)
+把results/下各类JSON结果（基线、前后对比、最新优化、完整验证、消融、TQA错误难度、实验5）
+导入同一个本地SQLite库：每个任务一行汇总，每道题一行预测，
+按 (model, task, strategy, run, question_id) 建索引，跨运行/跨模型查询在毫秒级完成
+"""
+
+import glob
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+from question_ids import DEFAULT_INDEX_PATH, QuestionIndex
+
+DEFAULT_DB = "results/results.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    model TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    source TEXT,
+    timestamp TEXT,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS task_results (
+    run_id INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    task TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    total INTEGER,
+    correct INTEGER,
+    accuracy REAL,
+    avg_time REAL,
+    num_runs INTEGER,
+    individual_accuracies TEXT,
+    extra TEXT,
+    PRIMARY KEY (run_id, task, strategy)
+);
+CREATE TABLE IF NOT EXISTS question_results (
+    run_id INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    task TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    question_id TEXT NOT NULL,
+    position INTEGER,
+    repeat INTEGER NOT NULL DEFAULT 0,
+    level TEXT,
+    groundtruth TEXT,
+    predicted TEXT,
+    correct INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_question_results
+    ON question_results (model, task, strategy, run_id, question_id);
+CREATE INDEX IF NOT EXISTS idx_question_lookup
+    ON question_results (run_id, task, question_id, repeat);
+CREATE INDEX IF NOT EXISTS idx_task_results
+    ON task_results (model, task, strategy, run_id);
+"""
+
+
+def normalize_model(name: str) -> str:
+    """统一模型名（文件名、model字段中的各种写法）"""
+    lowered = (name or "").lower().replace("-", "").replace("_", "")
+    if "reasoningv" in lowered:
+        return "ReasoningV"
+    if "analogseeker" in lowered:
+        return "Analogseeker"
+    return name or "unknown"
+
+
+def normalize_task(name: str) -> str:
+    """统一任务名："LDO Task" -> "LDO" """
+    name = (name or "").strip()
+    return name[:-5].strip() if name.endswith(" Task") else name
+
+
+def _model_from_file(path: str) -> str:
+    """从结果文件名推断模型（tqa_*/experiment*等未标明模型的文件归为ReasoningV）"""
+    model = normalize_model(os.path.basename(path).split("_")[0])
+    return "ReasoningV" if model not in ("ReasoningV", "Analogseeker") else model
+
+
+class ResultsStore:
+    """SQLite结果库"""
+
+    def __init__(self, db_path: str = DEFAULT_DB, question_index: Optional[QuestionIndex] = None):
+        """
+        打开（或创建）结果库
+
+        Args:
+            db_path: SQLite文件路径，":memory:"表示内存库
+            question_index: 题目ID索引；只有位置的旧结果行按它换算为题目ID，跨运行按题目ID对齐
+        """
+        self.question_index = question_index
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # ------------------------------------------------------------------ 写入
+
+    def create_run(self, name: str, model: str, kind: str, source: str = None,
+                   timestamp: str = None, metadata: Dict = None) -> int:
+        """新建运行（同名运行先删除，重复导入同一文件结果不会重复）"""
+        self.delete_run(name)
+        cursor = self.conn.execute(
+            "INSERT INTO runs (name, model, kind, source, timestamp, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, normalize_model(model), kind, source, timestamp,
+             json.dumps(metadata, ensure_ascii=False) if metadata else None))
+        return cursor.lastrowid
+
+    def delete_run(self, name: str):
+        """删除运行及其全部结果行"""
+        row = self.conn.execute("SELECT run_id FROM runs WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return
+        for table in ("question_results", "task_results", "runs"):
+            self.conn.execute(f"DELETE FROM {table} WHERE run_id = ?", (row["run_id"],))
+
+    def add_task_result(self, run_id: int, model: str, task: str, strategy: str, total: int = None,
+                        correct: int = None, accuracy: float = None, avg_time: float = None,
+                        num_runs: int = None, individual_accuracies: List[float] = None,
+                        extra: Dict = None):
+        """写入一个任务的汇总结果"""
+        if accuracy is None and correct is not None and total:
+            accuracy = correct / total * 100
+        self.conn.execute(
+            "INSERT OR REPLACE INTO task_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, normalize_model(model), normalize_task(task), strategy, total, correct, accuracy,
+             avg_time, num_runs, json.dumps(individual_accuracies) if individual_accuracies else None,
+             json.dumps(extra, ensure_ascii=False) if extra else None))
+
+    def add_question_results(self, run_id: int, model: str, task: str, rows: List[Dict],
+                             strategy: str = "default"):
+        """
+        批量写入逐题结果
+
+        Args:
+            rows: [{index, groundtruth, predicted, correct, 可选: question_id, level, strategy, run}]
+        """
+        model, task = normalize_model(model), normalize_task(task)
+        records = []
+        for row in rows:
+            position = row.get("index")
+            question_id = row.get("question_id")
+            if question_id is None and self.question_index is not None:
+                question_id = self.question_index.id_at(task, position)
+            if question_id is None:
+                question_id = position
+            groundtruth = row.get("groundtruth")
+            predicted = row.get("predicted")
+            correct = row.get("correct")
+            if correct is None:
+                correct = predicted is not None and str(predicted).upper() == str(groundtruth).upper()
+            records.append((run_id, model, task, row.get("strategy") or strategy, str(question_id), position,
+                            row.get("run", 0), row.get("level"), groundtruth, predicted, int(bool(correct))))
+        self.conn.executemany("INSERT INTO question_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+
+    # ------------------------------------------------------------------ 导入
+
+    def import_file(self, path: str) -> List[str]:
+        """
+        导入一个结果JSON（按内容识别格式）
+
+        Returns:
+            导入的运行名列表（无法识别时为空）
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            return []
+        stem = os.path.splitext(os.path.basename(path))[0]
+        model = _model_from_file(path)
+
+        for importer in IMPORTERS:
+            names = importer(self, data, stem, model, path)
+            if names is not None:
+                self.conn.commit()
+                return names
+        return []
+
+    def import_directory(self, results_dir: str = "results") -> Dict[str, List[str]]:
+        """导入目录下全部结果JSON，返回 {文件: 运行名列表}"""
+        imported = {}
+        for path in sorted(glob.glob(os.path.join(results_dir, "*.json"))):
+            try:
+                imported[path] = self.import_file(path)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"   ⚠️ 导入失败 {path}: {e}")
+                imported[path] = []
+        return imported
+
+    # ------------------------------------------------------------------ 查询
+
+    def runs(self, model: str = None) -> List[Dict]:
+        """运行列表（含逐题行数）"""
+        sql = ("SELECT r.*, (SELECT COUNT(*) FROM question_results q WHERE q.run_id = r.run_id) AS num_questions "
+               "FROM runs r")
+        params = ()
+        if model:
+            sql += " WHERE r.model = ?"
+            params = (normalize_model(model),)
+        return [dict(row) for row in self.conn.execute(sql + " ORDER BY r.run_id", params)]
+
+    def run_id(self, name: str) -> Optional[int]:
+        row = self.conn.execute("SELECT run_id FROM runs WHERE name = ?", (name,)).fetchone()
+        return row["run_id"] if row else None
+
+    def latest_run(self, model: str, task: str = None) -> Optional[int]:
+        """该模型（和任务）最近导入的、带逐题结果的运行"""
+        sql = "SELECT MAX(run_id) FROM question_results WHERE model = ?"
+        params = [normalize_model(model)]
+        if task:
+            sql += " AND task = ?"
+            params.append(normalize_task(task))
+        row = self.conn.execute(sql, params).fetchone()
+        return row[0] if row else None
+
+    def task_results(self, model: str = None, task: str = None, strategy: str = None,
+                     run: str = None) -> List[Dict]:
+        """按条件查询任务汇总行"""
+        clauses, params = [], []
+        for column, value in (("t.model", normalize_model(model) if model else None),
+                              ("t.task", normalize_task(task) if task else None),
+                              ("t.strategy", strategy), ("r.name", run)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        sql = "SELECT t.*, r.name AS run FROM task_results t JOIN runs r ON r.run_id = t.run_id"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return [dict(row) for row in self.conn.execute(sql + " ORDER BY t.run_id, t.task", params)]
+
+    def task_accuracies(self, run: str, model: str = None) -> Dict[str, float]:
+        """某次运行各任务的准确率 {task: accuracy}"""
+        return {row["task"]: row["accuracy"] for row in self.task_results(model=model, run=run)}
+
+    def question_results(self, model: str, task: str = None, run: str = None, repeat: int = 0) -> List[Dict]:
+        """某模型一次运行的逐题结果（默认最近一次）"""
+        run_id = self.run_id(run) if run else self.latest_run(model, task)
+        sql = "SELECT * FROM question_results WHERE model = ? AND run_id = ? AND repeat = ?"
+        params = [normalize_model(model), run_id, repeat]
+        if task:
+            sql += " AND task = ?"
+            params.append(normalize_task(task))
+        return [dict(row) for row in self.conn.execute(sql + " ORDER BY task, position", params)]
+
+    def compare_models(self, model_a: str, model_b: str, task: str = None, a_correct: bool = True,
+                       b_correct: bool = False, run_a: str = None, run_b: str = None,
+                       repeat: int = 0) -> List[Dict]:
+        """
+        跨模型逐题对比，如"ReasoningV答对而Analogseeker答错的题"
+
+        Args:
+            a_correct / b_correct: 两个模型各自是否答对（None表示不限）
+            run_a / run_b: 运行名（默认各自最近一次带逐题结果的运行）
+
+        Returns:
+            [{task, question_id, position, level, groundtruth, predicted_a, predicted_b, correct_a, correct_b}]
+        """
+        run_id_a = self.run_id(run_a) if run_a else self.latest_run(model_a, task)
+        run_id_b = self.run_id(run_b) if run_b else self.latest_run(model_b, task)
+        if run_id_a is None or run_id_b is None:
+            return []
+
+        sql = ("SELECT a.task, a.question_id, a.position, a.level, a.groundtruth, "
+               "a.predicted AS predicted_a, b.predicted AS predicted_b, a.correct AS correct_a, b.correct AS correct_b "
+               "FROM question_results a JOIN question_results b "
+               "ON b.run_id = ? AND b.task = a.task AND b.question_id = a.question_id AND b.repeat = a.repeat "
+               "WHERE a.run_id = ? AND a.model = ? AND a.repeat = ?")
+        params = [run_id_b, run_id_a, normalize_model(model_a), repeat]
+        if task:
+            sql += " AND a.task = ?"
+            params.append(normalize_task(task))
+        if a_correct is not None:
+            sql += " AND a.correct = ?"
+            params.append(int(a_correct))
+        if b_correct is not None:
+            sql += " AND b.correct = ?"
+            params.append(int(b_correct))
+        return [dict(row) for row in self.conn.execute(sql + " ORDER BY a.task, a.position", params)]
+
+
+# ---------------------------------------------------------------------- 各格式导入器
+# 每个导入器识别一种结果JSON：识别成功返回导入的运行名列表，否则返回None
+
+def _import_full_validation(store: ResultsStore, data: Dict, stem: str, model: str, path: str):
+    """完整验证结果：validation_results.results[task]（新版本带逐题question_results）"""
+    validation = data.get("validation_results")
+    if not isinstance(validation, dict) or "results" not in validation:
+        return None
+    model = normalize_model(data.get("model_path", "")) if data.get("model_path") else model
+    if model not in ("ReasoningV", "Analogseeker"):
+        model = _model_from_file(path)
+    run_id = store.create_run(stem, model, "full_validation", path, data.get("timestamp"),
+                              {"model_path": data.get("model_path")})
+    for task, result in validation["results"].items():
+        if not result:
+            continue
+        store.add_task_result(run_id, model, task, "optimized", result.get("total_questions"),
+                              result.get("correct_count"), result.get("accuracy"), result.get("avg_time"),
+                              result.get("num_runs"), result.get("individual_accuracies"))
+        if result.get("question_results"):
+            store.add_question_results(run_id, model, task, result["question_results"], "optimized")
+    return [stem]
+
+
+def _import_baseline(store: ResultsStore, data: Dict, stem: str, model: str, path: str):
+    """基线结果：baseline_results[task]"""
+    if "baseline_results" not in data:
+        return None
+    run_id = store.create_run(stem, model, "baseline", path, data.get("summary", {}).get("timestamp"))
+    for task, result in data["baseline_results"].items():
+        store.add_task_result(run_id, model, task, "baseline", result.get("total_questions"),
+                              result.get("correct"), result.get("accuracy"),
+                              extra={"prompt_template": result.get("prompt_template"),
+                                     "parameters": result.get("parameters")})
+    return [stem]
+
+
+def _import_model_comparison(store: ResultsStore, data: Dict, stem: str, model: str, path: str):
+    """两模型基线对比：results[task]{analogseeker, reasoningv}，每个模型一个运行"""
+    results = data.get("results")
+    if not isinstance(results, dict) or not results:
+        return None
+    first = next(iter(results.values()))
+    if not isinstance(first, dict) or "analogseeker" not in first or "reasoningv" not in first:
+        return None
+    names = []
+    for key in ("reasoningv", "analogseeker"):
+        name = f"{stem}:{key}"
+        run_id = store.create_run(name, key, "baseline", path, data.get("timestamp"))
+        for task, result in results.items():
+            row = result.get(key, {})
+            store.add_task_result(run_id, key, task, "baseline", result.get("total_questions"),
+                                  row.get("correct"), row.get("accuracy"), row.get("avg_time"))
+        names.append(name)
+    return names
+
+
+def _import_before_after(store: ResultsStore, data: Dict, stem: str, model: str, path: str):
+    """优化前后对比：results[task]{before, after}，前后各一个运行"""
+    results = data.get("results")
+    if not isinstance(results, dict) or not results:
+        return None
+    first = next(iter(results.values()))
+    if not isinstance(first, dict) or "before" not in first or "after" not in first:
+        return None
+    model = normalize_model(data.get("model", model))
+    names = []
+    for key, strategy in (("before", "baseline"), ("after", "optimized")):
+        name = f"{stem}:{key}"
+        timestamp = data.get(f"{'baseline' if key == 'before' else 'optimized'}_timestamp", data.get("timestamp"))
+        run_id = store.create_run(name, model, "before_after", path, timestamp)
+        for task, result in results.items():
+            row = result.get(key, {})
+            store.add_task_result(run_id, model, task, strategy, result.get("total_questions"),
+                                  row.get("correct"), row.get("accuracy"), row.get("avg_time"),
+                                  row.get("num_runs"), row.get("individual_accuracies"))
+        names.append(name)
+    return names
+
+
+def _import_latest_optimization(store: ResultsStore, data: Dict, stem: str, model: str, path: str):
+    """最新优化策略：optimization_results[task]{strategy_name, strategy, accuracy?}"""
+    results = data.get("optimization_results")
+    if not isinstance(results, dict) or not all(isinstance(v, dict) and "strategy_name" in v
+                                                for v in results.values()):
+        return None
+    model = normalize_model(data.get("model", model))
+    run_id = store.create_run(stem, model, "latest_optimization", path, data.get("timestamp"),
+                              {"target_tasks": data.get("target_tasks"), "protected_tasks": data.get("protected_tasks")})
+    for task, result in results.items():
+        store.add_task_result(run_id, model, task, result["strategy_name"], accuracy=result.get("accuracy"),
+                              extra={"strategy": result.get("strategy")})
+    return [stem]
+
+
+def _import_tqa_pattern_optimization(store: ResultsStore, data: Dict, stem: str, model: str, path: str):
+    """TQA模式优化：optimization_results.result（只含汇总和错题，不导入逐题行）"""
+    results = data.get("optimization_results")
+    if not isinstance(results, dict) or "result" not in results:
+        return None
+    result = results["result"]
+    run_id = store.create_run(stem, model, "tqa_pattern_optimization", path, data.get("timestamp"))
+    store.add_task_result(run_id, model, "TQA", "pattern_optimized", result.get("total_questions"),
+                          result.get("correct_count"), result.get("accuracy"),
+                          extra={"num_mapped_questions": len(result.get("strategy_map", {})),
+                                 "improvement": results.get("improvement")})
+    return [stem]
+
+
+def _import_error_difficulty(store: ResultsStore, data: Dict, stem: str, model: str, path: str):
+    """TQA错误难度分析：overall + 逐题question_results"""
+    if "question_results" not in data or "overall" not in data:
+        return None
+    overall = data["overall"]
+    run_id = store.create_run(stem, model, "tqa_error_difficulty", path, data.get("timestamp"),
+                              {"method": data.get("method"), "error_stats": data.get("error_stats")})
+    store.add_task_result(run_id, model, "TQA", "pattern_optimized", overall.get("total_questions"),
+                          overall.get("correct_count"), overall.get("accuracy"))
+    store.add_question_results(run_id, model, "TQA", data["question_results"], "pattern_optimized")
+    return [stem]
+
+
+def _import_ablation(store: ResultsStore, data: Dict, stem: str, model: str, path: str):
+    """消融结果：执行消融实验.py的 ablation_results[task]{baseline, steps}，
+    或 ablation_study.py 的 {experiment: {correct, total, accuracy, ...}}"""
+    if "ablation_results" in data:
+        run_id = store.create_run(stem, model, "ablation", path, data.get("timestamp"))
+        for task, result in data["ablation_results"].items():
+            store.add_task_result(run_id, model, task, "Baseline", accuracy=result["baseline"]["accuracy"])
+            for step in result.get("steps", []):
+                store.add_task_result(run_id, model, task, step["step"], accuracy=step["accuracy"],
+                                      extra={"improvement": step.get("improvement")})
+        return [stem]
+
+    experiments = {key: value for key, value in data.items()
+                   if isinstance(value, dict) and "experiment" in value and "accuracy" in value}
+    if not experiments:
+        return None
+    summary = data.get("summary") or {}
+    run_id = store.create_run(stem, model, "ablation", path, metadata=summary)
+    task = summary.get("task_name", "unknown")
+    for name, result in experiments.items():
+        store.add_task_result(run_id, model, task, name, result.get("total"), result.get("correct"),
+                              result.get("accuracy"), result.get("avg_time"),
+                              extra={"ci_low": result.get("ci_low"), "ci_high": result.get("ci_high")})
+    return [stem]
+
+
+def _import_experiment5(store: ResultsStore, data: Dict, stem: str, model: str, path: str):
+    """实验5：{task: {reasoningv, analogseeker, comparison}}，每个模型一个运行"""
+    tasks = {key: value for key, value in data.items()
+             if isinstance(value, dict) and "reasoningv" in value and "analogseeker" in value}
+    if not tasks or len(tasks) != len(data):
+        return None
+    names = []
+    for key in ("reasoningv", "analogseeker"):
+        name = f"{stem}:{key}"
+        run_id = store.create_run(name, key, "experiment5", path)
+        for task, result in tasks.items():
+            row = result[key]
+            store.add_task_result(run_id, key, task, "optimized", row.get("total"), row.get("correct"),
+                                  row.get("accuracy"))
+        names.append(name)
+    return names
+
+
+IMPORTERS = [
+    _import_full_validation,
+    _import_baseline,
+    _import_model_comparison,
+    _import_before_after,
+    _import_latest_optimization,
+    _import_tqa_pattern_optimization,
+    _import_error_difficulty,
+    _import_ablation,
+    _import_experiment5
+]
+
+
+def test_results_store():
+    """测试结果库：导入、跨模型查询和查询耗时"""
+    import random
+
+    store = ResultsStore(":memory:")
+    rng = random.Random(0)
+    groundtruths = [rng.choice("ABCD") for _ in range(1257)]
+    for model, skill in (("ReasoningV", 0.9), ("Analogseeker", 0.85)):
+        run_id = store.create_run(f"{model.lower()}_full_validation_results", model, "full_validation")
+        rows = []
+        for i, groundtruth in enumerate(groundtruths):
+            predicted = groundtruth if rng.random() < skill else "ABCD"[("ABCD".index(groundtruth) + 1) % 4]
+            rows.append({"index": i, "groundtruth": groundtruth, "predicted": predicted,
+                         "level": "Graduate" if i % 2 else "Undergraduate"})
+        store.add_question_results(run_id, model, "TQA Task", rows)
+        store.add_task_result(run_id, model, "TQA Task", "optimized", len(rows),
+                              sum(r["predicted"] == r["groundtruth"] for r in rows))
+    store.conn.commit()
+
+    start = time.perf_counter()
+    cases = store.compare_models("ReasoningV", "Analogseeker", task="TQA")
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    rv = {r["question_id"]: r["correct"] for r in store.question_results("ReasoningV", "TQA")}
+    asr = {r["question_id"]: r["correct"] for r in store.question_results("Analogseeker", "TQA")}
+    expected = sorted(q for q in rv if rv[q] and not asr[q])
+    assert sorted(case["question_id"] for case in cases) == expected
+    assert store.task_accuracies("reasoningv_full_validation_results")["TQA"] > 80
+
+    # 重复导入同名运行不重复计数
+    store.create_run("reasoningv_full_validation_results", "ReasoningV", "full_validation")
+    assert len(store.runs("ReasoningV")) == 1
+    print(f"✅ 结果库测试通过（{len(cases)} 道ReasoningV对/Analogseeker错，查询 {elapsed_ms:.2f}ms）")
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="SQLite结果库：导入results/下的JSON并做跨运行查询")
+    parser.add_argument("--db", default=DEFAULT_DB, help="SQLite文件路径")
+    parser.add_argument("--question-index", default=DEFAULT_INDEX_PATH,
+                        help="题目ID索引（导入只有位置的旧结果时换算为题目ID，空字符串表示不使用）")
+    subparsers = parser.add_subparsers(dest="command")
+
+    import_parser = subparsers.add_parser("import", help="导入结果JSON（文件或目录）")
+    import_parser.add_argument("paths", nargs="*", default=["results"], help="结果文件或目录（默认results）")
+
+    subparsers.add_parser("runs", help="列出运行")
+
+    compare_parser = subparsers.add_parser("compare", help="跨模型逐题对比")
+    compare_parser.add_argument("--a", default="ReasoningV", help="模型A")
+    compare_parser.add_argument("--b", default="Analogseeker", help="模型B")
+    compare_parser.add_argument("--task", default=None, help="任务（默认全部）")
+    compare_parser.add_argument("--a-wrong", action="store_true", help="查A答错（默认查A答对）")
+    compare_parser.add_argument("--b-right", action="store_true", help="查B答对（默认查B答错）")
+    compare_parser.add_argument("--run-a", default=None, help="模型A的运行名（默认最近一次）")
+    compare_parser.add_argument("--run-b", default=None, help="模型B的运行名（默认最近一次）")
+    compare_parser.add_argument("--limit", type=int, default=20, help="最多打印的题数")
+
+    subparsers.add_parser("test", help="运行自检")
+    args = parser.parse_args()
+
+    if args.command in (None, "test"):
+        test_results_store()
+        return
+
+    index = QuestionIndex(args.question_index) if args.question_index and os.path.exists(args.question_index) else None
+    store = ResultsStore(args.db, index)
+    if args.command == "import":
+        for path in args.paths:
+            imported = store.import_directory(path) if os.path.isdir(path) else {path: store.import_file(path)}
+            for file_path, names in imported.items():
+                status = f"✅ {', '.join(names)}" if names else "⏭️ 未识别的格式，跳过"
+                print(f"   {os.path.basename(file_path)}: {status}")
+        print(f"💾 结果库: {args.db}")
+    elif args.command == "runs":
+        for run in store.runs():
+            print(f"   [{run['run_id']:3d}] {run['name']:60s} {run['model']:13s} {run['kind']:22s} "
+                  f"逐题 {run['num_questions']}")
+    elif args.command == "compare":
+        start = time.perf_counter()
+        cases = store.compare_models(args.a, args.b, args.task, not args.a_wrong, args.b_right,
+                                     args.run_a, args.run_b)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        label_a = "错" if args.a_wrong else "对"
+        label_b = "对" if args.b_right else "错"
+        print(f"📊 {args.a}答{label_a}且{args.b}答{label_b}: {len(cases)} 题（查询 {elapsed_ms:.2f}ms）")
+        for case in cases[:args.limit]:
+            print(f"   {case['task']} #{case['question_id']} [{case['level'] or '-'}] 正确答案 {case['groundtruth']}: "
+                  f"{args.a}={case['predicted_a']}, {args.b}={case['predicted_b']}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内存映射共享权重 (Memory-Mapped Shared Weights)
+直接把safetensors文件内存映射为模型参数（不复制到私有内存），
+fork出的worker进程与父进程共享同一份只读权重页；
+并提供worker常驻内存（RSS/PSS/USS）和启动时间的对比测量
+"""
+
+import json
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+
+# safetensors dtype -> torch dtype
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool
+}
+
+# 测量用：父进程映射加载的模型（fork后子进程直接继承）
+_SHARED = {}
+
+
+def safetensors_files(model_path: str) -> List[str]:
+    """模型目录下的safetensors文件（单文件或分片索引）"""
+    index_file = os.path.join(model_path, "model.safetensors.index.json")
+    if os.path.exists(index_file):
+        with open(index_file, 'r', encoding='utf-8') as f:
+            shards = sorted(set(json.load(f)["weight_map"].values()))
+        return [os.path.join(model_path, shard) for shard in shards]
+
+    single_file = os.path.join(model_path, "model.safetensors")
+    if os.path.exists(single_file):
+        return [single_file]
+    raise FileNotFoundError(f"未找到safetensors权重: {model_path}")
+
+
+def mmap_safetensors(file_path: str) -> Dict[str, torch.Tensor]:
+    """
+    把一个safetensors文件内存映射为张量字典（不读入内存）
+
+    使用写时复制映射（np.memmap mode='c'）：页面来自文件页缓存，
+    只要不写入就在所有进程间共享，写入时只复制被修改的页，不会改动文件
+    """
+    with open(file_path, 'rb') as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+
+    data_start = 8 + header_size
+    buffer = torch.from_numpy(np.memmap(file_path, dtype=np.uint8, mode='c'))
+
+    tensors = {}
+    for name, info in header.items():
+        begin, end = info["data_offsets"]
+        raw = buffer[data_start + begin:data_start + end]
+        tensors[name] = raw.view(SAFETENSORS_DTYPES[info["dtype"]]).reshape(info["shape"])
+    return tensors
+
+
+def load_shared_model(model_path: str, trust_remote_code: bool = True):
+    """
+    从内存映射的safetensors构建模型（CPU）
+
+    模型结构在meta设备上创建，参数直接指向映射的权重（load_state_dict(assign=True)），
+    因此保持文件中的dtype（转换dtype会产生私有副本，失去共享）
+
+    Returns:
+        eval模式的模型
+    """
+    from accelerate import init_empty_weights
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    config = AutoConfig.from_pretrained(model_path, trust_remote_code=trust_remote_code)
+    state_dict = {}
+    for file_path in safetensors_files(model_path):
+        state_dict.update(mmap_safetensors(file_path))
+
+    # 缓冲区（如RoPE的inv_freq）正常创建，只有参数放在meta设备上
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config, trust_remote_code=trust_remote_code)
+
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+
+    missing = [name for name, param in model.named_parameters() if param.device.type == "meta"]
+    if missing:
+        raise RuntimeError(f"权重缺失: {missing[:5]}{'...' if len(missing) > 5 else ''}")
+    if result.unexpected_keys:
+        print(f"⚠️ 忽略未使用的权重: {result.unexpected_keys[:5]}")
+    return model.eval()
+
+
+def memory_usage(pid: Optional[int] = None) -> Dict[str, float]:
+    """
+    进程内存占用（MB）
+
+    - rss: 常驻内存（共享页按完整大小计入每个进程）
+    - pss: 按共享进程数分摊后的内存（多进程之和即真实占用）
+    - uss: 进程私有内存
+    """
+    pid = pid or os.getpid()
+    usage = {"rss": 0.0, "pss": 0.0, "uss": 0.0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", 'r') as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024
+        usage["rss"] = fields.get("Rss", 0.0)
+        usage["pss"] = fields.get("Pss", 0.0)
+        usage["uss"] = fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0)
+    except OSError:
+        # 非Linux环境只能拿到RSS
+        import resource
+        usage["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return usage
+
+
+def create_fork_pool(num_workers: int, initializer=None, initargs: tuple = ()) -> ProcessPoolExecutor:
+    """
+    创建fork进程池：父进程中已用load_shared_model加载的模型可直接作为initargs传给worker，
+    fork时不经过pickle，worker与父进程共享权重页
+
+    注意：需在父进程执行任何前向计算之前创建（避免fork已启动的计算线程池）
+    """
+    import multiprocessing
+
+    # tokenizer的内部线程池在fork后不可用，子进程继承该设置
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    ctx = multiprocessing.get_context("fork")
+    return ProcessPoolExecutor(num_workers, mp_context=ctx, initializer=initializer, initargs=initargs)
+
+
+def _probe_worker(model_path: str, mode: str, start_time: float, result_queue, measure_event):
+    """
+    测量用worker：加载（或继承）模型，完成一次前向后报告就绪时间；
+    等所有worker都就绪后再测内存，保证共享页按同时存活的进程数分摊
+    """
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    torch.set_num_threads(1)
+    if mode == "shared":
+        model, tokenizer = _SHARED["model"], _SHARED["tokenizer"]
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+        model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype="auto",
+                                                     trust_remote_code=True).eval()
+
+    inputs = tokenizer("Question: What is the dropout voltage of an LDO?\n\nAnswer:", return_tensors="pt")
+    with torch.no_grad():
+        model(**inputs)
+    result_queue.put({"pid": os.getpid(), "ready_time": time.time() - start_time})
+
+    measure_event.wait()
+    result_queue.put({"pid": os.getpid(), **memory_usage()})
+
+
+def benchmark_worker_memory(model_path: str, num_workers: int = 4) -> Dict[str, Dict]:
+    """
+    对比两种多worker加载方式
+
+    - independent: 每个worker（spawn）各自from_pretrained一份权重
+    - shared: 父进程内存映射加载一次，worker通过fork继承
+
+    Returns:
+        {mode: {workers: [...], avg_ready_time, avg_rss, avg_pss, avg_uss, total_pss, parent_load_time}}
+    """
+    import multiprocessing
+    from transformers import AutoTokenizer
+
+    results = {}
+    for mode in ["independent", "shared"]:
+        parent_load_time = 0.0
+        if mode == "shared":
+            start = time.time()
+            _SHARED["model"] = load_shared_model(model_path)
+            _SHARED["tokenizer"] = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+            parent_load_time = time.time() - start
+            os.environ["TOKENIZERS_PARALLELISM"] = "false"
+            ctx = multiprocessing.get_context("fork")
+        else:
+            ctx = multiprocessing.get_context("spawn")
+
+        result_queue = ctx.Queue()
+        measure_event = ctx.Event()
+        processes = []
+        for _ in range(num_workers):
+            process = ctx.Process(target=_probe_worker,
+                                  args=(model_path, mode, time.time(), result_queue, measure_event))
+            process.start()
+            processes.append(process)
+        workers = {}
+        for _ in processes:
+            message = result_queue.get()
+            workers[message["pid"]] = message
+        measure_event.set()
+        for _ in processes:
+            message = result_queue.get()
+            workers[message["pid"]].update(message)
+        workers = list(workers.values())
+        for process in processes:
+            process.join()
+
+        results[mode] = {
+            "workers": workers,
+            "parent_load_time": parent_load_time,
+            "avg_ready_time": sum(w["ready_time"] for w in workers) / len(workers),
+            "avg_rss": sum(w["rss"] for w in workers) / len(workers),
+            "avg_pss": sum(w["pss"] for w in workers) / len(workers),
+            "avg_uss": sum(w["uss"] for w in workers) / len(workers),
+            "total_pss": sum(w["pss"] for w in workers)
+        }
+    _SHARED.clear()
+    return results
+
+
+def print_memory_benchmark(results: Dict[str, Dict], weights_mb: float):
+    """打印worker内存/启动时间对比"""
+    print(f"\n📊 多worker加载对比（权重文件 {weights_mb:.1f} MB）")
+    print(f"{'方式':<14} {'启动时间(s)':>12} {'RSS/worker':>12} {'PSS/worker':>12} {'USS/worker':>12} {'PSS总计':>10}")
+    print("-" * 78)
+    for mode, row in results.items():
+        print(f"{mode:<14} {row['avg_ready_time']:>12.2f} {row['avg_rss']:>10.1f}MB {row['avg_pss']:>10.1f}MB "
+              f"{row['avg_uss']:>10.1f}MB {row['total_pss']:>8.1f}MB")
+    shared = results.get("shared")
+    if shared:
+        print(f"   共享模式父进程映射加载耗时: {shared['parent_load_time']:.2f}s")
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="内存映射共享权重：worker内存与启动时间对比")
+    parser.add_argument("model_path", help="模型路径（safetensors格式）")
+    parser.add_argument("--workers", type=int, default=4, help="worker数")
+    parser.add_argument("--output", default=None, help="结果JSON输出路径")
+    args = parser.parse_args()
+
+    # 先校验映射加载与常规加载的输出一致
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.model_path, trust_remote_code=True)
+    inputs = tokenizer("Question: Which component sets the LDO output voltage?\n\nAnswer:", return_tensors="pt")
+    reference = AutoModelForCausalLM.from_pretrained(args.model_path, torch_dtype="auto",
+                                                     trust_remote_code=True).eval()
+    with torch.no_grad():
+        expected = reference(**inputs).logits.float()
+        actual = load_shared_model(args.model_path)(**inputs).logits.float()
+    print(f"✅ 映射加载与from_pretrained的logits最大差异: {(expected - actual).abs().max().item():.2e}")
+    del reference
+
+    weights_mb = sum(os.path.getsize(path) for path in safetensors_files(args.model_path)) / 1024 / 1024
+    results = benchmark_worker_memory(args.model_path, args.workers)
+    print_memory_benchmark(results, weights_mb)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"weights_mb": weights_mb, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线策略表优化 (Offline Strategy-map Optimizer)
+在已归档的 题目 × 策略 × 选项 logit张量上用NumPy计算最优的逐题策略分配和按路由类型的策略分配，
+用k折交叉验证衡量按题目索引的策略表的过拟合程度；全程不调用模型，
+输出与 reasoningv_tqa_pattern_optimization_results.json 相同的格式，可直接被 load_optimized_configs 加载
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from logit_archive import DEFAULT_ARCHIVE_DIR, LogitArchive, template_label
+from question_ids import assign_question_ids
+from question_router import QuestionRouter
+
+DEFAULT_PROMPT = "Question: {question}\n\nOptions:\n{options}\n\nAnswer:"
+
+
+def strategy_scores(logits: np.ndarray, groundtruth: Sequence[str], letters: Sequence[str]) -> Dict[str, np.ndarray]:
+    """
+    张量 [题数, 策略数, 选项数] -> 每个 (题目, 策略) 是否答对、是否有logits、标准答案的概率
+
+    Returns:
+        {correct: [Q, S] bool, available: [Q, S] bool, gt_prob: [Q, S]}
+    """
+    available = ~np.isnan(logits).any(axis=2)
+    filled = np.nan_to_num(logits.astype(np.float64), nan=-np.inf)
+    top = filled.max(axis=2, keepdims=True)
+    weights = np.exp(filled - np.where(np.isfinite(top), top, 0.0))
+    totals = weights.sum(axis=2, keepdims=True)
+    probs = np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+
+    letter_index = {letter: i for i, letter in enumerate(letters)}
+    gt = np.array([letter_index.get(str(g).strip(), -1) for g in groundtruth])
+    known = gt >= 0
+    gt_prob = np.zeros(available.shape)
+    gt_prob[known] = probs[known, :, gt[known]]
+    correct = available & known[:, None] & (filled.argmax(axis=2) == np.maximum(gt, 0)[:, None])
+    return {"correct": correct, "available": available, "gt_prob": np.where(available, gt_prob, 0.0)}
+
+
+def assign_per_question(correct: np.ndarray, gt_prob: np.ndarray, base: int) -> np.ndarray:
+    """
+    逐题分配：基础策略答对的题保持基础策略，否则选答对的策略中标准答案概率最高的（都答错时保持基础策略）
+
+    Returns:
+        [Q] 策略序号
+    """
+    assignment = np.full(correct.shape[0], base)
+    rescue = ~correct[:, base] & correct.any(axis=1)
+    ranked = np.where(correct, gt_prob, -1.0)
+    assignment[rescue] = ranked[rescue].argmax(axis=1)
+    return assignment
+
+
+def assign_per_group(correct: np.ndarray, gt_prob: np.ndarray, groups: np.ndarray, num_groups: int,
+                     base: int) -> np.ndarray:
+    """
+    按组分配：每组选答对题数最多的策略（平局时优先基础策略，再比标准答案概率之和；空组为基础策略）
+
+    Returns:
+        [G] 每组的策略序号
+    """
+    one_hot = np.zeros((len(groups), num_groups))
+    one_hot[np.arange(len(groups)), groups] = 1.0
+    counts = one_hot.T @ correct.astype(np.float64)
+    mass = one_hot.T @ gt_prob
+    assignment = np.full(num_groups, base)
+    for g in range(num_groups):
+        if one_hot[:, g].any():
+            assignment[g] = max(range(counts.shape[1]), key=lambda s: (counts[g, s], s == base, mass[g, s]))
+    return assignment
+
+
+def accuracy_of(correct: np.ndarray, assignment: np.ndarray, rows: Optional[np.ndarray] = None) -> float:
+    """按逐题分配计算准确率（百分数）"""
+    rows = np.arange(correct.shape[0]) if rows is None else rows
+    if len(rows) == 0:
+        return 0.0
+    return float(correct[rows, assignment[rows]].mean() * 100)
+
+
+def cross_validate(correct: np.ndarray, gt_prob: np.ndarray, groups: np.ndarray, num_groups: int, base: int,
+                   folds: int = 5, seed: int = 0) -> Dict[str, Dict]:
+    """
+    k折交叉验证：在k-1折上求策略分配，在留出折上评估
+    （按题目索引的策略表对没见过的题目不起作用，留出折只能使用基础策略，训练/留出差距即过拟合程度）
+
+    Returns:
+        {per_question / per_router_type: {train, test, test_std, gap}}
+    """
+    order = np.random.default_rng(seed).permutation(correct.shape[0])
+    scores = {"per_question": {"train": [], "test": []}, "per_router_type": {"train": [], "test": []}}
+    for held_out in np.array_split(order, folds):
+        train = np.setdiff1d(order, held_out)
+        # 逐题：训练折用学到的表，留出折的题目不在表中，回退到基础策略
+        per_question = np.full(correct.shape[0], base)
+        per_question[train] = assign_per_question(correct[train], gt_prob[train], base)
+        scores["per_question"]["train"].append(accuracy_of(correct, per_question, train))
+        scores["per_question"]["test"].append(accuracy_of(correct, per_question, held_out))
+        # 按路由类型：训练折学到的类型->策略映射同样适用于留出折
+        per_group = assign_per_group(correct[train], gt_prob[train], groups[train], num_groups, base)[groups]
+        scores["per_router_type"]["train"].append(accuracy_of(correct, per_group, train))
+        scores["per_router_type"]["test"].append(accuracy_of(correct, per_group, held_out))
+
+    report = {}
+    for name, values in scores.items():
+        train, test = np.mean(values["train"]), np.mean(values["test"])
+        report[name] = {"train": float(train), "test": float(test), "test_std": float(np.std(values["test"])),
+                        "gap": float(train - test)}
+    return report
+
+
+class StrategyMapOptimizer:
+    """在 题目 × 策略 × 选项 logit张量上离线优化策略表"""
+
+    def __init__(self, logits: np.ndarray, groundtruth: Sequence[str], letters: Sequence[str],
+                 strategies: List[Dict], router_types: Sequence[str], base: int = 0,
+                 question_ids: Optional[Sequence[str]] = None):
+        """
+        Args:
+            logits: [题数, 策略数, 选项数]，某策略没有评估的题目为NaN（不会被分配到该策略）
+            groundtruth: 每题的标准答案字母
+            letters: 选项字母（logits最后一维的顺序）
+            strategies: 每个策略的 {label, prompt, params}
+            router_types: 每题的路由类型
+            base: 基础策略序号（不在策略表中的题目使用基础策略）
+            question_ids: 每题的题目ID（策略表的键，默认为位置）
+        """
+        self.strategies = strategies
+        self.base = base
+        self.num_questions = logits.shape[0]
+        self.question_ids = [str(q) for q in question_ids] if question_ids is not None \
+            else [str(i) for i in range(self.num_questions)]
+        scores = strategy_scores(logits, groundtruth, letters)
+        self.correct, self.available, self.gt_prob = scores["correct"], scores["available"], scores["gt_prob"]
+        self.type_names, self.groups = np.unique(np.asarray(router_types, dtype=str), return_inverse=True)
+        self.groups = self.groups.reshape(-1)
+
+    def optimize(self, folds: int = 5, seed: int = 0) -> Dict:
+        """
+        计算逐题和按路由类型的最优分配及交叉验证结果
+
+        Returns:
+            {base_accuracy, oracle_accuracy, coverage, per_question: {assignment, accuracy},
+             per_router_type: {types, assignment, accuracy}, cross_validation}
+        """
+        base_assignment = np.full(self.num_questions, self.base)
+        per_question = assign_per_question(self.correct, self.gt_prob, self.base)
+        type_assignment = assign_per_group(self.correct, self.gt_prob, self.groups, len(self.type_names), self.base)
+        per_type = type_assignment[self.groups]
+        return {
+            "base_accuracy": accuracy_of(self.correct, base_assignment),
+            "oracle_accuracy": float(self.correct.any(axis=1).mean() * 100) if self.num_questions else 0.0,
+            "coverage": {s["label"]: int(self.available[:, i].sum()) for i, s in enumerate(self.strategies)},
+            "per_question": {"assignment": per_question, "accuracy": accuracy_of(self.correct, per_question)},
+            "per_router_type": {
+                "types": {str(name): self.strategies[s]["label"] for name, s in zip(self.type_names, type_assignment)},
+                "assignment": per_type,
+                "accuracy": accuracy_of(self.correct, per_type)
+            },
+            "cross_validation": cross_validate(self.correct, self.gt_prob, self.groups, len(self.type_names),
+                                               self.base, folds, seed) if folds > 1 else {}
+        }
+
+    def strategy_map(self, assignment: np.ndarray) -> Dict[str, Dict]:
+        """逐题分配 -> strategy_map（只记录非基础策略的题目，键为题目ID）"""
+        return {self.question_ids[i]: {"prompt": self.strategies[s]["prompt"], "params": self.strategies[s]["params"]}
+                for i, s in enumerate(assignment) if s != self.base}
+
+    def write_config(self, path: str, report: Dict, kind: str = "per_question"):
+        """按 reasoningv_tqa_pattern_optimization_results.json 的格式写出策略表"""
+        assignment = report[kind]["assignment"]
+        accuracy = report[kind]["accuracy"]
+        correct_count = int(self.correct[np.arange(self.num_questions), assignment].sum())
+        output = {
+            "optimization_results": {
+                "best_accuracy": accuracy,
+                "improvement": accuracy - report["base_accuracy"],
+                "result": {
+                    "accuracy": accuracy,
+                    "correct_count": correct_count,
+                    "total_questions": self.num_questions,
+                    "strategy_map": self.strategy_map(assignment),
+                    "strategy_map_keys": "question_id"
+                }
+            },
+            "current_best_accuracy": accuracy,
+            "offline_optimization": {
+                "assignment": kind,
+                "base_strategy": self.strategies[self.base]["label"],
+                "base_accuracy": report["base_accuracy"],
+                "oracle_accuracy": report["oracle_accuracy"],
+                "router_type_strategies": report["per_router_type"]["types"],
+                "cross_validation": report["cross_validation"]
+            },
+            "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+
+
+def load_archived_strategies(archive: LogitArchive, task_name: str, base_strategy: str = DEFAULT_PROMPT) -> Dict:
+    """
+    从归档读取可写入策略表的策略（元数据中有提示词模板的，Few-shot策略除外），基础策略排在第0位；
+    候选按归档键（完整提示词模板）读取，前缀标签相同的模板各是一个候选，写出的提示词就是被打分的模板
+
+    Args:
+        base_strategy: 基础策略的归档键（提示词模板），或归档中唯一的显示标签
+
+    Returns:
+        LogitArchive.stack 的结果，另含 strategy_configs: [{label, prompt, params}]
+    """
+    metas = {key: archive.load(task_name, key)["meta"] for key in archive.strategies(task_name)}
+    keys = [key for key, meta in metas.items() if meta.get("prompt")]
+    labels = {key: metas[key].get("label", key) for key in keys}
+    if base_strategy in keys:
+        base_key = base_strategy
+    else:
+        matches = [key for key in keys if labels[key] == base_strategy]
+        if len(matches) != 1:
+            raise ValueError(f"归档中没有唯一的基础策略 {base_strategy!r}（可用: {list(labels.values())}）")
+        base_key = matches[0]
+    keys.remove(base_key)
+    stacked = archive.stack(task_name, [base_key] + keys)
+    stacked["strategy_configs"] = [{"label": labels[key], "prompt": meta["prompt"], "params": meta.get("params", {})}
+                                   for key, meta in zip(stacked["strategies"], stacked["meta"])]
+    return stacked
+
+
+def print_optimization_report(report: Dict, strategies: List[Dict]):
+    """打印离线优化结果"""
+    print(f"\n🧭 离线策略表优化（{len(strategies)} 个候选策略）")
+    for label, covered in report["coverage"].items():
+        print(f"   候选 {label}: {covered} 题有logits")
+    print(f"   基础策略准确率: {report['base_accuracy']:.2f}%")
+    print(f"   逐题分配准确率: {report['per_question']['accuracy']:.2f}% (上限 {report['oracle_accuracy']:.2f}%)")
+    print(f"   按路由类型分配准确率: {report['per_router_type']['accuracy']:.2f}%")
+    for type_name, label in report["per_router_type"]["types"].items():
+        print(f"      {type_name} -> {label}")
+    if report["cross_validation"]:
+        print(f"   交叉验证（训练 / 留出 / 差距）:")
+        for name, stats in report["cross_validation"].items():
+            print(f"      {name}: {stats['train']:.2f}% / {stats['test']:.2f}% ± {stats['test_std']:.2f} / "
+                  f"{stats['gap']:.2f}")
+
+
+def test_strategy_optimizer():
+    """测试离线优化：逐题分配达到上限但留出折退回基础策略，按类型分配能泛化"""
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    n, letters = 3000, ["A", "B", "C", "D", "E"]
+    groundtruth = np.asarray(letters[:4])[rng.integers(0, 4, n)]
+    types = np.asarray(["factual", "reasoning", "calculation"])[rng.integers(0, 3, n)]
+    gt_index = np.searchsorted(letters, groundtruth)
+    # 策略0在所有类型上70%正确，策略1在reasoning类型上90%正确、其他类型50%
+    hit = np.stack([rng.random(n) < 0.7, rng.random(n) < np.where(types == "reasoning", 0.9, 0.5)], axis=1)
+    logits = rng.normal(size=(n, 2, len(letters)))
+    wrong = (gt_index + 1) % 4
+    for s in range(2):
+        logits[np.arange(n), s, np.where(hit[:, s], gt_index, wrong)] += 10.0
+    logits[:5, 1] = np.nan
+    strategies = [{"label": "Question:", "prompt": DEFAULT_PROMPT, "params": {}},
+                  {"label": "Analyze carefully:", "prompt": "Analyze carefully: " + DEFAULT_PROMPT, "params": {}}]
+
+    start = time.perf_counter()
+    optimizer = StrategyMapOptimizer(logits, groundtruth, letters, strategies, types)
+    report = optimizer.optimize(folds=5)
+    elapsed = time.perf_counter() - start
+    assert abs(report["base_accuracy"] - hit[:, 0].mean() * 100) < 1e-9
+    assert abs(report["per_question"]["accuracy"] - report["oracle_accuracy"]) < 1e-9
+    assert report["per_router_type"]["types"] == {"calculation": "Question:", "factual": "Question:",
+                                                  "reasoning": "Analyze carefully:"}
+    cv = report["cross_validation"]
+    assert abs(cv["per_question"]["test"] - report["base_accuracy"]) < 2.0 and cv["per_question"]["gap"] > 5.0
+    assert cv["per_router_type"]["test"] > report["base_accuracy"] + 3.0
+    assert not (report["per_question"]["assignment"][:5] == 1).any()
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "tqa.json")
+        optimizer.write_config(path, report, "per_router_type")
+        with open(path, 'r', encoding='utf-8') as f:
+            result = json.load(f)["optimization_results"]["result"]
+        assert len(result["strategy_map"]) == int((types == "reasoning").sum())
+        assert set(result["strategy_map"]) <= set(optimizer.question_ids)
+        assert result["correct_count"] == round(report["per_router_type"]["accuracy"] * n / 100)
+
+        # 前缀标签相同（都是"Question:"）的模板按完整模板归档，读回后各自是一个候选
+        templates = [DEFAULT_PROMPT] + [DEFAULT_PROMPT.replace("Answer:", f"Pay special attention to option {letter}. "
+                                                                          "Answer:") for letter in "AB"]
+        archive = LogitArchive("tiny", root)
+        question_ids = [str(i) for i in range(n)]
+        for s, template in enumerate(templates):
+            archive.save("TQA Task", template, logits[:, min(s, 1)] + s * 1e-3, groundtruth, question_ids,
+                         {"prompt": template, "params": {}, "label": template_label(template)})
+        stacked = load_archived_strategies(LogitArchive("tiny", root), "TQA Task")
+        configs = stacked["strategy_configs"]
+        assert [c["prompt"] for c in configs] == templates
+        assert len({c["label"] for c in configs}) == 3 and all(c["label"].startswith("Question:") for c in configs)
+        for s in range(3):
+            assert np.allclose(stacked["logits"][:, s], logits[:, min(s, 1)] + s * 1e-3, equal_nan=True)
+        assert load_archived_strategies(archive, "TQA Task", "Question:")["strategies"][0] == DEFAULT_PROMPT
+    print(f"✅ 离线策略表优化测试通过（{n} 题，{elapsed * 1000:.1f}ms）")
+
+
+def main():
+    """命令行入口：从logit归档读取候选策略，离线优化并写出策略表"""
+    parser = argparse.ArgumentParser(description="在已归档的选项logits上离线优化策略表（不调用模型）")
+    parser.add_argument("--model", default="ReasoningV-7B", help="归档中的模型名（模型目录名）")
+    parser.add_argument("--archive-dir", default=DEFAULT_ARCHIVE_DIR, help="选项logit归档目录")
+    parser.add_argument("--task", default="TQA Task", help="任务名")
+    parser.add_argument("--data-file", default="TQA Task/TQA Task.json", help="任务数据文件（计算路由类型）")
+    parser.add_argument("--base-strategy", default=DEFAULT_PROMPT, help="基础策略（提示词模板，或唯一的显示标签）")
+    parser.add_argument("--assignment", choices=["per_question", "per_router_type"], default="per_question",
+                        help="写出哪种分配")
+    parser.add_argument("--folds", type=int, default=5, help="交叉验证折数（<2表示不做交叉验证）")
+    parser.add_argument("--seed", type=int, default=0, help="交叉验证划分的随机种子")
+    parser.add_argument("--output", default="results/reasoningv_tqa_offline_strategy_map.json",
+                        help="输出文件（与reasoningv_tqa_pattern_optimization_results.json格式相同）")
+    parser.add_argument("--self-test", action="store_true", help="只运行自检")
+    args = parser.parse_args()
+
+    if args.self_test:
+        test_strategy_optimizer()
+        return
+
+    archive = LogitArchive(args.model, args.archive_dir)
+    stacked = load_archived_strategies(archive, args.task, args.base_strategy)
+    with open(args.data_file, 'r', encoding='utf-8') as f:
+        questions = json.load(f)
+    # 归档按题目ID与数据文件对齐（与两边的题目顺序无关）
+    by_id = dict(zip(assign_question_ids(questions), questions))
+    missing = [qid for qid in stacked["question_ids"] if qid not in by_id]
+    if missing:
+        raise ValueError(f"归档中有 {len(missing)} 题不在数据文件 {args.data_file} 中（如 {missing[0]}）")
+    router = QuestionRouter()
+    router_types = [router.classify_question(by_id[qid].get("question", ""))[0].value
+                    for qid in stacked["question_ids"]]
+
+    optimizer = StrategyMapOptimizer(stacked["logits"], stacked["groundtruth"], stacked["letters"],
+                                     stacked["strategy_configs"], router_types,
+                                     question_ids=stacked["question_ids"])
+    report = optimizer.optimize(args.folds, args.seed)
+    print_optimization_report(report, stacked["strategy_configs"])
+    optimizer.write_config(args.output, report, args.assignment)
+    print(f"\n✅ 策略表已保存到: {args.output}（{args.assignment}）")
+
+
+if __name__ == "__main__":
+    main()
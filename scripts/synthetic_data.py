@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AMSBench格式合成数据生成器 (Synthetic AMSBench Data Generator)
+按真实数据的目录结构和字段（question, options, ground_truth/groundtruth, level）
+生成任意规模的任务数据，用于测试加载、路由和评估流程在10×/100×规模下的表现；
+题目数、选项长度分布和路由关键词比例均可配置，固定种子可复现
+"""
+
+import json
+import math
+import os
+import random
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+# 每种路由类型的题干开头（命中QuestionRouter中对应类型的关键词，且不命中其他类型）
+ROUTER_PHRASES = {
+    "factual": ["What is the role of", "Which of the following describes", "Define the", "What does the"],
+    "reasoning": ["Why does", "How does", "Explain why", "What causes"],
+    "calculation": ["Calculate", "Compute", "Determine", "Find"],
+    "analysis": ["Analyze", "Evaluate", "Examine", "Compare"],
+    "comparison": ["Which topology is preferred for", "Which is the best choice for", "Which circuit is superior for"],
+    "none": ["In a typical design,", "For the given circuit,", "Consider the"]
+}
+
+# 题干和选项的填充词（不含任何路由关键词）
+CIRCUIT_WORDS = ("LDO pass transistor error amplifier bandgap reference comparator hysteresis opamp "
+                 "loop gain bandwidth phase margin dropout voltage load current PSRR offset noise "
+                 "slew rate capacitor resistor divider output stage input pair mirror bias "
+                 "supply ripple regulator").split()
+
+# 默认比例（level比例参考真实TQA数据：Graduate约49%，Undergraduate约42%，Unknown约9%）
+DEFAULT_KEYWORD_MIX = {"factual": 0.3, "reasoning": 0.2, "calculation": 0.2,
+                       "analysis": 0.15, "comparison": 0.1, "none": 0.05}
+DEFAULT_LEVEL_MIX = {"Graduate": 0.49, "Undergraduate": 0.42, "Unknown": 0.09}
+
+# 与ReasoningVFullValidation.tasks一致的AMSBench目录结构
+AMSBENCH_LAYOUT = {
+    "LDO Task": {"data_dir": "reasoning_task/LDO/LDO_QA/", "groundtruth_field": "ground_truth"},
+    "Comparator Task": {"data_dir": "reasoning_task/Comparator/comparator_QA/", "groundtruth_field": "ground_truth"},
+    "Bandgap Task": {"data_dir": "reasoning_task/Bandgap/bandgap_QA/", "groundtruth_field": "ground_truth"},
+    "TQA Task": {"data_file": "TQA Task/TQA Task.json", "groundtruth_field": "groundtruth"},
+    "Caption Task": {"data_dir": "Caption_task/test_QA_caption/", "groundtruth_field": "ground_truth"},
+    "Opamp Task": {"data_dir": "reasoning_task/Opamp/test_QA_opamp/", "groundtruth_field": "ground_truth"}
+}
+
+
+def parse_length_spec(spec: str) -> Callable[[random.Random], int]:
+    """
+    解析长度分布（单位：词）
+
+    - "fixed:8"          固定8个词
+    - "uniform:2-12"     2到12之间均匀分布
+    - "lognormal:2.0,0.6" 对数正态分布（mu, sigma），长尾，适合模拟偶尔很长的选项
+    """
+    kind, _, args = spec.partition(":")
+    if kind == "fixed":
+        length = int(args)
+        return lambda rng: length
+    if kind == "uniform":
+        low, high = (int(x) for x in args.split("-"))
+        return lambda rng: rng.randint(low, high)
+    if kind == "lognormal":
+        mu, sigma = (float(x) for x in args.split(","))
+        return lambda rng: max(1, int(round(rng.lognormvariate(mu, sigma))))
+    raise ValueError(f"不支持的长度分布: {spec}")
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """解析比例字符串，如 "factual=0.5,reasoning=0.5"（无需归一化）"""
+    mix = {}
+    for part in spec.split(","):
+        key, _, value = part.partition("=")
+        mix[key.strip()] = float(value)
+    return mix
+
+
+class SyntheticTaskGenerator:
+    """合成任务生成器 - 同一种子、同一参数生成完全相同的数据"""
+
+    def __init__(self, seed: int = 0, keyword_mix: Optional[Dict[str, float]] = None,
+                 option_length: str = "lognormal:1.8,0.6", question_length: str = "uniform:6-30",
+                 num_options: int = 4, level_mix: Optional[Dict[str, float]] = None):
+        """
+        初始化生成器
+
+        Args:
+            seed: 随机种子
+            keyword_mix: 路由类型比例（factual/reasoning/calculation/analysis/comparison/none）
+            option_length: 选项长度分布（见parse_length_spec）
+            question_length: 题干填充部分的长度分布
+            num_options: 每题选项数（A开始的连续字母）
+            level_mix: 难度级别比例
+        """
+        self.seed = seed
+        self.keyword_mix = keyword_mix or DEFAULT_KEYWORD_MIX
+        self.level_mix = level_mix or DEFAULT_LEVEL_MIX
+        unknown = set(self.keyword_mix) - set(ROUTER_PHRASES)
+        if unknown:
+            raise ValueError(f"未知的路由类型: {sorted(unknown)}")
+        self.option_length = parse_length_spec(option_length)
+        self.question_length = parse_length_spec(question_length)
+        self.option_keys = [chr(ord("A") + i) for i in range(num_options)]
+        self.settings = {
+            "seed": seed, "keyword_mix": self.keyword_mix, "option_length": option_length,
+            "question_length": question_length, "num_options": num_options, "level_mix": self.level_mix
+        }
+
+    @staticmethod
+    def _weighted_choice(rng: random.Random, mix: Dict[str, float]) -> str:
+        return rng.choices(list(mix.keys()), weights=list(mix.values()))[0]
+
+    def _words(self, rng: random.Random, count: int) -> str:
+        return " ".join(rng.choice(CIRCUIT_WORDS) for _ in range(count))
+
+    def question(self, rng: random.Random, groundtruth_field: str = "ground_truth",
+                 include_labels: bool = False) -> Dict[str, Any]:
+        """
+        生成一道题目
+
+        Args:
+            include_labels: 是否附带生成时的路由类型（router_type字段，真实数据中没有）
+        """
+        router_type = self._weighted_choice(rng, self.keyword_mix)
+        phrase = rng.choice(ROUTER_PHRASES[router_type])
+        item = {
+            "question": f"{phrase} {self._words(rng, self.question_length(rng))}?",
+            "options": {key: self._words(rng, self.option_length(rng)) for key in self.option_keys},
+            groundtruth_field: rng.choice(self.option_keys),
+            "level": self._weighted_choice(rng, self.level_mix)
+        }
+        if include_labels:
+            item["router_type"] = router_type
+        return item
+
+    def generate(self, num_questions: int, groundtruth_field: str = "ground_truth", stream: str = "",
+                 include_labels: bool = False) -> List[Dict[str, Any]]:
+        """
+        生成题目列表
+
+        Args:
+            stream: 随机流名称（不同任务使用不同的流，互不影响且各自可复现）
+        """
+        rng = random.Random(f"{self.seed}:{stream}")
+        return [self.question(rng, groundtruth_field, include_labels) for _ in range(num_questions)]
+
+    def write_directory_task(self, data_dir: str, num_questions: int, groundtruth_field: str = "ground_truth",
+                             stream: str = "") -> int:
+        """写入目录模式任务（每题一个JSON文件，文件名按序号补零，排序即生成顺序）"""
+        os.makedirs(data_dir, exist_ok=True)
+        width = max(5, len(str(num_questions)))
+        for i, item in enumerate(self.generate(num_questions, groundtruth_field, stream)):
+            with open(os.path.join(data_dir, f"question_{i:0{width}d}.json"), 'w', encoding='utf-8') as f:
+                json.dump(item, f, ensure_ascii=False, indent=2)
+        return num_questions
+
+    def write_file_task(self, data_file: str, num_questions: int, groundtruth_field: str = "groundtruth",
+                        stream: str = "") -> int:
+        """写入单文件模式任务（所有题目在一个JSON列表中）"""
+        if os.path.dirname(data_file):
+            os.makedirs(os.path.dirname(data_file), exist_ok=True)
+        with open(data_file, 'w', encoding='utf-8') as f:
+            json.dump(self.generate(num_questions, groundtruth_field, stream), f, ensure_ascii=False, indent=2)
+        return num_questions
+
+    def write_amsbench(self, root: str, num_questions: int, tasks: Optional[Dict[str, Dict]] = None,
+                       task_names: Optional[List[str]] = None) -> Dict[str, str]:
+        """
+        按AMSBench目录结构写入所有任务
+
+        Args:
+            root: 输出根目录（验证器的工作目录）
+            num_questions: 每个任务的题目数
+            tasks: 任务配置（格式同ReasoningVFullValidation.tasks），默认AMSBENCH_LAYOUT
+            task_names: 只生成其中部分任务
+
+        Returns:
+            {任务名称: 写入路径}
+        """
+        tasks = tasks or AMSBENCH_LAYOUT
+        written = {}
+        for task_name, task_config in tasks.items():
+            if task_names and task_name not in task_names:
+                continue
+            field = task_config["groundtruth_field"]
+            if "data_file" in task_config:
+                path = os.path.join(root, task_config["data_file"])
+                self.write_file_task(path, num_questions, field, stream=task_name)
+            else:
+                path = os.path.join(root, task_config["data_dir"])
+                self.write_directory_task(path, num_questions, field, stream=task_name)
+            written[task_name] = path
+        return written
+
+    def describe(self, items: List[Dict[str, Any]], groundtruth_field: str = "ground_truth") -> Dict[str, Any]:
+        """统计生成结果（路由类型、级别、答案分布和选项长度），带router_type时同时检查路由一致率"""
+        option_lengths = [len(text.split()) for item in items for text in item["options"].values()]
+        stats = {
+            "num_questions": len(items),
+            "levels": dict(Counter(item["level"] for item in items)),
+            "answers": dict(Counter(item[groundtruth_field] for item in items)),
+            "option_words": {
+                "mean": sum(option_lengths) / len(option_lengths) if option_lengths else 0,
+                "max": max(option_lengths, default=0),
+                "p95": sorted(option_lengths)[int(math.ceil(0.95 * len(option_lengths))) - 1] if option_lengths else 0
+            }
+        }
+        if items and "router_type" in items[0]:
+            from question_router import QuestionRouter
+            router = QuestionRouter()
+            stats["router_types"] = dict(Counter(item["router_type"] for item in items))
+            # "none"类型没有关键词，路由器回退为factual
+            agree = sum(
+                router.classify_question(item["question"])[0].value
+                == (item["router_type"] if item["router_type"] != "none" else "factual")
+                for item in items
+            )
+            stats["router_agreement"] = agree / len(items)
+        return stats
+
+
+def test_generator():
+    """测试生成器：可复现性、字段格式、路由一致率"""
+    generator = SyntheticTaskGenerator(seed=7, keyword_mix={"reasoning": 1, "calculation": 1, "none": 1},
+                                       option_length="uniform:3-5", num_options=5)
+    first = generator.generate(200, include_labels=True)
+    second = SyntheticTaskGenerator(seed=7, keyword_mix={"reasoning": 1, "calculation": 1, "none": 1},
+                                    option_length="uniform:3-5", num_options=5).generate(200, include_labels=True)
+    assert first == second
+    assert all(set(item["options"]) == set("ABCDE") and item["ground_truth"] in "ABCDE" for item in first)
+    assert all(3 <= len(text.split()) <= 5 for item in first for text in item["options"].values())
+
+    stats = generator.describe(first)
+    print(f"   路由类型: {stats['router_types']}")
+    print(f"   路由一致率: {stats['router_agreement'] * 100:.1f}%")
+    assert stats["router_agreement"] == 1.0
+    print("✅ 生成器测试通过")
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="AMSBench格式合成数据生成器")
+    parser.add_argument("output_root", nargs="?", default=None, help="输出根目录（不提供时只运行自检）")
+    parser.add_argument("--questions", type=int, default=1000, help="每个任务的题目数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--tasks", default=None, help="只生成部分任务，逗号分隔，如 \"LDO Task,TQA Task\"")
+    parser.add_argument("--option-length", default="lognormal:1.8,0.6",
+                        help="选项长度分布（词）：fixed:N / uniform:A-B / lognormal:MU,SIGMA")
+    parser.add_argument("--question-length", default="uniform:6-30", help="题干长度分布（词）")
+    parser.add_argument("--num-options", type=int, default=4, help="每题选项数")
+    parser.add_argument("--keyword-mix", default=None,
+                        help="路由类型比例，如 factual=0.4,reasoning=0.3,calculation=0.3")
+    parser.add_argument("--level-mix", default=None, help="难度比例，如 Graduate=0.5,Undergraduate=0.5")
+    args = parser.parse_args()
+
+    if args.output_root is None:
+        test_generator()
+        return
+
+    generator = SyntheticTaskGenerator(
+        seed=args.seed,
+        keyword_mix=parse_mix(args.keyword_mix) if args.keyword_mix else None,
+        option_length=args.option_length,
+        question_length=args.question_length,
+        num_options=args.num_options,
+        level_mix=parse_mix(args.level_mix) if args.level_mix else None
+    )
+    task_names = [name.strip() for name in args.tasks.split(",")] if args.tasks else None
+    written = generator.write_amsbench(args.output_root, args.questions, task_names=task_names)
+
+    print(f"📁 已生成 {len(written)} 个任务 × {args.questions} 题 → {args.output_root}")
+    for task_name, path in written.items():
+        print(f"   {task_name}: {path}")
+
+    stats = generator.describe(generator.generate(min(args.questions, 2000), include_labels=True))
+    print(f"   路由类型: {stats['router_types']} (路由一致率 {stats['router_agreement'] * 100:.1f}%)")
+    print(f"   难度级别: {stats['levels']}")
+    print(f"   选项长度: 平均 {stats['option_words']['mean']:.1f} 词, P95 {stats['option_words']['p95']} 词, "
+          f"最长 {stats['option_words']['max']} 词")
+
+    with open(os.path.join(args.output_root, "synthetic_data_settings.json"), 'w', encoding='utf-8') as f:
+        json.dump({"questions": args.questions, "tasks": list(written), **generator.settings}, f,
+                  ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
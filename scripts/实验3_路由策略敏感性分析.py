@@ -8,8 +8,11 @@
 
 import json
 import os
-from typing import Dict, List, Any, Tuple
+import sys
+import time
+from typing import Dict, List, Any, Optional, Tuple
 from question_router import QuestionRouter, QuestionType
+from aggregation import ResultFrame
 import numpy as np
 from collections import defaultdict
 
@@ -17,13 +20,38 @@ from collections import defaultdict
 class RouterSensitivityAnalysis:
     """路由策略敏感性分析器"""
     
-    def __init__(self):
-        """初始化分析器"""
+    def __init__(self, model_path: Optional[str] = None):
+        """初始化分析器（提供model_path时可运行全前缀批量打分实验）"""
         self.router = QuestionRouter()
         self.tqa_data_file = "TQA Task/TQA Task.json"
+        self.model_path = model_path
+        self.model = None
+        self.tokenizer = None
         
         print(f"🔍 初始化路由策略敏感性分析器")
     
+    def load_model(self):
+        """加载模型（仅全前缀打分实验需要）"""
+        if self.model is not None:
+            return
+        
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+        
+        print(f"📥 正在加载模型: {self.model_path}")
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, trust_remote_code=True)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.model = AutoModelForCausalLM.from_pretrained(
+            self.model_path,
+            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+            device_map={"": 0} if torch.cuda.is_available() else None,
+            low_cpu_mem_usage=True,
+            trust_remote_code=True
+        )
+        self.model.eval()
+        print("✅ 模型加载完成")
+    
     def load_tqa_data(self) -> List[Dict]:
         """加载TQA任务数据"""
         if not os.path.exists(self.tqa_data_file):
@@ -107,10 +135,7 @@ class RouterSensitivityAnalysis:
         else:
             sampled_questions = questions
         
-        confusion_matrix = defaultdict(lambda: defaultdict(int))
-        total_by_true = defaultdict(int)
-        total_by_pred = defaultdict(int)
-        
+        true_types, pred_types = [], []
         for q in sampled_questions:
             question_text = q.get('question', '')
             if not question_text:
@@ -122,20 +147,25 @@ class RouterSensitivityAnalysis:
             # 预测类型（Router分类）
             pred_type, _ = self.router.classify_question(question_text)
             
-            confusion_matrix[true_type.value][pred_type.value] += 1
-            total_by_true[true_type.value] += 1
-            total_by_pred[pred_type.value] += 1
+            true_types.append(true_type.value)
+            pred_types.append(pred_type.value)
+        
+        # 分组计数（真实类型×预测类型）
+        frame = ResultFrame({"true_type": true_types, "pred_type": pred_types})
+        confusion_matrix = defaultdict(dict)
+        for (true_type, pred_type), count in frame.counts(["true_type", "pred_type"]).items():
+            confusion_matrix[true_type][pred_type] = count
         
         # 计算准确率
-        correct = sum(confusion_matrix[true_type.value][true_type.value] 
+        correct = sum(confusion_matrix[true_type.value].get(true_type.value, 0)
                      for true_type in QuestionType)
         total = len(sampled_questions)
         accuracy = (correct / total * 100) if total > 0 else 0
         
         return {
-            "confusion_matrix": {k: dict(v) for k, v in confusion_matrix.items()},
-            "total_by_true": dict(total_by_true),
-            "total_by_pred": dict(total_by_pred),
+            "confusion_matrix": dict(confusion_matrix),
+            "total_by_true": frame.counts("true_type"),
+            "total_by_pred": frame.counts("pred_type"),
             "accuracy": accuracy,
             "total_questions": total,
             "correct": correct
@@ -168,12 +198,8 @@ class RouterSensitivityAnalysis:
                                      confusion_matrix["total_questions"] * 100) if confusion_matrix["total_questions"] > 0 else 0
         }
     
-    def test_wrong_strategy_performance(self, questions: List[Dict], 
-                                       sample_size: int = 20) -> Dict:
-        """测试错误策略的性能损失"""
-        print(f"\n🧪 测试错误策略的性能损失（样本数: {sample_size}）...")
-        
-        # 选择典型问题（每种类型选几个）
+    def select_typical_questions(self, questions: List[Dict], sample_size: int) -> List[Dict]:
+        """按类型选择典型问题（每种类型选几个，固定种子保证可重复）"""
         type_questions = defaultdict(list)
         
         for q in questions:
@@ -200,6 +226,15 @@ class RouterSensitivityAnalysis:
         if len(selected_questions) > sample_size:
             selected_questions = selected_questions[:sample_size]
         
+        return selected_questions
+    
+    def test_wrong_strategy_performance(self, questions: List[Dict], 
+                                       sample_size: int = 20) -> Dict:
+        """测试错误策略的性能损失"""
+        print(f"\n🧪 测试错误策略的性能损失（样本数: {sample_size}）...")
+        
+        selected_questions = self.select_typical_questions(questions, sample_size)
+        
         # 测试正确策略 vs 错误策略
         results = {}
         
@@ -236,8 +271,109 @@ class RouterSensitivityAnalysis:
             "cases": results
         }
     
+    def test_all_prefix_performance(self, questions: List[Dict], sample_size: int = 20,
+                                    groundtruth_field: str = "groundtruth") -> Dict:
+        """
+        全前缀批量打分：每道题在所有路由前缀下打分，得到 题目×策略 的正确性矩阵，
+        直接测量（而非推断）使用错误策略的性能损失
+        
+        同一道题的各前缀提示词排在同一批中一次前向完成；
+        前缀文本相同的策略（如推理类和分析类都使用"Analyze carefully:"）只计算一次
+        
+        限制：路由前缀位于{question}之前，因果注意力下题目token的KV依赖各自的前缀，
+        题目token不能在前缀变体之间共享——每个变体都完整预填充一次，批量只减少了前向调用次数
+        """
+        from option_scorer import OptionLetterScorer
+        
+        print(f"\n🧪 全前缀批量打分（样本数: {sample_size}）...")
+        self.load_model()
+        scorer = OptionLetterScorer(self.model, self.tokenizer)
+        
+        strategies = [qtype.value for qtype in QuestionType]
+        strategy_prefix = {qtype.value: self.router.rules[qtype]["prompt_prefix"] for qtype in QuestionType}
+        unique_prefixes = list(dict.fromkeys(strategy_prefix.values()))
+        
+        selected_questions = [
+            q for q in self.select_typical_questions(questions, sample_size)
+            if q.get('question') and q.get('options') and q.get(groundtruth_field)
+        ]
+        
+        prompts = []
+        for q in selected_questions:
+            options_str = "\n".join(f"{key}. {value}" for key, value in q['options'].items())
+            for prefix in unique_prefixes:
+                template = f"{prefix} {{question}}\n\nOptions:\n{{options}}\n\nAnswer:"
+                prompts.append(template.format(question=q['question'], options=options_str))
+        
+        start_time = time.time()
+        # 每批包含若干道题的全部前缀变体
+        batch_size = len(unique_prefixes) * max(1, scorer.batch_size // len(unique_prefixes))
+        scores = scorer.score_prompts(prompts, batch_size=batch_size)
+        elapsed = time.time() - start_time
+        
+        matrix = []
+        for qi, q in enumerate(selected_questions):
+            valid_letters = list(q['options'].keys())
+            ground_truth = q[groundtruth_field]
+            predicted_by_prefix = {}
+            for pi, prefix in enumerate(unique_prefixes):
+                row_logits = scores["letter_logits"][qi * len(unique_prefixes) + pi]
+                predicted_by_prefix[prefix] = OptionLetterScorer.pick_letter(row_logits, valid_letters)
+            
+            router_type, _ = self.router.classify_question(q['question'])
+            matrix.append({
+                "question": q['question'],
+                "ground_truth": ground_truth,
+                "router_strategy": router_type.value,
+                "true_type": self.manually_classify_question(q['question']).value,
+                "predicted": {name: predicted_by_prefix[strategy_prefix[name]] for name in strategies},
+                "correct": {name: predicted_by_prefix[strategy_prefix[name]] == ground_truth for name in strategies}
+            })
+        
+        total = len(matrix)
+        # 题目×策略 正确性矩阵，按列/按行归约
+        correct = np.array([[row["correct"][name] for name in strategies] for row in matrix],
+                           dtype=bool).reshape(total, len(strategies))
+        router_column = np.array([strategies.index(row["router_strategy"]) for row in matrix], dtype=np.int64)
+        router_hit = correct[np.arange(total), router_column]
+        strategy_accuracy = {
+            name: float(correct[:, s].mean() * 100) if total > 0 else 0
+            for s, name in enumerate(strategies)
+        }
+        router_correct = int(router_hit.sum())
+        wrong_correct = float(((correct.sum(axis=1) - router_hit) / (len(strategies) - 1)).sum())
+        oracle_correct = int(correct.any(axis=1).sum())
+        
+        router_accuracy = (router_correct / total * 100) if total > 0 else 0
+        wrong_accuracy = (wrong_correct / total * 100) if total > 0 else 0
+        
+        # 按Router类型分组的Router策略准确率（附自助法95%置信区间）
+        frame = ResultFrame({"router_strategy": [row["router_strategy"] for row in matrix],
+                             "router_correct": router_hit})
+        by_router_type = frame.group("router_strategy", "router_correct", bootstrap=1000)
+        
+        print(f"   打分完成: {len(prompts)} 个提示词, {scores['prompt_tokens']} tokens, 用时 {elapsed:.2f}秒")
+        print(f"   Router策略准确率: {router_accuracy:.2f}%, 错误策略平均准确率: {wrong_accuracy:.2f}%")
+        sys.stdout.flush()
+        
+        return {
+            "total_tested": total,
+            "strategies": strategies,
+            "strategy_prefixes": strategy_prefix,
+            "strategy_accuracy": strategy_accuracy,
+            "router_accuracy": router_accuracy,
+            "wrong_strategy_accuracy": wrong_accuracy,
+            "wrong_strategy_cost": router_accuracy - wrong_accuracy,
+            "oracle_accuracy": (oracle_correct / total * 100) if total > 0 else 0,
+            "by_router_type": by_router_type,
+            "num_prompts": len(prompts),
+            "prompt_tokens": scores["prompt_tokens"],
+            "elapsed_time": elapsed,
+            "matrix": matrix
+        }
+    
     def generate_report(self, confusion_matrix: Dict, misclassification_impact: Dict, 
-                       wrong_strategy_results: Dict) -> str:
+                       wrong_strategy_results: Dict, all_prefix_results: Optional[Dict] = None) -> str:
         """生成分析报告"""
         report = []
         report.append("=" * 80)
@@ -263,7 +399,8 @@ class RouterSensitivityAnalysis:
         report.append("")
         # 表头
         all_types = list(QuestionType)
-        header = f"{'真实\\预测':<15}"
+        corner = "真实\\预测"
+        header = f"{corner:<15}"
         for pred_type in all_types:
             header += f"{pred_type.value:<15}"
         report.append(header)
@@ -309,6 +446,30 @@ class RouterSensitivityAnalysis:
             report.append(f"  错误策略: {case['wrong_strategy']['type']} ({case['wrong_strategy']['prefix']})")
         
         report.append("")
+        
+        # 全前缀打分矩阵（实测）
+        if all_prefix_results:
+            report.append("=" * 80)
+            report.append("4. 全前缀打分矩阵（实测）")
+            report.append("=" * 80)
+            report.append("")
+            report.append(f"测试问题数: {all_prefix_results['total_tested']}")
+            report.append(f"Router策略准确率: {all_prefix_results['router_accuracy']:.2f}%")
+            report.append(f"错误策略平均准确率: {all_prefix_results['wrong_strategy_accuracy']:.2f}%")
+            report.append(f"错误策略性能损失: {all_prefix_results['wrong_strategy_cost']:+.2f}%")
+            report.append(f"Oracle准确率（任一策略正确）: {all_prefix_results['oracle_accuracy']:.2f}%")
+            report.append("")
+            report.append("各策略准确率:")
+            for name, accuracy in all_prefix_results['strategy_accuracy'].items():
+                prefix = all_prefix_results['strategy_prefixes'][name]
+                report.append(f"  {name:<15}({prefix}): {accuracy:.2f}%")
+            report.append("")
+            report.append("按Router类型的Router策略准确率（95%置信区间）:")
+            for name, stats in all_prefix_results.get('by_router_type', {}).items():
+                report.append(f"  {name:<15}: {stats['accuracy']:.2f}% "
+                              f"[{stats['ci_low']:.2f}%, {stats['ci_high']:.2f}%] ({stats['correct']}/{stats['total']})")
+            report.append("")
+        
         report.append("=" * 80)
         report.append("结论")
         report.append("=" * 80)
@@ -327,7 +488,9 @@ def main():
     print("实验3: 路由策略敏感性分析")
     print("=" * 80)
     
-    analyzer = RouterSensitivityAnalysis()
+    # 可选：提供模型路径时运行全前缀批量打分实验
+    model_path = sys.argv[1] if len(sys.argv) > 1 else None
+    analyzer = RouterSensitivityAnalysis(model_path)
     
     # 加载TQA数据
     questions = analyzer.load_tqa_data()
@@ -346,12 +509,19 @@ def main():
     # 测试错误策略性能损失
     wrong_strategy_results = analyzer.test_wrong_strategy_performance(questions, sample_size=20)
     
+    # 全前缀批量打分（实测错误策略损失）
+    all_prefix_results = None
+    if model_path:
+        all_prefix_results = analyzer.test_all_prefix_performance(questions, sample_size=20)
+    
     # 保存结果
     results = {
         "confusion_matrix": confusion_matrix,
         "misclassification_impact": misclassification_impact,
         "wrong_strategy_results": wrong_strategy_results
     }
+    if all_prefix_results:
+        results["all_prefix_results"] = all_prefix_results
     
     output_file = "experiment3_router_sensitivity_results.json"
     with open(output_file, 'w', encoding='utf-8') as f:
@@ -359,7 +529,8 @@ def main():
     print(f"\n💾 结果已保存到: {output_file}")
     
     # 生成报告
-    report = analyzer.generate_report(confusion_matrix, misclassification_impact, wrong_strategy_results)
+    report = analyzer.generate_report(confusion_matrix, misclassification_impact, wrong_strategy_results,
+                                      all_prefix_results)
     report_file = "experiment3_router_sensitivity_report.md"
     with open(report_file, 'w', encoding='utf-8') as f:
         f.write(report)
@@ -6,17 +6,28 @@
 并对比展示ReasoningV如何通过Few-shot或Checklist避免这个错误
 """
 
+import argparse
 import json
 import os
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Optional, Tuple
 import glob
 
+from failure_mining import FailureMiner, classify_error_type
+from question_ids import QuestionIndex, assign_question_ids
+from results_store import ResultsStore, normalize_task
+
 
 class FailureCaseAnalysis:
     """失败案例分析器"""
     
-    def __init__(self):
-        """初始化分析器"""
+    def __init__(self, results_db: Optional[str] = None):
+        """
+        初始化分析器
+
+        Args:
+            results_db: 导入结果的SQLite结果库路径（None表示只在内存中导入，不写入results/）
+        """
+        self.results_db = results_db
         self.tasks = {
             "LDO Task": {
                 "data_dir": "reasoning_task/LDO/LDO_QA/",
@@ -39,6 +50,10 @@ class FailureCaseAnalysis:
             }
         }
         
+        self.miner = None  # 两个模型都有逐题结果时的失败挖掘器
+        self.mining = None  # 挖掘汇总（分区、分组统计、选项偏见）
+        self.question_cache = {}
+        
         print(f"🔍 初始化失败案例分析器")
         print(f"   分析任务: {list(self.tasks.keys())}")
     
@@ -50,7 +65,7 @@ class FailureCaseAnalysis:
         if "data_dir" in task_config:
             data_dir = task_config["data_dir"]
             file_pattern = task_config["file_pattern"]
-            files = glob.glob(os.path.join(data_dir, file_pattern))
+            files = sorted(glob.glob(os.path.join(data_dir, file_pattern)))
             
             for file_path in files:
                 try:
@@ -74,64 +89,84 @@ class FailureCaseAnalysis:
             except Exception as e:
                 print(f"   ⚠️ 加载文件失败 {data_file}: {e}")
         
+        assign_question_ids(questions)
         return questions
     
-    def load_model_results(self, model_name: str) -> Dict:
-        """加载模型测试结果"""
-        result_files = {
-            "ReasoningV": "reasoningv_full_validation_results.json",
-            "AnalogSeeker": "analogseeker_full_validation_results.json"
-        }
-        
-        if model_name not in result_files:
-            return {}
-        
-        result_file = result_files[model_name]
-        if not os.path.exists(result_file):
-            print(f"   ⚠️ 结果文件不存在: {result_file}")
-            return {}
-        
-        try:
-            with open(result_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"   ⚠️ 加载结果文件失败: {e}")
-            return {}
+    def load_results_store(self) -> ResultsStore:
+        """把两个模型的完整验证结果导入结果库（当前目录或results/下的文件；默认内存库，指定results_db时持久化）"""
+        # 只有位置的旧结果按验证脚本保存的题目ID索引迁移
+        store = ResultsStore(self.results_db or ":memory:", QuestionIndex())
+        for file_name in ["reasoningv_full_validation_results.json",
+                          "analogseeker_full_validation_results.json"]:
+            for result_file in [file_name, os.path.join("results", file_name)]:
+                if os.path.exists(result_file):
+                    try:
+                        store.import_file(result_file)
+                    except Exception as e:
+                        print(f"   ⚠️ 导入结果文件失败 {result_file}: {e}")
+                    break
+            else:
+                print(f"   ⚠️ 结果文件不存在: {file_name}")
+        return store
+    
+    def load_model_results(self, store: ResultsStore, model_name: str) -> Dict[str, Dict]:
+        """从结果库读取模型完整验证的各任务汇总 {task: {correct, total, accuracy, ...}}"""
+        return {row["task"]: row for row in store.task_results(model=model_name)
+                if row["run"].endswith("full_validation_results")}
     
     def classify_error_type(self, question: Dict, ground_truth: str, predicted: str, 
-                           options: Dict[str, str]) -> str:
-        """分类错误类型"""
-        # 1. 选项偏见（Option Bias）
-        # 如果模型总是选择某个特定选项（如总是选A或总是选D）
-        if predicted not in ['A', 'B', 'C', 'D', 'E']:
-            return "格式错误"
-        
-        # 2. 幻觉错误（Hallucination）
-        # 如果预测的选项内容与问题完全不相关
-        predicted_text = options.get(predicted, "")
-        ground_truth_text = options.get(ground_truth, "")
-        
-        # 简单的相关性检查（可以根据需要扩展）
-        if not predicted_text or not ground_truth_text:
-            return "未知错误"
-        
-        # 3. 逻辑错误（Logical Error）
-        # 如果预测的选项在逻辑上不合理
-        # 这里需要更复杂的分析，暂时标记为"逻辑错误"
-        
-        # 4. 灾难性遗忘（Catastrophic Forgetting）
-        # 如果问题是基础概念但模型答错
-        # 需要人工判断，暂时标记为"可能遗忘"
+                           options: Dict[str, str], biased_letters: List[str] = (),
+                           other_predicted: str = None) -> str:
+        """分类错误类型（格式错误/选项偏见/共同干扰项/幻觉错误/逻辑错误）"""
+        return classify_error_type(question, ground_truth, predicted, options, biased_letters, other_predicted)
+    
+    def get_questions(self, task_name: str) -> List[Dict]:
+        """加载任务数据（缓存）"""
+        if task_name not in self.question_cache:
+            self.question_cache[task_name] = self.load_task_data(task_name)
+        return self.question_cache[task_name]
+    
+    def find_question(self, task_name: str, question_id: str) -> Optional[Dict]:
+        """按题目ID查找题目（只有位置的旧结果按位置查找）"""
+        questions = self.get_questions(task_name)
+        for question in questions:
+            if question["question_id"] == question_id:
+                return question
+        if str(question_id).isdigit() and int(question_id) < len(questions):
+            return questions[int(question_id)]
+        return None
+    
+    def build_miner(self, store: ResultsStore) -> FailureMiner:
+        """用两个模型完整验证运行的逐题结果构建失败挖掘器（任一模型没有逐题结果时返回None）"""
+        runs = {run["name"]: run for run in store.runs()}
+        run_names = ["reasoningv_full_validation_results", "analogseeker_full_validation_results"]
+        if any(runs.get(name, {}).get("num_questions", 0) == 0 for name in run_names):
+            print("   ⚠️ 结果库中缺少逐题预测，需用新版完整验证脚本重新运行")
+            return None
         
-        return "逻辑错误"
+        question_texts = {}
+        for task_name in self.tasks:
+            for i, q in enumerate(self.get_questions(task_name)):
+                question_texts[f"{normalize_task(task_name)}/{q['question_id']}"] = q.get('question', '')
+                question_texts[f"{normalize_task(task_name)}/{i}"] = q.get('question', '')
+        return FailureMiner.from_store(store, "ReasoningV", "Analogseeker", run_names[0], run_names[1],
+                                       question_texts=question_texts)
     
-    def find_failure_cases(self) -> Dict:
+    def find_failure_cases(self, num_cases: int = 5) -> Dict:
         """查找失败案例"""
         print("\n🔍 查找失败案例...")
         
         # 加载模型结果
-        reasoningv_results = self.load_model_results("ReasoningV")
-        analogseeker_results = self.load_model_results("AnalogSeeker")
+        store = self.load_results_store()
+        reasoningv_results = self.load_model_results(store, "ReasoningV")
+        analogseeker_results = self.load_model_results(store, "AnalogSeeker")
+        self.miner = self.build_miner(store)
+        store.close()
+        if self.miner is not None:
+            self.mining = self.miner.summary(limit=num_cases)
+            partitions = self.mining["partitions"]
+            print(f"   对齐 {self.miner.total} 题: 都对 {partitions['both_right']}, 仅ReasoningV对 {partitions['a_only']}, "
+                  f"仅AnalogSeeker对 {partitions['b_only']}, 都错 {partitions['both_wrong']}")
         
         failure_cases = {}
         
@@ -139,62 +174,60 @@ class FailureCaseAnalysis:
             print(f"\n📊 分析 {task_name}...")
             
             # 加载任务数据
-            questions = self.load_task_data(task_name)
+            questions = self.get_questions(task_name)
             if not questions:
                 continue
             
-            groundtruth_field = self.tasks[task_name]["groundtruth_field"]
-            
             # 获取模型结果
-            rv_task_results = reasoningv_results.get("validation_results", {}).get("results", {}).get(task_name, {})
-            as_task_results = analogseeker_results.get("validation_results", {}).get("results", {}).get(task_name, {})
+            rv_task_results = reasoningv_results.get(normalize_task(task_name), {})
+            as_task_results = analogseeker_results.get(normalize_task(task_name), {})
             
-            # 这里需要实际的预测结果，但当前结果文件可能不包含每个问题的预测
-            # 我们需要重新运行测试或从日志中提取
-            
-            # 暂时返回空，需要实际运行测试才能获得详细结果
             failure_cases[task_name] = {
-                "reasoningv_correct": rv_task_results.get("correct_count", 0),
-                "reasoningv_total": rv_task_results.get("total_questions", 0),
-                "analogseeker_correct": as_task_results.get("correct_count", 0),
-                "analogseeker_total": as_task_results.get("total_questions", 0),
-                "cases": []
+                "reasoningv_correct": rv_task_results.get("correct") or 0,
+                "reasoningv_total": rv_task_results.get("total") or 0,
+                "analogseeker_correct": as_task_results.get("correct") or 0,
+                "analogseeker_total": as_task_results.get("total") or 0,
+                "cases": self.analyze_specific_cases(task_name, num_cases)
             }
         
         return failure_cases
     
     def analyze_specific_cases(self, task_name: str, num_cases: int = 5) -> List[Dict]:
-        """分析特定任务的失败案例"""
+        """分析特定任务的失败案例：AnalogSeeker答错而ReasoningV答对的题，按反常程度排序"""
         print(f"\n📋 分析 {task_name} 的失败案例...")
         
-        questions = self.load_task_data(task_name)
-        if not questions:
+        questions = self.get_questions(task_name)
+        if not questions or self.miner is None:
             return []
         
-        groundtruth_field = self.tasks[task_name]["groundtruth_field"]
-        
-        # 这里需要实际的预测结果
-        # 由于当前结果文件可能不包含每个问题的预测，我们需要：
-        # 1. 重新运行测试并保存详细结果
-        # 2. 或者从日志中提取
-        
-        # 暂时返回示例结构
+        biased_letters = self.mining["option_bias"][self.miner.name_b]["biased_letters"]
+        task = normalize_task(task_name)
         cases = []
-        for i, q in enumerate(questions[:num_cases]):
-            if not q.get('question') or not q.get('options') or not q.get(groundtruth_field):
+        for ranked in self.miner.ranked_cases("a_only", limit=None):
+            if ranked["task"] != task:
                 continue
-            
-            case = {
-                "question_id": i + 1,
-                "question": q['question'],
-                "options": q['options'],
-                "ground_truth": q[groundtruth_field],
-                "reasoningv_predicted": "待测试",
-                "analogseeker_predicted": "待测试",
-                "error_type": "待分析",
-                "analysis": "需要实际运行测试才能获得详细分析"
-            }
-            cases.append(case)
+            q = self.find_question(task_name, ranked["question_id"])
+            if q is None:
+                continue
+            rv_predicted = ranked[f"{self.miner.name_a}_predicted"]
+            as_predicted = ranked[f"{self.miner.name_b}_predicted"]
+            error_type = self.classify_error_type(q, ranked["groundtruth"], as_predicted, q.get('options', {}),
+                                                  biased_letters, rv_predicted)
+            cases.append({
+                "question_id": q["question_id"],
+                "question": q.get('question', ''),
+                "options": q.get('options', {}),
+                "ground_truth": ranked["groundtruth"],
+                "level": ranked["level"],
+                "router_type": ranked["router_type"],
+                "reasoningv_predicted": rv_predicted,
+                "analogseeker_predicted": as_predicted,
+                "error_type": error_type,
+                "analysis": f"AnalogSeeker选{as_predicted}（{error_type}），ReasoningV答对；"
+                            f"AnalogSeeker在同组（{ranked['router_type']}）题目上的准确率为{ranked['group_accuracy']:.1f}%"
+            })
+            if len(cases) >= num_cases:
+                break
         
         return cases
     
@@ -214,8 +247,8 @@ class FailureCaseAnalysis:
             report.append(f"【{task_name}】")
             report.append("=" * 80)
             report.append("")
-            report.append(f"ReasoningV: {task_cases['reasoningv_correct']}/{task_cases['reasoningv_total']} ({task_cases['reasoningv_correct']/task_cases['reasoningv_total']*100:.2f}%)")
-            report.append(f"AnalogSeeker: {task_cases['analogseeker_correct']}/{task_cases['analogseeker_total']} ({task_cases['analogseeker_correct']/task_cases['analogseeker_total']*100:.2f}%)")
+            report.append(f"ReasoningV: {task_cases['reasoningv_correct']}/{task_cases['reasoningv_total']} ({task_cases['reasoningv_correct']/max(task_cases['reasoningv_total'], 1)*100:.2f}%)")
+            report.append(f"AnalogSeeker: {task_cases['analogseeker_correct']}/{task_cases['analogseeker_total']} ({task_cases['analogseeker_correct']/max(task_cases['analogseeker_total'], 1)*100:.2f}%)")
             report.append("")
             
             if task_cases['cases']:
@@ -232,12 +265,36 @@ class FailureCaseAnalysis:
                 report.append("  ⚠️ 需要实际运行测试才能获得详细案例")
                 report.append("")
         
+        if self.mining:
+            report.append("=" * 80)
+            report.append("逐题对比统计")
+            report.append("=" * 80)
+            report.append("")
+            partitions = self.mining["partitions"]
+            report.append(f"对齐题数: {self.mining['total_questions']}（都对 {partitions['both_right']}, "
+                          f"仅ReasoningV对 {partitions['a_only']}, 仅AnalogSeeker对 {partitions['b_only']}, "
+                          f"都错 {partitions['both_wrong']}）")
+            for title, key in [("按难度级别", "by_level"), ("按路由类型", "by_router_type")]:
+                report.append(f"{title}:")
+                for group, row in self.mining[key].items():
+                    report.append(f"  {group}: {row['total']}题, 仅ReasoningV对 {row['a_only']}, "
+                                  f"仅AnalogSeeker对 {row['b_only']}, 都错 {row['both_wrong']}")
+            report.append("选项位置偏见（卡方检验，预测字母分布 vs 正确答案分布）:")
+            for model, bias in self.mining["option_bias"].items():
+                letters = ", ".join(bias["biased_letters"]) or "无"
+                report.append(f"  {model}: χ²={bias['chi2']:.2f}, p={bias['p_value']:.3g}, 显著偏多的字母: {letters}")
+            report.append("")
+        
         report.append("=" * 80)
         report.append("结论")
         report.append("=" * 80)
         report.append("")
-        report.append("1. 需要实际运行测试并保存每个问题的预测结果")
-        report.append("2. 对比两个模型的错误案例，找出典型错误类型")
+        if self.mining:
+            report.append("1. 案例按AnalogSeeker在同组题目上的准确率排序，越靠前越反常")
+            report.append("2. 落在偏见字母上的错误多为选项位置偏见，而非知识性错误")
+        else:
+            report.append("1. 需要实际运行测试并保存每个问题的预测结果")
+            report.append("2. 对比两个模型的错误案例，找出典型错误类型")
         report.append("3. 分析ReasoningV如何通过Few-shot或Checklist避免错误")
         
         return "\n".join(report)
@@ -245,11 +302,15 @@ class FailureCaseAnalysis:
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="实验5: 失败案例分析")
+    parser.add_argument("--results-db", default=None, help="同时写入的SQLite结果库路径（如results/results.db）")
+    args = parser.parse_args()
+    
     print("=" * 80)
     print("实验5: 失败案例分析")
     print("=" * 80)
     
-    analyzer = FailureCaseAnalysis()
+    analyzer = FailureCaseAnalysis(args.results_db)
     cases = analyzer.find_failure_cases()
     
     # 保存结果
@@ -257,6 +318,10 @@ def main():
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(cases, f, indent=2, ensure_ascii=False)
     print(f"\n💾 结果已保存到: {output_file}")
+    if analyzer.mining:
+        with open("experiment5_failure_mining.json", 'w', encoding='utf-8') as f:
+            json.dump(analyzer.mining, f, indent=2, ensure_ascii=False)
+        print(f"💾 挖掘汇总已保存到: experiment5_failure_mining.json")
     
     # 生成报告
     report = analyzer.generate_case_report(cases)
@@ -266,7 +331,8 @@ def main():
     print(f"📄 报告已保存到: {report_file}")
     
     print("\n" + report)
-    print("\n⚠️ 注意: 需要实际运行测试并保存每个问题的预测结果才能获得详细分析")
+    if not analyzer.mining:
+        print("\n⚠️ 注意: 需要实际运行测试并保存每个问题的预测结果才能获得详细分析")
 
 
 if __name__ == "__main__":
@@ -11,15 +11,19 @@
 5. + 多策略混合: 完整优化策略（仅TQA）
 """
 
+import argparse
 import json
 import os
 import sys
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
 # 添加项目根目录到路径
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from results_store import ResultsStore
 
 # 导入现有的验证测试类
 try:
@@ -31,8 +35,15 @@ except ImportError:
 class AblationExperiment:
     """消融实验执行器"""
     
-    def __init__(self, model_path: str, results_dir: str = "results"):
+    def __init__(self, model_path: str, results_dir: str = "results", results_db: Optional[str] = None):
+        """
+        Args:
+            model_path: 模型路径
+            results_dir: 结果文件目录
+            results_db: 导入结果的SQLite结果库路径（None表示只在内存中导入，不写入results/）
+        """
         self.model_path = model_path
+        self.results_db = results_db
         self.results_dir = Path(results_dir)
         self.results_dir.mkdir(parents=True, exist_ok=True)
         
@@ -104,36 +115,24 @@ class AblationExperiment:
             }
         }
     
-    def load_baseline_results(self) -> Dict:
-        """加载基线结果"""
-        baseline_file = self.results_dir / "reasoningv_baseline_results.json"
-        if baseline_file.exists():
-            with open(baseline_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return None
-    
-    def load_optimization_results(self) -> Dict:
-        """加载优化结果"""
-        results = {}
-        
-        # 第一次优化结果
-        first_opt_file = self.results_dir / "reasoningv_before_after_comparison_results.json"
-        if first_opt_file.exists():
-            with open(first_opt_file, 'r', encoding='utf-8') as f:
-                results['first'] = json.load(f)
-        
-        # 最终优化结果
-        final_opt_file = self.results_dir / "reasoningv_latest_optimization_results.json"
-        if final_opt_file.exists():
-            with open(final_opt_file, 'r', encoding='utf-8') as f:
-                results['final'] = json.load(f)
-        
-        return results
+    def load_results_store(self) -> ResultsStore:
+        """把基线、第一次优化和最终优化结果导入结果库（默认内存库，指定results_db时持久化）"""
+        store = ResultsStore(self.results_db or ":memory:")
+        for file_name in ["reasoningv_baseline_results.json",
+                          "reasoningv_before_after_comparison_results.json",
+                          "reasoningv_latest_optimization_results.json"]:
+            if (self.results_dir / file_name).exists():
+                store.import_file(str(self.results_dir / file_name))
+        return store
     
     def analyze_ablation(self) -> Dict[str, Any]:
         """分析消融实验结果"""
-        baseline = self.load_baseline_results()
-        optimizations = self.load_optimization_results()
+        store = self.load_results_store()
+        baseline = store.task_accuracies("reasoningv_baseline_results")
+        # 第一次优化（优化后）和最终优化的各任务准确率
+        first = store.task_accuracies("reasoningv_before_after_comparison_results:after")
+        final = store.task_accuracies("reasoningv_latest_optimization_results")
+        store.close()
         
         if not baseline:
             print("警告：未找到基线结果，将使用估算数据")
@@ -143,11 +142,10 @@ class AblationExperiment:
         tasks = ['LDO', 'Comparator', 'Bandgap', 'TQA', 'Caption', 'Opamp']
         
         for task in tasks:
-            if task not in baseline.get('baseline_results', {}):
+            if task not in baseline:
                 continue
             
-            baseline_data = baseline['baseline_results'][task]
-            baseline_acc = baseline_data.get('accuracy', 0)
+            baseline_acc = baseline[task] or 0
             
             ablation_results[task] = {
                 'baseline': {
@@ -158,49 +156,41 @@ class AblationExperiment:
             }
             
             # Step 1: 参数优化（从第一次优化结果估算）
-            if optimizations.get('first') and 'results' in optimizations['first']:
-                first_data = optimizations['first']['results'].get(task)
-                if first_data:
-                    first_opt_acc = first_data.get('after', {}).get('accuracy', 0)
-                    # 估算参数优化的贡献（假设参数优化贡献30%的提升）
-                    param_improvement = (first_opt_acc - baseline_acc) * 0.3
-                    
-                    ablation_results[task]['steps'].append({
-                        'step': '参数优化',
-                        'accuracy': baseline_acc + param_improvement,
-                        'improvement': param_improvement,
-                        'description': '标准提示词 + 优化参数（max_new_tokens=1, temperature=0.0）'
-                    })
+            if task in first:
+                first_opt_acc = first[task] or 0
+                # 估算参数优化的贡献（假设参数优化贡献30%的提升）
+                param_improvement = (first_opt_acc - baseline_acc) * 0.3
+                
+                ablation_results[task]['steps'].append({
+                    'step': '参数优化',
+                    'accuracy': baseline_acc + param_improvement,
+                    'improvement': param_improvement,
+                    'description': '标准提示词 + 优化参数（max_new_tokens=1, temperature=0.0）'
+                })
+                
+                # Step 2: 提示词优化
+                prompt_improvement = first_opt_acc - baseline_acc - param_improvement
+                
+                ablation_results[task]['steps'].append({
+                    'step': '提示词优化',
+                    'accuracy': first_opt_acc,
+                    'improvement': prompt_improvement,
+                    'description': '任务特定提示词 + 优化参数'
+                })
             
-            # Step 2: 提示词优化
-            if optimizations.get('first') and 'results' in optimizations['first']:
-                first_data = optimizations['first']['results'].get(task)
-                if first_data:
-                    first_opt_acc = first_data.get('after', {}).get('accuracy', 0)
-                    prompt_improvement = first_opt_acc - baseline_acc - param_improvement
+            # Step 3: Few-shot学习
+            if final.get(task):
+                final_opt_acc = final[task]
+                if final_opt_acc > first_opt_acc:
+                    fewshot_improvement = final_opt_acc - first_opt_acc
                     
                     ablation_results[task]['steps'].append({
-                        'step': '提示词优化',
-                        'accuracy': first_opt_acc,
-                        'improvement': prompt_improvement,
-                        'description': '任务特定提示词 + 优化参数'
+                        'step': 'Few-shot学习',
+                        'accuracy': final_opt_acc,
+                        'improvement': fewshot_improvement,
+                        'description': f'任务特定提示词 + Few-shot示例 + 优化参数'
                     })
             
-            # Step 3: Few-shot学习
-            if optimizations.get('final') and 'optimization_results' in optimizations['final']:
-                final_data = optimizations['final']['optimization_results'].get(task)
-                if final_data:
-                    final_opt_acc = final_data.get('accuracy', 0)
-                    if final_opt_acc > first_opt_acc:
-                        fewshot_improvement = final_opt_acc - first_opt_acc
-                        
-                        ablation_results[task]['steps'].append({
-                            'step': 'Few-shot学习',
-                            'accuracy': final_opt_acc,
-                            'improvement': fewshot_improvement,
-                            'description': f'任务特定提示词 + Few-shot示例 + 优化参数'
-                        })
-            
             # 计算总提升
             if ablation_results[task]['steps']:
                 final_step = ablation_results[task]['steps'][-1]
@@ -293,11 +283,13 @@ class AblationExperiment:
 
 
 if __name__ == '__main__':
-    import sys
-    
-    model_path = sys.argv[1] if len(sys.argv) > 1 else "/home/ligengfei/LLM/Analogseeker-lgf/ReasoningV-7B"
+    parser = argparse.ArgumentParser(description="消融实验")
+    parser.add_argument("model_path", nargs="?", default="/home/ligengfei/LLM/Analogseeker-lgf/ReasoningV-7B",
+                        help="模型路径")
+    parser.add_argument("--results-db", default=None, help="同时写入的SQLite结果库路径（如results/results.db）")
+    args = parser.parse_args()
     
-    experiment = AblationExperiment(model_path)
+    experiment = AblationExperiment(args.model_path, results_db=args.results_db)
     experiment.save_results()
     
     # 打印报告摘要